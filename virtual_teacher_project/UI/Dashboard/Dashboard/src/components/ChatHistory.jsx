@@ -1,4 +1,7 @@
-import React, { useState, useEffect } from "react";
+import React, { useState, useEffect, useRef } from "react";
+
+const SEARCH_URL = "http://localhost:8001/api/search/";
+const SEARCH_DEBOUNCE_MS = 300;
 
 const ChatHistory = ({
   userId,
@@ -8,11 +11,62 @@ const ChatHistory = ({
   const [conversations, setConversations] = useState([]);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState(null);
+  const [query, setQuery] = useState("");
+  const [search, setSearch] = useState(null); // {hits, page, hasMore} for the current query
+  const [searching, setSearching] = useState(false);
+  const searchSeqRef = useRef(0); // ignores responses to superseded queries
 
   useEffect(() => {
     fetchConversations();
   }, [userId]);
 
+  // Search runs on the server (text index over titles, topics and lesson content)
+  useEffect(() => {
+    const q = query.trim();
+    if (!q || !userId) {
+      searchSeqRef.current += 1;
+      setSearch(null);
+      setSearching(false);
+      return undefined;
+    }
+    const timer = setTimeout(() => runSearch(q, 1), SEARCH_DEBOUNCE_MS);
+    return () => clearTimeout(timer);
+  }, [query, userId]);
+
+  const runSearch = async (q, page) => {
+    const seq = ++searchSeqRef.current;
+    setSearching(true);
+    try {
+      const params = new URLSearchParams({ user_id: userId, q, page: String(page) });
+      const response = await fetch(`${SEARCH_URL}?${params}`);
+      const data = await response.json();
+      if (seq !== searchSeqRef.current) return;
+      if (response.ok) {
+        setSearch((prev) => ({
+          hits: page > 1 && prev ? [...prev.hits, ...data.hits] : data.hits,
+          page,
+          hasMore: data.has_more,
+        }));
+      } else {
+        setSearch({ hits: [], page, hasMore: false, error: data.error || "Search failed" });
+      }
+    } catch (err) {
+      console.error("Error searching conversations:", err);
+      if (seq === searchSeqRef.current) {
+        setSearch({ hits: [], page, hasMore: false, error: "Network error while searching" });
+      }
+    } finally {
+      if (seq === searchSeqRef.current) {
+        setSearching(false);
+      }
+    }
+  };
+
+  const selectHit = (hit) => {
+    const conversation = conversations.find((conv) => conv._id === hit.conversation_id);
+    onConversationSelect(conversation || { _id: hit.conversation_id, title: hit.conversation_title });
+  };
+
   const fetchConversations = async () => {
     if (!userId) return;
 
@@ -108,10 +162,51 @@ const ChatHistory = ({
         <p className="text-sm text-slate-400">
           {conversations.length} conversations
         </p>
+        <input
+          type="search"
+          value={query}
+          onChange={(e) => setQuery(e.target.value)}
+          placeholder="Search lessons..."
+          className="mt-3 w-full px-3 py-1.5 rounded bg-slate-800 border border-slate-700 text-sm text-white placeholder-slate-500 focus:outline-none focus:border-blue-500"
+        />
       </div>
 
       <div className="flex-1 overflow-y-auto">
-        {conversations.length === 0 ? (
+        {search ? (
+          <div className="space-y-1 p-2">
+            {search.error && <p className="p-2 text-sm text-red-400">{search.error}</p>}
+            {!search.error && search.hits.length === 0 && !searching && (
+              <p className="p-2 text-center text-sm text-slate-400">No matches.</p>
+            )}
+            {search.hits.map((hit) => (
+              <div
+                key={hit.message_id || hit.conversation_id}
+                className={`p-3 rounded-lg cursor-pointer border transition-colors ${
+                  currentConversationId === hit.conversation_id
+                    ? "bg-blue-600/20 border-blue-500"
+                    : "bg-slate-800/50 border-slate-700 hover:bg-slate-700/50"
+                }`}
+                onClick={() => selectHit(hit)}
+              >
+                <h4 className="text-white font-medium truncate">{hit.conversation_title}</h4>
+                {/* Snippets are HTML-escaped by the server; only <mark> tags are added */}
+                <p
+                  className="text-xs text-slate-300 mt-1 [&_mark]:bg-yellow-400/30 [&_mark]:text-yellow-200"
+                  dangerouslySetInnerHTML={{ __html: hit.snippet }}
+                />
+              </div>
+            ))}
+            {search.hasMore && (
+              <button
+                onClick={() => runSearch(query.trim(), search.page + 1)}
+                disabled={searching}
+                className="w-full mt-1 px-3 py-1 bg-slate-700 text-slate-200 rounded text-sm hover:bg-slate-600 disabled:opacity-50"
+              >
+                {searching ? "Searching..." : "More results"}
+              </button>
+            )}
+          </div>
+        ) : conversations.length === 0 ? (
           <div className="p-4 text-center text-slate-400">
             <p>No conversations yet.</p>
             <p className="text-sm mt-1">Start a new lesson to begin!</p>
@@ -138,8 +233,15 @@ const ChatHistory = ({
                         Topic: {conversation.topic}
                       </p>
                     )}
+                    {conversation.last_message_preview && (
+                      <p className="text-xs text-slate-400 truncate mt-1">
+                        {conversation.last_message_preview}
+                      </p>
+                    )}
                     <p className="text-xs text-slate-500 mt-1">
-                      {formatDate(conversation.updated_at)}
+                      {formatDate(conversation.last_activity_at || conversation.updated_at)}
+                      {conversation.lesson_step_count > 0 &&
+                        ` · ${conversation.lesson_step_count} steps`}
                     </p>
                   </div>
                   <button
@@ -26,10 +26,73 @@ const TeachingCanvas = forwardRef(
     const [nextShapeY, setNextShapeY] = useState(80); // Track next available Y position for shapes
     const stageRef = useRef();
     const animationTimeoutRef = useRef();
+    const commandTimersRef = useRef([]);
+
+    // Steps laid out by the server (teacher_app/layout.py) carry final coordinates and
+    // absolute timestamps: commands are drawn as given, at (command.at - step.start_ms)
+    const isLaidOut = (step) => step && step.start_ms !== undefined;
+
+    const clearCommandTimers = () => {
+      commandTimersRef.current.forEach(clearTimeout);
+      commandTimersRef.current = [];
+    };
+
+    // Elements on the canvas once every command up to and including index `upTo` has run
+    const elementsUpTo = (commands, upTo) => {
+      let elements = [];
+      for (let i = 0; i <= upTo; i++) {
+        if (commands[i].action === "clear_all") {
+          elements = [];
+          continue;
+        }
+        const element = elementFromLaidOutCommand(commands[i], i);
+        if (element) {
+          elements.push(element);
+        }
+      }
+      return elements;
+    };
+
+    // Draw a laid-out step as it looks `offsetMs` after the step starts, then (when playing)
+    // schedule the remaining commands from that point
+    const seekTo = (offsetMs, playing = isPlaying) => {
+      if (!isLaidOut(teachingStep)) return;
+      clearCommandTimers();
+      const commands = teachingStep.drawing_commands || [];
+      const offsetOf = (command) => (command.at ?? teachingStep.start_ms) - teachingStep.start_ms;
+      let last = -1;
+      while (last + 1 < commands.length && offsetOf(commands[last + 1]) <= offsetMs) {
+        last++;
+      }
+      setDrawnElements(last >= 0 ? elementsUpTo(commands, last) : []);
+      setCurrentElementIndex(last + 1);
+      if (!playing) return;
+      if (last + 1 >= commands.length) {
+        if (onStepComplete) onStepComplete();
+        return;
+      }
+      for (let i = last + 1; i < commands.length; i++) {
+        const index = i;
+        commandTimersRef.current.push(setTimeout(() => {
+          setDrawnElements(elementsUpTo(commands, index));
+          setCurrentElementIndex(index + 1);
+          if (index === commands.length - 1 && onStepComplete) {
+            onStepComplete();
+          }
+        }, offsetOf(commands[i]) - offsetMs));
+      }
+    };
 
     // Expose methods to parent component
     useImperativeHandle(ref, () => ({
       addDrawingCommand: (command) => {
+        if (command.at !== undefined) {
+          const element = elementFromLaidOutCommand(command, drawnElements.length);
+          if (element) {
+            setDrawnElements(prev => [...prev, element]);
+          }
+          return;
+        }
         const element = createElementFromCommand(command, drawnElements.length);
         if (element) {
           setDrawnElements(prev => {
@@ -49,7 +112,9 @@ const TeachingCanvas = forwardRef(
           });
         }
       },
+      seekTo: (offsetMs) => seekTo(offsetMs),
       clearCanvas: () => {
+        clearCommandTimers();
         setDrawnElements([]);
         setCurrentElementIndex(0);
         setNextTextY(60);
@@ -71,6 +136,7 @@ const TeachingCanvas = forwardRef(
         if (animationTimeoutRef.current) {
           clearTimeout(animationTimeoutRef.current);
         }
+        clearCommandTimers();
 
         // If using Konva, you may also want to clear the Layer manually (if needed)
         if (stageRef.current) {
@@ -85,19 +151,23 @@ const TeachingCanvas = forwardRef(
 
     // Start drawing animation when playing
     useEffect(() => {
-      if (isPlaying && teachingStep && teachingStep.drawing_commands) {
+      if (isPlaying && isLaidOut(teachingStep)) {
+        seekTo(0, true);
+      } else if (isPlaying && teachingStep && teachingStep.drawing_commands) {
         startDrawingAnimation();
       } else {
         // Stop animation if not playing
         if (animationTimeoutRef.current) {
           clearTimeout(animationTimeoutRef.current);
         }
+        clearCommandTimers();
       }
 
       return () => {
         if (animationTimeoutRef.current) {
           clearTimeout(animationTimeoutRef.current);
         }
+        clearCommandTimers();
       };
     }, [isPlaying, teachingStep]);
 
@@ -285,6 +355,96 @@ const TeachingCanvas = forwardRef(
       }
     };
 
+    // Konva element for a command whose position and size the server already computed
+    const elementFromLaidOutCommand = (command, index) => {
+      const baseProps = {
+        id: `element-${index}`,
+        key: `element-${index}`,
+      };
+
+      switch (command.action) {
+        case "draw_text":
+          return {
+            ...baseProps,
+            type: "text",
+            x: command.x,
+            y: command.y,
+            width: command.width,
+            text: command.text || "",
+            fontSize: command.fontSize || 18,
+            fontFamily: command.fontFamily || "Arial",
+            fontStyle: command.fontStyle || "normal",
+            fill: command.color || "#000000",
+          };
+
+        case "draw_rectangle":
+          return {
+            ...baseProps,
+            type: "rect",
+            x: command.x,
+            y: command.y,
+            width: command.width,
+            height: command.height,
+            fill: command.fill || "transparent",
+            stroke: command.color || "#0066cc",
+            strokeWidth: command.strokeWidth || 2,
+          };
+
+        case "draw_circle":
+          return {
+            ...baseProps,
+            type: "circle",
+            x: command.x,
+            y: command.y,
+            radius: command.radius,
+            fill: command.fill || "transparent",
+            stroke: command.color || "#0066cc",
+            strokeWidth: command.strokeWidth || 2,
+          };
+
+        case "draw_arrow":
+          return {
+            ...baseProps,
+            type: "arrow",
+            points: command.points,
+            pointerLength: command.pointerLength || 10,
+            pointerWidth: command.pointerWidth || 10,
+            fill: command.color || "#059669",
+            stroke: command.color || "#059669",
+            strokeWidth: command.strokeWidth || 2,
+          };
+
+        case "draw_line":
+          return {
+            ...baseProps,
+            type: "line",
+            points: command.points,
+            stroke: command.color || "#000000",
+            strokeWidth: command.strokeWidth || 2,
+            lineCap: "round",
+            lineJoin: "round",
+          };
+
+        case "highlight":
+          if (command.x === undefined) return null; // nothing written yet to highlight
+          return {
+            ...baseProps,
+            type: "rect",
+            x: command.x,
+            y: command.y,
+            width: command.width,
+            height: command.height,
+            fill: "yellow",
+            opacity: 0.3,
+            stroke: "orange",
+            strokeWidth: 1,
+          };
+
+        default:
+          return null;
+      }
+    };
+
     const renderElement = (element) => {
       const commonProps = {
         key: element.id,
@@ -76,6 +76,17 @@ export default function UploadBox({ onStartSession }) {
         console.log("Response received:", response.status, response.statusText);
         console.log("Response headers:", response.headers);
 
+        if (response.status === 429 || response.status === 413) {
+          // Upload budget exhausted (429, retry_after in seconds) or the file alone exceeds it (413)
+          const limited = await response.json();
+          alert(
+            limited.retry_after
+              ? `${limited.message} Try again in ${limited.retry_after} seconds.`
+              : limited.message
+          );
+          return;
+        }
+
         if (!response.ok) {
           const errorText = await response.text();
           console.error("Server error:", errorText);
@@ -14,6 +14,8 @@ import {
   Layers,
 } from "lucide-react";
 import TeachingCanvas from "./TeachingCanvas";
+import { COMPACT_SUBPROTOCOL, decodeFrame, loadWireSchema } from "../wireFormat";
+import { createProgressReporter } from "../progressReporter";
 
 // Text-to-Speech Hook
 const useTTS = () => {
@@ -121,6 +123,17 @@ const Whiteboard = ({
   const timerRef = useRef(null);
   const teachingCanvasRef = useRef(null);
 
+  // Lesson session state that must survive reconnects (onopen closes over the first render)
+  const lastSeqRef = useRef(0);
+  const conversationIdRef = useRef(currentConversationId || null);
+  const lessonInFlightRef = useRef(false);
+  const lessonReceivedRef = useRef(false);
+  const hasConnectedRef = useRef(false);
+  const wireSchemaRef = useRef(null); // compact encoding key tables (null = JSON frames)
+  const progressReporterRef = useRef(null); // batches step progress to /api/progress/bulk/
+  const lessonRequestRef = useRef(null); // last lesson request, resent by "Generate new"
+  const [similarLesson, setSimilarLesson] = useState(null); // offered stored lesson (similar_lesson frame)
+
   // Helper function to safely send WebSocket messages
   const sendWebSocketMessage = (message) => {
     if (wsRef.current && wsRef.current.readyState === WebSocket.OPEN) {
@@ -145,20 +158,44 @@ const Whiteboard = ({
       return;
     }
     
+    let unmounted = false;
+
     const connectWebSocket = () => {
+      // Ask for compact frames once the key tables are loaded; plain JSON otherwise
+      loadWireSchema().then((schema) => {
+        if (!unmounted) {
+          wireSchemaRef.current = schema;
+          openWebSocket(schema);
+        }
+      });
+    };
+
+    const openWebSocket = (schema) => {
       const wsUrl = `ws://localhost:8001/ws/teacher/`;
       console.log("Creating new WebSocket connection to:", wsUrl);
-      wsRef.current = new WebSocket(wsUrl);
+      wsRef.current = schema ? new WebSocket(wsUrl, [COMPACT_SUBPROTOCOL]) : new WebSocket(wsUrl);
 
       wsRef.current.onopen = () => {
         console.log("WebSocket connected successfully");
         setIsConnected(true);
         setStatus("Connected! Starting lesson generation...");
 
+        const isReconnect = hasConnectedRef.current;
+        hasConnectedRef.current = true;
+
         // Add a small delay to ensure WebSocket is fully ready
         setTimeout(() => {
-          // Only send lesson generation request if we don't already have synchronized steps
-          if (teachingSteps.length === 0) {
+          if (isReconnect && lessonInFlightRef.current && conversationIdRef.current) {
+            // Pick the in-flight lesson back up instead of generating (and paying for) it again
+            console.log("Resuming lesson session after seq", lastSeqRef.current);
+            setStatus("Reconnected! Resuming lesson...");
+            sendWebSocketMessage({
+              action: "resume",
+              conversation_id: conversationIdRef.current,
+              last_seq: lastSeqRef.current,
+              user_id: currentUserId || "anonymous",
+            });
+          } else if (!lessonReceivedRef.current) {
             // Send PDF data to start lesson generation
             const pdfText = sessionStorage.getItem("pdfText");
             const pdfFilename = sessionStorage.getItem("pdfFilename") || pdfName;
@@ -168,7 +205,10 @@ const Whiteboard = ({
               pdf_filename: pdfFilename,
               user_id: currentUserId || "anonymous",
               conversation_id: currentConversationId || null,
+              // Typed topics may be answered with a similar_lesson offer instead of a new lesson
+              allow_similar: !pdfText,
             };
+            lessonRequestRef.current = message;
 
             console.log("Sending lesson generation request via WebSocket");
             sendWebSocketMessage(message);
@@ -181,7 +221,10 @@ const Whiteboard = ({
 
       wsRef.current.onmessage = (event) => {
         try {
-          const data = JSON.parse(event.data);
+          const data = decodeFrame(JSON.parse(event.data), wireSchemaRef.current);
+          if (data.seq) {
+            lastSeqRef.current = data.seq;
+          }
           handleWebSocketMessage(data);
         } catch (error) {
           console.error("Error parsing WebSocket message:", error);
@@ -194,7 +237,9 @@ const Whiteboard = ({
         setStatus("Disconnected");
 
         // Attempt to reconnect after 3 seconds
-        setTimeout(connectWebSocket, 3000);
+        if (!unmounted) {
+          setTimeout(connectWebSocket, 3000);
+        }
       };
 
       wsRef.current.onerror = (error) => {
@@ -204,9 +249,12 @@ const Whiteboard = ({
     };
 
     connectWebSocket();
+    progressReporterRef.current = createProgressReporter();
 
     // Cleanup on unmount
     return () => {
+      unmounted = true;
+      progressReporterRef.current.close();
       if (wsRef.current) {
         console.log("Closing WebSocket connection on cleanup");
         wsRef.current.close();
@@ -224,6 +272,8 @@ const Whiteboard = ({
         break;
 
       case "lesson_start":
+        lessonInFlightRef.current = true;
+        lessonReceivedRef.current = false;
         // Reset everything for new lesson
         setSlides([]);
         setCurrentSlide(0);
@@ -243,6 +293,8 @@ const Whiteboard = ({
         
       case "lesson_ready":
         // All teaching steps received - now we can start synchronized lesson
+        lessonInFlightRef.current = false;
+        lessonReceivedRef.current = true;
         console.log(`Lesson ready with ${data.total_steps} steps:`, data.teaching_steps);
         
         // Log each step for debugging
@@ -272,6 +324,7 @@ const Whiteboard = ({
 
       case "conversation_created":
         console.log("Conversation created:", data.conversation_id, data.title);
+        conversationIdRef.current = data.conversation_id;
         // Notify parent component about new conversation
         if (onConversationCreated) {
           onConversationCreated(data.conversation_id, data.title);
@@ -393,7 +446,37 @@ const Whiteboard = ({
         }
         break;
 
+      case "similar_lesson":
+        // A stored lesson on a near-identical topic exists; let the user pick
+        console.log("Similar lesson offered:", data.topic, data.similarity);
+        setSimilarLesson(data);
+        setStatus(data.message);
+        break;
+
+      case "rate_limited":
+        // Lesson budget used up; nothing was generated (retry_after in seconds)
+        lessonInFlightRef.current = false;
+        setStatus(
+          data.retry_after
+            ? `${data.message} Try again in ${data.retry_after} seconds.`
+            : data.message
+        );
+        break;
+
+      case "resumed":
+        console.log("Lesson session resumed from seq", data.from_seq);
+        setStatus(data.generating ? "Reconnected! Lesson still generating..." : "Reconnected! Catching up...");
+        break;
+
+      case "resume_failed":
+        // The session expired; fall back to the stored lesson, if it was saved
+        console.log("Lesson session could not be resumed:", data.message);
+        lessonInFlightRef.current = false;
+        sendWebSocketMessage({ action: "replay", conversation_id: conversationIdRef.current });
+        break;
+
       case "error":
+        lessonInFlightRef.current = false;
         setStatus(`Error: ${data.message}`);
         console.error("WebSocket error:", data);
         break;
@@ -403,6 +486,20 @@ const Whiteboard = ({
     }
   };
 
+  const replaySimilarLesson = () => {
+    const offer = similarLesson;
+    setSimilarLesson(null);
+    conversationIdRef.current = offer.conversation_id;
+    setStatus(`Loading the lesson on "${offer.topic}"...`);
+    sendWebSocketMessage({ action: "replay", conversation_id: offer.conversation_id });
+  };
+
+  const generateNewLesson = () => {
+    setSimilarLesson(null);
+    setStatus("Starting lesson generation...");
+    sendWebSocketMessage({ ...lessonRequestRef.current, allow_similar: false });
+  };
+
   const executeWhiteboardCommands = (commands) => {
     const canvas = canvasRef.current;
     if (!canvas) return;
@@ -657,6 +754,14 @@ const Whiteboard = ({
       speak(speechText, () => {
         console.log("Speech completed for step:", step.step);
         setCurrentSpeakingStep(null);
+        if (progressReporterRef.current) {
+          progressReporterRef.current.report({
+            student_id: currentUserId || "anonymous",
+            lesson_id: conversationIdRef.current,
+            completed_steps: (stepIndex !== undefined ? stepIndex : 0) + 1,
+            total_steps: teachingSteps.length,
+          });
+        }
 
         // Automatically move to next step after a pause (if autoPlay is enabled)
         setTimeout(() => {
@@ -674,8 +779,9 @@ const Whiteboard = ({
         }, 2000); // 2 second pause between steps
       }, true);
 
-      // Start drawing commands with proper timing
-      if (step.drawing_commands && step.drawing_commands.length > 0) {
+      // Start drawing commands with proper timing (TeachingCanvas schedules steps the server
+      // laid out itself, from their absolute timestamps)
+      if (step.start_ms === undefined && step.drawing_commands && step.drawing_commands.length > 0) {
         step.drawing_commands.forEach(command => {
           setTimeout(() => {
             // Send drawing command to TeachingCanvas
@@ -713,6 +819,14 @@ const Whiteboard = ({
       speak(speechText, () => {
         console.log("Speech completed for step:", step.step);
         setCurrentSpeakingStep(null);
+        if (progressReporterRef.current) {
+          progressReporterRef.current.report({
+            student_id: currentUserId || "anonymous",
+            lesson_id: conversationIdRef.current,
+            completed_steps: (stepIndex !== undefined ? stepIndex : 0) + 1,
+            total_steps: teachingSteps.length,
+          });
+        }
 
         // Auto-advance to next step if available
         const currentIndex = teachingSteps.findIndex(
@@ -793,6 +907,24 @@ const Whiteboard = ({
           <div className="flex items-center gap-3">
             <span className="text-slate-300 text-sm">{status}</span>
 
+            {similarLesson && (
+              <div className="flex items-center gap-2">
+                <button
+                  onClick={replaySimilarLesson}
+                  className="px-3 py-1 bg-green-600 hover:bg-green-700 text-white rounded text-xs transition-colors"
+                  title={`Replay the stored lesson (${Math.round(similarLesson.similarity * 100)}% similar topic)`}
+                >
+                  Replay it
+                </button>
+                <button
+                  onClick={generateNewLesson}
+                  className="px-3 py-1 bg-slate-600 hover:bg-slate-500 text-slate-300 rounded text-xs transition-colors"
+                >
+                  Generate new
+                </button>
+              </div>
+            )}
+
             {/* Audio Controls */}
             <div className="flex items-center gap-2 border-l border-slate-600 pl-3">
               <button
@@ -0,0 +1,97 @@
+// Batched lesson progress reporting (POST /api/progress/bulk/ on the server).
+//
+// Contract: within a flush window only the last update per (student_id, lesson_id) is kept, and
+// the window is at most `coalesce_ms` long (returned by every bulk response, default 1000 ms).
+// Pending updates are sent with navigator.sendBeacon when the page is hidden or unloaded.
+
+const BULK_URL = "http://localhost:8001/api/progress/bulk/";
+const DEFAULT_COALESCE_MS = 1000;
+const MAX_BATCH = 500; // PROGRESS_BULK_MAX_UPDATES on the server
+
+export const createProgressReporter = ({ url = BULK_URL, coalesceMs = DEFAULT_COALESCE_MS } = {}) => {
+  const pending = new Map();
+  let windowMs = coalesceMs;
+  let timer = null;
+
+  const takeBatch = () => {
+    const updates = Array.from(pending.values()).slice(0, MAX_BATCH);
+    updates.forEach((u) => pending.delete(`${u.student_id}|${u.lesson_id}`));
+    return updates;
+  };
+
+  const schedule = () => {
+    if (!timer && pending.size > 0) {
+      timer = setTimeout(flush, windowMs);
+    }
+  };
+
+  const flush = () => {
+    clearTimeout(timer);
+    timer = null;
+    const updates = takeBatch();
+    if (updates.length === 0) {
+      return Promise.resolve(null);
+    }
+    return fetch(url, {
+      method: "POST",
+      headers: { "Content-Type": "application/json" },
+      body: JSON.stringify({ updates }),
+    })
+      .then((response) => (response.ok ? response.json() : null))
+      .then((result) => {
+        if (result && result.coalesce_ms) {
+          windowMs = result.coalesce_ms;
+        }
+        return result;
+      })
+      .catch((error) => {
+        // Keep the updates unless newer ones for the same lesson arrived meanwhile
+        updates.forEach((u) => {
+          const key = `${u.student_id}|${u.lesson_id}`;
+          if (!pending.has(key)) {
+            pending.set(key, u);
+          }
+        });
+        console.warn("Progress update failed, will retry:", error);
+        return null;
+      })
+      .finally(schedule);
+  };
+
+  const flushWithBeacon = () => {
+    clearTimeout(timer);
+    timer = null;
+    while (pending.size > 0) {
+      // text/plain keeps the beacon a CORS "simple" request; the server parses the body as JSON
+      const body = new Blob([JSON.stringify({ updates: takeBatch() })], { type: "text/plain" });
+      if (!navigator.sendBeacon || !navigator.sendBeacon(url, body)) {
+        break;
+      }
+    }
+  };
+
+  const onVisibilityChange = () => {
+    if (document.visibilityState === "hidden") {
+      flushWithBeacon();
+    }
+  };
+  window.addEventListener("pagehide", flushWithBeacon);
+  document.addEventListener("visibilitychange", onVisibilityChange);
+
+  return {
+    // Record the latest progress of a student in a lesson; replaces any pending update for it
+    report(update) {
+      if (!update.student_id || !update.lesson_id) {
+        return;
+      }
+      pending.set(`${update.student_id}|${update.lesson_id}`, update);
+      schedule();
+    },
+    flush,
+    close() {
+      window.removeEventListener("pagehide", flushWithBeacon);
+      document.removeEventListener("visibilitychange", onVisibilityChange);
+      flushWithBeacon();
+    },
+  };
+};
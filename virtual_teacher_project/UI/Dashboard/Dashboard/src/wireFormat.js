@@ -0,0 +1,80 @@
+// Decoder for the compact WebSocket encoding (teacher_app/wire.py on the server).
+//
+// Connections that offer COMPACT_SUBPROTOCOL receive frames whose teaching steps and drawing
+// commands are packed as arrays, in the order of the key tables served by /api/wire-schema/:
+//
+//   step:     [value for each step field..., [command, ...], {extra keys}?]
+//   command:  [action index, value for each field of that action..., {extra keys}?]
+
+export const COMPACT_SUBPROTOCOL = "gyansetu.compact.v2";
+const COMPACT_VERSION = "compact.v2";
+const STEP_LIST_KEYS = ["teaching_steps", "steps"];
+
+let schemaPromise = null;
+
+// Fetch the key tables once per page load; resolves to null (use plain JSON) if unavailable
+export const loadWireSchema = () => {
+  if (!schemaPromise) {
+    schemaPromise = fetch("http://localhost:8001/api/wire-schema/")
+      .then((response) => (response.ok ? response.json() : null))
+      .then((schema) => (schema && schema.encoding === COMPACT_VERSION ? schema : null))
+      .catch((error) => {
+        console.warn("Wire schema unavailable, using JSON frames:", error);
+        return null;
+      });
+  }
+  return schemaPromise;
+};
+
+const isExtras = (value) => value !== null && typeof value === "object" && !Array.isArray(value);
+
+const unpackCommand = (packed, schema) => {
+  if (!Array.isArray(packed)) {
+    return packed;
+  }
+  const action = schema.actions[packed[0]];
+  const command = { action };
+  const values = packed.slice(1);
+  if (values.length && isExtras(values[values.length - 1])) {
+    Object.assign(command, values.pop());
+  }
+  schema.command_fields[action].forEach((name, i) => {
+    if (i < values.length && values[i] !== null) {
+      command[name] = values[i];
+    }
+  });
+  return command;
+};
+
+const unpackStep = (packed, schema) => {
+  const step = {};
+  const values = packed.slice();
+  if (values.length && isExtras(values[values.length - 1])) {
+    Object.assign(step, values.pop());
+  }
+  const fields = schema.step_fields;
+  fields.forEach((name, i) => {
+    if (i < values.length && values[i] !== null) {
+      step[name] = values[i];
+    }
+  });
+  if (values.length > fields.length) {
+    step.drawing_commands = values[fields.length].map((c) => unpackCommand(c, schema));
+  }
+  return step;
+};
+
+// Expand a parsed frame sent in the compact encoding; other frames are returned unchanged
+export const decodeFrame = (frame, schema) => {
+  if (!schema || frame.encoding !== COMPACT_VERSION) {
+    return frame;
+  }
+  const decoded = { ...frame };
+  delete decoded.encoding;
+  STEP_LIST_KEYS.forEach((key) => {
+    if (Array.isArray(decoded[key])) {
+      decoded[key] = decoded[key].map((s) => unpackStep(s, schema));
+    }
+  });
+  return decoded;
+};
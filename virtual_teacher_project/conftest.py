@@ -0,0 +1,21 @@
+# conftest.py
+
+import os
+
+import django
+from django.test.utils import setup_test_environment, teardown_test_environment
+
+# The app modules read django.conf.settings at import time; set Django up before pytest collects them.
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "virtual_teacher_project.settings")
+django.setup()
+
+
+def pytest_configure(config):
+    # What `manage.py test` does before running tests: ALLOWED_HOSTS gains "testserver", mail
+    # goes to the locmem backend.
+    setup_test_environment()
+
+
+def pytest_unconfigure(config):
+    teardown_test_environment()
+
@@ -48,12 +48,12 @@ if command -v concurrently &> /dev/null; then
     concurrently \
         --names "Backend,Frontend" \
         --prefix-colors "cyan,yellow" \
-        "python -m daphne -b 0.0.0.0 -p 8000 virtual_teacher_project.asgi:application" \
+        "python -m teacher_app.wsserver -b 0.0.0.0 -p 8000 virtual_teacher_project.asgi:application" \
         "cd UI/Dashboard/Dashboard && npm start"
 else
     # Option 2: Using background processes
     echo "Starting backend in background..."
-    python -m daphne -b 0.0.0.0 -p 8000 virtual_teacher_project.asgi:application &
+    python -m teacher_app.wsserver -b 0.0.0.0 -p 8000 virtual_teacher_project.asgi:application &
     BACKEND_PID=$!
     
     echo "Waiting 3 seconds for backend to start..."
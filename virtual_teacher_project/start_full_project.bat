@@ -21,7 +21,7 @@ echo.
 echo [3/4] Starting Django Backend (Daphne ASGI Server)...
 echo Backend will run at: http://localhost:8000
 echo WebSocket will be at: ws://localhost:8000/ws/teacher/
-start "GnyanSetu Backend" cmd /k "cd /d d:\Virtual-Tutor\virtual_teacher_project && C:/Python313/python.exe -m daphne -b 0.0.0.0 -p 8000 virtual_teacher_project.asgi:application"
+start "GnyanSetu Backend" cmd /k "cd /d d:\Virtual-Tutor\virtual_teacher_project && C:/Python313/python.exe -m teacher_app.wsserver -b 0.0.0.0 -p 8000 virtual_teacher_project.asgi:application"
 
 echo.
 echo Waiting 5 seconds for backend to start...
@@ -32,7 +32,7 @@ Write-Host "WebSocket will be at: ws://localhost:8000/ws/teacher/" -ForegroundCo
 $BackendScript = @"
 Set-Location '$ProjectRoot'
 Write-Host 'Starting GnyanSetu Backend...' -ForegroundColor Green
-& 'C:/Python313/python.exe' -m daphne -b 0.0.0.0 -p 8000 virtual_teacher_project.asgi:application
+& 'C:/Python313/python.exe' -m teacher_app.wsserver -b 0.0.0.0 -p 8000 virtual_teacher_project.asgi:application
 "@
 
 Start-Process powershell -ArgumentList "-NoExit", "-Command", $BackendScript -WindowStyle Normal
@@ -20,4 +20,4 @@ echo Server will be available at: http://localhost:8000
 echo WebSocket will be available at: ws://localhost:8000/ws/teacher/
 echo.
 
-daphne -b 0.0.0.0 -p 8000 virtual_teacher_project.asgi:application
+python -m teacher_app.wsserver -b 0.0.0.0 -p 8000 virtual_teacher_project.asgi:application
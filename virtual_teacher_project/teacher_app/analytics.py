@@ -0,0 +1,222 @@
+# teacher_app/analytics.py
+
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+from .mongo import create_analytics
+
+# Per-lesson analytics (one document per lesson_id in the analytics collection) are kept up to
+# date by record_quiz()/save_progress() on every write, so reading them is a single lookup on
+# the unique "lesson" index. rebuild_pipeline() recomputes the same numbers from scratch; the
+# expressions below and their Python twins must agree so the two never drift apart.
+
+SCORE = {"$convert": {"input": "$score", "to": "double", "onError": 0, "onNull": 0}}
+_TOTAL_STEPS = {"$convert": {"input": "$total_steps", "to": "double", "onError": 0, "onNull": 0}}
+_COMPLETED_STEPS = {"$convert": {"input": "$completed_steps", "to": "double", "onError": 0, "onNull": 0}}
+IS_COMPLETE = {"$and": [{"$gt": [_TOTAL_STEPS, 0]}, {"$gte": [_COMPLETED_STEPS, _TOTAL_STEPS]}]}
+
+COUNTERS = ("attempts", "score_total", "learners", "completed")
+_DUPLICATE_KEY = 11000
+
+# Derived fields, recomputed in the same update as the counters they depend on
+RATES_STAGE = {"$set": {
+    "average_score": {"$cond": [{"$gt": ["$attempts", 0]}, {"$divide": ["$score_total", "$attempts"]}, 0]},
+    "completion_rate": {"$cond": [{"$gt": ["$learners", 0]}, {"$divide": ["$completed", "$learners"]}, 0]},
+    "calculated_at": "$$NOW",
+}}
+
+
+def _number(value):
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.0
+
+
+def is_complete(progress_doc):
+    """Python twin of IS_COMPLETE."""
+    if not progress_doc:
+        return False
+    total = _number(progress_doc.get("total_steps"))
+    return total > 0 and _number(progress_doc.get("completed_steps")) >= total
+
+
+def increment_update(**deltas):
+    """Pipeline update adding ``deltas`` to the counters (``$inc`` semantics, upsert-safe) and
+    refreshing the derived rates in the same atomic write."""
+    return [
+        {"$set": {name: {"$add": [{"$ifNull": [f"${name}", 0]}, deltas.get(name, 0)]} for name in COUNTERS}},
+        RATES_STAGE,
+    ]
+
+
+def quiz_update(score):
+    return increment_update(attempts=1, score_total=_number(score))
+
+
+def progress_deltas(was_complete, now_complete):
+    """``{"learners", "completed"}`` change for a progress record that was ``was_complete``
+    (None: the write created it) and now is ``now_complete``."""
+    return {"learners": 1 if was_complete is None else 0,
+            "completed": int(bool(now_complete)) - int(bool(was_complete))}
+
+
+def progress_update(was_complete, now_complete):
+    """Analytics update for one progress write, or None when the lesson's numbers don't change."""
+    deltas = progress_deltas(was_complete, now_complete)
+    return increment_update(**deltas) if any(deltas.values()) else None
+
+
+async def _apply(collection, lesson_id, update):
+    """Best effort: the quiz/progress write already succeeded, and rebuild_analytics repairs drift."""
+    if collection is None or not lesson_id or update is None:
+        return
+    try:
+        await collection.update_one({"lesson_id": lesson_id}, update, upsert=True)
+    except Exception as e:
+        print(f"DEBUG: Could not update analytics of lesson {lesson_id}: {e}")
+
+
+async def record_quiz(collection, lesson_id, score):
+    """Fold one quiz submission into the lesson's analytics."""
+    await _apply(collection, lesson_id, quiz_update(score))
+
+
+def progress_pipeline(progress_doc):
+    """Pipeline update that writes ``progress_doc`` over a student's progress record."""
+    # $literal: client-supplied strings starting with "$" must not be read as field paths
+    return [{"$set": {key: {"$literal": value} for key, value in progress_doc.items() if key != "_id"}}]
+
+
+async def save_progress(progress_collection, analytics_collection, progress_doc):
+    """Upsert a student's progress record for a lesson and fold the change into the lesson's
+    analytics. The write returns the record as it was before (None when the upsert created it),
+    which gives the analytics deltas; only a record's first write needs a second round trip, to
+    read the _id it was given. Returns the stored record."""
+    query = {"student_id": progress_doc["student_id"], "lesson_id": progress_doc["lesson_id"]}
+    update = progress_pipeline(progress_doc)
+    try:
+        before = await progress_collection.find_one_and_update(
+            query, update, upsert=True, return_document=ReturnDocument.BEFORE)
+    except DuplicateKeyError:
+        # A concurrent first write for the same student inserted the record; update that one
+        before = await progress_collection.find_one_and_update(
+            query, update, return_document=ReturnDocument.BEFORE)
+
+    if before is None:
+        record = {**progress_doc, "_id": (await progress_collection.find_one(query, {"_id": 1}))["_id"]}
+        was_complete = None
+    else:
+        record = {**before, **{key: value for key, value in progress_doc.items() if key != "_id"}}
+        was_complete = is_complete(before)
+    await _apply(analytics_collection, progress_doc["lesson_id"], progress_update(was_complete, is_complete(record)))
+    return record
+
+
+def coalesce_progress(updates):
+    """Keep the last update per (student_id, lesson_id), in first-seen order."""
+    latest = {}
+    for update in updates:
+        latest[(update["student_id"], update["lesson_id"])] = update
+    return list(latest.values())
+
+
+async def save_progress_bulk(progress_collection, analytics_collection, progress_docs):
+    """Upsert many progress records with one ``bulk_write`` and apply the analytics changes with
+    one more (per lesson, summed). ``progress_docs`` must hold one document per
+    (student_id, lesson_id), see coalesce_progress().
+
+    The states before the write come from a single read of the affected records just before it,
+    so two requests writing the same student's record at the same moment can skew a lesson's
+    counters; rebuild_analytics repairs that. Upserts that lose the race to create a record
+    (duplicate key) are applied to the record the other request created.
+    """
+    if not progress_docs:
+        return {"matched": 0, "upserted": 0, "lessons": 0}
+    pairs = [{"student_id": doc["student_id"], "lesson_id": doc["lesson_id"]} for doc in progress_docs]
+    before = {}
+    async for record in progress_collection.find(
+            {"$or": pairs}, {"_id": 0, "student_id": 1, "lesson_id": 1, "total_steps": 1, "completed_steps": 1}):
+        before[(record["student_id"], record["lesson_id"])] = record
+
+    try:
+        result = (await progress_collection.bulk_write(
+            [UpdateOne(query, progress_pipeline(doc), upsert=True) for query, doc in zip(pairs, progress_docs)],
+            ordered=False)).bulk_api_result
+    except BulkWriteError as e:
+        result = e.details
+        duplicates = [error["index"] for error in result.get("writeErrors", []) if error.get("code") == _DUPLICATE_KEY]
+        if len(duplicates) != len(result.get("writeErrors", [])):
+            raise
+        # A concurrent first write for the same student inserted these records; update those,
+        # reading their state before the update as save_progress() does
+        for i in duplicates:
+            before.pop((pairs[i]["student_id"], pairs[i]["lesson_id"]), None)
+            record = await progress_collection.find_one_and_update(
+                pairs[i], progress_pipeline(progress_docs[i]), return_document=ReturnDocument.BEFORE)
+            if record is not None:
+                before[(pairs[i]["student_id"], pairs[i]["lesson_id"])] = record
+                result["nMatched"] += 1
+
+    deltas = {}
+    for doc in progress_docs:
+        if not doc["lesson_id"]:
+            continue
+        key = (doc["student_id"], doc["lesson_id"])
+        was_complete = is_complete(before[key]) if key in before else None
+        lesson = deltas.setdefault(doc["lesson_id"], {"learners": 0, "completed": 0})
+        for name, delta in progress_deltas(was_complete, is_complete(doc)).items():
+            lesson[name] += delta
+    writes = [UpdateOne({"lesson_id": lesson_id}, increment_update(**delta), upsert=True)
+              for lesson_id, delta in deltas.items() if delta["learners"] or delta["completed"]]
+    if writes and analytics_collection is not None:
+        try:
+            await analytics_collection.bulk_write(writes, ordered=False)
+        except Exception as e:
+            print(f"DEBUG: Could not update analytics of {len(writes)} lessons: {e}")
+    return {"matched": result["nMatched"], "upserted": result["nUpserted"], "lessons": len(deltas)}
+
+
+async def get_lesson_analytics(collection, lesson_id):
+    """The lesson's analytics document (zeros if nothing was recorded yet)."""
+    doc = await collection.find_one({"lesson_id": lesson_id}, {"_id": 0})
+    return doc if doc is not None else create_analytics(lesson_id, 0, 0, 0)
+
+
+def rebuild_pipeline(lesson_ids=None, progress_collection="progress", into="analytics"):
+    """Aggregation over quizzes that recomputes the analytics of ``lesson_ids`` (default: every
+    lesson) from quizzes and progress and ``$merge``s them into ``into`` (needs the unique
+    "lesson" index)."""
+    if lesson_ids is None:
+        with_lesson = {"$match": {"lesson_id": {"$nin": [None, ""]}}}
+    else:
+        with_lesson = {"$match": {"lesson_id": {"$in": list(lesson_ids)}}}
+    return [
+        with_lesson,
+        {"$group": {"_id": "$lesson_id", "attempts": {"$sum": 1}, "score_total": {"$sum": SCORE},
+                    "learners": {"$sum": 0}, "completed": {"$sum": 0}}},
+        {"$unionWith": {"coll": progress_collection, "pipeline": [
+            with_lesson,
+            {"$group": {"_id": "$lesson_id", "attempts": {"$sum": 0}, "score_total": {"$sum": 0},
+                        "learners": {"$sum": 1}, "completed": {"$sum": {"$cond": [IS_COMPLETE, 1, 0]}}}},
+        ]}},
+        {"$group": {"_id": "$_id", **{name: {"$sum": f"${name}"} for name in COUNTERS}}},
+        {"$project": {"_id": 0, "lesson_id": "$_id", **{name: 1 for name in COUNTERS}}},
+        RATES_STAGE,
+        {"$merge": {"into": into, "on": "lesson_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+
+
+async def rebuild_analytics(db, lesson_ids=None):
+    """Recompute analytics from scratch; returns the number of lessons written.
+
+    Analytics documents of lessons that no longer have any quiz or progress are removed too
+    (only when rebuilding every lesson).
+    """
+    async for _ in db["quizzes"].aggregate(rebuild_pipeline(lesson_ids), allowDiskUse=True):
+        pass  # $merge returns no documents
+    if lesson_ids is None:
+        live = set(await db["quizzes"].distinct("lesson_id")) | set(await db["progress"].distinct("lesson_id"))
+        await db["analytics"].delete_many({"lesson_id": {"$nin": list(live)}})
+        return await db["analytics"].count_documents({})
+    return await db["analytics"].count_documents({"lesson_id": {"$in": list(lesson_ids)}})
@@ -0,0 +1,453 @@
+# teacher_app/batch.py
+
+import asyncio
+import logging
+import os
+import socket
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from django.conf import settings
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import ConnectionFailure
+
+from . import metrics, ratelimit
+from .codec import encode_message
+from .consumers import (MAX_PDF_TEXT_LENGTH, build_lesson_content, build_lesson_prompt, parse_notes_and_quiz,
+                        parse_teaching_steps)
+from .layout import LAYOUT_VERSION
+from .llm import get_llm_provider
+from .mongo import (conversation_activity_update, create_batch_item, create_batch_job, create_conversation,
+                    create_lesson_snapshot, create_message)
+
+# Offline lesson generation for a whole syllabus. A job (batch_jobs) has one item per topic or PDF
+# (batch_items); both live in MongoDB, so the queue survives restarts. `manage.py batch_worker`
+# runs a BatchWorkerPool: each worker claims the oldest claimable item with one
+# find_one_and_update, generates the lesson with the same prompt and parser as TeacherConsumer and
+# stores it like a live lesson (conversation, step messages, lesson snapshot), ready to replay.
+#
+# A claim is a lease that the worker renews while it generates. When a worker crashes or hangs its
+# lease runs out and the item is claimable again. The conversation id is fixed on the item and
+# storing first removes whatever an interrupted attempt left, so a retry never duplicates a
+# lesson. Failed generations are retried with exponential backoff, BATCH_MAX_ATTEMPTS in all.
+#
+# The items are the only record of progress: a job's counts and LLM time are aggregated from
+# them when it is reported (item_counts), so a worker that dies between two writes cannot leave
+# a job's numbers wrong.
+
+JOBS = "batch_jobs"
+ITEMS = "batch_items"
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+MAX_TOPIC_CHARS = 300
+MAX_ERROR_CHARS = 500
+RETRY_BACKOFF_SECONDS = 30
+ITEM_PROJECTION = {"pdf_text": 0}
+
+logger = logging.getLogger(__name__)
+
+items_finished = metrics.counter("batch_items_total", "Batch lesson items finished", ["status"])
+items_in_progress = metrics.gauge("batch_items_in_progress", "Batch lesson items being generated by this process")
+
+
+def extract_pdf_text(data):
+    """Text of a PDF given as bytes."""
+    import fitz  # PyMuPDF, imported on first use (see startup.py)
+    with fitz.open(stream=data, filetype="pdf") as doc:
+        return "".join(page.get_text() for page in doc)
+
+
+# ---------------- Queue ----------------
+
+async def enqueue_job(db, user_id, name, topics=(), pdfs=()):
+    """Queue one lesson per topic and per ``(filename, text)`` PDF; returns the job document.
+    Topics repeated in the list (ignoring case and spacing) are queued once."""
+    entries, seen = [], set()
+    for topic in topics:
+        topic = " ".join(str(topic).split())[:MAX_TOPIC_CHARS]
+        if topic and topic.lower() not in seen:
+            seen.add(topic.lower())
+            entries.append({"topic": topic})
+    for filename, text in pdfs:
+        entries.append({"pdf_filename": filename, "pdf_text": text[:MAX_PDF_TEXT_LENGTH]})
+    if not entries:
+        raise ValueError("A batch job needs at least one topic or PDF")
+
+    job = create_batch_job(user_id, name, len(entries))
+    job["_id"] = ObjectId()
+    items = [create_batch_item(job["_id"], seq, user_id, **entry) for seq, entry in enumerate(entries)]
+    # Items first: a job that exists always has all of its items
+    await db[ITEMS].insert_many(items, ordered=False)
+    await db[JOBS].insert_one(job)
+    return job
+
+
+def _lease_filter(item):
+    """Matches the item only while this claim of it still holds the lease."""
+    return {"_id": item["_id"], "status": RUNNING, "worker_id": item["worker_id"], "attempts": item["attempts"]}
+
+
+async def claim_item(db, worker_id, lease_seconds, job_id=None):
+    """Lease the oldest claimable item to ``worker_id``: a queued one whose backoff has passed or a
+    running one whose lease expired. Returns the item with this attempt counted, or None."""
+    now = datetime.utcnow()
+    query = {"status": {"$in": [QUEUED, RUNNING]}, "available_at": {"$lte": now}}
+    if job_id is not None:
+        query["job_id"] = job_id
+    lease_until = now + timedelta(seconds=lease_seconds)
+    previous = await db[ITEMS].find_one_and_update(
+        query,
+        {"$set": {"status": RUNNING, "worker_id": worker_id, "available_at": lease_until}, "$inc": {"attempts": 1}},
+        sort=[("available_at", ASCENDING)],
+    )
+    if previous is None:
+        return None
+    if previous["status"] == QUEUED:
+        await db[JOBS].update_one({"_id": previous["job_id"], "started_at": None},
+                                  {"$set": {"status": "running", "started_at": now}})
+    else:
+        logger.warning(f"Batch item {previous['_id']} resumed after the lease of {previous['worker_id']} expired")
+    return dict(previous, status=RUNNING, worker_id=worker_id, available_at=lease_until,
+                attempts=previous["attempts"] + 1)
+
+
+async def renew_lease(db, item, lease_seconds):
+    """Extend the lease; False when it was lost (expired and claimed by another worker)."""
+    result = await db[ITEMS].update_one(
+        _lease_filter(item), {"$set": {"available_at": datetime.utcnow() + timedelta(seconds=lease_seconds)}})
+    return result.matched_count == 1
+
+
+async def finish_item(db, item, status, error=None, generation_ms=None):
+    """Mark a leased item done or failed, finishing its job with its last item. Returns False if
+    the lease was lost (the new holder finishes the item)."""
+    now = datetime.utcnow()
+    result = await db[ITEMS].update_one(_lease_filter(item), {"$set": {
+        "status": status, "worker_id": None, "error": error, "generation_ms": generation_ms, "finished_at": now,
+    }})
+    if not result.modified_count:
+        return False
+    if not await pending_items(db, item["job_id"]):
+        await db[JOBS].update_one({"_id": item["job_id"], "status": {"$ne": "finished"}},
+                                  {"$set": {"status": "finished", "finished_at": now}})
+    return True
+
+
+async def requeue_item(db, item, error=None, delay=0.0, refund_attempt=False):
+    """Put a leased item back in the queue, claimable after ``delay`` seconds. A worker shutting
+    down refunds the attempt: the item did not fail."""
+    update = {"$set": {"status": QUEUED, "worker_id": None, "error": error,
+                       "available_at": datetime.utcnow() + timedelta(seconds=delay)}}
+    if refund_attempt:
+        update["$inc"] = {"attempts": -1}
+    result = await db[ITEMS].update_one(_lease_filter(item), update)
+    return bool(result.modified_count)
+
+
+async def retry_failed(db, job_id):
+    """Queue a job's failed items again with fresh attempts; returns how many."""
+    result = await db[ITEMS].update_many(
+        {"job_id": job_id, "status": FAILED},
+        {"$set": {"status": QUEUED, "attempts": 0, "available_at": datetime.utcnow(), "finished_at": None}})
+    if result.modified_count:
+        await db[JOBS].update_one({"_id": job_id}, {"$set": {"status": "running", "finished_at": None}})
+    return result.modified_count
+
+
+async def pending_items(db, job_id=None):
+    """Items of ``job_id`` (or all jobs) that are queued or running."""
+    query = {"status": {"$in": [QUEUED, RUNNING]}}
+    if job_id is not None:
+        query["job_id"] = job_id
+    return await db[ITEMS].count_documents(query)
+
+
+# ---------------- Lessons ----------------
+
+async def generate_lesson(llm, item):
+    """Stream the item's lesson from ``llm``; returns the parsed, laid-out teaching steps and the
+    notes/quiz (or None)."""
+    prompt = build_lesson_prompt(build_lesson_content(item.get("topic"), item.get("pdf_text")))
+    content = "".join([text async for text in llm.stream(prompt)])
+    return parse_teaching_steps(content), parse_notes_and_quiz(content)
+
+
+async def store_lesson(db, item, steps, notes_and_quiz=None):
+    """Store the lesson under the item's conversation id, the way TeacherConsumer stores a live one,
+    replacing anything an earlier attempt stored."""
+    conversation_id, user_id, topic = item["conversation_id"], item["user_id"], item.get("topic")
+    title = topic or f"PDF: {item.get('pdf_filename')}"
+    await db["messages"].delete_many({"conversation_id": conversation_id})
+    await db["lesson_snapshots"].delete_many({"conversation_id": conversation_id})
+    conversation = create_conversation(user_id, title, topic=topic, pdf_filename=item.get("pdf_filename"))
+    conversation["batch_job_id"] = item["job_id"]
+    await db["conversations"].replace_one({"_id": conversation_id}, conversation, upsert=True)
+
+    request = create_message(conversation_id, "user", f"Topic: {topic}" if topic else title, "topic_request",
+                             user_id=user_id)
+    step_messages = [create_message(conversation_id, "ai", step["speech_text"], "teaching_step", step_data=step,
+                                    user_id=user_id) for step in steps]
+    message_docs = [request] + step_messages
+    if notes_and_quiz:
+        message_docs.append(create_message(conversation_id, "ai", "Notes and quiz generated", "notes_and_quiz",
+                                           step_data=notes_and_quiz, user_id=user_id))
+    for doc in message_docs:
+        doc["_id"] = ObjectId()
+    await db["messages"].insert_many([encode_message(doc) for doc in message_docs], ordered=False)
+    await db["conversations"].update_one({"_id": conversation_id}, conversation_activity_update(message_docs))
+
+    await db["lesson_snapshots"].insert_one(create_lesson_snapshot(
+        conversation_id, user_id, title, topic, steps, notes_and_quiz, first_step_message_id=step_messages[0]["_id"],
+        source="batch", layout_version=LAYOUT_VERSION,
+    ))
+    if topic:
+        from .topic_index import persist_lesson_topic  # noqa: deferred (numpy)
+        await persist_lesson_topic(topic, conversation_id, user_id)
+
+
+# ---------------- Worker pool ----------------
+
+class BatchWorkerPool:
+    """``workers`` concurrent workers over the queue (every job, or only ``job_id``). At most
+    ``llm_concurrency`` of them stream from the LLM at once; the others store finished lessons or
+    wait for a slot. Generations start at most BATCH_LLM_REQUESTS_PER_MINUTE times a minute, counted
+    in the rate-limit backend so that several worker processes share the budget."""
+
+    def __init__(self, db, workers=None, llm_concurrency=None, llm=None, job_id=None):
+        self.db = db
+        self.workers = max(1, workers or settings.BATCH_WORKERS)
+        self.llm_concurrency = max(1, llm_concurrency or settings.BATCH_LLM_CONCURRENCY)
+        self.llm = llm or get_llm_provider()
+        self.job_id = job_id
+        self.lease_seconds = settings.BATCH_LEASE_SECONDS
+        self.max_attempts = settings.BATCH_MAX_ATTEMPTS
+        self.name = f"{socket.gethostname()}:{os.getpid()}:{ObjectId()}"
+        self.done = self.failed = self.retried = 0
+        self.generation_seconds = 0.0
+        self.started = None
+        self._llm_slots = None
+
+    async def run(self, until_idle=False, stop=None, report=None, report_every=30.0):
+        """Work until ``stop`` (an asyncio.Event) is set or, with ``until_idle``, until no item
+        is queued or running, calling ``report()`` every ``report_every`` seconds. A cancelled
+        pool puts the items it holds back in the queue."""
+        stop = stop or asyncio.Event()
+        self.started = time.monotonic()
+        self._llm_slots = asyncio.Semaphore(self.llm_concurrency)
+        reporter = asyncio.ensure_future(self._report(report, report_every)) if report else None
+        try:
+            await asyncio.gather(*(self._worker(f"{self.name}/{n}", until_idle, stop) for n in range(self.workers)))
+        finally:
+            if reporter is not None:
+                reporter.cancel()
+
+    async def _report(self, report, every):
+        while True:
+            await asyncio.sleep(every)
+            try:
+                await report()
+            except Exception as e:
+                print(f"DEBUG: Batch progress report failed: {e}")
+
+    def stats(self):
+        """Throughput of this pool so far."""
+        elapsed = time.monotonic() - self.started if self.started else 0.0
+        return {
+            "done": self.done, "failed": self.failed, "retried": self.retried,
+            "elapsed_seconds": round(elapsed, 1),
+            "lessons_per_minute": round(self.done * 60 / elapsed, 2) if elapsed > 0 else 0.0,
+            "mean_generation_seconds": round(self.generation_seconds / self.done, 2) if self.done else None,
+        }
+
+    async def _worker(self, worker_id, until_idle, stop):
+        while not stop.is_set():
+            try:
+                item = await claim_item(self.db, worker_id, self.lease_seconds, self.job_id)
+                if item is None and until_idle and not await pending_items(self.db, self.job_id):
+                    return
+            except ConnectionFailure as e:
+                print(f"DEBUG: Batch queue unavailable: {str(e).split(',')[0]}")
+                item = None
+            if item is None:
+                try:
+                    await asyncio.wait_for(stop.wait(), settings.BATCH_POLL_SECONDS)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self.process(item)
+
+    async def _renew(self, item):
+        while True:
+            await asyncio.sleep(self.lease_seconds / 3)
+            try:
+                if not await renew_lease(self.db, item, self.lease_seconds):
+                    logger.warning(f"Lost the lease on batch item {item['_id']}")
+                    return
+            except ConnectionFailure as e:
+                logger.warning(f"Could not renew the lease on batch item {item['_id']}: {str(e).split(',')[0]}")
+
+    async def _pace(self):
+        """Wait for a generation start within BATCH_LLM_REQUESTS_PER_MINUTE."""
+        per_minute = settings.BATCH_LLM_REQUESTS_PER_MINUTE
+        if per_minute <= 0:
+            return
+        limit = ratelimit.Limit(self.llm_concurrency, per_minute / 60)
+        while True:
+            decision = await ratelimit.get_backend().aconsume("llm_requests:batch", limit, 1)
+            if decision.allowed:
+                return
+            await asyncio.sleep(decision.retry_after)
+
+    async def process(self, item):
+        """Generate and store one claimed item, then finish, retry or fail it."""
+        label = item.get("topic") or item.get("pdf_filename")
+        if item["attempts"] > self.max_attempts:
+            # Its workers kept dying mid-lesson (the lease expired every time)
+            error = item.get("error") or f"Gave up after {self.max_attempts} attempts"
+            await self._finish(item, FAILED, error)
+            return
+        items_in_progress.inc()
+        renewer = asyncio.ensure_future(self._renew(item))
+        try:
+            async with self._llm_slots:
+                await self._pace()
+                started = time.monotonic()
+                steps, notes_and_quiz = await asyncio.wait_for(generate_lesson(self.llm, item),
+                                                               settings.BATCH_ITEM_TIMEOUT_SECONDS)
+                generation_seconds = time.monotonic() - started
+            if not steps:
+                raise ValueError("Failed to parse teaching steps from generated content")
+            await store_lesson(self.db, item, steps, notes_and_quiz)
+        except asyncio.CancelledError:
+            await asyncio.shield(self._release(item))
+            raise
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"[:MAX_ERROR_CHARS]
+            print(f"DEBUG: Batch item {label!r} attempt {item['attempts']} failed: {error}")
+            if item["attempts"] >= self.max_attempts:
+                await self._finish(item, FAILED, error)
+            else:
+                await self._retry(item, error, RETRY_BACKOFF_SECONDS * 2 ** (item["attempts"] - 1))
+        else:
+            self.generation_seconds += generation_seconds
+            await self._finish(item, DONE, generation_ms=int(generation_seconds * 1000))
+            print(f"DEBUG: Batch item {label!r} done: {len(steps)} steps in {generation_seconds:.1f}s")
+        finally:
+            renewer.cancel()
+            items_in_progress.dec()
+
+    async def _finish(self, item, status, error=None, generation_ms=None):
+        try:
+            finished = await finish_item(self.db, item, status, error, generation_ms)
+        except ConnectionFailure as e:
+            # The lease runs out and the item is generated again
+            print(f"DEBUG: Could not record batch item {item['_id']} as {status}: {str(e).split(',')[0]}")
+            return
+        if finished:
+            items_finished.inc(status=status)
+            if status == DONE:
+                self.done += 1
+            else:
+                self.failed += 1
+
+    async def _retry(self, item, error, delay):
+        try:
+            if await requeue_item(self.db, item, error, delay):
+                self.retried += 1
+        except ConnectionFailure as e:
+            print(f"DEBUG: Could not requeue batch item {item['_id']}: {str(e).split(',')[0]}")
+
+    async def _release(self, item):
+        try:
+            await requeue_item(self.db, item, item.get("error"), refund_attempt=True)
+        except Exception as e:
+            print(f"DEBUG: Could not release batch item {item['_id']}, it resumes when its lease expires: {e}")
+
+
+# ---------------- Reports ----------------
+
+async def item_counts(db, job_ids):
+    """``{job_id: (items per status, summed LLM ms of the done items)}`` from batch_items."""
+    counts = {job_id: {QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0} for job_id in job_ids}
+    generation_ms = dict.fromkeys(job_ids, 0)
+    pipeline = [
+        {"$match": {"job_id": {"$in": list(job_ids)}}},
+        {"$group": {"_id": {"job_id": "$job_id", "status": "$status"}, "items": {"$sum": 1},
+                    "generation_ms": {"$sum": "$generation_ms"}}},
+    ]
+    async for group in db[ITEMS].aggregate(pipeline):
+        job_id, status = group["_id"]["job_id"], group["_id"]["status"]
+        counts[job_id][status] = group["items"]
+        if status == DONE:
+            generation_ms[job_id] = group["generation_ms"]
+    return {job_id: (counts[job_id], generation_ms[job_id]) for job_id in job_ids}
+
+
+async def _with_counts(db, jobs):
+    counts = await item_counts(db, [job["_id"] for job in jobs])
+    for job in jobs:
+        job["counts"], job["generation_ms"] = counts[job["_id"]]
+    return jobs
+
+
+def job_report(job, now=None):
+    """A job's progress and throughput: counts, fraction finished, lessons per minute, mean LLM
+    time per lesson and the estimated time left. ``job`` carries the ``counts`` and
+    ``generation_ms`` of item_counts()."""
+    counts = job["counts"]
+    finished = counts["done"] + counts["failed"]
+    remaining = job["total"] - finished
+    elapsed = None
+    if job.get("started_at"):
+        elapsed = ((job.get("finished_at") or now or datetime.utcnow()) - job["started_at"]).total_seconds()
+    eta = 0.0 if not remaining else None
+    if remaining and finished and elapsed:
+        eta = round(remaining * elapsed / finished, 1)
+    return {
+        "job_id": str(job["_id"]),
+        "name": job.get("name"),
+        "user_id": job.get("user_id"),
+        "status": job["status"],
+        "total": job["total"],
+        "counts": counts,
+        "progress": round(finished / job["total"], 3) if job["total"] else 1.0,
+        "created_at": job.get("created_at"),
+        "started_at": job.get("started_at"),
+        "finished_at": job.get("finished_at"),
+        "elapsed_seconds": round(elapsed, 1) if elapsed is not None else None,
+        "lessons_per_minute": round(counts["done"] * 60 / elapsed, 2) if elapsed else None,
+        "mean_generation_seconds": round(job["generation_ms"] / 1000 / counts["done"], 2) if counts["done"] else None,
+        "eta_seconds": eta,
+    }
+
+
+def serialize_item(item):
+    return {
+        "seq": item["seq"],
+        "topic": item.get("topic"),
+        "pdf_filename": item.get("pdf_filename"),
+        "status": item["status"],
+        "attempts": item["attempts"],
+        "error": item.get("error"),
+        "conversation_id": str(item["conversation_id"]) if item["status"] == DONE else None,
+        "generation_ms": item.get("generation_ms"),
+        "finished_at": item.get("finished_at"),
+    }
+
+
+async def get_job(db, job_id, with_items=False):
+    """``job_report`` of a job, with its items in order if asked; None if there is no such job."""
+    job = await db[JOBS].find_one({"_id": job_id})
+    if job is None:
+        return None
+    report = job_report((await _with_counts(db, [job]))[0])
+    if with_items:
+        cursor = db[ITEMS].find({"job_id": job_id}, ITEM_PROJECTION).sort("seq", ASCENDING)
+        report["items"] = [serialize_item(item) async for item in cursor]
+    return report
+
+
+async def list_jobs(db, user_id, limit=50):
+    """``job_report`` of a user's most recent jobs."""
+    cursor = db[JOBS].find({"user_id": user_id}).sort("created_at", DESCENDING).limit(limit)
+    return [job_report(job) for job in await _with_counts(db, [job async for job in cursor])]
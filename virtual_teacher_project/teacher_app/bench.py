@@ -0,0 +1,152 @@
+# teacher_app/bench.py
+
+import json
+import random
+import re
+
+from .consumers import (
+    STEP_START, STEP_END, LESSON_END,
+    clamp, sanitize_command, strip_code_fences, clean_text_for_speech, parse_teaching_steps,
+)
+from .speech import get_normalizer
+from .schema import validate_lesson
+from .layout import layout_lesson
+
+SPEECH_SAMPLE = (
+    "Hello everyone! Today we will learn about **photosynthesis**, i.e. how plants make food. "
+    "Plants use *sunlight*, water and carbon dioxide, e.g. from the air; the result: glucose and oxygen. "
+    "Compare `chlorophyll` vs. other pigments w/ me, etc. Ready? Let's go!"
+)
+
+
+def _step(n, text=SPEECH_SAMPLE, commands=None):
+    return {
+        "step": n,
+        "speech_text": text,
+        "speech_duration": 8000,
+        "drawing_commands": commands if commands is not None else [
+            {"time": 0, "action": "draw_text", "text": f"Key idea {n}", "fontSize": 24, "color": "#2563eb"},
+            {"time": 3000, "action": "draw_rectangle", "width": 150, "height": 80, "color": "#059669", "strokeWidth": 3},
+            {"time": 5000, "action": "draw_arrow", "color": "#059669"},
+        ],
+    }
+
+
+def lesson_text(steps, fenced=True, **step_kwargs):
+    """Render ``steps`` marker-delimited steps the way the LLM streams them."""
+    parts = []
+    for n in range(1, steps + 1):
+        body = json.dumps(_step(n, **step_kwargs), indent=2)
+        if fenced:
+            body = f"```json\n{body}\n```"
+        parts.append(f"{STEP_START}\n{body}\n{STEP_END}\n")
+    return "".join(parts) + LESSON_END
+
+
+def nested_json(depth):
+    value = "leaf"
+    for _ in range(depth):
+        value = {"child": [value]}
+    return value
+
+
+def legacy_commands(count):
+    base = [
+        {"action": "write_text", "text": "Chlorophyll absorbs light", "x_percent": 10, "y_percent": "20", "font_size": 24},
+        {"action": "draw_shape", "shape": "rect", "x_percent": 60, "y_percent": 30, "width_percent": "20"},
+        {"action": "draw_arrow", "points": [10, 20, "30", 40], "color": "red"},
+        {"action": "clear_all"},
+        {"action": "unknown"},
+        "not-a-dict",
+    ]
+    return [base[i % len(base)] for i in range(count)]
+
+
+def hostile_step(n, commands=50):
+    """A step the LLM got wrong in every way the schema has to coerce."""
+    junk = [
+        {"time": "1000", "action": "draw_text", "text": "t" * 5000, "fontSize": "huge", "fontStyle": ["bold"], "x": -40},
+        {"action": "draw_rectangle", "width": 10_000, "height": "80", "strokeWidth": None, "extra": {"a": 1}},
+        {"action": "draw_circle", "radius": float("nan"), "color": 12345},
+        {"action": "draw_arrow", "points": [1, 2, 3]},
+        {"action": "draw_line", "points": [0, "10", 800, 10_000]},
+        {"action": "explode"},
+        ["not", "a", "dict"],
+    ]
+    return {
+        "step": str(n), "speech_text": SPEECH_SAMPLE * 40, "speech_duration": "8000.5", "mood": "x",
+        "drawing_commands": [junk[i % len(junk)] for i in range(commands * 2)],
+    }
+
+
+def reference_clean_text_for_speech(text):
+    """The original multi-pass ``clean_text_for_speech``, with ``w/o`` expanded before ``w/``."""
+    if not text:
+        return ""
+    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)
+    text = re.sub(r'\*(.*?)\*', r'\1', text)
+    text = re.sub(r'`(.*?)`', r'\1', text)
+    for abbreviation, expansion in (("e.g.", "for example"), ("i.e.", "that is"), ("etc.", "and so on"),
+                                    ("vs.", "versus"), ("w/o", "without"), ("w/", "with")):
+        text = text.replace(abbreviation, expansion)
+    for char in ".?!;:":
+        text = text.replace(char, char + " ")
+    text = re.sub(r'\s+', ' ', text)
+    return text.strip()
+
+
+def speech_corpus(fuzz=5000, seed=7):
+    """Realistic and randomly composed speech texts for equivalence checks (tests.py)."""
+    words = ["hello", "**bold words**", "*italic*", "`code`", "e.g.", "i.e.", "etc.", "vs.", "w/", "w/o",
+             "end.", "why?", "wow!", "a;", "key:", "3.14", "\n", "  ", "\t", "*", "x*y"]
+    rng = random.Random(seed)
+    corpus = [SPEECH_SAMPLE, (SPEECH_SAMPLE + "\n") * 50, "", "   ", "w/o sugar w/ milk", "**Note:** see `x.y`!"]
+    corpus += [" ".join(rng.choice(words) for _ in range(rng.randint(0, 20))) for _ in range(fuzz)]
+    return corpus
+
+
+def postprocessing_cases():
+    """Return ``{name: callable}`` for the lesson post-processing hot path
+    (benchmarked by benchmarks/test_postprocessing.py)."""
+    realistic_lesson = lesson_text(6)
+    cmds = legacy_commands(6)
+    thousands = legacy_commands(5000)
+    huge_text_cmds = [{"action": "write_text", "text": "x" * 100_000, "x_percent": "5"}] * 50
+    huge_speech = (SPEECH_SAMPLE + "\n") * 2000
+    markdown_storm = "**bold** *it* `code` e.g. i.e. w/o w/ vs. etc. ?!;:. " * 5000
+    unbalanced = "2 * 3 = 6 and 4 * 5" + " word" * 20_000
+    fenced_huge = "```json\n" + json.dumps([_step(n) for n in range(2000)]) + "\n```"
+    many_steps = lesson_text(1000)
+    nested = lesson_text(6, commands=[{"action": "draw_text", "text": "deep", "meta": nested_json(100)}])
+    huge_step_text = lesson_text(6, text=huge_speech)
+    lesson_speech = [SPEECH_SAMPLE] * 6
+    normalizer = get_normalizer()
+    parsed_lesson = [_step(n) for n in range(1, 7)]
+    hostile_lesson = [hostile_step(n) for n in range(1, 7)]
+    laid_out_lesson = validate_lesson([_step(n) for n in range(1, 7)])
+    crowded_lesson = validate_lesson([hostile_step(n) for n in range(1, 7)])
+
+    return {
+        "clamp/number": lambda: clamp(42.5, 0, 100),
+        "clamp/string": lambda: clamp("73", 0, 100),
+        "clamp/invalid": lambda: clamp("n/a", 0, 100),
+        "sanitize_command/realistic": lambda: [sanitize_command(c) for c in cmds],
+        "sanitize_command/5000_commands": lambda: [sanitize_command(c) for c in thousands],
+        "sanitize_command/huge_text": lambda: [sanitize_command(c) for c in huge_text_cmds],
+        "strip_code_fences/realistic": lambda: strip_code_fences(realistic_lesson),
+        "strip_code_fences/huge": lambda: strip_code_fences(fenced_huge),
+        "clean_text_for_speech/realistic": lambda: clean_text_for_speech(SPEECH_SAMPLE),
+        "clean_text_for_speech/huge": lambda: clean_text_for_speech(huge_speech),
+        "clean_text_for_speech/markdown_storm": lambda: clean_text_for_speech(markdown_storm),
+        "clean_text_for_speech/unbalanced_markdown": lambda: clean_text_for_speech(unbalanced),
+        "clean_text_for_speech/lesson_batch": lambda: normalizer.normalize_many(lesson_speech),
+        "clean_text_for_speech/reference_realistic": lambda: reference_clean_text_for_speech(SPEECH_SAMPLE),
+        "validate_lesson/realistic": lambda: validate_lesson(parsed_lesson),
+        "validate_lesson/hostile": lambda: validate_lesson(hostile_lesson),
+        "layout_lesson/realistic": lambda: layout_lesson(laid_out_lesson),
+        "layout_lesson/crowded": lambda: layout_lesson(crowded_lesson),
+        "parse_teaching_steps/realistic": lambda: parse_teaching_steps(realistic_lesson),
+        "parse_teaching_steps/1000_steps": lambda: parse_teaching_steps(many_steps),
+        "parse_teaching_steps/nested_json": lambda: parse_teaching_steps(nested),
+        "parse_teaching_steps/huge_speech": lambda: parse_teaching_steps(huge_step_text),
+    }
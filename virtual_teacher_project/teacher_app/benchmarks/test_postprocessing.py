@@ -0,0 +1,27 @@
+# teacher_app/benchmarks/test_postprocessing.py
+"""Benchmarks of the lesson post-processing hot path (clamp, sanitize_command, strip_code_fences,
+clean_text_for_speech, validate_lesson, layout_lesson, parse_teaching_steps) on realistic and
+adversarial inputs. The baseline is the newest run saved in teacher_app/benchmarks/baseline
+(pytest.ini points --benchmark-storage there):
+
+    pytest teacher_app/benchmarks --benchmark-compare --benchmark-compare-fail=min:25%
+    pytest teacher_app/benchmarks --benchmark-save=baseline    # accept this run as the new baseline
+    pytest teacher_app/benchmarks -k clean_text                # a subset
+"""
+
+import contextlib
+import os
+
+import pytest
+
+from teacher_app.bench import postprocessing_cases
+
+CASES = postprocessing_cases()
+
+
+@pytest.mark.parametrize("name", sorted(CASES))
+def test_postprocessing(benchmark, name):
+    benchmark.group = name.split("/")[0]
+    # The functions under test print DEBUG lines; keep them out of the timings.
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        benchmark(CASES[name])
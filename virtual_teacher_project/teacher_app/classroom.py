@@ -0,0 +1,208 @@
+# teacher_app/classroom.py
+
+import asyncio
+import json
+import re
+from urllib.parse import parse_qs
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from . import metrics
+from .consumers import TeacherConsumer
+from .wire import COMPACT, JSON, encode_frame
+
+classroom_viewers = metrics.gauge("classroom_viewers", "Viewers connected to classroom rooms in this process")
+classroom_frames = metrics.counter(
+    "classroom_frames_broadcast_total", "Frames fanned out to classroom rooms (each serialized once)")
+
+ROOM_ID_RE = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# Frame types a late joiner needs to catch up, kept (latest of each) in the room snapshot
+SNAPSHOT_FRAME_TYPES = ("lesson_start", "conversation_created", "generation_progress",
+                        "lesson_ready", "notes_and_quiz_ready", "error", "playback_sync")
+
+
+def group_name(room_id):
+    return f"classroom_{room_id}"
+
+
+class Room:
+    """A classroom: one host generating a lesson, frames fanned out over a channel-layer group.
+
+    Every frame is numbered with the room's own ``seq`` (the host's session numbers only the
+    frames of its lessons, for resuming), serialized once here (lesson frames once per wire
+    encoding) and delivered to viewers as ready-made text, so the per-viewer cost of a frame is
+    a single send. The room keeps the latest frame of each snapshot type so late joiners can
+    catch up. Rooms live in the host's server process; with several workers, route a room's
+    connections to one process (group fan-out itself works across processes through the
+    channel layer).
+    """
+
+    def __init__(self, room_id):
+        self.room_id = room_id
+        self.group = group_name(room_id)
+        self.host = None
+        self.seq = 0
+        self._latest = {}
+        self._snapshot_text = None
+        self._close_handle = None
+
+    async def publish(self, frame):
+        """Number ``frame``, record it for the snapshot and broadcast it to every viewer."""
+        frame_type = frame.get("type")
+        if frame_type == "lesson_start" or frame.get("replay"):
+            self._latest = {}  # a new (or replayed) lesson replaces the previous one
+        self.seq += 1
+        frame = {**frame, "seq": self.seq}
+        if frame_type in SNAPSHOT_FRAME_TYPES:
+            self._latest[frame_type] = frame
+        self._snapshot_text = None
+        classroom_frames.inc()
+        message = {"type": "classroom.frame", "frame_type": frame_type, "text": encode_frame(frame, JSON)}
+        if "teaching_steps" in frame:
+            message["compact_text"] = encode_frame(frame, COMPACT)
+        await get_channel_layer().group_send(self.group, message)
+
+    def snapshot_text(self):
+        """Serialized ``classroom_snapshot`` frame: the kept frames in the order they were sent."""
+        if self._snapshot_text is None:
+            frames = [self._latest[t] for t in SNAPSHOT_FRAME_TYPES if t in self._latest]
+            frames.sort(key=lambda f: f.get("seq", 0))
+            self._snapshot_text = json.dumps({
+                "type": "classroom_snapshot",
+                "room_id": self.room_id,
+                "seq": self.seq,
+                "host_connected": self.host is not None,
+                "frames": frames,
+            })
+        return self._snapshot_text
+
+    def host_left(self, grace):
+        """Close the room ``grace`` seconds after the host leaves, unless the host comes back."""
+        self.host = None
+        self._snapshot_text = None
+        self._cancel_close()
+        self._close_handle = asyncio.get_running_loop().call_later(grace, lambda: asyncio.ensure_future(self.close()))
+
+    def host_joined(self, consumer):
+        self._cancel_close()
+        self.host = consumer
+        self._snapshot_text = None
+
+    def _cancel_close(self):
+        if self._close_handle is not None:
+            self._close_handle.cancel()
+            self._close_handle = None
+
+    async def close(self):
+        self._close_handle = None
+        if self.host is not None:
+            return
+        if rooms.get(self.room_id) is self:
+            del rooms[self.room_id]
+        await get_channel_layer().group_send(self.group, {
+            "type": "classroom.frame",
+            "text": json.dumps({"type": "classroom_closed", "room_id": self.room_id}),
+        })
+
+
+# room_id -> Room, for rooms hosted in this process
+rooms = {}
+
+
+class ClassroomConsumer(TeacherConsumer):
+    """``ws/classroom/<room_id>/``. Connect with ``?role=host`` to run the lesson (the host speaks
+    the same protocol as ``ws/teacher/`` plus ``{"action": "playback", ...}`` position updates);
+    every other connection is a viewer that receives the host's frames."""
+
+    async def connect(self):
+        self.room_id = self.scope["url_route"]["kwargs"]["room_id"]
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        self.is_host = query.get("role", [""])[0] == "host"
+        self.room = None
+        self.session = None
+        if not ROOM_ID_RE.match(self.room_id):
+            await self.accept_connection()
+            await self.send_json({"type": "error", "message": "Invalid classroom id."})
+            await self.close()
+            return
+
+        if self.is_host:
+            room = rooms.get(self.room_id)
+            if room is not None and room.host is not None:
+                await self.accept_connection()
+                await self.send_json({"type": "error", "message": "This classroom already has a host."})
+                await self.close()
+                return
+            if room is None:
+                room = rooms[self.room_id] = Room(self.room_id)
+            room.host_joined(self)
+            self.room = room
+            await super().connect()
+            return
+
+        await self.channel_layer.group_add(group_name(self.room_id), self.channel_name)
+        await self.accept_connection()
+        classroom_viewers.inc()
+        room = rooms.get(self.room_id)
+        if room is not None:
+            # Frames queued behind the snapshot may repeat it; clients drop seq <= snapshot seq
+            await self.send_text(room.snapshot_text(), "classroom_snapshot")
+        else:
+            await self.send_json({"type": "status", "message": "Joined the classroom. Waiting for the host..."})
+
+    async def disconnect(self, close_code):
+        if getattr(self, "is_host", False):
+            if self.room is not None and self.room.host is self:
+                self.room.host_left(getattr(settings, "LESSON_SESSION_GRACE_SECONDS", 60.0))
+            await super().disconnect(close_code)
+            return
+        self.stop_outbound()
+        if getattr(self, "room_id", None) and ROOM_ID_RE.match(self.room_id):
+            await self.channel_layer.group_discard(group_name(self.room_id), self.channel_name)
+            classroom_viewers.dec()
+
+    async def receive(self, text_data=None, bytes_data=None):
+        if not self.is_host:
+            await self.send_json({"type": "error", "message": "Only the classroom host can control the lesson."})
+            return
+        try:
+            payload = json.loads(text_data)
+        except (TypeError, json.JSONDecodeError):
+            payload = None
+        if isinstance(payload, dict) and payload.get("action") == "playback":
+            await self.sync_playback(payload)
+            return
+        await super().receive(text_data=text_data, bytes_data=bytes_data)
+
+    async def sync_playback(self, payload):
+        """Broadcast the host's playback position so viewers follow along (to the room only: it is
+        not part of the lesson the host's session keeps for resuming)"""
+        try:
+            frame = {
+                "type": "playback_sync",
+                "step_index": int(payload.get("step_index", 0)),
+                "position_ms": int(payload.get("position_ms", 0)),
+                "playing": bool(payload.get("playing", True)),
+            }
+        except (TypeError, ValueError):
+            await self.send_json({"type": "error", "message": "Invalid playback position."})
+            return
+        await self.room.publish(frame)
+
+    async def emit(self, obj, session=None):
+        frame = await super().emit(obj, session)
+        if self.room is not None:
+            await self.room.publish(frame)
+        return frame
+
+    async def send_replay(self, obj):
+        await super().send_replay(obj)
+        if self.room is not None:
+            await self.room.publish(obj)
+
+    async def classroom_frame(self, event):
+        """Group message: forward the pre-serialized frame to this viewer"""
+        if not self.is_host:
+            text = event.get("compact_text") if self.wire_format == COMPACT else None
+            await self.send_text(text or event["text"], event.get("frame_type"))
@@ -0,0 +1,97 @@
+# teacher_app/codec.py
+
+import zlib
+
+import bson
+from bson.binary import Binary
+from django.conf import settings
+
+try:
+    import zstandard
+except ImportError:  # optional dependency
+    zstandard = None
+
+# Marker fields written next to an encoded step_data
+CODEC_FIELD = "step_codec"            # "zlib" / "zstd" when step_data is compressed BSON
+CONTENT_FIELD = "step_content_field"  # step_data key that was dropped because it equals content
+
+# step_data keys that may duplicate the message content
+DEDUPE_KEYS = ("speech_text", "text_explanation")
+
+ZLIB_LEVEL = 6
+ZSTD_LEVEL = 3
+
+
+def _compressors():
+    table = {"zlib": (lambda raw: zlib.compress(raw, ZLIB_LEVEL), zlib.decompress)}
+    if zstandard is not None:
+        table["zstd"] = (zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress,
+                         zstandard.ZstdDecompressor().decompress)
+    return table
+
+
+_COMPRESSORS = _compressors()
+
+
+def configured_codec():
+    """Codec name from ``settings.MESSAGE_CODEC``; zstd falls back to zlib when not installed."""
+    name = getattr(settings, "MESSAGE_CODEC", "zlib") or "none"
+    if name == "zstd" and zstandard is None:
+        print("DEBUG: MESSAGE_CODEC=zstd but the zstandard package is not installed, using zlib")
+        return "zlib"
+    if name not in _COMPRESSORS and name != "none":
+        raise ValueError(f"Unknown MESSAGE_CODEC {name!r}")
+    return name
+
+
+def encode_message(message, codec=None, min_bytes=None):
+    """Return a copy of ``message`` with its step_data deduplicated and, if large, compressed.
+
+    Documents without a dict step_data, or already encoded, are returned unchanged.
+    """
+    step_data = message.get("step_data")
+    if not isinstance(step_data, dict) or CODEC_FIELD in message or CONTENT_FIELD in message:
+        return message
+    codec = configured_codec() if codec is None else codec
+    if codec == "none":
+        return message
+    min_bytes = getattr(settings, "MESSAGE_CODEC_MIN_BYTES", 512) if min_bytes is None else min_bytes
+
+    out = dict(message)
+    content = message.get("content")
+    for key in DEDUPE_KEYS:
+        if content and step_data.get(key) == content:
+            step_data = {k: v for k, v in step_data.items() if k != key}
+            out[CONTENT_FIELD] = key
+            break
+
+    raw = bson.encode(step_data)
+    if len(raw) >= min_bytes:
+        compressed = _COMPRESSORS[codec][0](raw)
+        if len(compressed) < len(raw):
+            out["step_data"] = Binary(compressed)
+            out[CODEC_FIELD] = codec
+            return out
+    out["step_data"] = step_data
+    return out
+
+
+def decode_message(message):
+    """Inverse of ``encode_message``: returns a copy with a plain step_data dict."""
+    codec = message.get(CODEC_FIELD)
+    content_field = message.get(CONTENT_FIELD)
+    if codec is None and content_field is None:
+        return message
+
+    out = {k: v for k, v in message.items() if k not in (CODEC_FIELD, CONTENT_FIELD)}
+    step_data = out.get("step_data")
+    if codec is not None:
+        if codec not in _COMPRESSORS:
+            raise RuntimeError(f"Message {message.get('_id')} uses codec {codec!r}, which is not installed")
+        step_data = bson.decode(_COMPRESSORS[codec][1](bytes(step_data)))
+    else:
+        step_data = dict(step_data)
+    if content_field is not None:
+        step_data[content_field] = out.get("content")
+    out["step_data"] = step_data
+    return out
@@ -1,5 +1,6 @@
 # teacher_app/consumers.py
 
+import asyncio
 import json
 import re
 import logging
@@ -7,15 +8,22 @@ from typing import Optional
 from datetime import datetime
 from bson import ObjectId
 
-import google.generativeai as genai
 from django.conf import settings
 from channels.generic.websocket import AsyncWebsocketConsumer
-from langchain.prompts import PromptTemplate # Corrected import
-from .mongo_collections import conversations, messages
-from .mongo import create_conversation, create_message
-from .mongo_collections import conversations, messages
-from .mongo import create_conversation, create_message
-from bson import ObjectId
+from .mongo_collections import conversations, messages, lesson_snapshots
+from .mongo import create_conversation, create_message, create_lesson_snapshot, conversation_activity_update, mongo_available
+from .snapshots import ensure_snapshot_layout, get_latest_snapshot, serialize_snapshot
+from .codec import encode_message
+from .spool import get_spool
+from .sessions import LessonSession, registry, session_resumes
+from .outbound import OutboundQueue
+from .wire import JSON, encode_frame, negotiate
+from . import ratelimit
+from pymongo.errors import ConnectionFailure
+from .llm import get_llm_provider
+from .speech import get_normalizer
+from .schema import clamp, validate_command, validate_lesson
+from .layout import LAYOUT_VERSION, layout_lesson
 
 logger = logging.getLogger(__name__)
 
@@ -24,72 +32,10 @@ STEP_START = "@@STEP_START@@"
 STEP_END = "@@STEP_END@@"
 LESSON_END = "@@LESSON_END@@"
 
-# Allowed whiteboard commands (server side sanitization)
-ALLOWED_ACTIONS = {"clear_all", "write_text", "draw_shape", "draw_arrow"}
-ALLOWED_SHAPES = {"rect", "circle"}
-MAX_PERCENT = 100
-MIN_PERCENT = 0
-
-
-def clamp(value, lo, hi):
-    try:
-        v = float(value)
-    except (ValueError, TypeError):
-        return lo
-    return max(lo, min(hi, v))
-
 
 def sanitize_command(cmd: dict) -> Optional[dict]:
     """Return sanitized command dict or None if invalid."""
-    if not isinstance(cmd, dict):
-        return None
-    action = cmd.get("action")
-    if action not in ALLOWED_ACTIONS:
-        return None
-
-    out = {"action": action}
-    if action == "clear_all":
-        return out
-
-    if action == "write_text":
-        text = str(cmd.get("text", ""))[:1200]
-        out.update({
-            "text": text,
-            "x_percent": clamp(cmd.get("x_percent", 0), MIN_PERCENT, MAX_PERCENT),
-            "y_percent": clamp(cmd.get("y_percent", 0), MIN_PERCENT, MAX_PERCENT),
-            "font_size": int(clamp(cmd.get("font_size", 20), 8, 200)),
-            "color": str(cmd.get("color", "black"))[:32],
-            "align": cmd.get("align", "left") if cmd.get("align") in ("left", "center") else "left"
-        })
-        return out
-
-    if action == "draw_shape":
-        shape = cmd.get("shape")
-        if shape not in ALLOWED_SHAPES:
-            return None
-        out.update({
-            "shape": shape,
-            "x_percent": clamp(cmd.get("x_percent", 0), MIN_PERCENT, MAX_PERCENT),
-            "y_percent": clamp(cmd.get("y_percent", 0), MIN_PERCENT, MAX_PERCENT),
-            "width_percent": clamp(cmd.get("width_percent", 10), 0.1, MAX_PERCENT),
-            "height_percent": clamp(cmd.get("height_percent", 10), 0.1, MAX_PERCENT),
-            "color": str(cmd.get("color", "#f3f4f6"))[:32],
-            "stroke": str(cmd.get("stroke", "black"))[:32]
-        })
-        return out
-
-    if action == "draw_arrow":
-        pts = cmd.get("points", [])
-        if not (isinstance(pts, list) and len(pts) == 4):
-            return None
-        pts_clamped = [clamp(p, MIN_PERCENT, MAX_PERCENT) for p in pts]
-        out.update({
-            "points": pts_clamped,
-            "color": str(cmd.get("color", "black"))[:32]
-        })
-        return out
-
-    return None
+    return validate_command(cmd)
 
 
 def strip_code_fences(text: str) -> str:
@@ -100,63 +46,219 @@ def strip_code_fences(text: str) -> str:
 
 def clean_text_for_speech(text: str) -> str:
     """Clean text to make it more suitable for speech synthesis"""
-    if not text:
-        return ""
-    
-    # Remove markdown formatting
-    text = re.sub(r'\*\*(.*?)\*\*', r'\1', text)  # Bold
-    text = re.sub(r'\*(.*?)\*', r'\1', text)      # Italic  
-    text = re.sub(r'`(.*?)`', r'\1', text)        # Code
-    
-    # Replace abbreviations with full words
-    text = text.replace('e.g.', 'for example')
-    text = text.replace('i.e.', 'that is')
-    text = text.replace('etc.', 'and so on')
-    text = text.replace('vs.', 'versus')
-    text = text.replace('w/', 'with')
-    text = text.replace('w/o', 'without')
+    return get_normalizer().normalize(text)
+
+
+def parse_teaching_steps(content: str) -> list:
+    """Parse all teaching steps from complete content"""
+    teaching_steps = []
     
-    # Add pauses for better speech rhythm
-    text = re.sub(r'\.', '. ', text)
-    text = re.sub(r'\?', '? ', text)
-    text = re.sub(r'!', '! ', text)
-    text = re.sub(r';', '; ', text)
-    text = re.sub(r':', ': ', text)
+    try:
+        # Look for step blocks in the content
+        start = 0
+        while True:
+            s = content.find(STEP_START, start)
+            if s == -1:
+                break
+            e = content.find(STEP_END, s + len(STEP_START))
+            if e == -1:
+                break
+            
+            print(f"DEBUG: Found step block from {s} to {e}")
+            block = content[s + len(STEP_START): e]
+            
+            try:
+                # Clean and parse the JSON
+                clean_block = strip_code_fences(block.strip())
+                step_data = json.loads(clean_block)
+                
+                teaching_steps.append(step_data)
+                    
+            except json.JSONDecodeError as json_error:
+                print(f"DEBUG: JSON parse error for step: {json_error}")
+                print(f"DEBUG: Block content: {block[:200]}...")
+                
+            start = e + len(STEP_END)
+            
+    except Exception as e:
+        print(f"DEBUG: Error parsing teaching steps: {e}")
     
-    # Clean up extra spaces
-    text = re.sub(r'\s+', ' ', text)
+    # Validate and coerce steps and drawing commands in one batched call
+    parsed = len(teaching_steps)
+    teaching_steps = validate_lesson(teaching_steps)
+    if len(teaching_steps) != parsed:
+        print(f"DEBUG: Dropped {parsed - len(teaching_steps)} invalid teaching steps")
+
+    # Clean speech text for all steps in one pass
+    get_normalizer().normalize_lesson(teaching_steps)
+
+    # Sort steps by step number
+    teaching_steps.sort(key=lambda x: x.get('step', 0))
+
+    # Position drawing commands and stamp the lesson timeline (layout.py)
+    layout_lesson(teaching_steps)
+    print(f"DEBUG: Total teaching steps parsed: {len(teaching_steps)}")
     
-    return text.strip()
+    return teaching_steps
+
+
+def parse_notes_and_quiz(content: str):
+    """The notes/quiz of a generated lesson: the ``notes_and_quiz_ready`` value of its last
+    ``{"notes_and_quiz_ready": ...}`` step block, or None"""
+    if '"notes_and_quiz_ready"' not in content:
+        return None
+    notes_and_quiz = None
+    start = 0
+    while True:
+        s = content.find(STEP_START, start)
+        if s == -1:
+            break
+        e = content.find(STEP_END, s + len(STEP_START))
+        if e == -1:
+            break
+        try:
+            block = json.loads(strip_code_fences(content[s + len(STEP_START): e].strip()))
+        except json.JSONDecodeError:
+            block = None
+        if isinstance(block, dict) and "notes_and_quiz_ready" in block:
+            notes_and_quiz = block["notes_and_quiz_ready"]
+        start = e + len(STEP_END)
+    return notes_and_quiz
+
+
+# Characters of an uploaded PDF's text that go into the prompt
+MAX_PDF_TEXT_LENGTH = 15000
+
+
+def build_lesson_content(topic, pdf_text=None) -> str:
+    """What the lesson is about: the topic, plus the start of the PDF text if there is one."""
+    lesson_content = f"Topic: {topic}"
+    if pdf_text:
+        lesson_content += f"\n\nUse the following content to create the lesson:\n\n---\n{pdf_text[:MAX_PDF_TEXT_LENGTH]}\n---"
+    return lesson_content
+
+
+def build_lesson_prompt(lesson_content: str) -> str:
+    """Build the lesson generation prompt sent to the LLM provider."""
+    from langchain.prompts import PromptTemplate  # imported on first use, see startup.py
+
+    prompt_template = PromptTemplate(
+        input_variables=["lesson_content", "step_start", "step_end", "lesson_end"],
+        template=(
+            "You are an engaging AI Virtual Teacher with a whiteboard. Create an interactive visual lesson based on: '{lesson_content}'.\n\n"
+            "**CRITICAL FORMAT REQUIREMENTS**:\n"
+            "1. Create exactly 4-6 teaching steps, each with proper JSON format.\n"
+            "2. Each step MUST be wrapped between {step_start} and {step_end} markers.\n"
+            "3. Use this EXACT JSON format for each step:\n\n"
+            "{step_start}\n"
+            "{{\n"
+            '  "step": 1,\n'
+            '  "speech_text": "Hello everyone! Today we will learn about [topic]. Let me start by writing the main concept on our whiteboard.",\n'
+            '  "speech_duration": 8000,\n'
+            '  "drawing_commands": [\n'
+            '    {{\n'
+            '      "time": 1000,\n'
+            '      "action": "draw_text",\n'
+            '      "text": "Main Topic Title",\n'
+            '      "x": 400,\n'
+            '      "y": 80,\n'
+            '      "fontSize": 32,\n'
+            '      "color": "#2563eb",\n'
+            '      "fontStyle": "bold"\n'
+            '    }},\n'
+            '    {{\n'
+            '      "time": 4000,\n'
+            '      "action": "draw_rectangle",\n'
+            '      "x": 200,\n'
+            '      "y": 150,\n'
+            '      "width": 400,\n'
+            '      "height": 100,\n'
+            '      "color": "#059669",\n'
+            '      "strokeWidth": 3\n'
+            '    }}\n'
+            '  ]\n'
+            "}}\n"
+            "{step_end}\n\n"
+            "**SPEECH GUIDELINES**:\n"
+            "- Make speech natural and conversational (like 'Hello everyone!', 'Now let me show you...', 'As you can see here...')\n"
+            "- Speech should be 6-10 seconds long (speech_duration: 6000-10000)\n"
+            "- Explain what you're drawing as you draw it\n"
+            "- Use encouraging teacher language\n\n"
+            "**DRAWING COMMANDS** (Keep it simple and clear):\n"
+            "- draw_text: {{'action': 'draw_text', 'text': 'Your explanation here', 'fontSize': 18, 'color': '#333'}}\n"
+            "- draw_rectangle: {{'action': 'draw_rectangle', 'width': 150, 'height': 80, 'color': '#0066cc'}}\n"
+            "- draw_circle: {{'action': 'draw_circle', 'radius': 40, 'color': '#dc2626'}}\n"
+            "- draw_arrow: {{'action': 'draw_arrow', 'color': '#059669'}}\n\n"
+            "**LAYOUT RULES**:\n"
+            "- Text will be automatically positioned from top to bottom, no overlapping\n"
+            "- Shapes will be positioned on the right side\n"
+            "- Use 1-3 drawing commands per step maximum\n"
+            "- Focus on clear, simple demonstrations\n"
+            "- Don't specify x,y coordinates - system will auto-position\n"
+            "**TIMING**: Use 'time' for when to draw, counted from the start of the step (0 = immediately, 3000 = 3 seconds in)\n\n"
+            "Create a complete lesson with clear step-by-step teaching, then end with {lesson_end}.\n"
+        )
+    )
+
+    return prompt_template.format(lesson_content=lesson_content, step_start=STEP_START, step_end=STEP_END, lesson_end=LESSON_END)
 
 
 class TeacherConsumer(AsyncWebsocketConsumer):
+    outbound = None
+    wire_format = JSON
+
     async def connect(self):
-        await self.accept()
-        api_key = getattr(settings, "GOOGLE_API_KEY", None)
-        print(f"DEBUG: Google API Key configured: {bool(api_key)}")
-        if api_key:
-            print(f"DEBUG: API Key starts with: {api_key[:10]}...")
-        genai.configure(api_key=api_key)
+        await self.accept_connection()
+        self.llm = get_llm_provider()
         self._buffer = ""
         self._seen_hashes = set()
         self.current_conversation_id = None
-        self.is_generating = False  # Prevent duplicate processing
+        self.session = None         # LessonSession of the lesson this connection is showing
         self.teaching_steps = []    # Buffer for synchronized lesson
+        self.lesson_meta = {}
+        self.spooling = False       # set after a failed write; the rest of the lesson goes to the spool
+        self.rate_limit_key = ratelimit.scope_key(self.scope)
+        spool = get_spool()
+        if spool is not None:
+            spool.start_replayer()
         await self.send_json({"type": "status", "message": "Connected! Ready for a topic or PDF."})
 
     async def disconnect(self, close_code):
         logger.info("WebSocket disconnected: %s", close_code)
+        self.stop_outbound()
+        if self.session is not None:
+            # Keep the generation running for the grace period so a reconnect can resume it
+            registry.detach(self.session, self)
+
+    @property
+    def is_generating(self):
+        """Prevent duplicate processing while this connection's lesson is still generating"""
+        return self.session is not None and not self.session.done
 
     async def receive(self, text_data=None, bytes_data=None):
         print(f"DEBUG: Received WebSocket message: {text_data[:200]}...")
         
+        try:
+            payload = json.loads(text_data)
+        except json.JSONDecodeError:
+            print("DEBUG: JSON decode error")
+            await self.send_json({"type": "error", "message": "Invalid JSON payload."})
+            return
+        if isinstance(payload, dict) and payload.get("action") == "resume":
+            await self.resume_lesson(payload.get("conversation_id"), payload.get("last_seq", 0), payload.get("user_id"))
+            return
+
         # Prevent duplicate processing
-        if hasattr(self, 'is_generating') and self.is_generating:
+        if self.is_generating:
             print("DEBUG: Lesson generation already in progress, ignoring duplicate request")
             return
             
+        session = None
         try:
-            payload = json.loads(text_data)
+            if payload.get("action") == "replay":
+                await self.replay_lesson(payload.get("conversation_id"))
+                return
+
             topic = payload.get("topic", "").strip()
             pdf_text = payload.get("pdf_text", "").strip()
             pdf_filename = payload.get("pdf_filename", "").strip()
@@ -169,16 +271,46 @@ class TeacherConsumer(AsyncWebsocketConsumer):
                 await self.send_json({"type": "error", "message": "Please provide a topic or a PDF."})
                 return
 
-            # Set generation flag
-            self.is_generating = True
+            # Opt-in: offer a stored lesson on a near-identical topic instead of generating one
+            if payload.get("allow_similar") and topic and not pdf_text:
+                from .topic_index import find_similar_lesson  # noqa: deferred (numpy)
+                match = find_similar_lesson(topic, user_id)
+                if match and str(match["conversation_id"]) != str(conversation_id or ""):
+                    await self.send_json({
+                        "type": "similar_lesson",
+                        "conversation_id": str(match["conversation_id"]),
+                        "topic": match["topic"],
+                        "similarity": match["similarity"],
+                        "message": f"A lesson on \"{match['topic']}\" already exists. Replay it or generate a new one?",
+                    })
+                    return
+
+            # Only requests that will really generate are charged (not offers, replays or resumes)
+            decision = await ratelimit.aconsume("lesson", self.rate_limit_key)
+            if not decision.allowed:
+                print(f"DEBUG: Lesson request from {self.rate_limit_key} rate limited")
+                await self.send_json(ratelimit.rate_limited_frame("lesson", decision))
+                return
+
+            # Frames of this lesson go through a session so a reconnecting client can resume it
+            if self.session is not None:
+                registry.detach(self.session, self)
+            session = self.session = LessonSession(self, user_id=user_id or "anonymous")
             
             # Reset for new lesson
             self._buffer = ""
             self._seen_hashes = set()
             self.teaching_steps = []
+            self.spooling = False
+            self.lesson_meta = {
+                "user_id": user_id or "anonymous",
+                "title": topic if topic else f"PDF: {pdf_filename}" if pdf_filename else "New Lesson",
+                "topic": topic,
+                "from_pdf": bool(pdf_text),
+            }
             
             # Send lesson start message
-            await self.send_json({
+            await self.emit({
                 "type": "lesson_start", 
                 "message": f"Generating lesson content for: {topic or pdf_filename}",
                 "status": "generating"
@@ -199,7 +331,7 @@ class TeacherConsumer(AsyncWebsocketConsumer):
                     conversation_id = None
                     
             if not conversation_id:
-                # Create new conversation (only if MongoDB is available)
+                # Create new conversation (spooled locally if MongoDB is unavailable)
                 if conversations is not None:
                     try:
                         title = topic if topic else f"PDF: {pdf_filename}" if pdf_filename else "New Lesson"
@@ -209,11 +341,11 @@ class TeacherConsumer(AsyncWebsocketConsumer):
                             topic=topic,
                             pdf_filename=pdf_filename
                         )
-                        result = await conversations.insert_one(conversation_doc)
-                        self.current_conversation_id = result.inserted_id
+                        await self.persist_inserts(conversations, [conversation_doc])
+                        self.current_conversation_id = conversation_doc["_id"]
                         
                         # Send conversation ID back to frontend
-                        await self.send_json({
+                        await self.emit({
                             "type": "conversation_created", 
                             "conversation_id": str(self.current_conversation_id),
                             "title": title
@@ -222,7 +354,7 @@ class TeacherConsumer(AsyncWebsocketConsumer):
                         print(f"DEBUG: Error creating conversation: {e}")
                         self.current_conversation_id = None
                 else:
-                    print("MongoDB not available - skipping conversation creation")
+                    print("MongoDB not configured - skipping conversation creation")
                     self.current_conversation_id = None
 
             # Save user message (only if MongoDB is available)
@@ -233,29 +365,30 @@ class TeacherConsumer(AsyncWebsocketConsumer):
                         conversation_id=self.current_conversation_id,
                         sender="user",
                         content=user_content,
-                        message_type="topic_request"
+                        message_type="topic_request",
+                        user_id=self.lesson_meta["user_id"]
                     )
-                    await messages.insert_one(user_message)
+                    if await self.persist_inserts(messages, [user_message]):
+                        await self.record_conversation_activity([user_message], self.current_conversation_id)
                 except Exception as e:
                     print(f"DEBUG: Error saving user message: {e}")
 
-            lesson_content = f"Topic: {topic}"
-            if pdf_text:
-                max_pdf_text_length = 15000 
-                lesson_content += f"\n\nUse the following content to create the lesson:\n\n---\n{pdf_text[:max_pdf_text_length]}\n---"
+            lesson_content = build_lesson_content(topic, pdf_text)
 
-            # Generate lesson content synchronously
-            await self.generate_complete_lesson(lesson_content)
+            if self.current_conversation_id:
+                registry.register(self.current_conversation_id, session)
+            self.lesson_meta["conversation_id"] = self.current_conversation_id
+
+            # Generate the lesson in its own task: it keeps running if this connection drops, and
+            # it gets its session and metadata as arguments since a resume or replay on this
+            # connection replaces self.session and self.current_conversation_id
+            session.task = asyncio.ensure_future(self.generate_complete_lesson(lesson_content, session, self.lesson_meta))
 
-        except json.JSONDecodeError:
-            print("DEBUG: JSON decode error")
-            await self.send_json({"type": "error", "message": "Invalid JSON payload."})
-            self.is_generating = False
-            return
         except Exception as e:
             print(f"DEBUG: Error in receive: {e}")
             await self.send_json({"type": "error", "message": f"Error processing request: {str(e)}"})
-            self.is_generating = False
+            if session is not None and session.task is None:
+                registry.finish(session)
 
     async def process_buffer_for_steps(self):
         """Process buffer for complete lesson steps and send them to frontend"""
@@ -302,9 +435,11 @@ class TeacherConsumer(AsyncWebsocketConsumer):
                             sender="ai",
                             content="Notes and quiz generated",
                             message_type="notes_and_quiz",
-                            step_data=step_obj["notes_and_quiz_ready"]
+                            step_data=step_obj["notes_and_quiz_ready"],
+                            user_id=self.lesson_meta.get("user_id")
                         )
-                        await messages.insert_one(notes_message)
+                        if await self.persist_inserts(messages, [notes_message], encode=True):
+                            await self.record_conversation_activity([notes_message], self.current_conversation_id)
                     except Exception as e:
                         print(f"DEBUG: Error saving notes message: {e}")
                         
@@ -327,96 +462,34 @@ class TeacherConsumer(AsyncWebsocketConsumer):
                             sender="ai",
                             content=step_obj.get("text_explanation", ""),
                             message_type="lesson_step",
-                            step_data=step_obj
+                            step_data=step_obj,
+                            user_id=self.lesson_meta.get("user_id")
                         )
-                        await messages.insert_one(step_message)
+                        if await self.persist_inserts(messages, [step_message], encode=True):
+                            await self.record_conversation_activity([step_message], self.current_conversation_id)
                     except Exception as e:
                         print(f"DEBUG: Error saving step message: {e}")
             
             self._buffer = self._buffer[e + len(STEP_END):]
             start = 0
 
-    async def generate_complete_lesson(self, lesson_content):
-        """Generate complete lesson content and send synchronized steps"""
+    async def generate_complete_lesson(self, lesson_content, session, lesson_meta):
+        """Generate complete lesson content and send synchronized steps through ``session``"""
         try:
-            prompt_template = PromptTemplate(
-                input_variables=["lesson_content", "step_start", "step_end", "lesson_end"],
-                template=(
-                    "You are an engaging AI Virtual Teacher with a whiteboard. Create an interactive visual lesson based on: '{lesson_content}'.\n\n"
-                    "**CRITICAL FORMAT REQUIREMENTS**:\n"
-                    "1. Create exactly 4-6 teaching steps, each with proper JSON format.\n"
-                    "2. Each step MUST be wrapped between {step_start} and {step_end} markers.\n"
-                    "3. Use this EXACT JSON format for each step:\n\n"
-                    "{step_start}\n"
-                    "{{\n"
-                    '  "step": 1,\n'
-                    '  "speech_text": "Hello everyone! Today we will learn about [topic]. Let me start by writing the main concept on our whiteboard.",\n'
-                    '  "speech_duration": 8000,\n'
-                    '  "drawing_commands": [\n'
-                    '    {{\n'
-                    '      "time": 1000,\n'
-                    '      "action": "draw_text",\n'
-                    '      "text": "Main Topic Title",\n'
-                    '      "x": 400,\n'
-                    '      "y": 80,\n'
-                    '      "fontSize": 32,\n'
-                    '      "color": "#2563eb",\n'
-                    '      "fontStyle": "bold"\n'
-                    '    }},\n'
-                    '    {{\n'
-                    '      "time": 4000,\n'
-                    '      "action": "draw_rectangle",\n'
-                    '      "x": 200,\n'
-                    '      "y": 150,\n'
-                    '      "width": 400,\n'
-                    '      "height": 100,\n'
-                    '      "color": "#059669",\n'
-                    '      "strokeWidth": 3\n'
-                    '    }}\n'
-                    '  ]\n'
-                    "}}\n"
-                    "{step_end}\n\n"
-                    "**SPEECH GUIDELINES**:\n"
-                    "- Make speech natural and conversational (like 'Hello everyone!', 'Now let me show you...', 'As you can see here...')\n"
-                    "- Speech should be 6-10 seconds long (speech_duration: 6000-10000)\n"
-                    "- Explain what you're drawing as you draw it\n"
-                    "- Use encouraging teacher language\n\n"
-                    "**DRAWING COMMANDS** (Keep it simple and clear):\n"
-                    "- draw_text: {{'action': 'draw_text', 'text': 'Your explanation here', 'fontSize': 18, 'color': '#333'}}\n"
-                    "- draw_rectangle: {{'action': 'draw_rectangle', 'width': 150, 'height': 80, 'color': '#0066cc'}}\n"
-                    "- draw_circle: {{'action': 'draw_circle', 'radius': 40, 'color': '#dc2626'}}\n"
-                    "- draw_arrow: {{'action': 'draw_arrow', 'color': '#059669'}}\n\n"
-                    "**LAYOUT RULES**:\n"
-                    "- Text will be automatically positioned from top to bottom, no overlapping\n"
-                    "- Shapes will be positioned on the right side\n"
-                    "- Use 1-3 drawing commands per step maximum\n"
-                    "- Focus on clear, simple demonstrations\n"
-                    "- Don't specify x,y coordinates - system will auto-position\n"
-                    "**TIMING**: Use 'time' for delays (0 = immediate, 3000 = after 3 seconds)\n\n"
-                    "Create a complete lesson with clear step-by-step teaching, then end with {lesson_end}.\n"
-                )
-            )
+            prompt = build_lesson_prompt(lesson_content)
 
-            prompt = prompt_template.format(lesson_content=lesson_content, step_start=STEP_START, step_end=STEP_END, lesson_end=LESSON_END)
+            await self.emit({"type": "generation_progress", "status": "Starting AI generation...", "buffer_length": 0}, session)
 
-            await self.send_json({"type": "generation_progress", "status": "Starting AI generation...", "buffer_length": 0})
-
-            print("DEBUG: Starting Google Generative AI model call...")
-            model = genai.GenerativeModel("gemini-1.5-flash")
-            print("DEBUG: Model created, starting stream...")
+            print(f"DEBUG: Starting LLM stream with provider '{self.llm.name}'...")
             
             # Generate complete content first
             full_content = ""
             chunk_count = 0
             
             try:
-                stream = await model.generate_content_async(prompt, stream=True)
-                print("DEBUG: Stream started, processing chunks...")
-
-                async for chunk in stream:
+                async for text in self.llm.stream(prompt):
                     chunk_count += 1
                     print(f"DEBUG: Processing chunk {chunk_count}")
-                    text = getattr(chunk, "text", "") or ""
                     print(f"DEBUG: Chunk text length: {len(text)}")
                     
                     if not text:
@@ -428,15 +501,15 @@ class TeacherConsumer(AsyncWebsocketConsumer):
 
                     # Send progress updates
                     if len(full_content) % 200 < 50:  # Update every ~200 characters
-                        await self.send_json({
+                        await self.emit({
                             "type": "generation_progress", 
                             "buffer_length": len(full_content),
                             "status": f"Generating... ({len(full_content)} characters)"
-                        })
+                        }, session)
                         
             except Exception as ai_error:
                 print(f"DEBUG: AI generation error: {ai_error}")
-                await self.send_json({"type": "error", "message": f"AI service error: {str(ai_error)}"})
+                await self.emit({"type": "error", "message": f"AI service error: {str(ai_error)}"}, session)
                 return
 
             print(f"DEBUG: Complete content generated, length: {len(full_content)}")
@@ -446,107 +519,261 @@ class TeacherConsumer(AsyncWebsocketConsumer):
             
             if teaching_steps:
                 # Send all steps to frontend for synchronized playback
-                await self.send_json({
+                await self.emit({
                     "type": "lesson_ready",
                     "total_steps": len(teaching_steps),
                     "teaching_steps": teaching_steps,
+                    "layout_version": LAYOUT_VERSION,
+                    "duration_ms": teaching_steps[-1]["end_ms"],
                     "message": f"Lesson ready with {len(teaching_steps)} steps"
-                })
+                }, session)
+                notes_and_quiz = parse_notes_and_quiz(full_content)
+                if notes_and_quiz:
+                    await self.emit({"type": "notes_and_quiz_ready", "data": notes_and_quiz}, session)
                 
                 # Store the lesson in database
-                await self.store_lesson_steps(teaching_steps)
+                await self.store_lesson_steps(teaching_steps, lesson_meta, notes_and_quiz)
                 
                 print(f"DEBUG: Lesson sent with {len(teaching_steps)} synchronized steps")
             else:
-                await self.send_json({
+                await self.emit({
                     "type": "error",
                     "message": "Failed to parse teaching steps from generated content"
-                })
+                }, session)
 
         except Exception as e:
             print(f"DEBUG: Error in lesson generation: {e}")
-            await self.send_json({"type": "error", "message": f"Error generating lesson: {str(e)}"})
+            await self.emit({"type": "error", "message": f"Error generating lesson: {str(e)}"}, session)
         finally:
-            # Reset generation flag
-            self.is_generating = False
+            # Mark the session finished (it stays resumable for the grace period)
+            registry.finish(session)
             # Only send lesson_end if we actually generated content (not for duplicate requests)
             if hasattr(self, 'teaching_steps') and len(self.teaching_steps) > 0:
-                await self.send_json({"type": "lesson_end", "message": "Lesson generation finished."})
+                await self.emit({"type": "lesson_end", "message": "Lesson generation finished."}, session)
             else:
                 print("DEBUG: Skipping lesson_end - no content generated (likely duplicate request)")
 
     async def parse_all_teaching_steps(self, content):
         """Parse all teaching steps from complete content"""
-        teaching_steps = []
-        
-        try:
-            # Look for step blocks in the content
-            start = 0
-            while True:
-                s = content.find(STEP_START, start)
-                if s == -1:
-                    break
-                e = content.find(STEP_END, s + len(STEP_START))
-                if e == -1:
-                    break
-                
-                print(f"DEBUG: Found step block from {s} to {e}")
-                block = content[s + len(STEP_START): e]
-                
-                try:
-                    # Clean and parse the JSON
-                    clean_block = strip_code_fences(block.strip())
-                    step_data = json.loads(clean_block)
-                    
-                    # Validate required fields
-                    if all(key in step_data for key in ['step', 'speech_text', 'speech_duration', 'drawing_commands']):
-                        # Clean speech text
-                        step_data['speech_text'] = clean_text_for_speech(step_data['speech_text'])
-                        teaching_steps.append(step_data)
-                        print(f"DEBUG: Parsed teaching step {step_data.get('step', len(teaching_steps))}")
-                    else:
-                        print(f"DEBUG: Invalid step format: {step_data}")
-                        
-                except json.JSONDecodeError as json_error:
-                    print(f"DEBUG: JSON parse error for step: {json_error}")
-                    print(f"DEBUG: Block content: {block[:200]}...")
-                    
-                start = e + len(STEP_END)
-                
-        except Exception as e:
-            print(f"DEBUG: Error parsing teaching steps: {e}")
-        
-        # Sort steps by step number
-        teaching_steps.sort(key=lambda x: x.get('step', 0))
-        print(f"DEBUG: Total teaching steps parsed: {len(teaching_steps)}")
-        
-        return teaching_steps
+        return parse_teaching_steps(content)
 
-    async def store_lesson_steps(self, teaching_steps):
-        """Store all teaching steps in database"""
-        if not self.current_conversation_id or messages is None:
-            print("DEBUG: Skipping database storage - no conversation ID or MongoDB unavailable")
+    async def store_lesson_steps(self, teaching_steps, lesson_meta, notes_and_quiz=None):
+        """Store all teaching steps (and the notes/quiz) in database, plus a single-document snapshot for replay"""
+        conversation_id = lesson_meta.get("conversation_id")
+        if not conversation_id or messages is None:
+            print("DEBUG: Skipping database storage - no conversation ID or MongoDB not configured")
             return
             
+        first_step_message_id = None
         try:
-            for step in teaching_steps:
-                message_doc = {
-                    "conversation_id": self.current_conversation_id,
-                    "sender": "ai",
-                    "content": step['speech_text'],
-                    "message_type": "teaching_step",
-                    "step_data": step,
-                    "timestamp": datetime.utcnow()
-                }
-                
-                try:
-                    await messages.insert_one(message_doc)
-                except Exception as e:
-                    print(f"DEBUG: Error storing step {step.get('step')}: {e}")
-                    
+            message_docs = [{
+                "conversation_id": conversation_id,
+                "user_id": lesson_meta.get("user_id"),
+                "sender": "ai",
+                "content": step['speech_text'],
+                "message_type": "teaching_step",
+                "step_data": step,
+                "timestamp": datetime.utcnow()
+            } for step in teaching_steps]
+            if notes_and_quiz:
+                message_docs.append(create_message(
+                    conversation_id=conversation_id,
+                    sender="ai",
+                    content="Notes and quiz generated",
+                    message_type="notes_and_quiz",
+                    step_data=notes_and_quiz,
+                    user_id=lesson_meta.get("user_id")
+                ))
+            if await self.persist_inserts(messages, message_docs, encode=True):
+                await self.record_conversation_activity(message_docs, conversation_id)
+            first_step_message_id = message_docs[0]["_id"]
         except Exception as e:
             print(f"DEBUG: Error storing lesson steps: {e}")
 
+        await self.store_lesson_snapshot(teaching_steps, lesson_meta, first_step_message_id, notes_and_quiz)
+
+    async def persist_inserts(self, collection, docs, encode=False):
+        """Insert documents into MongoDB, or append them to the local spool when MongoDB is down
+        or the write fails with a connection error. Every document gets its _id up front so the
+        replay is idempotent. After one failed write the rest of the lesson is spooled without
+        retrying, so an outage costs at most one timeout. Returns True if MongoDB took the write."""
+        for doc in docs:
+            doc.setdefault("_id", ObjectId())
+        stored = [encode_message(doc) for doc in docs] if encode else docs
+        if not self.spooling and mongo_available():
+            try:
+                if len(stored) == 1:
+                    await collection.insert_one(stored[0])
+                else:
+                    await collection.insert_many(stored, ordered=False)
+                return True
+            except ConnectionFailure as e:
+                self.spooling = True
+                print(f"DEBUG: MongoDB write to {collection.name} failed, spooling: {str(e).split(',')[0]}")
+        spool = get_spool()
+        if spool is None:
+            raise ConnectionFailure(f"MongoDB unavailable and the spool is disabled; {collection.name} write lost")
+        spool.spool_inserts(collection.name, stored)
+        return False
+
+    async def record_conversation_activity(self, message_docs, conversation_id):
+        """Fold newly stored messages into the conversation's sidebar summary (one atomic update)"""
+        if conversations is None or not conversation_id or not message_docs:
+            return
+        try:
+            await conversations.update_one(
+                {"_id": conversation_id},
+                conversation_activity_update(message_docs)
+            )
+        except ConnectionFailure as e:
+            # The spool replayer recomputes the summary from the stored messages
+            spool = get_spool()
+            if spool is not None:
+                spool.spool_summary_refresh(conversation_id)
+            print(f"DEBUG: Error updating conversation summary, refresh spooled: {str(e).split(',')[0]}")
+        except Exception as e:
+            print(f"DEBUG: Error updating conversation summary: {e}")
+
+    async def store_lesson_snapshot(self, teaching_steps, lesson_meta, first_step_message_id=None, notes_and_quiz=None):
+        """Write the finished lesson as one lesson_snapshots document"""
+        if lesson_snapshots is None:
+            return
+        try:
+            snapshot = create_lesson_snapshot(
+                conversation_id=lesson_meta.get("conversation_id"),
+                user_id=lesson_meta.get("user_id", "anonymous"),
+                title=lesson_meta.get("title", "New Lesson"),
+                topic=lesson_meta.get("topic"),
+                steps=teaching_steps,
+                notes_and_quiz=notes_and_quiz,
+                first_step_message_id=first_step_message_id,
+                layout_version=LAYOUT_VERSION,
+            )
+            stored = await self.persist_inserts(lesson_snapshots, [snapshot])
+        except Exception as e:
+            print(f"DEBUG: Error storing lesson snapshot: {e}")
+            return
+        # Spooled lessons are indexed by the next rebuild_topic_index
+        if stored and lesson_meta.get("topic") and not lesson_meta.get("from_pdf"):
+            from .topic_index import remember_lesson  # noqa: deferred (numpy)
+            await remember_lesson(lesson_meta["topic"], lesson_meta.get("conversation_id"), lesson_meta.get("user_id"))
+
+    async def replay_lesson(self, conversation_id):
+        """Send the latest stored lesson of a conversation as a lesson_ready frame"""
+        if not conversation_id or not ObjectId.is_valid(conversation_id):
+            await self.send_json({"type": "error", "message": "A valid conversation_id is required for replay."})
+            return
+        try:
+            snapshot = await get_latest_snapshot(lesson_snapshots, conversation_id)
+        except Exception as e:
+            print(f"DEBUG: Error loading lesson snapshot: {e}")
+            await self.send_json({"type": "error", "message": "Could not load the lesson for replay."})
+            return
+        if snapshot is None:
+            await self.send_json({"type": "error", "message": "No stored lesson found for this conversation."})
+            return
+
+        snapshot = serialize_snapshot(await ensure_snapshot_layout(lesson_snapshots, snapshot))
+        self.current_conversation_id = ObjectId(conversation_id)
+        await self.send_replay({
+            "type": "lesson_ready",
+            "replay": True,
+            "conversation_id": snapshot["conversation_id"],
+            "title": snapshot.get("title"),
+            "created_at": snapshot.get("created_at"),
+            "total_steps": len(snapshot["steps"]),
+            "teaching_steps": snapshot["steps"],
+            "layout_version": snapshot["layout_version"],
+            "duration_ms": snapshot["duration_ms"],
+            "message": f"Replaying lesson with {len(snapshot['steps'])} steps"
+        })
+        if snapshot.get("notes_and_quiz"):
+            await self.send_replay({"type": "notes_and_quiz_ready", "data": snapshot["notes_and_quiz"]})
+
+
+    async def resume_lesson(self, conversation_id, last_seq=0, user_id=None):
+        """Re-attach a reconnecting client to its lesson session: send the frames after
+        ``last_seq`` it missed, then keep streaming live ones"""
+        session = registry.get(conversation_id) if conversation_id else None
+        if session is None or not self.may_resume(session, user_id):
+            session_resumes.inc(status="missed" if session is None else "denied")
+            await self.send_json({
+                "type": "resume_failed",
+                "conversation_id": conversation_id,
+                "message": "No live lesson session to resume." if session is None
+                else "This lesson session belongs to another user or connection."
+            })
+            return
+        if not isinstance(last_seq, int) or last_seq < 0:
+            last_seq = 0
+        if self.session is not None and self.session is not session:
+            registry.detach(self.session, self)
+        self.session = session
+        if ObjectId.is_valid(conversation_id):
+            self.current_conversation_id = ObjectId(conversation_id)
+        await self.send_json({
+            "type": "resumed",
+            "conversation_id": conversation_id,
+            "from_seq": last_seq,
+            "generating": not session.done
+        })
+        replayed = await session.attach(self, last_seq)
+        session_resumes.inc(status="resumed")
+        print(f"DEBUG: Resumed session {session.key}: replayed {replayed} frames after seq {last_seq}")
+
+    def may_resume(self, session, user_id):
+        """Only the lesson's own user may resume it; an anonymous lesson only once the connection
+        showing it is gone (or from that connection)"""
+        if session.user_id != (user_id or "anonymous"):
+            return False
+        return session.user_id != "anonymous" or session.consumer is None or session.consumer is self
+
+    async def send_replay(self, obj):
+        """Send a frame of a replayed (stored) lesson; it is not part of any session"""
+        await self.send_json(obj)
+
+    async def emit(self, obj, session=None):
+        """Send a frame of a lesson (numbered and kept by its session for resume): the one
+        ``session`` generates, by default the one this connection is showing"""
+        session = session or self.session
+        if session is not None:
+            return await session.publish(obj)
+        await self.send_json(obj)
+        return obj
+
+    async def accept_connection(self):
+        """Accept the WebSocket with the negotiated wire encoding (see wire.py) and start the
+        outbound queue"""
+        self.wire_format, subprotocol = negotiate(self.scope)
+        await self.accept(subprotocol)
+        self.start_outbound()
+
+    def start_outbound(self):
+        """Route this connection's frames through a bounded queue with its own sender task, so a
+        slow client never stalls the code producing frames"""
+        self.outbound = OutboundQueue(
+            send=lambda text: AsyncWebsocketConsumer.send(self, text_data=text),
+            close=lambda code: AsyncWebsocketConsumer.close(self, code),
+            label=self.channel_name or hex(id(self)),
+        )
+
+    def stop_outbound(self):
+        if self.outbound is not None:
+            self.outbound.stop()
+            self.outbound = None
 
     async def send_json(self, obj):
-        await self.send(text_data=json.dumps(obj))
\ No newline at end of file
+        await self.send_text(encode_frame(obj, self.wire_format), obj.get("type"))
+
+    async def send_text(self, text, frame_type=None):
+        """Queue an already-serialized frame (``frame_type`` drives coalescing and dropping)"""
+        if self.outbound is not None:
+            self.outbound.put(text, frame_type)
+        else:
+            await self.send(text_data=text)
+
+    async def close(self, code=None):
+        if self.outbound is not None:
+            self.outbound.close(code)  # after the frames already queued
+        else:
+            await super().close(code)
\ No newline at end of file
@@ -0,0 +1,28 @@
+# teacher_app/db.py
+
+from django.conf import settings
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """``connection_created`` receiver: put new SQLite connections in WAL mode.
+
+    journal_mode=WAL is persistent in the database file, but is re-applied per connection so a
+    database created or restored elsewhere picks it up. synchronous=NORMAL is safe under WAL
+    (a crash can lose the last commits, never corrupt the file) and skips an fsync per commit.
+    """
+    if connection.vendor != "sqlite" or not getattr(settings, "SQLITE_WAL", True):
+        return
+    if connection.settings_dict["NAME"] in ("", ":memory:") or "mode=memory" in str(connection.settings_dict["NAME"]):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute(f"PRAGMA synchronous={getattr(settings, 'SQLITE_SYNCHRONOUS', 'NORMAL')}")
+
+
+def journal_mode(connection):
+    """The journal mode in effect for ``connection`` ("wal", "delete", ...), or None if not SQLite."""
+    if connection.vendor != "sqlite":
+        return None
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA journal_mode")
+        return cursor.fetchone()[0]
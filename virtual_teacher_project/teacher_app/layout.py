@@ -0,0 +1,236 @@
+# teacher_app/layout.py
+
+import math
+
+from .schema import CANVAS_HEIGHT, CANVAS_WIDTH
+
+# Server-side whiteboard layout and lesson timeline.
+#
+# The lesson prompt asks the model not to position anything, so every drawing command is
+# placed here, once, when the lesson is parsed: text flows down a left column and shapes are
+# packed into a right column, both with a skyline (bottom-left) rectangle packer so nothing
+# overlaps. Each command also gets an absolute lesson timestamp ``at`` (ms from the start of
+# the lesson) and each step its ``start_ms``/``end_ms``, so clients draw the commands as-is
+# and can seek to any point without replaying the lesson. The result is stored in the lesson
+# snapshot; bump LAYOUT_VERSION when placement changes so older snapshots are laid out again.
+
+LAYOUT_VERSION = 1
+
+MARGIN = 30
+TOP = 60                    # below the step label TeachingCanvas overlays in the top-left corner
+GAP = 12                    # space between packed items
+SHAPE_COLUMN_WIDTH = 250
+TEXT_COLUMN = (MARGIN, TOP, CANVAS_WIDTH - SHAPE_COLUMN_WIDTH - 2 * MARGIN, CANVAS_HEIGHT - TOP - MARGIN)
+SHAPE_COLUMN = (CANVAS_WIDTH - SHAPE_COLUMN_WIDTH - MARGIN // 2, TOP, SHAPE_COLUMN_WIDTH, CANVAS_HEIGHT - TOP - MARGIN)
+
+# Shapes are capped so a column can hold several (the sizes TeachingCanvas used to clamp to)
+MAX_RECT_WIDTH = 200
+MAX_RECT_HEIGHT = 100
+MAX_CIRCLE_RADIUS = 50
+DEFAULT_FONT_SIZE = 18
+CHAR_WIDTH = 0.55           # average glyph width of the canvas font, in ems
+LINE_HEIGHT = 1.0           # Konva Text's default line height
+RULE_HEIGHT = 30            # vertical space taken by an unpositioned arrow or line
+
+DEFAULT_COMMAND_GAP_MS = 1000   # spacing of commands that carry no "time"
+DRAW_TAIL_MS = 500              # a step lasts at least this long after its last command
+
+
+class Skyline:
+    """Bottom-left skyline packer for one rectangular region of the canvas.
+
+    The skyline is a list of ``[x, width, y]`` segments covering the region's width, ``y``
+    being the lowest free coordinate above that segment. ``place`` puts a rectangle where its
+    top is highest, leftmost on ties, and returns its ``(x, y)``, or None if it does not fit.
+    """
+
+    def __init__(self, region):
+        self.left, self.top, self.width, self.height = region
+        self.bottom = self.top + self.height
+        self.segments = [[self.left, self.width, self.top]]
+
+    def place(self, width, height):
+        width = min(width, self.width)
+        best = None
+        segments = self.segments
+        for i in range(len(segments)):
+            x = segments[i][0]
+            if x + width > self.left + self.width:
+                break
+            y = self._fit(i, width)
+            if y + height <= self.bottom and (best is None or y < best[1]):
+                best = (i, y)
+        if best is None:
+            return None
+        i, y = best
+        x = segments[i][0]
+        self._add(i, x, min(width + GAP, self.left + self.width - x), y + height + GAP)
+        return x, y
+
+    def _fit(self, i, width):
+        """Top of a ``width``-wide rectangle whose left edge is at segment ``i``."""
+        segments = self.segments
+        x_end = segments[i][0] + width
+        y = 0
+        while i < len(segments) and segments[i][0] < x_end:
+            y = max(y, segments[i][2])
+            i += 1
+        return y
+
+    def _add(self, i, x, width, y):
+        """Raise the skyline to ``y`` over ``[x, x + width)``, starting at segment ``i``."""
+        segments = self.segments
+        x_end = x + width
+        new = [x, width, y]
+        j = i
+        while j < len(segments) and segments[j][0] < x_end:
+            j += 1
+        last = segments[j - 1]
+        tail_end = last[0] + last[1]
+        replaced = [new]
+        if tail_end > x_end:
+            replaced.append([x_end, tail_end - x_end, last[2]])
+        segments[i:j] = replaced
+        # Merge neighbours at the same height
+        merged = [segments[0]]
+        for segment in segments[1:]:
+            if segment[2] == merged[-1][2]:
+                merged[-1] = [merged[-1][0], merged[-1][1] + segment[1], segment[2]]
+            else:
+                merged.append(segment)
+        self.segments = merged
+
+    def lowest(self):
+        """Top of the free space below everything placed so far."""
+        return max(segment[2] for segment in self.segments)
+
+    def raise_to(self, y):
+        """Treat everything above ``y`` as used (for full-width rules across columns)."""
+        self.segments = [[self.left, self.width, max(y, self.lowest())]]
+
+
+def text_extent(text, font_size, width):
+    """Estimated ``(width, height)`` of ``text`` word-wrapped to ``width`` pixels."""
+    per_line = max(1, int(width / (font_size * CHAR_WIDTH)))
+    lines = 0
+    longest = 0
+    for paragraph in (text or "").split("\n"):
+        used = 0
+        lines += 1
+        for word in paragraph.split(" "):
+            length = len(word)
+            if used and used + 1 + length > per_line:
+                longest = max(longest, used)
+                lines += 1
+                used = 0
+            used = (used + 1 + length) if used else length
+            if used > per_line:  # a word longer than the line breaks mid-word
+                extra = (used - 1) // per_line
+                lines += extra
+                used -= extra * per_line
+                longest = per_line
+        longest = max(longest, used)
+    return min(width, math.ceil(longest * font_size * CHAR_WIDTH)), math.ceil(lines * font_size * LINE_HEIGHT)
+
+
+class StepLayout:
+    """Places one step's commands on an empty canvas (clear_all empties it again)."""
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.text = Skyline(TEXT_COLUMN)
+        self.shapes = Skyline(SHAPE_COLUMN)
+        self.last_text = None   # (x, y, width, height) of the latest text as drawn
+        self.last_shape = None  # (x, y, width, height) of the latest shape's bounding box
+
+    def _pack(self, column, width, height):
+        position = column.place(width, height)
+        if position is None:
+            # The column is full: overlap at the bottom rather than draw off the canvas
+            position = (column.left, max(column.top, column.bottom - height))
+        return position
+
+    def _rule_y(self):
+        y = max(self.text.lowest(), self.shapes.lowest())
+        y = min(y, CANVAS_HEIGHT - MARGIN - RULE_HEIGHT)
+        self.text.raise_to(y + RULE_HEIGHT)
+        self.shapes.raise_to(y + RULE_HEIGHT)
+        return y + RULE_HEIGHT // 2
+
+    def place(self, command):
+        action = command["action"]
+        if action == "clear_all":
+            self.reset()
+        elif action == "draw_text":
+            font_size = command.get("fontSize") or DEFAULT_FONT_SIZE
+            width = TEXT_COLUMN[2]
+            used, height = text_extent(command.get("text", ""), font_size, width)
+            x, y = self._pack(self.text, width, height)
+            command.update(x=x, y=y, width=width)
+            self.last_text = (x, y, used, height)
+        elif action == "draw_rectangle":
+            width = min(command.get("width") or 150, MAX_RECT_WIDTH)
+            height = min(command.get("height") or 80, MAX_RECT_HEIGHT)
+            x, y = self._pack(self.shapes, width, height)
+            command.update(x=x, y=y, width=width, height=height)
+            self.last_shape = (x, y, width, height)
+        elif action == "draw_circle":
+            radius = min(command.get("radius") or 40, MAX_CIRCLE_RADIUS)
+            x, y = self._pack(self.shapes, 2 * radius, 2 * radius)
+            command.update(x=x + radius, y=y + radius, radius=radius)  # Konva circles are centred
+            self.last_shape = (x, y, 2 * radius, 2 * radius)
+        elif action == "draw_arrow" and "points" not in command:
+            if self.last_text is not None and self.last_shape is not None:
+                # From the latest text block to the latest shape
+                tx, ty, tw, th = self.last_text
+                sx, sy, sw, sh = self.last_shape
+                command["points"] = [tx + tw + GAP, ty + th // 2, max(tx + tw + 2 * GAP, sx - GAP), sy + sh // 2]
+            else:
+                y = self._rule_y()
+                command["points"] = [MARGIN + 270, y, MARGIN + 470, y]
+        elif action == "draw_line" and "points" not in command:
+            y = self._rule_y()
+            command["points"] = [MARGIN, y, CANVAS_WIDTH - MARGIN, y]
+        elif action == "highlight" and self.last_text is not None:
+            x, y, width, height = self.last_text
+            command.update(x=x - 5, y=y - 5, width=width + 10, height=height + 10)
+        return command
+
+
+def layout_lesson(steps):
+    """Position every drawing command and stamp the lesson timeline, in place.
+
+    Returns the lesson duration in ms. A command's ``time`` is its offset from the start of its
+    step; commands without one follow the previous command after DEFAULT_COMMAND_GAP_MS, and
+    offsets never go backwards. A step lasts for its speech or until its last command has
+    been drawn, whichever is longer.
+    """
+    clock = 0
+    for step in steps:
+        layout = StepLayout()
+        step["start_ms"] = clock
+        offset = 0
+        commands = step.get("drawing_commands") or []
+        for i, command in enumerate(commands):
+            layout.place(command)
+            time = command.get("time")
+            if time is None:
+                time = offset + DEFAULT_COMMAND_GAP_MS if i else 0
+            offset = max(offset, time)
+            command["at"] = clock + offset
+        duration = step.get("speech_duration") or 0
+        if commands:
+            duration = max(duration, offset + DRAW_TAIL_MS)
+        clock += duration
+        step["end_ms"] = clock
+    return clock
+
+
+def ensure_layout(snapshot):
+    """Lay out a stored lesson snapshot's steps if it predates LAYOUT_VERSION (in place)."""
+    if snapshot.get("layout_version") != LAYOUT_VERSION:
+        snapshot["duration_ms"] = layout_lesson(snapshot.get("steps") or [])
+        snapshot["layout_version"] = LAYOUT_VERSION
+    return snapshot
@@ -0,0 +1,175 @@
+# teacher_app/llm.py
+
+import asyncio
+import hashlib
+import json
+import re
+import time
+from datetime import datetime
+from pathlib import Path
+
+from django.conf import settings
+
+# Rough characters-per-token ratio used to turn the stub's token rate into delays
+CHARS_PER_TOKEN = 4
+
+TOPIC_RE = re.compile(r"Topic: (.*?)(?:'\.|\n)")
+
+
+class LLMProvider:
+    """Base class for lesson generation backends.
+
+    Subclasses implement ``stream(prompt)`` as an async generator of text chunks.
+    """
+    name = "base"
+
+    async def stream(self, prompt):
+        raise NotImplementedError
+        yield  # pragma: no cover - makes this an async generator
+
+
+class GeminiProvider(LLMProvider):
+    """Streams from Google Generative AI (the original production backend)."""
+    name = "gemini"
+
+    def __init__(self, api_key=None, model_name=None):
+        self.api_key = api_key if api_key is not None else getattr(settings, "GOOGLE_API_KEY", None)
+        self.model_name = model_name or getattr(settings, "LLM_GEMINI_MODEL", "gemini-1.5-flash")
+        print(f"DEBUG: Google API Key configured: {bool(self.api_key)}")
+        # Imported here rather than at module level: the SDK takes ~0.8 s to import (see startup.py)
+        import google.generativeai as genai
+        self.genai = genai
+        genai.configure(api_key=self.api_key)
+
+    async def stream(self, prompt):
+        model = self.genai.GenerativeModel(self.model_name)
+        response = await model.generate_content_async(prompt, stream=True)
+        async for chunk in response:
+            text = getattr(chunk, "text", "") or ""
+            if text:
+                yield text
+
+
+def build_canned_lesson(topic, steps=5):
+    """Return a deterministic marker-delimited lesson for ``topic``."""
+    from .consumers import STEP_START, STEP_END, LESSON_END
+
+    topic = topic or "this topic"
+    blocks = []
+    for n in range(1, steps + 1):
+        step = {
+            "step": n,
+            "speech_text": f"Step {n} of our lesson on {topic}. Let me write the key idea on the whiteboard, e.g. the main definition.",
+            "speech_duration": 6000 + 500 * n,
+            "drawing_commands": [
+                {"time": 0, "action": "draw_text", "text": f"{topic}: key idea {n}", "fontSize": 24, "color": "#2563eb", "fontStyle": "bold"},
+                {"time": 2000, "action": "draw_rectangle", "width": 150, "height": 80, "color": "#059669", "strokeWidth": 3},
+                {"time": 4000, "action": "draw_circle", "radius": 40, "color": "#dc2626"},
+                {"time": 5000, "action": "draw_arrow", "color": "#059669"},
+            ],
+        }
+        blocks.append(f"{STEP_START}\n{json.dumps(step, indent=2)}\n{STEP_END}\n")
+    return "".join(blocks) + LESSON_END
+
+
+class StubProvider(LLMProvider):
+    """Deterministic offline backend that streams a canned lesson.
+
+    ``chunk_size`` is in characters; ``tokens_per_second`` of 0 streams as fast as possible.
+    """
+    name = "stub"
+
+    def __init__(self, tokens_per_second=None, chunk_size=None, steps=None):
+        self.tokens_per_second = float(tokens_per_second if tokens_per_second is not None
+                                       else getattr(settings, "LLM_STUB_TOKENS_PER_SECOND", 0))
+        self.chunk_size = max(1, int(chunk_size or getattr(settings, "LLM_STUB_CHUNK_SIZE", 64)))
+        self.steps = int(steps or getattr(settings, "LLM_STUB_STEPS", 5))
+
+    async def stream(self, prompt):
+        match = TOPIC_RE.search(prompt)
+        content = build_canned_lesson(match.group(1).strip() if match else "", self.steps)
+        delay = 0.0
+        if self.tokens_per_second > 0:
+            delay = (self.chunk_size / CHARS_PER_TOKEN) / self.tokens_per_second
+        for i in range(0, len(content), self.chunk_size):
+            if delay:
+                await asyncio.sleep(delay)
+            else:
+                await asyncio.sleep(0)
+            yield content[i:i + self.chunk_size]
+
+
+def fixture_key(prompt):
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:16]
+
+
+class RecordReplayProvider(LLMProvider):
+    """Captures real streams with their timing to fixture files and replays them.
+
+    In ``record`` mode every chunk from ``inner`` is passed through and saved, with
+    the delay since the previous chunk, to ``<fixture_dir>/<sha256(prompt)[:16]>.json``.
+    In ``replay`` mode the fixture is streamed back with the same chunk boundaries and
+    delays (scaled by ``speed``; 0 disables the delays).
+    """
+    name = "replay"
+
+    def __init__(self, mode="replay", fixture_dir=None, inner=None, speed=None):
+        if mode not in ("record", "replay"):
+            raise ValueError(f"Unknown record/replay mode: {mode}")
+        self.mode = mode
+        self.fixture_dir = Path(fixture_dir or getattr(settings, "LLM_FIXTURE_DIR"))
+        self.inner = inner
+        self.speed = float(speed if speed is not None else getattr(settings, "LLM_REPLAY_SPEED", 1.0))
+
+    def fixture_path(self, prompt):
+        return self.fixture_dir / f"{fixture_key(prompt)}.json"
+
+    async def stream(self, prompt):
+        if self.mode == "record":
+            async for text in self._record(prompt):
+                yield text
+        else:
+            async for text in self._replay(prompt):
+                yield text
+
+    async def _record(self, prompt):
+        inner = self.inner or GeminiProvider()
+        chunks = []
+        last = time.monotonic()
+        async for text in inner.stream(prompt):
+            now = time.monotonic()
+            chunks.append({"delay": round(now - last, 6), "text": text})
+            last = now
+            yield text
+
+        self.fixture_dir.mkdir(parents=True, exist_ok=True)
+        fixture = {
+            "prompt_sha256": hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+            "provider": inner.name,
+            "recorded_at": datetime.utcnow().isoformat(),
+            "chunks": chunks,
+        }
+        self.fixture_path(prompt).write_text(json.dumps(fixture, indent=1), encoding="utf-8")
+        print(f"DEBUG: Recorded {len(chunks)} chunks to {self.fixture_path(prompt)}")
+
+    async def _replay(self, prompt):
+        path = self.fixture_path(prompt)
+        if not path.exists():
+            raise FileNotFoundError(f"No LLM fixture recorded for this prompt: {path}")
+        fixture = json.loads(path.read_text(encoding="utf-8"))
+        for chunk in fixture["chunks"]:
+            if self.speed > 0 and chunk["delay"] > 0:
+                await asyncio.sleep(chunk["delay"] / self.speed)
+            yield chunk["text"]
+
+
+def get_llm_provider(name=None):
+    """Return the provider selected by ``settings.LLM_PROVIDER``."""
+    name = name or getattr(settings, "LLM_PROVIDER", "gemini")
+    if name == "gemini":
+        return GeminiProvider()
+    if name == "stub":
+        return StubProvider()
+    if name in ("record", "replay"):
+        return RecordReplayProvider(mode=name)
+    raise ValueError(f"Unknown LLM_PROVIDER: {name}")
@@ -0,0 +1,304 @@
+# teacher_app/loadtest.py
+
+import asyncio
+import base64
+import json
+import math
+import os
+import struct
+import time
+import zlib
+from urllib.parse import urlparse
+
+# Frames that carry (or complete) the lesson steps
+STEP_FRAMES = {"lesson_ready", "lesson_step"}
+DONE_FRAMES = {"lesson_ready", "lesson_end", "error", "rate_limited"}
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of ``values`` (``None`` when empty)."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = max(0, min(len(ordered) - 1, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return ordered[k]
+
+
+def summarize(values):
+    return {
+        "count": len(values),
+        "p50": percentile(values, 50),
+        "p90": percentile(values, 90),
+        "p99": percentile(values, 99),
+        "max": max(values) if values else None,
+    }
+
+
+def sample_process(pid=None):
+    """Return ``(cpu_seconds, rss_bytes)`` for ``pid`` (this process when ``None``)."""
+    if pid is None:
+        cpu = time.process_time()
+    else:
+        try:
+            with open(f"/proc/{pid}/stat") as f:
+                fields = f.read().rsplit(")", 1)[1].split()
+            cpu = (int(fields[11]) + int(fields[12])) / os.sysconf("SC_CLK_TCK")
+        except OSError:
+            return None, None
+    try:
+        with open(f"/proc/{pid or 'self'}/statm") as f:
+            rss = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        rss = None if pid else _peak_rss()
+    return cpu, rss
+
+
+def _peak_rss():
+    """Peak RSS of this process in bytes, or None where the resource module is unavailable (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class RawWebSocket:
+    """Minimal RFC 6455 text-frame client, enough to drive ``ws/teacher/`` over a real socket.
+
+    Pass ``extensions="permessage-deflate"`` to offer compression; compressed messages are
+    inflated on receipt. ``bytes_received`` counts bytes on the wire, ``payload_bytes`` the
+    message bytes after inflating.
+    """
+
+    def __init__(self, reader, writer):
+        self.reader = reader
+        self.writer = writer
+        self.bytes_received = 0
+        self.payload_bytes = 0
+        self.deflate = False
+        self._reset_inflater = False
+        self._inflater = None
+
+    @classmethod
+    async def connect(cls, url, subprotocols=None, extensions=None):
+        parsed = urlparse(url)
+        port = parsed.port or (443 if parsed.scheme == "wss" else 80)
+        reader, writer = await asyncio.open_connection(parsed.hostname, port, ssl=parsed.scheme == "wss" or None)
+        key = base64.b64encode(os.urandom(16)).decode()
+        path = parsed.path + (f"?{parsed.query}" if parsed.query else "")
+        lines = [
+            f"GET {path} HTTP/1.1",
+            f"Host: {parsed.hostname}:{port}",
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            f"Sec-WebSocket-Key: {key}",
+            "Sec-WebSocket-Version: 13",
+            f"Origin: http://{parsed.hostname}:{port}",
+        ]
+        if subprotocols:
+            lines.append(f"Sec-WebSocket-Protocol: {', '.join(subprotocols)}")
+        if extensions:
+            lines.append(f"Sec-WebSocket-Extensions: {extensions}")
+        writer.write(("\r\n".join(lines) + "\r\n\r\n").encode())
+        await writer.drain()
+        head = await reader.readuntil(b"\r\n\r\n")
+        status = head.split(b"\r\n", 1)[0]
+        if b" 101 " not in status:
+            writer.close()
+            raise ConnectionError(f"WebSocket handshake failed: {status.decode(errors='replace')}")
+        ws = cls(reader, writer)
+        ws.bytes_received = len(head)
+        ws.handshake_headers = head.decode(errors="replace")
+        accepted = [line.split(":", 1)[1].strip() for line in ws.handshake_headers.split("\r\n")
+                    if line.lower().startswith("sec-websocket-extensions:")]
+        if any(ext.startswith("permessage-deflate") for ext in accepted):
+            ws.deflate = True
+            ws._reset_inflater = any("server_no_context_takeover" in ext for ext in accepted)
+            ws._inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+        return ws
+
+    async def send_text(self, text):
+        payload = text.encode("utf-8")
+        header = bytearray([0x81])
+        length = len(payload)
+        if length < 126:
+            header.append(0x80 | length)
+        elif length < 65536:
+            header.append(0x80 | 126)
+            header += struct.pack("!H", length)
+        else:
+            header.append(0x80 | 127)
+            header += struct.pack("!Q", length)
+        mask = os.urandom(4)
+        header += mask
+        masked = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+        self.writer.write(bytes(header) + masked)
+        await self.writer.drain()
+
+    async def recv(self):
+        """Return the next data frame payload (str or bytes); ``None`` once the server closes."""
+        message = b""
+        opcode = None
+        compressed = False
+        while True:
+            b1, b2 = await self.reader.readexactly(2)
+            length = b2 & 0x7F
+            extra = 0
+            if length == 126:
+                length = struct.unpack("!H", await self.reader.readexactly(2))[0]
+                extra = 2
+            elif length == 127:
+                length = struct.unpack("!Q", await self.reader.readexactly(8))[0]
+                extra = 8
+            payload = await self.reader.readexactly(length)
+            self.bytes_received += 2 + extra + length
+            op = b1 & 0x0F
+            if op == 0x8:
+                return None
+            if op in (0x9, 0xA):
+                continue
+            if op:
+                opcode = op
+                compressed = bool(b1 & 0x40)
+            message += payload
+            if b1 & 0x80:
+                if compressed:
+                    message = self._inflate(message)
+                self.payload_bytes += len(message)
+                return message.decode("utf-8") if opcode == 0x1 else message
+
+    def _inflate(self, data):
+        if self._inflater is None:
+            raise ConnectionError("Compressed frame received without permessage-deflate")
+        if self._reset_inflater:
+            self._inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+        return self._inflater.decompress(data + b"\x00\x00\xff\xff")
+
+    async def close(self):
+        try:
+            self.writer.write(bytes([0x88, 0x80]) + os.urandom(4))
+            await self.writer.drain()
+        except (ConnectionError, RuntimeError):
+            pass
+        self.writer.close()
+
+
+class ClientResult:
+    def __init__(self):
+        self.first_step = None
+        self.total = None
+        self.frames = 0
+        self.error = None
+
+
+async def _drive(send, recv, topic, timeout):
+    """Send one lesson request and time the response frames."""
+    result = ClientResult()
+    start = time.perf_counter()
+    await send(json.dumps({"topic": topic, "user_id": "loadtest"}))
+    deadline = start + timeout
+    while True:
+        remaining = deadline - time.perf_counter()
+        if remaining <= 0:
+            result.error = "timeout"
+            break
+        frame = await asyncio.wait_for(recv(), remaining)
+        if frame is None:
+            result.error = "closed"
+            break
+        result.frames += 1
+        data = json.loads(frame)
+        kind = data.get("type")
+        if kind in STEP_FRAMES and result.first_step is None:
+            result.first_step = time.perf_counter() - start
+        if kind in DONE_FRAMES:
+            if kind in ("error", "rate_limited"):
+                result.error = data.get("message", kind)
+            result.total = time.perf_counter() - start
+            break
+    return result
+
+
+async def run_inprocess_client(application, topic, timeout):
+    from channels.testing import WebsocketCommunicator
+
+    communicator = WebsocketCommunicator(application, "/ws/teacher/")
+    connected, _ = await communicator.connect(timeout=timeout)
+    if not connected:
+        result = ClientResult()
+        result.error = "rejected"
+        return result
+    await communicator.receive_from(timeout=timeout)  # "Connected!" status
+
+    async def recv():
+        try:
+            return await communicator.receive_from(timeout=timeout)
+        except AssertionError:
+            return None
+
+    try:
+        return await _drive(communicator.send_to, recv, topic, timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        result = ClientResult()
+        result.error = "timeout"
+        return result
+    finally:
+        await communicator.disconnect()
+
+
+async def run_socket_client(url, topic, timeout):
+    try:
+        ws = await RawWebSocket.connect(url)
+        await ws.recv()  # "Connected!" status
+    except (OSError, ConnectionError, asyncio.IncompleteReadError) as e:
+        result = ClientResult()
+        result.error = f"connect failed: {e}"
+        return result
+    try:
+        return await _drive(ws.send_text, ws.recv, topic, timeout)
+    except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError) as e:
+        result = ClientResult()
+        result.error = f"{type(e).__name__}: {e}"
+        return result
+    finally:
+        await ws.close()
+
+
+async def run_level(make_client, concurrency, worker_pids=None):
+    """Run ``concurrency`` clients at once and return the aggregated level report.
+
+    ``worker_pids`` of ``None`` samples this process (in-process runs); an empty list samples nothing.
+    """
+    pids = [None] if worker_pids is None else worker_pids
+    before = {pid: sample_process(pid) for pid in pids}
+    started = time.perf_counter()
+    results = await asyncio.gather(*(make_client(i) for i in range(concurrency)))
+    wall = time.perf_counter() - started
+    after = {pid: sample_process(pid) for pid in pids}
+
+    workers = []
+    for pid in pids:
+        cpu0, _ = before[pid]
+        cpu1, rss = after[pid]
+        cpu = (cpu1 - cpu0) if cpu0 is not None and cpu1 is not None else None
+        workers.append({
+            "pid": pid or os.getpid(),
+            "cpu_seconds": cpu,
+            "cpu_percent": round(100.0 * cpu / wall, 1) if cpu is not None and wall else None,
+            "rss_bytes": rss,
+        })
+
+    ok = [r for r in results if r.error is None]
+    frames = sum(r.frames for r in results)
+    return {
+        "concurrency": concurrency,
+        "wall_seconds": round(wall, 4),
+        "completed": len(ok),
+        "errors": sorted({r.error for r in results if r.error}),
+        "error_count": len(results) - len(ok),
+        "time_to_first_step": summarize([r.first_step for r in ok if r.first_step is not None]),
+        "lesson_time": summarize([r.total for r in ok if r.total is not None]),
+        "frames": frames,
+        "frames_per_second": round(frames / wall, 2) if wall else None,
+        "workers": workers,
+    }
@@ -0,0 +1,100 @@
+# teacher_app/management/commands/archive_conversations.py
+
+import asyncio
+import time
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from teacher_app import mongo, retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Move conversations inactive for more than --days days, with their messages and lesson "
+        "snapshots, out of the hot collections into gzip NDJSON segment files or archive collections. "
+        "Works in bounded batches; each batch is written durably before its hot data is deleted. "
+        "Also marks deleted the messages stored under a conversation after it was deleted."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=float, default=None,
+                            help="Inactivity threshold (default: settings.ARCHIVE_INACTIVE_DAYS).")
+        parser.add_argument("--target", choices=["file", "collection"], default="file")
+        parser.add_argument("--dir", default=None, help="Segment directory (default: settings.ARCHIVE_DIR).")
+        parser.add_argument("--batch-size", type=int, default=200,
+                            help="Conversations per batch (and per segment file).")
+        parser.add_argument("--max-batches", type=int, default=0, help="Stop after this many batches (0 = all).")
+        parser.add_argument("--dry-run", action="store_true", help="Count what would be archived without writing.")
+
+    def handle(self, *args, **options):
+        if not mongo.mongo_available():
+            raise CommandError("MongoDB is not available")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+        if options["days"] is None:
+            options["days"] = getattr(settings, "ARCHIVE_INACTIVE_DAYS", 180)
+        options["dir"] = options["dir"] or getattr(settings, "ARCHIVE_DIR", "archive")
+
+        stats = asyncio.run(self._archive(options))
+        self.stdout.write(
+            f"{'Would archive' if options['dry_run'] else 'Archived'} {stats['conversations']} conversations, "
+            f"{stats['messages']} messages, {stats['lesson_snapshots']} snapshots in {stats['batches']} batches "
+            f"({stats['elapsed_seconds']}s)."
+        )
+        if sum(stats.get("swept", {}).values()):
+            self.stdout.write(f"Marked deleted {stats['swept']['messages']} messages and "
+                              f"{stats['swept']['lesson_snapshots']} snapshots stored after their conversation was deleted.")
+        for segment in stats["segments"]:
+            self.stdout.write(f"  {segment['path']}  {segment['conversations']} conversations  {segment['bytes']:,} bytes")
+        self.stdout.write(self.style.SUCCESS("Archive run complete."))
+
+    async def _archive(self, options):
+        db = mongo.db
+        started = time.perf_counter()
+        run_started_at = datetime.utcnow()
+        query = retention.stale_conversations_query(
+            options["days"], now=run_started_at,
+            restore_grace_days=getattr(settings, "ARCHIVE_RESTORE_GRACE_DAYS", 30))
+        writer = None
+        if options["target"] == "file" and not options["dry_run"]:
+            writer = retention.SegmentWriter(options["dir"])
+
+        stats = {"conversations": 0, "messages": 0, "lesson_snapshots": 0, "batches": 0, "segments": [],
+                 "bytes_written": 0}
+        last_id = None
+        while not options["max_batches"] or stats["batches"] < options["max_batches"]:
+            page = dict(query, _id={"$gt": last_id}) if last_id is not None else query
+            batch = [doc async for doc in db["conversations"].find(page).sort("_id", 1).limit(options["batch_size"])]
+            if not batch:
+                break
+            last_id = batch[-1]["_id"]
+            records = await retention.load_conversation_records(db, batch)
+            stats["batches"] += 1
+            stats["conversations"] += len(records)
+            for name in retention.CONVERSATION_CHILDREN:
+                stats[name] += sum(len(r[name]) for r in records)
+            if options["dry_run"]:
+                continue
+
+            if writer is not None:
+                path, size = writer.write(records)
+                stats["segments"].append({"path": str(path), "conversations": len(records), "bytes": size})
+                stats["bytes_written"] += size
+            else:
+                await retention.archive_to_collections(db, records, run_started_at)
+            await retention.delete_conversation_records(db, records)
+
+        if not options["dry_run"]:
+            stats["swept"] = await retention.sweep_deleted_children(db)
+        stats["elapsed_seconds"] = round(time.perf_counter() - started, 3)
+        if not options["dry_run"]:
+            await db[retention.ARCHIVE_RUNS].insert_one({
+                "started_at": run_started_at,
+                "target": options["target"],
+                "inactive_days": options["days"],
+                "batch_size": options["batch_size"],
+                **stats,
+            })
+        return stats
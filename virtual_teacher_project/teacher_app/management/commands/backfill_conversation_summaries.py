@@ -0,0 +1,47 @@
+# teacher_app/management/commands/backfill_conversation_summaries.py
+
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+from pymongo import UpdateOne
+
+from teacher_app import mongo
+from teacher_app.mongo import conversation_summary_pipeline, conversation_summary_set
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute message_count, lesson_step_count, last_message_preview and last_activity_at "
+        "on every conversation from its messages. Needed once for conversations created before "
+        "the consumer maintained these fields; safe to re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        if not mongo.mongo_available():
+            raise CommandError("MongoDB is not available")
+        updated = asyncio.run(self._backfill(options["batch_size"]))
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} conversation summaries."))
+
+    async def _backfill(self, batch_size):
+        db = mongo.db
+        await mongo.ensure_indexes(db)
+        updated = 0
+        batch = []
+        async for summary in db["messages"].aggregate(conversation_summary_pipeline(), allowDiskUse=True):
+            batch.append(UpdateOne({"_id": summary["_id"]}, {"$set": conversation_summary_set(summary)}))
+            if len(batch) >= batch_size:
+                updated += (await db["conversations"].bulk_write(batch, ordered=False)).modified_count
+                batch = []
+        if batch:
+            updated += (await db["conversations"].bulk_write(batch, ordered=False)).modified_count
+
+        # Conversations without any messages still need the sidebar fields
+        result = await db["conversations"].update_many(
+            {"message_count": {"$exists": False}},
+            [{"$set": {"message_count": 0, "lesson_step_count": 0, "last_message_preview": None,
+                       "last_activity_at": {"$ifNull": ["$updated_at", "$created_at"]}}}],
+        )
+        return updated + result.modified_count
@@ -0,0 +1,29 @@
+# teacher_app/management/commands/backfill_message_owners.py
+
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+
+from teacher_app import mongo
+from teacher_app.search import backfill_message_user_ids
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy each conversation's user_id onto its messages, with one aggregation that $merges "
+        "into the messages collection, and create the search text indexes. Needed once for "
+        "messages stored before history search existed; until then they cannot be found. Safe "
+        "to re-run."
+    )
+
+    def handle(self, *args, **options):
+        if not mongo.mongo_available():
+            raise CommandError("MongoDB is not available")
+        orphans = asyncio.run(self._backfill())
+        self.stdout.write(self.style.SUCCESS("Messages now carry their conversation's user_id."))
+        if orphans:
+            self.stdout.write(self.style.WARNING(f"{orphans} messages have no conversation and stay unsearchable."))
+
+    async def _backfill(self):
+        await mongo.ensure_indexes(mongo.db)
+        return await backfill_message_user_ids(mongo.db)
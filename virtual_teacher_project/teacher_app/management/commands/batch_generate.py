@@ -0,0 +1,93 @@
+# teacher_app/management/commands/batch_generate.py
+
+import asyncio
+from pathlib import Path
+
+from bson import ObjectId
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+
+from teacher_app import mongo
+from teacher_app.batch import enqueue_job, extract_pdf_text, get_job
+
+
+def read_topics(path):
+    """Topics of a text file: one per line, blank lines and # comments skipped."""
+    lines = Path(path).read_text(encoding="utf-8").splitlines()
+    return [line.strip() for line in lines if line.strip() and not line.strip().startswith("#")]
+
+
+class Command(BaseCommand):
+    help = (
+        "Queue a batch job of lessons for a syllabus: one lesson per --topic, per line of each text "
+        "file and per PDF file given. `manage.py batch_worker` generates them; with --run this "
+        "command does it and waits. --status JOB_ID shows a job's progress and throughput."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="*", help="Text files (one topic per line) and PDF files.")
+        parser.add_argument("--topic", action="append", default=[], help="A topic (repeatable).")
+        parser.add_argument("--user-id", help="Owner of the generated lessons.")
+        parser.add_argument("--name", default=None, help="Job name (default: the first file name).")
+        parser.add_argument("--run", action="store_true", help="Generate the lessons now and wait.")
+        parser.add_argument("--workers", type=int, default=None)
+        parser.add_argument("--llm-concurrency", type=int, default=None)
+        parser.add_argument("--status", metavar="JOB_ID", default=None, help="Show a job instead of queueing one.")
+
+    def handle(self, *args, **options):
+        if not mongo.mongo_available():
+            raise CommandError("MongoDB is not available")
+        if options["status"]:
+            if not ObjectId.is_valid(options["status"]):
+                raise CommandError(f"Invalid job id: {options['status']}")
+            report = asyncio.run(get_job(mongo.db, ObjectId(options["status"]), with_items=True))
+            if report is None:
+                raise CommandError(f"No batch job {options['status']}")
+            self._describe(report)
+            return
+        if not options["user_id"]:
+            raise CommandError("--user-id is required")
+
+        topics, pdfs = list(options["topic"]), []
+        for path in options["paths"]:
+            if not Path(path).is_file():
+                raise CommandError(f"No such file: {path}")
+            if path.lower().endswith(".pdf"):
+                text = extract_pdf_text(Path(path).read_bytes())
+                if not text.strip():
+                    raise CommandError(f"Could not extract any text from {path}")
+                pdfs.append((Path(path).name, text))
+            else:
+                topics.extend(read_topics(path))
+        if not topics and not pdfs:
+            raise CommandError("Give at least one --topic, topic file or PDF")
+        if len(topics) + len(pdfs) > settings.BATCH_MAX_ITEMS:
+            raise CommandError(f"At most {settings.BATCH_MAX_ITEMS} topics and PDFs per job")
+
+        name = options["name"] or (Path(options["paths"][0]).name if options["paths"] else f"{len(topics)} topics")
+        job = asyncio.run(enqueue_job(mongo.db, options["user_id"], name, topics, pdfs))
+        self.stdout.write(self.style.SUCCESS(f"Queued job {job['_id']} ({job['total']} lessons)."))
+        if not options["run"]:
+            self.stdout.write(f"Generate them with `manage.py batch_worker`; follow with --status {job['_id']}")
+            return
+        call_command("batch_worker", job=str(job["_id"]), until_idle=True, workers=options["workers"],
+                     llm_concurrency=options["llm_concurrency"], stdout=self.stdout)
+        self._describe(asyncio.run(get_job(mongo.db, job["_id"], with_items=True)))
+
+    def _describe(self, report):
+        counts = report["counts"]
+        self.stdout.write(f"Job {report['job_id']} {report['name']!r} of {report['user_id']}: {report['status']}")
+        self.stdout.write(f"  {counts['done'] + counts['failed']}/{report['total']} finished: {counts['done']} done, "
+                          f"{counts['failed']} failed, {counts['running']} running, {counts['queued']} queued")
+        if report["elapsed_seconds"] is not None:
+            line = f"  {report['elapsed_seconds']:.0f}s elapsed, {report['lessons_per_minute']} lessons/min"
+            if report["mean_generation_seconds"] is not None:
+                line += f", {report['mean_generation_seconds']}s of LLM time per lesson"
+            if report["eta_seconds"]:
+                line += f", about {report['eta_seconds']:.0f}s left"
+            self.stdout.write(line)
+        for item in report.get("items", []):
+            if item["status"] == "failed":
+                self.stdout.write(f"  failed #{item['seq']} {item['topic'] or item['pdf_filename']!r} "
+                                  f"after {item['attempts']} attempts: {item['error']}")
@@ -0,0 +1,77 @@
+# teacher_app/management/commands/batch_worker.py
+
+import asyncio
+import signal
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand, CommandError
+
+from teacher_app import mongo
+from teacher_app.batch import BatchWorkerPool, get_job, pending_items, retry_failed
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate the lessons queued by batch jobs (api/batch/jobs/ or `manage.py batch_generate`). "
+        "Runs --workers lessons at a time, at most --llm-concurrency of them streaming from the LLM "
+        "(defaults BATCH_WORKERS and BATCH_LLM_CONCURRENCY). Several workers can run side by side; "
+        "the items of a worker that died are picked up again once their lease expires "
+        "(BATCH_LEASE_SECONDS). Ctrl-C or SIGTERM puts the items in progress back in the queue."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--workers", type=int, default=None)
+        parser.add_argument("--llm-concurrency", type=int, default=None)
+        parser.add_argument("--job", default=None, help="Only work on this job.")
+        parser.add_argument("--until-idle", action="store_true",
+                            help="Exit once no item is queued or running (instead of polling for new jobs).")
+        parser.add_argument("--retry-failed", action="store_true",
+                            help="First queue the failed items of --job again.")
+        parser.add_argument("--report-every", type=float, default=30.0, help="Seconds between progress lines.")
+
+    def handle(self, *args, **options):
+        if not mongo.mongo_available():
+            raise CommandError("MongoDB is not available")
+        job_id = None
+        if options["job"] is not None:
+            if not ObjectId.is_valid(options["job"]):
+                raise CommandError(f"Invalid job id: {options['job']}")
+            job_id = ObjectId(options["job"])
+        elif options["retry_failed"]:
+            raise CommandError("--retry-failed needs --job")
+        asyncio.run(self._run(options, job_id))
+
+    async def _run(self, options, job_id):
+        db = mongo.db
+        if job_id is not None:
+            if await get_job(db, job_id) is None:
+                raise CommandError(f"No batch job {job_id}")
+            if options["retry_failed"]:
+                self.stdout.write(f"Queued {await retry_failed(db, job_id)} failed items again")
+        pool = BatchWorkerPool(db, options["workers"], options["llm_concurrency"], job_id=job_id)
+        asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, asyncio.current_task().cancel)
+        self.stdout.write(f"Batch worker {pool.name}: {pool.workers} workers, LLM concurrency "
+                          f"{pool.llm_concurrency}, provider {pool.llm.name}")
+
+        async def report():
+            stats = pool.stats()
+            line = (f"{stats['done']} done, {stats['failed']} failed, {stats['retried']} retried "
+                    f"in {stats['elapsed_seconds']:.0f}s ({stats['lessons_per_minute']} lessons/min")
+            if stats["mean_generation_seconds"] is not None:
+                line += f", {stats['mean_generation_seconds']}s per lesson"
+            line += ")"
+            if job_id is not None:
+                job = await get_job(db, job_id)
+                counts = job["counts"]
+                line += (f"; job {counts['done'] + counts['failed']}/{job['total']} finished"
+                         + (f", ETA {job['eta_seconds']:.0f}s" if job["eta_seconds"] else ""))
+            else:
+                line += f"; {await pending_items(db)} items pending"
+            self.stdout.write(line)
+
+        try:
+            await pool.run(until_idle=options["until_idle"], report=report, report_every=options["report_every"])
+        except asyncio.CancelledError:
+            self.stdout.write("Stopped; the items in progress are back in the queue.")
+        await report()
+        self.stdout.write(self.style.SUCCESS("Batch worker finished."))
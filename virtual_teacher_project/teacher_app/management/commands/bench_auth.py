@@ -0,0 +1,194 @@
+# teacher_app/management/commands/bench_auth.py
+
+import asyncio
+import os
+import statistics
+import tempfile
+import threading
+import time
+from importlib import import_module
+
+from channels.auth import AuthMiddlewareStack
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.auth.models import User
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.db import close_old_connections, connection, connections
+from django.test import override_settings
+from django.utils import timezone
+
+from teacher_app.db import journal_mode
+from teacher_app.loadtest import percentile
+
+BACKEND = "django.contrib.auth.backends.ModelBackend"
+
+
+class Command(BaseCommand):
+    help = (
+        "Connect-storm benchmark for the WebSocket auth path: runs AuthMiddlewareStack (cookie -> "
+        "session -> user) for many concurrent connects against a throwaway copy of the database and "
+        "reports auth lookups per second for each session engine, optionally while background "
+        "threads perform login writes. Compare journal modes with --journal and connection reuse "
+        "with --conn-max-age."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--engines", default="db,cached_db",
+                            help="Comma-separated session engines (db, cached_db, cache or a dotted path).")
+        parser.add_argument("--concurrency", default="1,50,200", help="Comma-separated concurrent connect counts.")
+        parser.add_argument("--lookups", type=int, default=2000, help="Connects per concurrency level.")
+        parser.add_argument("--users", type=int, default=200, help="Distinct users/sessions the connects cycle through.")
+        parser.add_argument("--writers", type=int, default=1,
+                            help="Background threads writing logins (session save + last_login) during the storm.")
+        parser.add_argument("--journal", choices=["wal", "delete"], default=None,
+                            help="SQLite journal mode for the benchmark database (default: SQLITE_WAL).")
+        parser.add_argument("--conn-max-age", default=None,
+                            help="Override CONN_MAX_AGE for the run (seconds, or 'none' for unlimited).")
+        parser.add_argument("--min-rate", type=float, default=None,
+                            help="Fail when any level of the last engine falls below this many lookups/s.")
+
+    def handle(self, *args, **options):
+        engines = [_engine_path(e.strip()) for e in options["engines"].split(",") if e.strip()]
+        try:
+            levels = [int(c) for c in options["concurrency"].split(",") if c.strip()]
+        except ValueError:
+            raise CommandError("--concurrency must be a comma-separated list of integers")
+        if not engines or not levels or min(levels) < 1 or options["lookups"] < 1 or options["users"] < 1:
+            raise CommandError("--engines, --concurrency, --lookups and --users must be non-empty/positive")
+
+        overrides = {}
+        if options["journal"]:
+            overrides["SQLITE_WAL"] = options["journal"] == "wal"
+        db_settings = connection.settings_dict
+        saved = {key: db_settings.get(key) for key in ("CONN_MAX_AGE", "TEST")}
+        if options["conn_max_age"] is not None:
+            db_settings["CONN_MAX_AGE"] = None if options["conn_max_age"] == "none" else int(options["conn_max_age"])
+
+        with tempfile.TemporaryDirectory() as tmp, override_settings(**overrides):
+            old_name = db_settings["NAME"]
+            if connection.vendor == "sqlite":
+                # A file (not :memory:) database, so journal mode and cross-thread locking are real
+                db_settings["TEST"] = dict(saved["TEST"] or {}, NAME=os.path.join(tmp, "bench_auth.sqlite3"))
+            connection.creation.create_test_db(verbosity=0, autoclobber=True)
+            try:
+                mode = journal_mode(connection)
+                self.stdout.write(f"database={connection.vendor}  journal_mode={mode}  "
+                                  f"conn_max_age={db_settings['CONN_MAX_AGE']}  writers={options['writers']}  "
+                                  f"cache={settings.CACHES['default']['BACKEND'].rsplit('.', 1)[-1]}")
+                users = _create_users(options["users"])
+                results = [self._run_engine(engine, users, levels, options) for engine in engines]
+            finally:
+                connections.close_all()
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+                db_settings.update(saved)
+
+        last = results[-1]
+        failures = [f"{r['engine']}: {r['failed']} connects were not authenticated" for r in results if r["failed"]]
+        if options["min_rate"] is not None:
+            failures += [f"{last['engine']} c={level['concurrency']}: {level['rate']:.0f} lookups/s "
+                         f"< {options['min_rate']:.0f}" for level in last["levels"] if level["rate"] < options["min_rate"]]
+        if failures:
+            raise CommandError("; ".join(failures))
+        self.stdout.write(self.style.SUCCESS("Auth connect storm completed."))
+
+    def _run_engine(self, engine, users, levels, options):
+        caches["default"].clear()
+        with override_settings(SESSION_ENGINE=engine):
+            keys = [_login_session(engine, user) for user in users]
+            app = AuthMiddlewareStack(_require_user)
+            stop = threading.Event()
+            writes = []
+            writers = [threading.Thread(target=_login_writer, args=(engine, users, stop, writes), daemon=True)
+                       for _ in range(options["writers"])]
+            for thread in writers:
+                thread.start()
+            try:
+                level_results, failed = [], 0
+                for concurrency in levels:
+                    result = asyncio.run(_storm(app, keys, concurrency, options["lookups"]))
+                    failed += result.pop("failed")
+                    level_results.append(result)
+            finally:
+                stop.set()
+                for thread in writers:
+                    thread.join()
+
+        name = engine.rsplit(".", 1)[-1]
+        for r in level_results:
+            self.stdout.write(
+                f"engine={name:<9}  c={r['concurrency']:>4}  lookups={r['lookups']}  "
+                f"rate={r['rate']:>7.0f}/s  p50={r['p50'] * 1000:.2f}ms  p99={r['p99'] * 1000:.2f}ms")
+        self.stdout.write(f"engine={name:<9}  background login writes={sum(writes)}")
+        return {"engine": name, "levels": level_results, "failed": failed}
+
+
+async def _require_user(scope, receive, send):
+    if not scope["user"].is_authenticated:
+        raise PermissionError("connect was not authenticated")
+
+
+async def _storm(app, keys, concurrency, lookups):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    failed = 0
+
+    async def connect(i):
+        nonlocal failed
+        scope = {
+            "type": "websocket", "path": "/ws/teacher/", "query_string": b"", "subprotocols": [],
+            "client": ("127.0.0.1", 40000 + i % 20000), "server": ("127.0.0.1", 8001),
+            "headers": [(b"host", b"localhost"), (b"cookie", f"{settings.SESSION_COOKIE_NAME}={keys[i % len(keys)]}".encode())],
+        }
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                await app(scope, None, None)
+            except PermissionError:
+                failed += 1
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(connect(i) for i in range(lookups)))
+    elapsed = time.perf_counter() - started
+    return {
+        "concurrency": concurrency, "lookups": lookups, "rate": lookups / elapsed,
+        "p50": statistics.median(latencies), "p99": percentile(latencies, 99), "failed": failed,
+    }
+
+
+def _create_users(count):
+    users = [User(username=f"bench-auth-{i}@example.com", email=f"bench-auth-{i}@example.com") for i in range(count)]
+    for user in users:
+        user.set_unusable_password()  # hashing real passwords would dominate setup time
+    User.objects.bulk_create(users)
+    return list(User.objects.filter(username__startswith="bench-auth-").order_by("pk"))
+
+
+def _login_session(engine, user):
+    """Create the session ``login()`` would, in ``engine``'s store, and return its key."""
+    session = import_module(engine).SessionStore()
+    session[SESSION_KEY] = str(user.pk)
+    session[BACKEND_SESSION_KEY] = BACKEND
+    session[HASH_SESSION_KEY] = user.get_session_auth_hash()
+    session.save()
+    return session.session_key
+
+
+def _login_writer(engine, users, stop, writes):
+    """Perform the writes of a login (new session, last_login) until ``stop`` is set."""
+    count = 0
+    try:
+        while not stop.is_set():
+            user = users[count % len(users)]
+            _login_session(engine, user)
+            User.objects.filter(pk=user.pk).update(last_login=timezone.now())
+            count += 1
+            close_old_connections()
+    finally:
+        writes.append(count)
+        connection.close()
+
+
+def _engine_path(name):
+    return name if "." in name else f"django.contrib.sessions.backends.{name}"
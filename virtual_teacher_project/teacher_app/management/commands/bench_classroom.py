@@ -0,0 +1,176 @@
+# teacher_app/management/commands/bench_classroom.py
+
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from teacher_app import loadtest
+from teacher_app.llm import LLMProvider
+
+
+class CountingProvider(LLMProvider):
+    """Wraps the configured provider and counts generation calls."""
+    calls = 0
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.name = f"counting({inner.name})"
+
+    async def stream(self, prompt):
+        CountingProvider.calls += 1
+        async for chunk in self.inner.stream(prompt):
+            yield chunk
+
+
+class SendTimer:
+    """Accumulates the time viewers spend in classroom_frame: queueing the ready-made text on the
+    connection's outbound queue (the socket write happens later on its sender task)."""
+    seconds = 0.0
+    calls = 0
+
+    @classmethod
+    def wrap(cls, handler):
+        async def timed(consumer, event):
+            started = time.perf_counter()
+            await handler(consumer, event)
+            cls.seconds += time.perf_counter() - started
+            cls.calls += 1
+        return timed
+
+
+class Command(BaseCommand):
+    help = (
+        "Run one classroom lesson in-process with a host and N viewers on ws/classroom/<room>/ and "
+        "report the per-viewer cost of a frame (time in the viewers' classroom_frame handler, which "
+        "only queues the ready-made text), failing if it grows with N. The end-to-end fan-out time "
+        "is reported too; with InMemoryChannelLayer it grows faster than N because every receive "
+        "scans all channels, which the production Redis layer does not. The behaviour (one "
+        "serialization per frame, snapshots, playback, replay) is covered by ClassroomTests."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--viewers", default="50,500",
+                            help="Comma-separated viewer counts to run (one lesson each).")
+        parser.add_argument("--topic", default="Photosynthesis")
+        parser.add_argument("--timeout", type=float, default=60.0)
+        parser.add_argument("--max-cost-growth", type=float, default=3.0,
+                            help="Fail when per-viewer enqueue cost at the largest N exceeds the smallest N's by this factor.")
+
+    def handle(self, *args, **options):
+        try:
+            levels = sorted(int(v) for v in options["viewers"].split(",") if v.strip())
+        except ValueError:
+            raise CommandError("--viewers must be a comma-separated list of integers")
+        if not levels or levels[0] < 1:
+            raise CommandError("--viewers counts must be positive")
+
+        with override_settings(LLM_PROVIDER="stub", LLM_STUB_TOKENS_PER_SECOND=0):
+            results = asyncio.run(self._run_all(levels, options))
+
+        failures = []
+        for r in results:
+            self.stdout.write(
+                f"viewers={r['viewers']:>4}  llm_calls={r['llm_calls']}  frames={r['frames']}  "
+                f"deliveries={r['deliveries']}  "
+                f"fanout_p50={_fmt(r['fanout']['p50'])}  fanout_p99={_fmt(r['fanout']['p99'])}  "
+                f"enqueue={r['send_us']:.1f}us/frame/viewer  end_to_end={r['per_delivery_us']:.1f}us/delivery  "
+                f"late_join_snapshot={r['late_join_ok']}"
+            )
+            if r["llm_calls"] != 1:
+                failures.append(f"{r['viewers']} viewers: expected 1 LLM call, got {r['llm_calls']}")
+            if r["completed"] != r["viewers"]:
+                failures.append(f"{r['viewers']} viewers: only {r['completed']} received the lesson")
+            if not r["late_join_ok"]:
+                failures.append(f"{r['viewers']} viewers: late joiner did not get a snapshot with the lesson")
+        if len(results) > 1:
+            growth = results[-1]["send_us"] / max(results[0]["send_us"], 1e-9)
+            self.stdout.write(f"Per-viewer enqueue cost growth {results[0]['viewers']} -> {results[-1]['viewers']} viewers: {growth:.2f}x")
+            if growth > options["max_cost_growth"]:
+                failures.append(f"per-viewer enqueue cost grew {growth:.2f}x (limit {options['max_cost_growth']}x)")
+        if failures:
+            raise CommandError("; ".join(failures))
+        self.stdout.write(self.style.SUCCESS("Classroom fan-out checks passed."))
+
+    async def _run_all(self, levels, options):
+        from channels.routing import URLRouter
+        from teacher_app import classroom, consumers, routing
+
+        consumers.conversations = None
+        consumers.messages = None
+        consumers.lesson_snapshots = None
+        real_provider = consumers.get_llm_provider
+        real_handler = classroom.ClassroomConsumer.classroom_frame
+        consumers.get_llm_provider = lambda name=None: CountingProvider(real_provider(name))
+        classroom.ClassroomConsumer.classroom_frame = SendTimer.wrap(real_handler)
+        application = URLRouter(routing.websocket_urlpatterns)
+        try:
+            return [await self._run_level(application, n, f"bench-{n}", options) for n in levels]
+        finally:
+            consumers.get_llm_provider = real_provider
+            classroom.ClassroomConsumer.classroom_frame = real_handler
+
+    async def _run_level(self, application, viewer_count, room_id, options):
+        from channels.testing import WebsocketCommunicator
+
+        timeout = options["timeout"]
+        path = f"/ws/classroom/{room_id}/"
+        CountingProvider.calls = 0
+        SendTimer.seconds, SendTimer.calls = 0.0, 0
+
+        host = WebsocketCommunicator(application, path + "?role=host")
+        await host.connect()
+        await host.receive_json_from(timeout)  # connected status
+        viewers = []
+        for _ in range(viewer_count):
+            viewer = WebsocketCommunicator(application, path)
+            await viewer.connect()
+            await viewer.receive_json_from(timeout)  # waiting status (the room has no lesson yet)
+            viewers.append(viewer)
+
+        async def watch(viewer):
+            count = 0
+            while True:
+                frame = await viewer.receive_json_from(timeout)
+                count += 1
+                if frame["type"] in ("lesson_ready", "error"):
+                    return time.perf_counter(), count, frame["type"] == "lesson_ready"
+
+        watchers = [asyncio.ensure_future(watch(v)) for v in viewers]
+        started = time.perf_counter()
+        await host.send_json_to({"topic": options["topic"], "user_id": "bench-host"})
+        while True:
+            frame = await host.receive_json_from(timeout)
+            if frame["type"] in ("lesson_ready", "error"):
+                host_ready = time.perf_counter()
+                break
+        outcomes = await asyncio.gather(*watchers)
+        finished = max(t for t, _, _ in outcomes)
+        send_seconds, send_calls = SendTimer.seconds, SendTimer.calls
+
+        late = WebsocketCommunicator(application, path)
+        await late.connect()
+        snapshot = await late.receive_json_from(timeout)
+        late_join_ok = snapshot.get("type") == "classroom_snapshot" and any(
+            f.get("type") == "lesson_ready" for f in snapshot.get("frames", []))
+
+        for communicator in [late, host] + viewers:
+            await communicator.disconnect()
+
+        deliveries = sum(count for _, count, _ in outcomes)
+        return {
+            "viewers": viewer_count,
+            "llm_calls": CountingProvider.calls,
+            "frames": outcomes[0][1] if outcomes else 0,
+            "deliveries": deliveries,
+            "completed": sum(1 for _, _, ok in outcomes if ok),
+            "fanout": loadtest.summarize([t - host_ready for t, _, _ in outcomes]),
+            "send_us": send_seconds / max(send_calls, 1) * 1e6,
+            "per_delivery_us": (finished - started) / max(deliveries, 1) * 1e6,
+            "late_join_ok": late_join_ok,
+        }
+
+
+def _fmt(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.1f}ms"
@@ -0,0 +1,133 @@
+# teacher_app/management/commands/bench_portability.py
+
+import asyncio
+import os
+import random
+import resource
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from teacher_app import portability
+from teacher_app.management.commands.export_conversations import export_to_file
+from teacher_app.mongo import create_conversation, create_message
+from teacher_app.mongo_client import get_client
+
+USER_ID = "bench-portability"
+WORDS = ("photosynthesis chlorophyll light energy glucose oxygen carbon dioxide water leaf cell "
+         "plant reaction sunlight stomata root stem").split()
+
+
+def _peak_rss_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure export/import throughput for one large user: seed a scratch database with a "
+        "synthetic user (default 100k messages), export it with export_conversations' streaming "
+        "path, import the file into a second scratch database, check that every document and _id "
+        "arrived, and drop both databases."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=100_000)
+        parser.add_argument("--conversations", type=int, default=200)
+        parser.add_argument("--message-chars", type=int, default=400, help="Approximate content length.")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Export cursor / import insert batch size.")
+        parser.add_argument("--keep", action="store_true", help="Keep the scratch databases and export file.")
+        parser.add_argument("--min-rate", type=float, default=None,
+                            help="Fail when export or import is slower than this many messages/s.")
+
+    def handle(self, *args, **options):
+        if options["messages"] < 1 or options["conversations"] < 1:
+            raise CommandError("--messages and --conversations must be positive")
+        results = asyncio.run(self._run(options))
+        for phase in ("seed", "export", "import"):
+            r = results[phase]
+            self.stdout.write(f"{phase:<7} {r['seconds']:>7.2f}s  {r['rate']:>9.0f} messages/s"
+                              + (f"  {r['mb'] / r['seconds']:>6.1f} MB/s of {r['mb']:.1f} MB gzip" if "mb" in r else ""))
+        self.stdout.write(f"peak RSS {results['rss_start_mb']:.0f} MB -> {results['rss_peak_mb']:.0f} MB")
+        if options["min_rate"] is not None:
+            slow = [p for p in ("export", "import") if results[p]["rate"] < options["min_rate"]]
+            if slow:
+                raise CommandError(f"{', '.join(slow)} below {options['min_rate']:.0f} messages/s")
+        self.stdout.write(self.style.SUCCESS("Export and import round trip verified."))
+
+    async def _run(self, options):
+        client = get_client()
+        source = client[f"{settings.MONGO_DB_NAME}_bench_portability"]
+        target = client[f"{settings.MONGO_DB_NAME}_bench_portability_import"]
+        for database in (source, target):
+            await client.drop_database(database.name)
+        path = os.path.join(tempfile.mkdtemp(prefix="bench_portability-"), "export.ndjson.gz")
+        total = options["messages"]
+        results = {"rss_start_mb": _peak_rss_mb()}
+        try:
+            started = time.perf_counter()
+            await _seed(source, options)
+            await source["messages"].create_index([("conversation_id", 1), ("timestamp", 1)], name="conversation_timeline")
+            results["seed"] = _phase(started, total)
+
+            started = time.perf_counter()
+            counts, size = await export_to_file(source, USER_ID, path, options["batch_size"])
+            results["export"] = dict(_phase(started, total), mb=size / 1e6)
+            if counts != {"conversations": options["conversations"], "messages": total}:
+                raise CommandError(f"Export wrote {counts}")
+
+            started = time.perf_counter()
+            imported = await portability.import_records(target, portability.read_export(path), options["batch_size"])
+            results["import"] = dict(_phase(started, total), mb=results["export"]["mb"])
+            if imported["messages"] != total or imported["conversations"] != options["conversations"]:
+                raise CommandError(f"Import wrote {imported}")
+            for name in ("conversations", "messages"):
+                source_ids = await source[name].distinct("_id")
+                target_ids = await target[name].distinct("_id")
+                if sorted(source_ids) != sorted(target_ids):
+                    raise CommandError(f"{name}: imported _ids differ from the source")
+            results["rss_peak_mb"] = _peak_rss_mb()
+            return results
+        finally:
+            if not options["keep"]:
+                for database in (source, target):
+                    await client.drop_database(database.name)
+                if os.path.exists(path):
+                    os.remove(path)
+                os.rmdir(os.path.dirname(path))
+            else:
+                self.stdout.write(f"Kept {source.name}, {target.name} and {path}")
+
+
+def _phase(started, messages):
+    seconds = time.perf_counter() - started
+    return {"seconds": seconds, "rate": messages / seconds if seconds else 0.0}
+
+
+async def _seed(db, options):
+    rnd = random.Random(42)
+    conversation_docs = [create_conversation(USER_ID, f"Lesson {i}", topic=rnd.choice(WORDS))
+                         for i in range(options["conversations"])]
+    ids = (await db["conversations"].insert_many(conversation_docs)).inserted_ids
+    words = max(1, options["message_chars"] // 8)
+    base = datetime.utcnow() - timedelta(days=30)
+    batch = []
+    for i in range(options["messages"]):
+        if i % 5 == 0:
+            message = create_message(ids[i % len(ids)], "user", " ".join(rnd.choices(WORDS, k=words)), "topic_request",
+                                     user_id=USER_ID)
+        else:
+            content = " ".join(rnd.choices(WORDS, k=words))
+            message = create_message(ids[i % len(ids)], "ai", content, "lesson_step",
+                                     step_data={"step": i % 5, "speech_text": content,
+                                                "drawing_commands": [{"action": "draw_text", "text": content[:40]}]},
+                                     user_id=USER_ID)
+        message["timestamp"] = base + timedelta(milliseconds=i)
+        batch.append(message)
+        if len(batch) >= 5000:
+            await db["messages"].insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        await db["messages"].insert_many(batch, ordered=False)
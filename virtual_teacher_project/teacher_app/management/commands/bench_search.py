@@ -0,0 +1,135 @@
+# teacher_app/management/commands/bench_search.py
+
+import asyncio
+import random
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from teacher_app import mongo
+from teacher_app.mongo import create_conversation, create_message
+from teacher_app.mongo_client import get_client
+from teacher_app.search import search_history
+
+SUBJECTS = ("photosynthesis chlorophyll respiration mitochondria osmosis diffusion enzyme protein "
+            "gravity momentum velocity acceleration friction energy electricity magnetism circuit "
+            "fraction decimal equation triangle pythagoras algebra geometry probability statistics "
+            "volcano earthquake glacier erosion climate weather river ocean continent atmosphere "
+            "democracy revolution empire renaissance industrial colonial parliament constitution").split()
+FILLER = ("the a of and to in is that it for as with this which are on be by can when we our "
+          "let us look at how works first next then finally remember important example picture "
+          "diagram step idea simple called means happens because therefore shows each").split()
+
+
+def _percentile(sorted_values, fraction):
+    return sorted_values[min(len(sorted_values) - 1, int(len(sorted_values) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure history search latency: seed a scratch database with --messages lesson messages "
+        "(default 1M) spread over --users users, one of them --heavy-share of all messages, create "
+        "the search text indexes, run --queries searches for random users (page 1 and a deep "
+        "page) and report p50/p99. Drops the database afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--messages", type=int, default=1_000_000)
+        parser.add_argument("--users", type=int, default=1000)
+        parser.add_argument("--heavy-share", type=float, default=0.05,
+                            help="Fraction of all messages owned by one heavy user (searched too).")
+        parser.add_argument("--messages-per-conversation", type=int, default=25)
+        parser.add_argument("--queries", type=int, default=500)
+        parser.add_argument("--concurrency", type=int, default=8)
+        parser.add_argument("--keep", action="store_true", help="Keep the scratch database.")
+        parser.add_argument("--max-p99-ms", type=float, default=None, help="Fail when the page 1 p99 exceeds this.")
+
+    def handle(self, *args, **options):
+        if options["messages"] < 1 or options["users"] < 1:
+            raise CommandError("--messages and --users must be positive")
+        results = asyncio.run(self._run(options))
+        self.stdout.write(f"seed {results['seed']:.1f}s, text indexes {results['index']:.1f}s")
+        for name, latencies in results["latencies"].items():
+            latencies.sort()
+            self.stdout.write(f"{name:<16} n={len(latencies):<5} p50 {_percentile(latencies, 0.5):7.1f} ms  "
+                              f"p99 {_percentile(latencies, 0.99):7.1f} ms  max {latencies[-1]:7.1f} ms")
+        self.stdout.write(f"hits per page-1 query: {results['hits'] / max(1, len(results['latencies']['page 1'])):.1f}")
+        page_one = sorted(results["latencies"]["page 1"])
+        if options["max_p99_ms"] is not None and _percentile(page_one, 0.99) > options["max_p99_ms"]:
+            raise CommandError(f"page 1 p99 {_percentile(page_one, 0.99):.1f} ms > {options['max_p99_ms']} ms")
+        self.stdout.write(self.style.SUCCESS("Search benchmark finished."))
+
+    async def _run(self, options):
+        client = get_client()
+        db = client[f"{settings.MONGO_DB_NAME}_bench_search"]
+        await client.drop_database(db.name)
+        try:
+            started = time.perf_counter()
+            users = await _seed(db, options)
+            seeded = time.perf_counter()
+            await mongo.ensure_indexes(db)
+            results = {"seed": seeded - started, "index": time.perf_counter() - seeded, "hits": 0,
+                       "latencies": {"page 1": [], "heavy page 1": [], "heavy deep page": []}}
+
+            rnd = random.Random(1)
+            semaphore = asyncio.Semaphore(options["concurrency"])
+            deep_page = max(1, min(5, settings.SEARCH_MAX_RESULTS // settings.SEARCH_PAGE_SIZE))
+
+            async def one(name, user_id, query, page):
+                async with semaphore:
+                    started = time.perf_counter()
+                    result = await search_history(db, user_id, query, page, settings.SEARCH_PAGE_SIZE,
+                                                  settings.SEARCH_MAX_TIME_MS)
+                    results["latencies"][name].append((time.perf_counter() - started) * 1000)
+                    if name == "page 1":
+                        results["hits"] += len(result["hits"])
+
+            jobs = []
+            for i in range(options["queries"]):
+                query = " ".join(rnd.sample(SUBJECTS, rnd.choice((1, 1, 2))))
+                jobs.append(one("page 1", rnd.choice(users[1:] or users), query, 1))
+                if i % 5 == 0:
+                    jobs.append(one("heavy page 1", users[0], query, 1))
+                    jobs.append(one("heavy deep page", users[0], query, deep_page))
+            await asyncio.gather(*jobs)
+            return results
+        finally:
+            if not options["keep"]:
+                await client.drop_database(db.name)
+            else:
+                self.stdout.write(f"Kept {db.name}")
+
+
+async def _seed(db, options):
+    """Users "bench-0" (the heavy one) .. "bench-N"; returns their ids."""
+    rnd = random.Random(42)
+    users = [f"bench-{i}" for i in range(options["users"])]
+    heavy = int(options["messages"] * options["heavy_share"]) if options["users"] > 1 else options["messages"]
+    per_conversation = options["messages_per_conversation"]
+    base = datetime.utcnow() - timedelta(days=90)
+    conversation_batch, batch, written = [], [], 0
+    while written < options["messages"]:
+        user_id = users[0] if written < heavy else rnd.choice(users[1:])
+        subject = rnd.sample(SUBJECTS, 2)
+        conversation = create_conversation(user_id, f"{subject[0].title()} and {subject[1]}", topic=subject[0])
+        conversation_id = conversation["_id"] = ObjectId()
+        conversation_batch.append(conversation)
+        for step in range(min(per_conversation, options["messages"] - written)):
+            words = rnd.choices(FILLER, k=50) + rnd.choices(subject, k=4) + rnd.choices(SUBJECTS, k=2)
+            rnd.shuffle(words)
+            message = create_message(conversation_id, "ai", " ".join(words), "lesson_step", user_id=user_id)
+            message["timestamp"] = base + timedelta(seconds=written)
+            batch.append(message)
+            written += 1
+            if len(batch) >= 5000:
+                await db["conversations"].insert_many(conversation_batch, ordered=False)
+                await db["messages"].insert_many(batch, ordered=False)
+                conversation_batch, batch = [], []
+    if conversation_batch:
+        await db["conversations"].insert_many(conversation_batch, ordered=False)
+    if batch:
+        await db["messages"].insert_many(batch, ordered=False)
+    return users
@@ -0,0 +1,153 @@
+# teacher_app/management/commands/bench_topic_index.py
+
+import random
+import resource
+import statistics
+import string
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from teacher_app import topic_index
+
+# Phrasings that must find each other (first item is the stored topic) or must not
+SAME = [
+    ("Photosynthesis", "what is photosynthesis?", "photosynthesis in plants", "Explain photosynthesis"),
+    ("Newton's laws of motion", "newtons law of motion", "explain Newton's laws of motion to me"),
+    ("The water cycle", "water cycle for kids", "what is the water-cycle"),
+    ("Pythagorean theorem", "the Pythagorean theorems", "pythagorean theorem explained"),
+]
+DIFFERENT = [
+    ("Photosynthesis", "cellular respiration"),
+    ("Newton's laws of motion", "Kepler's laws of planetary motion"),
+    ("The water cycle", "the carbon cycle"),
+    ("World War 1", "World War 2"),
+]
+
+
+def _rss_mb():
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 2**20
+
+
+def _typo(rnd, topic):
+    """The topic with one character of a longer word replaced (a misspelt request)."""
+    words = topic.split()
+    candidates = [i for i, w in enumerate(words) if len(w) >= 6]
+    if not candidates:
+        return None
+    i = rnd.choice(candidates)
+    w = words[i]
+    j = rnd.randrange(1, len(w) - 1)
+    words[i] = w[:j] + rnd.choice(string.ascii_lowercase.replace(w[j], "")) + w[j + 1:]
+    return "what is " + " ".join(words)
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the similar-topic index in memory (no MongoDB): bulk-build it from synthetic "
+        "topics, then time lookups of misspelt stored topics (should match) and of unseen topics. "
+        "Also checks that a few real phrasings of one topic match each other and related but "
+        "different topics do not."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--topics", type=int, default=1_000_000)
+        parser.add_argument("--lookups", type=int, default=20_000)
+        parser.add_argument("--threshold", type=float, default=None,
+                            help="Similarity threshold (default: TOPIC_SIMILARITY_THRESHOLD).")
+        parser.add_argument("--max-p99-ms", type=float, default=1.0, help="Fail above this p99 lookup latency.")
+        parser.add_argument("--min-recall", type=float, default=0.9, help="Fail below this LSH recall.")
+        parser.add_argument("--seed", type=int, default=7)
+
+    def handle(self, *args, **options):
+        from django.conf import settings
+        threshold = options["threshold"] if options["threshold"] is not None else \
+            getattr(settings, "TOPIC_SIMILARITY_THRESHOLD", 0.6)
+        rnd = random.Random(options["seed"])
+        failures = self._check_phrasings(threshold)
+
+        syllables = [a + b for a in "bcdfghklmnprstvz" for b in ("a", "e", "i", "o", "u", "ar", "en", "is", "on")]
+        vocabulary = list({"".join(rnd.choices(syllables, k=rnd.randint(2, 4))) for _ in range(40_000)})
+        topics = [" ".join(rnd.sample(vocabulary, rnd.choice((1, 2, 2, 3, 3, 4)))) for _ in range(options["topics"])]
+
+        rss_before = _rss_mb()
+        index = topic_index.TopicIndex(threshold)
+        started = time.perf_counter()
+        index.add_many((topic, i, "") for i, topic in enumerate(topics))
+        build = time.perf_counter() - started
+        rss_after = _rss_mb()
+        self.stdout.write(f"built {len(index)} topics in {build:.1f}s ({len(index) / build:,.0f}/s), "
+                          f"RSS +{rss_after - rss_before:.0f} MB")
+
+        started = time.perf_counter()
+        for i in range(1000):
+            index.add(f"{topics[i]} extra{i}", f"new-{i}")
+        self.stdout.write(f"1000 single adds: {(time.perf_counter() - started) * 1000:.0f} ms")
+        started = time.perf_counter()
+        index.merge()
+        self.stdout.write(f"  merge: {(time.perf_counter() - started) * 1000:.0f} ms")
+
+        queries, expected = [], []
+        while len(queries) < options["lookups"]:
+            if len(queries) % 2:
+                queries.append(" ".join(rnd.sample(vocabulary, 3)) + " zq")  # unseen
+                expected.append(None)
+            else:
+                i = rnd.randrange(len(topics))
+                typo = _typo(rnd, topics[i])
+                if typo is not None:
+                    queries.append(typo)
+                    expected.append(topics[i])
+
+        # recall: of the misspelt topics still at/above the threshold from their original, how
+        # many did LSH find (the original or an even closer topic)
+        latencies, reachable, found, false_hits = [], 0, 0, 0
+        for query, target in zip(queries, expected):
+            started = time.perf_counter_ns()
+            match = index.lookup(query)
+            latencies.append((time.perf_counter_ns() - started) / 1e6)
+            if target is None:
+                false_hits += match is not None
+                continue
+            similarity = topic_index.jaccard(topic_index.shingles(topic_index.normalize_topic(query)),
+                                             topic_index.shingles(topic_index.normalize_topic(target)))
+            if similarity >= threshold:
+                reachable += 1
+                found += match is not None and match["similarity"] >= round(similarity, 3)
+        latencies.sort()
+        p50 = latencies[len(latencies) // 2]
+        p99 = latencies[int(len(latencies) * 0.99)]
+        misspelt = sum(1 for t in expected if t is not None)
+        self.stdout.write(f"lookups: p50 {p50:.3f} ms  p99 {p99:.3f} ms  mean {statistics.fmean(latencies):.3f} ms")
+        self.stdout.write(f"misspelt stored topics: {reachable / misspelt:.1%} still within the threshold "
+                          f"({threshold}), LSH recall on those {found / max(reachable, 1):.1%}")
+        self.stdout.write(f"unseen topics matched: {false_hits / (len(queries) - misspelt):.2%}")
+
+        if reachable and found / reachable < options["min_recall"]:
+            failures.append(f"LSH recall {found / reachable:.1%} < {options['min_recall']:.0%}")
+        if p99 > options["max_p99_ms"]:
+            failures.append(f"p99 lookup {p99:.3f} ms > {options['max_p99_ms']} ms")
+        if failures:
+            raise CommandError("; ".join(failures))
+        self.stdout.write(self.style.SUCCESS("Similar-topic index benchmark passed."))
+
+    def _check_phrasings(self, threshold):
+        index = topic_index.TopicIndex(threshold)
+        for i, phrasings in enumerate(SAME):
+            index.add(phrasings[0], i)
+        for stored, other in DIFFERENT:
+            index.add(stored, stored)
+        failures = []
+        for i, phrasings in enumerate(SAME):
+            for phrasing in phrasings[1:]:
+                match = index.lookup(phrasing)
+                self.stdout.write(f"  {phrasing!r:45} -> {match and (match['topic'], match['similarity'])}")
+                if match is None or match["topic"] != phrasings[0]:
+                    failures.append(f"{phrasing!r} did not match {phrasings[0]!r}")
+        for stored, other in DIFFERENT:
+            match = index.lookup(other)
+            self.stdout.write(f"  {other!r:45} -> {match and (match['topic'], match['similarity'])}")
+            if match is not None and match["topic"] == stored:
+                failures.append(f"{other!r} matched {stored!r}")
+        return failures
@@ -0,0 +1,126 @@
+# teacher_app/management/commands/bench_wire.py
+
+import asyncio
+import json
+import zlib
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from teacher_app import loadtest
+from teacher_app.wire import COMPACT, COMPACT_SUBPROTOCOL, JSON, decode_frame, encode_frame
+
+
+def frame_overhead(length):
+    """Header bytes of an unmasked (server to client) WebSocket frame carrying ``length`` bytes."""
+    return 2 if length < 126 else 4 if length < 65536 else 10
+
+
+def wire_bytes(messages, deflate=None):
+    """Bytes on the wire for ``messages``: ``deflate`` is None, "takeover" or "no_takeover"
+    (permessage-deflate with and without a shared compression context)."""
+    total = 0
+    compressor = None
+    for text in messages:
+        payload = text.encode("utf-8")
+        if deflate:
+            if compressor is None or deflate == "no_takeover":
+                compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+            payload = (compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH))[:-4]
+        total += frame_overhead(len(payload)) + len(payload)
+    return total
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the bytes on the wire for one lesson in the json and compact encodings, each "
+        "uncompressed and with permessage-deflate (with and without context takeover), and check "
+        "that compact frames decode back to the json ones. Runs the lesson in-process with the "
+        "stub LLM; --url also measures a live server (start it with teacher_app.wsserver)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--topic", default="Photosynthesis")
+        parser.add_argument("--timeout", type=float, default=60.0)
+        parser.add_argument("--url", default=None,
+                            help="Also measure a running server, e.g. ws://127.0.0.1:8000/ws/teacher/")
+        parser.add_argument("--min-saving", type=float, default=0.0,
+                            help="Fail unless compact+deflate saves at least this fraction of json bytes.")
+
+    def handle(self, *args, **options):
+        with override_settings(LLM_PROVIDER="stub", LLM_STUB_TOKENS_PER_SECOND=0):
+            frames = asyncio.run(self._record(options))
+
+        failures = []
+        for text in frames[JSON]:
+            frame = json.loads(text)
+            if decode_frame(encode_frame(frame, COMPACT)) != frame:
+                failures.append(f"{frame.get('type')} frame does not survive a compact round trip")
+        compact_lessons = [decode_frame(t) for t in frames[COMPACT]
+                           if json.loads(t).get("type") == "lesson_ready"]
+        if not compact_lessons or not compact_lessons[0].get("teaching_steps"):
+            failures.append("compact connection did not receive a decodable lesson")
+
+        baseline = wire_bytes(frames[JSON])
+        self.stdout.write(f"{'encoding':<10}{'frames':>8}{'raw':>10}{'deflate':>10}{'deflate(no ctx)':>17}")
+        for encoding in (JSON, COMPACT):
+            raw = wire_bytes(frames[encoding])
+            takeover = wire_bytes(frames[encoding], "takeover")
+            no_takeover = wire_bytes(frames[encoding], "no_takeover")
+            self.stdout.write(f"{encoding:<10}{len(frames[encoding]):>8}{raw:>10}{takeover:>10}{no_takeover:>17}")
+        best = wire_bytes(frames[COMPACT], "takeover")
+        saving = 1 - best / max(baseline, 1)
+        self.stdout.write(f"compact+deflate saves {saving:.1%} of json bytes ({baseline} -> {best})")
+        if saving < options["min_saving"]:
+            failures.append(f"saving {saving:.1%} is below --min-saving {options['min_saving']:.0%}")
+
+        if options["url"]:
+            for label, subprotocols, extensions in (
+                ("json", None, None),
+                ("json+deflate", None, "permessage-deflate; client_max_window_bits"),
+                ("compact+deflate", [COMPACT_SUBPROTOCOL], "permessage-deflate; client_max_window_bits"),
+            ):
+                wire, payload, deflate = asyncio.run(self._measure_socket(options, subprotocols, extensions))
+                self.stdout.write(f"live {label:<16} wire={wire}  payload={payload}  deflate_negotiated={deflate}")
+
+        if failures:
+            raise CommandError("; ".join(failures))
+        self.stdout.write(self.style.SUCCESS("Wire format checks passed."))
+
+    async def _record(self, options):
+        from channels.routing import URLRouter
+        from channels.testing import WebsocketCommunicator
+        from teacher_app import consumers, routing
+
+        consumers.conversations = None
+        consumers.messages = None
+        consumers.lesson_snapshots = None
+        application = URLRouter(routing.websocket_urlpatterns)
+        frames = {}
+        for encoding, subprotocols in ((JSON, None), (COMPACT, [COMPACT_SUBPROTOCOL])):
+            communicator = WebsocketCommunicator(application, "/ws/teacher/", subprotocols=subprotocols)
+            connected, subprotocol = await communicator.connect(options["timeout"])
+            if not connected:
+                raise CommandError(f"{encoding} connection was rejected")
+            received = []
+            await communicator.send_to(text_data=json.dumps({"topic": options["topic"], "user_id": "bench-wire"}))
+            while True:
+                text = await communicator.receive_from(options["timeout"])
+                received.append(text)
+                if json.loads(text).get("type") in loadtest.DONE_FRAMES:
+                    break
+            await communicator.disconnect()
+            frames[encoding] = received
+        return frames
+
+    async def _measure_socket(self, options, subprotocols, extensions):
+        ws = await loadtest.RawWebSocket.connect(options["url"], subprotocols=subprotocols, extensions=extensions)
+        try:
+            await ws.send_text(json.dumps({"topic": options["topic"], "user_id": "bench-wire"}))
+            while True:
+                text = await asyncio.wait_for(ws.recv(), options["timeout"])
+                if text is None or json.loads(text).get("type") in loadtest.DONE_FRAMES:
+                    break
+        finally:
+            await ws.close()
+        return ws.bytes_received, ws.payload_bytes, ws.deflate
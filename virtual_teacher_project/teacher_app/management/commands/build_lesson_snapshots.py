@@ -0,0 +1,79 @@
+# teacher_app/management/commands/build_lesson_snapshots.py
+
+import asyncio
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand, CommandError
+
+from teacher_app import mongo
+from teacher_app.codec import CODEC_FIELD, CONTENT_FIELD, decode_message
+from teacher_app.mongo import create_lesson_snapshot
+from teacher_app.snapshots import STEP_MESSAGE_TYPES, NOTES_MESSAGE_TYPE, LESSON_BOUNDARY_TYPES, lessons_from_messages
+
+
+class Command(BaseCommand):
+    help = (
+        "Build lesson_snapshots documents from the per-step messages of existing conversations. "
+        "Idempotent: lessons that already have a snapshot are left untouched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--conversation", action="append", default=[],
+                            help="Only migrate this conversation id (repeatable).")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Report what would be written without writing.")
+
+    def handle(self, *args, **options):
+        if not mongo.mongo_available():
+            raise CommandError("MongoDB is not available")
+        for conversation_id in options["conversation"]:
+            if not ObjectId.is_valid(conversation_id):
+                raise CommandError(f"Invalid conversation id: {conversation_id}")
+        counts = asyncio.run(self._migrate(options))
+        self.stdout.write(self.style.SUCCESS(
+            f"Conversations scanned: {counts['conversations']}, lessons found: {counts['lessons']}, "
+            f"snapshots written: {counts['written']}, already present: {counts['existing']}"
+        ))
+
+    async def _migrate(self, options):
+        db = mongo.db
+        if not options["dry_run"]:
+            await mongo.ensure_indexes(db)
+
+        query = {}
+        if options["conversation"]:
+            query["_id"] = {"$in": [ObjectId(c) for c in options["conversation"]]}
+
+        counts = {"conversations": 0, "lessons": 0, "written": 0, "existing": 0}
+        message_types = list(STEP_MESSAGE_TYPES) + [NOTES_MESSAGE_TYPE] + list(LESSON_BOUNDARY_TYPES)
+        async for conversation in db["conversations"].find(query, {"user_id": 1, "title": 1, "topic": 1}):
+            counts["conversations"] += 1
+            cursor = db["messages"].find(
+                {"conversation_id": conversation["_id"], "message_type": {"$in": message_types}},
+                {"message_type": 1, "content": 1, "step_data": 1, "timestamp": 1, CODEC_FIELD: 1, CONTENT_FIELD: 1},
+            ).sort("timestamp", 1)
+            for lesson in lessons_from_messages([decode_message(m) async for m in cursor]):
+                counts["lessons"] += 1
+                snapshot = create_lesson_snapshot(
+                    conversation_id=conversation["_id"],
+                    user_id=conversation.get("user_id", "anonymous"),
+                    title=conversation.get("title", "New Lesson"),
+                    topic=conversation.get("topic"),
+                    steps=lesson["steps"],
+                    notes_and_quiz=lesson["notes_and_quiz"],
+                    first_step_message_id=lesson["first_step_message_id"],
+                    source="migration",
+                )
+                snapshot["created_at"] = lesson["created_at"] or snapshot["created_at"]
+                if options["dry_run"]:
+                    exists = await db["lesson_snapshots"].count_documents(
+                        {"first_step_message_id": lesson["first_step_message_id"]}, limit=1)
+                    counts["existing" if exists else "written"] += 1
+                    continue
+                result = await db["lesson_snapshots"].update_one(
+                    {"first_step_message_id": lesson["first_step_message_id"]},
+                    {"$setOnInsert": snapshot},
+                    upsert=True,
+                )
+                counts["written" if result.upserted_id is not None else "existing"] += 1
+        return counts
@@ -0,0 +1,117 @@
+# teacher_app/management/commands/compact_messages.py
+
+import asyncio
+import hashlib
+import json
+
+import bson
+from django.core.management.base import BaseCommand, CommandError
+from pymongo import DeleteOne, UpdateOne
+
+from teacher_app import mongo
+from teacher_app.codec import CODEC_FIELD, CONTENT_FIELD, configured_codec, decode_message, encode_message
+from teacher_app.snapshots import LESSON_BOUNDARY_TYPES
+
+
+class Command(BaseCommand):
+    help = (
+        "Rewrite stored messages with the step_data storage codec (dedupe content, compress large "
+        "payloads), optionally delete duplicate step records within a lesson, and report the space saved."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--codec", choices=["zlib", "zstd"], default=None,
+                            help="Codec to use (default: settings.MESSAGE_CODEC).")
+        parser.add_argument("--dedupe", action="store_true",
+                            help="Delete messages whose step_data repeats an earlier one in the same lesson.")
+        parser.add_argument("--dry-run", action="store_true", help="Report savings without writing.")
+        parser.add_argument("--compact", action="store_true",
+                            help="Run the server-side compact command afterwards to release disk space.")
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        if not mongo.mongo_available():
+            raise CommandError("MongoDB is not available")
+        codec = options["codec"] or configured_codec()
+        if codec == "none":
+            raise CommandError("MESSAGE_CODEC is 'none'; pass --codec zlib or --codec zstd")
+        report = asyncio.run(self._compact(codec, options))
+
+        saved = report["bytes_before"] - report["bytes_after"]
+        pct = 100.0 * saved / report["bytes_before"] if report["bytes_before"] else 0.0
+        self.stdout.write(
+            f"Scanned {report['scanned']} messages: {report['encoded']} encoded with {codec}, "
+            f"{report['duplicates']} duplicates {'found' if options['dry_run'] else 'deleted'}."
+        )
+        self.stdout.write(
+            f"Rewritten documents: {report['bytes_before']:,} -> {report['bytes_after']:,} bytes "
+            f"({saved:,} bytes, {pct:.1f}% saved)"
+        )
+        for label in ("before", "after"):
+            stats = report.get(f"stats_{label}")
+            if stats:
+                self.stdout.write(
+                    f"Collection {label}: size={stats['size']:,} storageSize={stats['storageSize']:,} "
+                    f"count={stats['count']:,}"
+                )
+        self.stdout.write(self.style.SUCCESS("Dry run complete." if options["dry_run"] else "Compaction complete."))
+
+    async def _collection_stats(self, db):
+        stats = await db.command("collStats", "messages")
+        return {key: stats.get(key, 0) for key in ("size", "storageSize", "count")}
+
+    async def _compact(self, codec, options):
+        db = mongo.db
+        collection = db["messages"]
+        report = {"scanned": 0, "encoded": 0, "duplicates": 0, "bytes_before": 0, "bytes_after": 0,
+                  "stats_before": await self._collection_stats(db)}
+
+        batch = []
+        seen = set()
+        current_conversation = None
+        # Oldest first per conversation, so the first copy of a duplicate is the one kept
+        cursor = collection.find({}).sort([("conversation_id", 1), ("timestamp", 1)])
+        async for message in cursor:
+            report["scanned"] += 1
+            if message.get("conversation_id") != current_conversation or message.get("message_type") in LESSON_BOUNDARY_TYPES:
+                current_conversation = message.get("conversation_id")
+                seen = set()
+            if message.get("step_data") is None:
+                continue
+
+            if options["dedupe"]:
+                decoded = decode_message(message)
+                fingerprint = hashlib.sha1(json.dumps(
+                    [decoded.get("message_type"), decoded["step_data"]], sort_keys=True, default=str
+                ).encode("utf-8")).digest()
+                if fingerprint in seen:
+                    report["duplicates"] += 1
+                    report["bytes_before"] += len(bson.encode(message))
+                    batch.append(DeleteOne({"_id": message["_id"]}))
+                    continue
+                seen.add(fingerprint)
+
+            encoded = encode_message(message, codec=codec)
+            if encoded is not message:
+                report["encoded"] += 1
+                report["bytes_before"] += len(bson.encode(message))
+                report["bytes_after"] += len(bson.encode(encoded))
+                update = {"$set": {"step_data": encoded["step_data"]}}
+                for field in (CODEC_FIELD, CONTENT_FIELD):
+                    if field in encoded:
+                        update["$set"][field] = encoded[field]
+                batch.append(UpdateOne({"_id": message["_id"]}, update))
+
+            if len(batch) >= options["batch_size"]:
+                await self._flush(collection, batch, options["dry_run"])
+                batch = []
+        await self._flush(collection, batch, options["dry_run"])
+
+        if options["compact"] and not options["dry_run"]:
+            await db.command("compact", "messages")
+        report["stats_after"] = await self._collection_stats(db)
+        return report
+
+    async def _flush(self, collection, batch, dry_run):
+        if batch and not dry_run:
+            await collection.bulk_write(batch, ordered=False)
@@ -0,0 +1,19 @@
+# teacher_app/management/commands/ensure_indexes.py
+
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+
+from teacher_app import mongo
+
+
+class Command(BaseCommand):
+    help = "Create the MongoDB indexes declared in teacher_app.mongo.INDEXES (safe to re-run)."
+
+    def handle(self, *args, **options):
+        if not mongo.mongo_available():
+            raise CommandError("MongoDB is not available")
+        created = asyncio.run(mongo.ensure_indexes())
+        for collection_name, names in created.items():
+            self.stdout.write(f"{collection_name}: {', '.join(names)}")
+        self.stdout.write(self.style.SUCCESS("Indexes are in place."))
@@ -0,0 +1,51 @@
+# teacher_app/management/commands/export_conversations.py
+
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from teacher_app import mongo, portability
+
+
+class Command(BaseCommand):
+    help = (
+        "Write all of a user's conversations and messages to a gzip-compressed NDJSON file, "
+        "streaming from one joined cursor (constant memory). Load it with import_conversations. "
+        "The same export is served by GET api/conversations/export/?user_id=..."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", required=True, help="user_id whose conversations to export.")
+        parser.add_argument("--output", required=True, help="File to write (.ndjson.gz).")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Cursor batch size.")
+
+    def handle(self, *args, **options):
+        if not mongo.mongo_available():
+            raise CommandError("MongoDB is not available")
+        started = time.perf_counter()
+        counts, size = asyncio.run(export_to_file(mongo.db, options["user"], options["output"], options["batch_size"]))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Exported {counts['conversations']} conversations, {counts['messages']} messages "
+            f"({size / 1e6:.1f} MB) to {options['output']} in {elapsed:.1f}s"
+        ))
+
+
+async def export_to_file(db, user_id, path, batch_size=1000):
+    """Write the export of ``user_id`` to ``path``; returns ``(counts, bytes written)``."""
+    records = await portability.open_export(db, user_id, batch_size)
+    counts = {}
+
+    async def tracked():
+        async for record in records:
+            if "counts" in record:
+                counts.update(record["counts"])
+            yield record
+
+    size = 0
+    with open(path, "wb") as out:
+        async for chunk in portability.gzip_chunks(tracked()):
+            out.write(chunk)
+            size += len(chunk)
+    return counts, size
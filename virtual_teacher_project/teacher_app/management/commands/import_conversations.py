@@ -0,0 +1,39 @@
+# teacher_app/management/commands/import_conversations.py
+
+import asyncio
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from teacher_app import mongo, portability
+
+
+class Command(BaseCommand):
+    help = (
+        "Load a file written by export_conversations (or the export endpoint) with batched "
+        "insert_many, keeping every _id. Documents that already exist are skipped, so an "
+        "interrupted import can be re-run. Run build_lesson_snapshots afterwards to recreate "
+        "lesson snapshots."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--input", required=True, help="Export file (.ndjson.gz).")
+        parser.add_argument("--user", default=None, help="Assign the conversations to this user_id instead.")
+        parser.add_argument("--batch-size", type=int, default=1000, help="Documents per insert_many.")
+
+    def handle(self, *args, **options):
+        if not mongo.mongo_available():
+            raise CommandError("MongoDB is not available")
+        if options["batch_size"] < 1:
+            raise CommandError("--batch-size must be positive")
+        started = time.perf_counter()
+        try:
+            counts = asyncio.run(portability.import_records(
+                mongo.db, portability.read_export(options["input"]), options["batch_size"], options["user"]))
+        except portability.ExportFormatError as e:
+            raise CommandError(str(e))
+        elapsed = time.perf_counter() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {counts['conversations']} conversations, {counts['messages']} messages "
+            f"({counts['skipped']} already present) in {elapsed:.1f}s"
+        ))
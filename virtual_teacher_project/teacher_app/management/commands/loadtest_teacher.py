@@ -0,0 +1,115 @@
+# teacher_app/management/commands/loadtest_teacher.py
+
+import asyncio
+import json
+import os
+import platform
+from datetime import datetime
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.test import override_settings
+
+from teacher_app import loadtest
+
+
+class Command(BaseCommand):
+    help = (
+        "Drive N simulated lesson clients against ws/teacher/ at increasing concurrency "
+        "levels and write latency, frame-rate, CPU and RSS figures to a JSON report. "
+        "In-process mode forces the stub LLM and disables rate limits (all clients share one "
+        "address); for socket mode start the server with LLM_PROVIDER=stub RATE_LIMIT_ENABLED=0 "
+        "and pass its worker PIDs to sample CPU/RSS."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mode", choices=["inprocess", "socket"], default="inprocess")
+        parser.add_argument("--url", default="ws://127.0.0.1:8001/ws/teacher/",
+                            help="Server URL for socket mode.")
+        parser.add_argument("--concurrency", default="1,5,10,25,50",
+                            help="Comma-separated concurrency levels to sweep.")
+        parser.add_argument("--topic", default="Photosynthesis")
+        parser.add_argument("--timeout", type=float, default=60.0,
+                            help="Per-client timeout in seconds.")
+        parser.add_argument("--mongo", choices=["local", "none"], default="none",
+                            help="In-process mode: persist to the configured Mongo or disable persistence.")
+        parser.add_argument("--stub-tokens-per-second", type=float, default=None,
+                            help="In-process mode: stub LLM token rate (default: settings).")
+        parser.add_argument("--worker-pid", type=int, action="append", default=[],
+                            help="Socket mode: server worker PID to sample (repeatable).")
+        parser.add_argument("--output", default="loadtest_results.json")
+
+    def handle(self, *args, **options):
+        try:
+            levels = [int(c) for c in options["concurrency"].split(",") if c.strip()]
+        except ValueError:
+            raise CommandError("--concurrency must be a comma-separated list of integers")
+        if not levels or min(levels) < 1:
+            raise CommandError("--concurrency levels must be positive")
+
+        overrides = {"LLM_PROVIDER": "stub", "RATE_LIMIT_ENABLED": False}
+        if options["stub_tokens_per_second"] is not None:
+            overrides["LLM_STUB_TOKENS_PER_SECOND"] = options["stub_tokens_per_second"]
+
+        if options["mode"] == "inprocess":
+            with override_settings(**overrides):
+                sweep = asyncio.run(self._sweep_inprocess(levels, options))
+        else:
+            sweep = asyncio.run(self._sweep_socket(levels, options))
+
+        report = {
+            "created_at": datetime.utcnow().isoformat(),
+            "mode": options["mode"],
+            "topic": options["topic"],
+            "llm_provider": "stub" if options["mode"] == "inprocess" else "server-configured",
+            "llm_stub_tokens_per_second": overrides.get("LLM_STUB_TOKENS_PER_SECOND",
+                                                        getattr(settings, "LLM_STUB_TOKENS_PER_SECOND", 0)),
+            "mongo": options["mongo"] if options["mode"] == "inprocess" else "server-configured",
+            "python": platform.python_version(),
+            "cpu_count": os.cpu_count(),
+            "levels": sweep,
+        }
+        with open(options["output"], "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+
+        for level in sweep:
+            ttfs = level["time_to_first_step"]["p50"]
+            lesson = level["lesson_time"]
+            self.stdout.write(
+                f"c={level['concurrency']:>4}  ok={level['completed']:>4}  err={level['error_count']:>3}  "
+                f"ttfs_p50={_fmt(ttfs)}  lesson_p50={_fmt(lesson['p50'])}  p99={_fmt(lesson['p99'])}  "
+                f"fps={level['frames_per_second']}"
+            )
+        self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+
+    async def _sweep_inprocess(self, levels, options):
+        from channels.routing import URLRouter
+        from teacher_app import consumers, routing
+
+        if options["mongo"] == "none":
+            consumers.conversations = None
+            consumers.messages = None
+            consumers.lesson_snapshots = None
+
+        application = URLRouter(routing.websocket_urlpatterns)
+        results = []
+        for level in levels:
+            results.append(await loadtest.run_level(
+                lambda i: loadtest.run_inprocess_client(application, options["topic"], options["timeout"]),
+                level,
+            ))
+        return results
+
+    async def _sweep_socket(self, levels, options):
+        results = []
+        for level in levels:
+            results.append(await loadtest.run_level(
+                lambda i: loadtest.run_socket_client(options["url"], options["topic"], options["timeout"]),
+                level,
+                worker_pids=options["worker_pid"],
+            ))
+        return results
+
+
+def _fmt(seconds):
+    return "-" if seconds is None else f"{seconds * 1000:.0f}ms"
@@ -0,0 +1,31 @@
+# teacher_app/management/commands/rebuild_analytics.py
+
+import asyncio
+
+from django.core.management.base import BaseCommand, CommandError
+
+from teacher_app import mongo
+from teacher_app.analytics import rebuild_analytics
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute per-lesson analytics (attempts, average_score, completion_rate, ...) from "
+        "quizzes and progress with one aggregation that $merges into the analytics collection. "
+        "The API keeps them up to date incrementally; run this once for data written before that, "
+        "or to repair drift. Safe to re-run."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--lesson", action="append", dest="lessons", default=None,
+                            help="Only rebuild this lesson_id (repeatable).")
+
+    def handle(self, *args, **options):
+        if not mongo.mongo_available():
+            raise CommandError("MongoDB is not available")
+        written = asyncio.run(self._rebuild(options["lessons"]))
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt analytics for {written} lessons."))
+
+    async def _rebuild(self, lessons):
+        await mongo.ensure_indexes(mongo.db)  # $merge on lesson_id needs the unique "lesson" index
+        return await rebuild_analytics(mongo.db, lessons)
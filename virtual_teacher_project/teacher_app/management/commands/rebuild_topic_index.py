@@ -0,0 +1,33 @@
+# teacher_app/management/commands/rebuild_topic_index.py
+
+import asyncio
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from teacher_app import mongo
+from teacher_app.topic_index import rebuild_index
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the similar-topic index (the topic_index collection) from the conversations "
+        "that have a stored lesson. Needed once for lessons stored before the index existed, after "
+        "changing TOPIC_INDEX_SCOPE, or after an INDEX_VERSION bump. Running workers pick up the "
+        "rebuilt entries on their next refresh (TOPIC_INDEX_REFRESH_SECONDS) or restart."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000, help="Entries per bulk write.")
+
+    def handle(self, *args, **options):
+        if not mongo.mongo_available():
+            raise CommandError("MongoDB is not available")
+        user_scoped = getattr(settings, "TOPIC_INDEX_SCOPE", "global") == "user"
+        started = time.perf_counter()
+        read, written = asyncio.run(rebuild_index(mongo.db, user_scoped, options["batch_size"]))
+        self.stdout.write(self.style.SUCCESS(
+            f"Indexed {written} topics from {read} conversations "
+            f"({'per user' if user_scoped else 'global'}) in {time.perf_counter() - started:.1f}s."
+        ))
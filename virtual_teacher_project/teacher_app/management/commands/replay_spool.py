@@ -0,0 +1,46 @@
+# teacher_app/management/commands/replay_spool.py
+
+from collections import Counter
+
+from django.core.management.base import BaseCommand, CommandError
+from pymongo.errors import PyMongoError
+
+from teacher_app.spool import get_spool, read_records
+
+
+class Command(BaseCommand):
+    help = (
+        "Replay chat writes spooled locally during a MongoDB outage (the background replayer does "
+        "this automatically; use this to drain the spool by hand). Idempotent."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--dry-run", action="store_true",
+                            help="List pending segments and what they contain without writing.")
+
+    def handle(self, *args, **options):
+        spool = get_spool()
+        if spool is None:
+            raise CommandError("The spool is disabled (SPOOL_ENABLED)")
+
+        segments = spool.pending()
+        if options["dry_run"]:
+            for path in segments:
+                kinds = Counter(record.get("collection", record.get("op")) for record in read_records(path))
+                summary = ", ".join(f"{count} {kind}" for kind, count in sorted(kinds.items())) or "empty"
+                self.stdout.write(f"{path.name}: {summary}")
+            self.stdout.write(self.style.SUCCESS(f"{len(segments)} segments pending in {spool.directory}."))
+            return
+
+        try:
+            stats = spool.replay()
+        except PyMongoError as e:
+            raise CommandError(f"MongoDB is not available: {e}")
+        if stats["failed"]:
+            raise CommandError(
+                f"Replayed {stats['records']} records from {stats['segments']} segments, then a segment "
+                f"failed; {len(spool.pending())} segments left for the next run."
+            )
+        self.stdout.write(self.style.SUCCESS(
+            f"Replayed {stats['records']} records from {stats['segments']} segments."
+        ))
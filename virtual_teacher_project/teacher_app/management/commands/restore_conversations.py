@@ -0,0 +1,70 @@
+# teacher_app/management/commands/restore_conversations.py
+
+import asyncio
+
+from bson import ObjectId
+from django.core.management.base import BaseCommand, CommandError
+
+from teacher_app import mongo, retention
+
+
+class Command(BaseCommand):
+    help = (
+        "Restore archived conversations (with their messages and lesson snapshots) into the hot "
+        "collections, from segment files or from the archive collections. Idempotent."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--segment", action="append", default=[],
+                            help="Segment file written by archive_conversations (repeatable).")
+        parser.add_argument("--from-collection", action="store_true",
+                            help="Restore from the archive collections instead of segment files.")
+        parser.add_argument("--conversation", action="append", default=[],
+                            help="Only restore this conversation id (repeatable).")
+        parser.add_argument("--batch-size", type=int, default=200)
+
+    def handle(self, *args, **options):
+        if not mongo.mongo_available():
+            raise CommandError("MongoDB is not available")
+        if bool(options["segment"]) == options["from_collection"]:
+            raise CommandError("Pass either --segment FILE (repeatable) or --from-collection")
+        for conversation_id in options["conversation"]:
+            if not ObjectId.is_valid(conversation_id):
+                raise CommandError(f"Invalid conversation id: {conversation_id}")
+
+        counts = asyncio.run(self._restore(options))
+        self.stdout.write(self.style.SUCCESS(
+            f"Restored {counts['conversations']} conversations, {counts['messages']} messages, "
+            f"{counts['lesson_snapshots']} snapshots."
+        ))
+
+    async def _restore(self, options):
+        db = mongo.db
+        wanted = {ObjectId(c) for c in options["conversation"]}
+        totals = {"conversations": 0, **{name: 0 for name in retention.CONVERSATION_CHILDREN}}
+
+        async def restore(records):
+            for key, value in (await retention.restore_records(db, records)).items():
+                totals[key] += value
+
+        if options["from_collection"]:
+            while True:
+                records = await retention.load_archived_records(db, sorted(wanted) or None, options["batch_size"])
+                if not records:
+                    break
+                await restore(records)
+                await retention.delete_archived_records(db, records)
+            return totals
+
+        for path in options["segment"]:
+            batch = []
+            for record in retention.read_segment(path):
+                if wanted and record["conversation"]["_id"] not in wanted:
+                    continue
+                batch.append(record)
+                if len(batch) >= options["batch_size"]:
+                    await restore(batch)
+                    batch = []
+            if batch:
+                await restore(batch)
+        return totals
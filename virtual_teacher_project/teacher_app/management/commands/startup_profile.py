@@ -0,0 +1,167 @@
+# teacher_app/management/commands/startup_profile.py
+
+import asyncio
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from teacher_app import loadtest
+from teacher_app.startup import DEFERRED_IMPORTS
+
+# What a server worker imports before it can serve: the ASGI application module
+IMPORT_SCRIPT = (
+    "import time; started = time.perf_counter(); "
+    "import virtual_teacher_project.asgi; "
+    "print('ASGI_IMPORT_SECONDS', time.perf_counter() - started)"
+)
+
+
+def parse_importtime(stderr):
+    """``[(name, self_us, cumulative_us, depth)]`` from ``python -X importtime`` output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        self_us, cumulative_us, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((name.strip(), int(self_us), int(cumulative_us), depth))
+    return rows
+
+
+class Command(BaseCommand):
+    help = (
+        "Report the cold-start cost of a server worker: `python -X importtime` totals for importing "
+        "the ASGI application (by package, plus the slowest modules) and the time from starting "
+        "teacher_app.wsserver to its first accepted ws/teacher/ connection. Fails if a deferred "
+        "heavy dependency (teacher_app.startup.DEFERRED_IMPORTS) is imported at startup or a "
+        "budget is exceeded."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--runs", type=int, default=3, help="Cold starts to measure (medians are reported).")
+        parser.add_argument("--top", type=int, default=10, help="Packages and modules to list.")
+        parser.add_argument("--timeout", type=float, default=60.0, help="Seconds to wait for the server to accept.")
+        parser.add_argument("--skip-accept", action="store_true", help="Only measure imports.")
+        parser.add_argument("--import-budget-ms", type=float, default=None,
+                            help="Fail when the median ASGI import time exceeds this.")
+        parser.add_argument("--accept-budget-ms", type=float, default=None,
+                            help="Fail when the median time to first accepted connection exceeds this.")
+        parser.add_argument("--output", default=None, help="Also write the report to this JSON file.")
+
+    def handle(self, *args, **options):
+        if options["runs"] < 1:
+            raise CommandError("--runs must be positive")
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get(
+            "DJANGO_SETTINGS_MODULE", "virtual_teacher_project.settings"))
+
+        imports = [self._profile_imports(env) for _ in range(options["runs"])]
+        accepts = [] if options["skip_accept"] else [
+            self._time_to_accept(env, options["timeout"]) for _ in range(options["runs"])]
+
+        last = imports[-1]
+        report = {
+            "python": sys.version.split()[0],
+            "runs": options["runs"],
+            "asgi_import_ms": round(statistics.median(i["wall_ms"] for i in imports), 1),
+            "importtime_total_ms": round(statistics.median(i["total_ms"] for i in imports), 1),
+            "modules_imported": last["modules"],
+            "packages": last["packages"][:options["top"]],
+            "slowest_modules": last["slowest"][:options["top"]],
+            "deferred_imported_at_startup": last["deferred"],
+            "first_accept_ms": round(statistics.median(accepts), 1) if accepts else None,
+        }
+
+        self.stdout.write(f"ASGI application import: {report['asgi_import_ms']:.0f}ms wall, "
+                          f"{report['importtime_total_ms']:.0f}ms importtime total, "
+                          f"{report['modules_imported']} modules (median of {options['runs']})")
+        self.stdout.write("Self time by package:")
+        for name, ms in report["packages"]:
+            self.stdout.write(f"  {name:<40} {ms:>8.1f}ms")
+        self.stdout.write("Slowest modules (cumulative):")
+        for name, ms in report["slowest_modules"]:
+            self.stdout.write(f"  {name:<40} {ms:>8.1f}ms")
+        if accepts:
+            self.stdout.write(f"Time to first accepted connection: {report['first_accept_ms']:.0f}ms "
+                              f"(runs: {', '.join(f'{a:.0f}' for a in accepts)}ms)")
+
+        if options["output"]:
+            Path(options["output"]).write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+            self.stdout.write(f"Wrote {options['output']}")
+
+        failures = [f"{name} ({DEFERRED_IMPORTS[name]}) is imported at startup"
+                    for name in report["deferred_imported_at_startup"]]
+        budget = options["import_budget_ms"]
+        if budget is not None and report["asgi_import_ms"] > budget:
+            failures.append(f"ASGI import took {report['asgi_import_ms']:.0f}ms (budget {budget:.0f}ms)")
+        budget = options["accept_budget_ms"]
+        if budget is not None and accepts and report["first_accept_ms"] > budget:
+            failures.append(f"first accept took {report['first_accept_ms']:.0f}ms (budget {budget:.0f}ms)")
+        if failures:
+            raise CommandError("; ".join(failures))
+        self.stdout.write(self.style.SUCCESS("Startup within budget."))
+
+    def _profile_imports(self, env):
+        proc = subprocess.run([sys.executable, "-X", "importtime", "-c", IMPORT_SCRIPT],
+                              cwd=settings.BASE_DIR, env=env, capture_output=True, text=True)
+        wall = next((line.split()[1] for line in proc.stdout.splitlines()
+                     if line.startswith("ASGI_IMPORT_SECONDS")), None)
+        if proc.returncode != 0 or wall is None:
+            raise CommandError(f"Importing the ASGI application failed:\n{proc.stderr[-2000:]}")
+        rows = parse_importtime(proc.stderr)
+        packages = {}
+        for name, self_us, _, _ in rows:
+            root = name.split(".")[0]
+            packages[root] = packages.get(root, 0) + self_us
+        return {
+            "wall_ms": float(wall) * 1000,
+            "total_ms": sum(self_us for _, self_us, _, _ in rows) / 1000,
+            "modules": len(rows),
+            "packages": [(name, round(us / 1000, 1))
+                         for name, us in sorted(packages.items(), key=lambda item: -item[1])],
+            "slowest": [(name, round(cumulative / 1000, 1))
+                        for name, _, cumulative, depth in sorted(rows, key=lambda row: -row[2]) if depth <= 1],
+            "deferred": sorted({name for name, _, _, _ in rows if name in DEFERRED_IMPORTS}),
+        }
+
+    def _time_to_accept(self, env, timeout):
+        with socket.socket() as sock:
+            sock.bind(("127.0.0.1", 0))
+            port = sock.getsockname()[1]
+        url = f"ws://127.0.0.1:{port}/ws/teacher/"
+        started = time.perf_counter()
+        proc = subprocess.Popen(
+            [sys.executable, "-m", "teacher_app.wsserver", "-b", "127.0.0.1", "-p", str(port),
+             "virtual_teacher_project.asgi:application"],
+            cwd=settings.BASE_DIR, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            return asyncio.run(self._wait_for_accept(url, proc, started, timeout))
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(5)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+
+    async def _wait_for_accept(self, url, proc, started, timeout):
+        while time.perf_counter() - started < timeout:
+            if proc.poll() is not None:
+                raise CommandError(f"Server exited with code {proc.returncode} before accepting")
+            try:
+                ws = await loadtest.RawWebSocket.connect(url)
+            except OSError:
+                await asyncio.sleep(0.01)
+                continue
+            try:
+                await asyncio.wait_for(ws.recv(), timeout)  # the "Connected!" status frame
+            finally:
+                await ws.close()
+            return (time.perf_counter() - started) * 1000
+        raise CommandError(f"Server did not accept a connection within {timeout:.0f}s")
@@ -0,0 +1,114 @@
+# teacher_app/metrics.py
+
+import threading
+
+# In-process metrics, rendered in the Prometheus text format by the api/metrics/ view.
+# Values are per server process.
+
+_lock = threading.Lock()
+_registry = {}
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help_text = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def value(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def remove(self, **labels):
+        """Forget one label set (e.g. a per-connection series when the connection closes)."""
+        key = self._key(labels)
+        with _lock:
+            self._values.pop(key, None)
+
+    def samples(self):
+        with _lock:
+            return sorted(self._values.items())
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with _lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+
+def _register(metric):
+    with _lock:
+        existing = _registry.get(metric.name)
+        if existing is not None:
+            if type(existing) is not type(metric) or existing.labelnames != metric.labelnames:
+                raise ValueError(f"Metric {metric.name} already registered with a different type or labels")
+            return existing
+        _registry[metric.name] = metric
+        return metric
+
+
+def counter(name, help_text, labelnames=()):
+    """Return the counter called ``name``, registering it on first use."""
+    return _register(Counter(name, help_text, labelnames))
+
+
+def gauge(name, help_text, labelnames=()):
+    """Return the gauge called ``name``, registering it on first use."""
+    return _register(Gauge(name, help_text, labelnames))
+
+
+def _format_labels(labelnames, key):
+    if not labelnames:
+        return ""
+    pairs = ",".join(
+        '{}="{}"'.format(name, value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in zip(labelnames, key)
+    )
+    return "{" + pairs + "}"
+
+
+def render():
+    """Render every registered metric in the Prometheus text exposition format."""
+    with _lock:
+        metrics = sorted(_registry.values(), key=lambda m: m.name)
+    lines = []
+    for metric in metrics:
+        lines.append(f"# HELP {metric.name} {metric.help_text}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        for key, value in metric.samples():
+            lines.append(f"{metric.name}{_format_labels(metric.labelnames, key)} {value}")
+    return "\n".join(lines) + "\n"
+
+
+def snapshot():
+    """``{name: {label-tuple: value}}`` for every registered metric (used by benchmarks and reports)."""
+    with _lock:
+        metrics = list(_registry.values())
+    return {metric.name: dict(metric.samples()) for metric in metrics}
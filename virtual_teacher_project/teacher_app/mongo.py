@@ -1,18 +1,14 @@
 # teacher_app/mongo.py
-import motor.motor_asyncio
 from django.conf import settings
 from datetime import datetime
+from bson import ObjectId
+from pymongo import ASCENDING, DESCENDING, TEXT, IndexModel
+from .layout import ensure_layout
+from .mongo_client import LazyDatabase, MongoUnavailable, get_client, mongo_available
 
-# MongoDB connection with error handling
-try:
-    client = motor.motor_asyncio.AsyncIOMotorClient(settings.MONGO_DB_URI)
-    db = client[settings.MONGO_DB_NAME]
-    print(f"MongoDB connected to: {settings.MONGO_DB_NAME}")
-except Exception as e:
-    print(f"MongoDB connection failed: {e}")
-    print("Chat history features will be disabled.")
-    db = None
-    client = None
+# MongoDB connection: the client is created lazily (per event loop) on first use and every
+# operation goes through a circuit breaker, see mongo_client.py
+db = LazyDatabase()
 
 # ---------------- Document Structures ----------------
 def create_student(name, email, password_hash):
@@ -32,10 +28,15 @@ def create_lesson(student_id, pdf_data, llm_output, topic):
         "created_at": datetime.utcnow()
     }
 
+def lesson_key(lesson_id):
+    """lesson_id as stored in quizzes, progress and analytics: always a string, so an id posted
+    as a JSON number matches the one in api/lessons/<lesson_id>/analytics/."""
+    return None if lesson_id is None else str(lesson_id)
+
 def create_quiz(student_id, lesson_id, questions, score, time_taken):
     return {
         "student_id": student_id,
-        "lesson_id": lesson_id,
+        "lesson_id": lesson_key(lesson_id),
         "questions": questions,       # [{"question":..., "options":[..], "answer":"A"}]
         "score": score,
         "time_taken": time_taken,     # e.g. seconds or "5m 30s"
@@ -45,19 +46,22 @@ def create_quiz(student_id, lesson_id, questions, score, time_taken):
 def create_progress(student_id, lesson_id, completed_steps, total_steps, score):
     return {
         "student_id": student_id,
-        "lesson_id": lesson_id,
+        "lesson_id": lesson_key(lesson_id),
         "completed_steps": completed_steps,
         "total_steps": total_steps,
         "score": score,
         "updated_at": datetime.utcnow()
     }
 
-def create_analytics(lesson_id, average_score, completion_rate, attempts):
+def create_analytics(lesson_id, average_score, completion_rate, attempts, score_total=0, learners=0, completed=0):
     return {
         "lesson_id": lesson_id,
-        "average_score": average_score,
-        "completion_rate": completion_rate,
-        "attempts": attempts,
+        "average_score": average_score,      # score_total / attempts
+        "completion_rate": completion_rate,  # completed / learners
+        "attempts": attempts,                # quiz submissions
+        "score_total": score_total,
+        "learners": learners,                # students with a progress record
+        "completed": completed,              # ... that finished every step
         "calculated_at": datetime.utcnow()
     }
 
@@ -86,22 +90,214 @@ def create_message(conversation_id, sender, content, message_type="text", step_d
     return message
 
 def create_conversation(user_id, title, topic=None, pdf_filename=None):
+    now = datetime.utcnow()
     return {
         "user_id": user_id,
         "title": title,
         "topic": topic,
         "pdf_filename": pdf_filename,
-        "created_at": datetime.utcnow(),
-        "updated_at": datetime.utcnow(),
-        "is_active": True
+        "created_at": now,
+        "updated_at": now,
+        "is_active": True,
+        # Sidebar summary, maintained by conversation_activity_update()
+        "message_count": 0,
+        "lesson_step_count": 0,
+        "last_message_preview": None,
+        "last_activity_at": now
     }
 
-def create_message(conversation_id, sender, content, message_type="text", step_data=None):
+def create_message(conversation_id, sender, content, message_type="text", step_data=None, user_id=None):
     return {
         "conversation_id": conversation_id,
+        "user_id": user_id,  # the conversation's owner, for per-user search (search.py)
         "sender": sender,  # "user" or "ai"
         "content": content,
         "message_type": message_type,  # "text", "lesson_step", "quiz", "notes"
         "step_data": step_data,  # For storing lesson step JSON data
         "timestamp": datetime.utcnow()
     }
+
+# Characters of the latest message kept on the conversation for the sidebar
+PREVIEW_LENGTH = 120
+# Message types written for a generated lesson (see TeacherConsumer.store_lesson_steps)
+STEP_MESSAGE_TYPES = ("teaching_step", "lesson_step")
+
+def message_preview(content):
+    text = " ".join(str(content or "").split())
+    return text if len(text) <= PREVIEW_LENGTH else text[:PREVIEW_LENGTH - 3].rstrip() + "..."
+
+def conversation_activity_update(message_docs):
+    """``$inc``/``$set`` update that folds newly inserted messages into the conversation summary."""
+    last = message_docs[-1]
+    timestamp = last.get("timestamp") or datetime.utcnow()
+    return {
+        "$inc": {
+            "message_count": len(message_docs),
+            "lesson_step_count": sum(1 for m in message_docs if m.get("message_type") in STEP_MESSAGE_TYPES),
+        },
+        "$set": {
+            "last_message_preview": message_preview(last.get("content")),
+            "last_activity_at": timestamp,
+            "updated_at": timestamp,
+        },
+    }
+
+def conversation_summary_pipeline(conversation_ids=None):
+    """Aggregation over messages that recomputes the conversation summary fields from scratch."""
+    pipeline = [{"$match": {"conversation_id": {"$in": list(conversation_ids)}}}] if conversation_ids is not None else []
+    return pipeline + [
+        {"$sort": {"conversation_id": 1, "timestamp": 1}},
+        {"$group": {
+            "_id": "$conversation_id",
+            "message_count": {"$sum": 1},
+            "lesson_step_count": {"$sum": {"$cond": [{"$in": ["$message_type", list(STEP_MESSAGE_TYPES)]}, 1, 0]}},
+            "last_content": {"$last": "$content"},
+            "last_activity_at": {"$last": "$timestamp"},
+        }},
+    ]
+
+def conversation_summary_set(summary):
+    """``$set`` document for one result of ``conversation_summary_pipeline``."""
+    return {
+        "message_count": summary["message_count"],
+        "lesson_step_count": summary["lesson_step_count"],
+        "last_message_preview": message_preview(summary["last_content"]),
+        "last_activity_at": summary["last_activity_at"],
+    }
+
+# Fields the sidebar needs. The listing walks the "sidebar" index in updated_at order and fetches
+# only the user's active conversations; covering it would put every title and preview in the index.
+SIDEBAR_PROJECTION = {
+    "_id": 1, "title": 1, "topic": 1, "updated_at": 1,
+    "message_count": 1, "lesson_step_count": 1, "last_message_preview": 1, "last_activity_at": 1,
+}
+
+def create_lesson_snapshot(conversation_id, user_id, title, topic, steps, notes_and_quiz=None,
+                           first_step_message_id=None, source="live", layout_version=None):
+    """Lesson snapshot document; steps not laid out yet (``layout_version`` None) are laid out here."""
+    return ensure_layout({
+        "conversation_id": conversation_id,
+        "user_id": user_id,
+        "title": title,
+        "topic": topic,
+        "steps": steps,  # ordered teaching steps, exactly as sent in lesson_ready
+        "total_steps": len(steps),
+        "notes_and_quiz": notes_and_quiz,
+        "first_step_message_id": first_step_message_id,  # links the snapshot to its per-step messages
+        "source": source,  # "live", "batch" or "migration"
+        "schema_version": 1,
+        "layout_version": layout_version,  # see layout.py
+        "duration_ms": steps[-1].get("end_ms", 0) if steps else 0,
+        "created_at": datetime.utcnow()
+    })
+
+def create_batch_job(user_id, name, total):
+    """Batch generation job (batch.py); its progress is counted from its items (batch.item_counts)."""
+    return {
+        "user_id": user_id,
+        "name": name,
+        "status": "queued",  # "queued", "running", "finished"
+        "total": total,
+        "created_at": datetime.utcnow(),
+        "started_at": None,
+        "finished_at": None
+    }
+
+def create_batch_item(job_id, seq, user_id, topic=None, pdf_filename=None, pdf_text=None):
+    """One lesson of a batch job; its conversation id is chosen up front so a retry overwrites
+    the lesson instead of storing a second copy."""
+    now = datetime.utcnow()
+    return {
+        "job_id": job_id,
+        "seq": seq,
+        "user_id": user_id,
+        "topic": topic,
+        "pdf_filename": pdf_filename,
+        "pdf_text": pdf_text,
+        "conversation_id": ObjectId(),
+        "status": "queued",  # "queued", "running", "done", "failed"
+        "available_at": now,  # claimable from (the lease expiry while running, the backoff after a failure)
+        "worker_id": None,
+        "attempts": 0,
+        "error": None,
+        "generation_ms": None,
+        "created_at": now,
+        "finished_at": None
+    }
+
+# ---------------- Indexes ----------------
+# Indexes each collection relies on; created by `python manage.py ensure_indexes`
+# Soft-deleted documents (deleted_at set) are purged by TTL indexes after this many seconds
+DELETED_TTL_SECONDS = int(getattr(settings, "RETENTION_DELETED_TTL_DAYS", 30) * 86400)
+
+def _deleted_ttl_index():
+    return IndexModel([("deleted_at", ASCENDING)], name="deleted_ttl", expireAfterSeconds=DELETED_TTL_SECONDS)
+
+INDEXES = {
+    "conversations": [
+        IndexModel([("user_id", ASCENDING), ("is_active", ASCENDING), ("updated_at", DESCENDING)], name="sidebar"),
+        _deleted_ttl_index(),
+        # retention.stale_conversations_query(): both $or branches are ranges on this prefix
+        IndexModel([("last_activity_at", ASCENDING), ("updated_at", ASCENDING)], name="stale"),
+        # Full-text search (search.py); user_id is an equality prefix, so a search only walks one user's keys
+        IndexModel([("user_id", ASCENDING), ("title", TEXT), ("topic", TEXT)], name="search",
+                   weights={"title": 10, "topic": 5}, default_language="english"),
+    ],
+    "messages": [
+        IndexModel([("conversation_id", ASCENDING), ("timestamp", ASCENDING)], name="conversation_timeline"),
+        _deleted_ttl_index(),
+        IndexModel([("user_id", ASCENDING), ("content", TEXT)], name="search", default_language="english"),
+    ],
+    "progress": [
+        # One record per student and lesson; analytics.save_progress() counts learners by it
+        IndexModel([("lesson_id", ASCENDING), ("student_id", ASCENDING)], name="lesson_student", unique=True),
+    ],
+    "analytics": [
+        IndexModel([("lesson_id", ASCENDING)], name="lesson", unique=True),
+    ],
+    "lesson_snapshots": [
+        IndexModel([("conversation_id", ASCENDING), ("created_at", DESCENDING)], name="conversation_latest"),
+        IndexModel([("first_step_message_id", ASCENDING)], name="first_step_message", unique=True,
+                   partialFilterExpression={"first_step_message_id": {"$type": "objectId"}}),
+        _deleted_ttl_index(),
+    ],
+    "batch_jobs": [
+        IndexModel([("user_id", ASCENDING), ("created_at", DESCENDING)], name="user_recent"),
+    ],
+    "batch_items": [
+        # batch.claim_item(): queued items and expired leases, oldest first
+        IndexModel([("status", ASCENDING), ("available_at", ASCENDING)], name="claim"),
+        IndexModel([("job_id", ASCENDING), ("seq", ASCENDING)], name="job_items", unique=True),
+    ],
+    "topic_index": [
+        # topic_index.load_index() reads entries of the current version changed since its last load
+        IndexModel([("version", ASCENDING), ("updated_at", ASCENDING)], name="version_updated"),
+    ],
+}
+
+async def ensure_indexes(database=None):
+    """Create every index in ``INDEXES``; returns ``{collection: [index names]}``."""
+    database = db if database is None else database
+    created = {}
+    for collection_name, models in INDEXES.items():
+        collection = database[collection_name]
+        await _drop_changed_keys(collection, models)
+        for model in models:
+            ttl = model.document.get("expireAfterSeconds")
+            if ttl is not None:
+                await _update_ttl(database, collection, model.document["name"], ttl)
+        created[collection_name] = await collection.create_indexes(models)
+    return created
+
+async def _drop_changed_keys(collection, models):
+    """Drop existing indexes whose keys no longer match their model (create_indexes would conflict)."""
+    keys = {model.document["name"]: list(model.document["key"].items()) for model in models}
+    async for index in collection.list_indexes():
+        if index["name"] in keys and list(index["key"].items()) != keys[index["name"]]:
+            await collection.drop_index(index["name"])
+
+async def _update_ttl(database, collection, name, ttl):
+    """Apply a changed TTL to an existing index in place (create_indexes would conflict)."""
+    async for index in collection.list_indexes():
+        if index["name"] == name and index.get("expireAfterSeconds") != ttl:
+            await database.command("collMod", collection.name, index={"name": name, "expireAfterSeconds": ttl})
@@ -0,0 +1,338 @@
+# teacher_app/mongo_client.py
+
+import asyncio
+import threading
+import inspect
+import time
+
+import pymongo
+from django.conf import settings
+from pymongo.errors import ConnectionFailure, PyMongoError
+
+from . import metrics
+
+breaker_state = metrics.gauge(
+    "mongo_circuit_state", "MongoDB circuit breaker state (0 closed, 1 half-open, 2 open)", ["breaker"])
+breaker_transitions = metrics.counter(
+    "mongo_circuit_transitions_total", "MongoDB circuit breaker state changes", ["breaker", "state"])
+breaker_rejections = metrics.counter(
+    "mongo_circuit_rejections_total", "MongoDB operations refused while the circuit was open", ["breaker"])
+operation_failures = metrics.counter(
+    "mongo_operation_failures_total", "MongoDB operations that failed with a connection error", ["breaker"])
+probe_last_success = metrics.gauge(
+    "mongo_health_probe_last_success_timestamp", "Unix time of the last successful MongoDB ping", ["breaker"])
+
+
+class MongoUnavailable(ConnectionFailure):
+    """Raised immediately, without network I/O, while the circuit breaker is open."""
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker.
+
+    Closed: calls go through. After ``failure_threshold`` consecutive connection failures it
+    opens and calls fail fast. After ``reset_timeout`` seconds it goes half-open and lets one
+    trial call through; success (or a successful health probe) closes it again.
+    """
+    CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+    _STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(self, name, failure_threshold=3, reset_timeout=10.0, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        breaker_state.set(0, breaker=name)
+
+    @property
+    def state(self):
+        with self._lock:
+            self._maybe_half_open()
+            return self._state
+
+    def available(self):
+        """True unless the circuit is open (does not use up the half-open trial)."""
+        return self.state != self.OPEN
+
+    def allow(self):
+        """Return True if a call may proceed; in half-open state only one trial call at a time."""
+        with self._lock:
+            self._maybe_half_open()
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+        breaker_rejections.inc(breaker=self.name)
+        return False
+
+    def record_success(self):
+        with self._lock:
+            self._failures = 0
+            self._trial_in_flight = False
+            if self._state != self.CLOSED:
+                self._transition(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            self._trial_in_flight = False
+            if self._state == self.HALF_OPEN or (self._state == self.CLOSED and self._failures >= self.failure_threshold):
+                self._opened_at = self._clock()
+                self._transition(self.OPEN)
+            elif self._state == self.OPEN:
+                self._opened_at = self._clock()
+
+    def release_trial(self):
+        """Give back a half-open trial whose outcome is unknown (e.g. the call was cancelled)."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def _maybe_half_open(self):
+        if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+            self._transition(self.HALF_OPEN)
+
+    def _transition(self, state):
+        print(f"DEBUG: MongoDB circuit '{self.name}' {self._state} -> {state}")
+        self._state = state
+        breaker_state.set(self._STATE_VALUES[state], breaker=self.name)
+        breaker_transitions.inc(breaker=self.name, state=state)
+
+
+breaker = CircuitBreaker(
+    "mongo",
+    failure_threshold=getattr(settings, "MONGO_BREAKER_FAILURE_THRESHOLD", 3),
+    reset_timeout=getattr(settings, "MONGO_BREAKER_RESET_SECONDS", 10.0),
+)
+
+
+def mongo_available():
+    """Cheap check used to skip persistence entirely while MongoDB is known to be down."""
+    return breaker.available()
+
+
+def client_options():
+    return {
+        "maxPoolSize": getattr(settings, "MONGO_MAX_POOL_SIZE", 50),
+        "minPoolSize": getattr(settings, "MONGO_MIN_POOL_SIZE", 0),
+        "serverSelectionTimeoutMS": getattr(settings, "MONGO_SERVER_SELECTION_TIMEOUT_MS", 2000),
+        "connectTimeoutMS": getattr(settings, "MONGO_CONNECT_TIMEOUT_MS", 2000),
+        "socketTimeoutMS": getattr(settings, "MONGO_SOCKET_TIMEOUT_MS", 20000),
+    }
+
+
+# One Motor client per event loop: Motor binds a client to the loop it first runs on, and
+# the function views run each request on a fresh loop. The client holds its loop, so it
+# cannot be keyed weakly; instead the clients of closed loops are closed and dropped on the
+# next get_client() call.
+_clients = {}
+_default_client = None
+_clients_lock = threading.Lock()
+
+
+def _new_client(loop):
+    import motor.motor_asyncio  # on first use: Motor adds ~0.15 s to worker start (see startup.py)
+
+    client = motor.motor_asyncio.AsyncIOMotorClient(settings.MONGO_DB_URI, io_loop=loop, **client_options())
+    start_health_probe()
+    return client
+
+
+def _evict_closed_loops():
+    for loop in [loop for loop in _clients if loop.is_closed()]:
+        _clients.pop(loop).close()
+
+
+def get_client():
+    """Return the Motor client for the running event loop, creating it on first use."""
+    global _default_client
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        loop = None
+    with _clients_lock:
+        _evict_closed_loops()
+        if loop is None:
+            if _default_client is None:
+                _default_client = _new_client(None)
+            return _default_client
+        client = _clients.get(loop)
+        if client is None:
+            client = _clients[loop] = _new_client(loop)
+        return client
+
+
+def get_database():
+    return get_client()[settings.MONGO_DB_NAME]
+
+
+# Methods that return a cursor synchronously (I/O happens on iteration)
+_CURSOR_METHODS = frozenset({"find", "aggregate", "list_indexes", "watch", "find_raw_batches",
+                             "aggregate_raw_batches", "list_collections"})
+
+
+async def _tracked(awaitable):
+    # Any outcome other than a server answer or a connection failure (cancellation, a bug in the
+    # caller) gives back the half-open trial in the finally, so the breaker cannot stay stuck
+    outcome = breaker.release_trial
+    try:
+        result = await awaitable
+    except StopAsyncIteration:
+        outcome = breaker.record_success  # the server answered: the cursor is exhausted
+        raise
+    except ConnectionFailure:
+        operation_failures.inc(breaker=breaker.name)
+        outcome = breaker.record_failure
+        raise
+    except PyMongoError:
+        outcome = breaker.record_success  # the server answered
+        raise
+    else:
+        outcome = breaker.record_success
+        return result
+    finally:
+        outcome()
+
+
+class TrackedCursor:
+    """Proxy for a Motor cursor (or change stream) whose I/O -- iteration, ``to_list`` and the
+    other awaitable methods -- goes through the circuit breaker like any other operation."""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, attr):
+        target = getattr(self._cursor, attr)
+        if not callable(target) or attr.startswith("_"):
+            return target
+
+        def call(*args, **kwargs):
+            result = target(*args, **kwargs)
+            if result is self._cursor:  # chained: sort(), limit(), skip(), ...
+                return self
+            return _tracked(result) if inspect.isawaitable(result) else result
+        return call
+
+    def __aiter__(self):
+        return self
+
+    def __anext__(self):
+        return _tracked(self._cursor.__anext__())
+
+    async def __aenter__(self):
+        await _tracked(self._cursor.__aenter__())
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return await self._cursor.__aexit__(exc_type, exc_val, exc_tb)
+
+    def __repr__(self):
+        return f"<TrackedCursor {self._cursor!r}>"
+
+
+async def _guarded(method, label, args, kwargs):
+    # The breaker is asked only once the call runs: a coroutine that is never awaited, or is
+    # cancelled before it starts, never takes the half-open trial
+    if not breaker.allow():
+        raise MongoUnavailable(f"MongoDB circuit is open; skipped {label}")
+    try:
+        awaitable = method(*args, **kwargs)
+    except BaseException:
+        breaker.release_trial()
+        raise
+    return await _tracked(awaitable)
+
+
+def _guard(method, label, cursor):
+    def call(*args, **kwargs):
+        if cursor:
+            if not breaker.available():
+                breaker_rejections.inc(breaker=breaker.name)
+                raise MongoUnavailable(f"MongoDB circuit is open; skipped {label}")
+            return TrackedCursor(method(*args, **kwargs))
+        return _guarded(method, label, args, kwargs)
+    return call
+
+
+class LazyCollection:
+    """Stand-in for a Motor collection that resolves the per-loop client on each use and
+    routes operations through the circuit breaker."""
+
+    def __init__(self, name):
+        self.name = name
+
+    def __getattr__(self, attr):
+        target = getattr(get_database()[self.name], attr)
+        if not callable(target) or attr.startswith("_"):
+            return target
+        return _guard(target, f"{self.name}.{attr}", attr in _CURSOR_METHODS)
+
+    def __repr__(self):
+        return f"<LazyCollection {self.name}>"
+
+
+class LazyDatabase:
+    """Stand-in for the Motor database; ``db[name]`` returns a LazyCollection."""
+
+    def __init__(self):
+        self._collections = {}
+
+    @property
+    def name(self):
+        return settings.MONGO_DB_NAME
+
+    def __getitem__(self, name):
+        collection = self._collections.get(name)
+        if collection is None:
+            collection = self._collections[name] = LazyCollection(name)
+        return collection
+
+    def __getattr__(self, attr):
+        target = getattr(get_database(), attr)
+        if not callable(target) or attr.startswith("_"):
+            return target
+        return _guard(target, f"db.{attr}", attr in _CURSOR_METHODS)
+
+    def __repr__(self):
+        return f"<LazyDatabase {self.name}>"
+
+
+_probe_thread = None
+
+
+def _probe_loop(interval, stop):
+    probe = pymongo.MongoClient(
+        settings.MONGO_DB_URI,
+        serverSelectionTimeoutMS=getattr(settings, "MONGO_HEALTH_PROBE_TIMEOUT_MS", 1000),
+        connectTimeoutMS=getattr(settings, "MONGO_HEALTH_PROBE_TIMEOUT_MS", 1000),
+        maxPoolSize=1,
+    )
+    while True:
+        try:
+            probe.admin.command("ping")
+        except PyMongoError as e:
+            if breaker.available():
+                print(f"DEBUG: MongoDB health probe failed: {str(e).split(',')[0]}")
+            breaker.record_failure()
+        else:
+            probe_last_success.set(time.time(), breaker=breaker.name)
+            breaker.record_success()
+        if stop.wait(interval):
+            break
+
+
+def start_health_probe():
+    """Start the background ping thread (once per process) unless MONGO_HEALTH_PROBE_INTERVAL is 0."""
+    global _probe_thread
+    interval = getattr(settings, "MONGO_HEALTH_PROBE_INTERVAL", 5.0)
+    if _probe_thread is not None or not interval:
+        return
+    stop = threading.Event()
+    _probe_thread = threading.Thread(target=_probe_loop, args=(interval, stop), name="mongo-health-probe", daemon=True)
+    _probe_thread.stop = stop
+    _probe_thread.start()
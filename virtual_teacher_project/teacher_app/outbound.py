@@ -0,0 +1,140 @@
+# teacher_app/outbound.py
+
+import asyncio
+from collections import deque
+
+from django.conf import settings
+
+from . import metrics
+
+queue_depth = metrics.gauge(
+    "ws_outbound_queue_depth", "Frames waiting in a connection's outbound queue", ["connection"])
+queue_high_water = metrics.gauge(
+    "ws_outbound_queue_high_water", "Deepest a connection's outbound queue has been", ["connection"])
+frames_coalesced = metrics.counter(
+    "ws_outbound_frames_coalesced_total", "Queued frames replaced by a newer frame of the same kind", ["type"])
+frames_dropped = metrics.counter(
+    "ws_outbound_frames_dropped_total", "Frames dropped because a connection's outbound queue was full", ["type"])
+backpressure_closes = metrics.counter(
+    "ws_outbound_backpressure_closes_total", "Connections closed because their outbound queue overflowed")
+
+# Frames that only carry the latest state: a queued one is replaced by a newer one of the same type
+COALESCE_TYPES = frozenset({"generation_progress", "playback_sync"})
+# Frames a slow client can lose without missing lesson content
+DROPPABLE_TYPES = frozenset({"generation_progress", "playback_sync", "status"})
+# Close code sent when the client cannot keep up (it may reconnect and resume, see sessions.py)
+BACKPRESSURE_CLOSE_CODE = 4008
+
+_CLOSE = object()
+
+
+class OutboundQueue:
+    """Bounded per-connection send queue drained by its own task.
+
+    Producers (the generation loop, session and classroom fan-out) call ``put`` with
+    already-serialized text and never wait on the network. When the queue holds
+    ``max_frames`` frames the overflow policy applies: ``"drop"`` drops droppable frames
+    (the incoming one, or the oldest queued one to make room for lesson content) and closes
+    only if nothing can be dropped; ``"close"`` closes the connection with
+    ``BACKPRESSURE_CLOSE_CODE`` straight away.
+    """
+
+    def __init__(self, send, close, label, max_frames=None, policy=None):
+        self._send = send    # async (text) -> None
+        self._close = close  # async (code) -> None
+        self.label = label
+        self.max_frames = max_frames or getattr(settings, "OUTBOUND_QUEUE_MAX_FRAMES", 64)
+        self.policy = policy or getattr(settings, "OUTBOUND_OVERFLOW_POLICY", "drop")
+        self._queue = deque()
+        self._pending = {}  # frame type -> queued entry that a newer frame of that type replaces
+        self._wakeup = asyncio.Event()
+        self._high_water = 0
+        self.closed = False
+        self._task = asyncio.ensure_future(self._run())
+
+    def __len__(self):
+        return len(self._queue)
+
+    def put(self, text, frame_type=None):
+        """Queue a frame; returns False if it was dropped or the connection is closing."""
+        if self.closed:
+            return False
+        pending = self._pending.get(frame_type)
+        if pending is not None:
+            pending[1] = text
+            frames_coalesced.inc(type=frame_type)
+            return True
+        if len(self._queue) >= self.max_frames and not self._make_room(frame_type):
+            return False
+        entry = [frame_type, text]
+        self._queue.append(entry)
+        if frame_type in COALESCE_TYPES:
+            self._pending[frame_type] = entry
+        self._changed()
+        return True
+
+    def close(self, code=None):
+        """Send what is queued, then close the connection."""
+        if not self.closed:
+            self._queue.append([_CLOSE, code])
+            self.closed = True
+            self._changed()
+
+    def stop(self):
+        """The connection is gone: discard queued frames and end the sender task."""
+        self.closed = True
+        self._queue.clear()
+        self._pending.clear()
+        self._task.cancel()
+        queue_depth.remove(connection=self.label)
+        queue_high_water.remove(connection=self.label)
+
+    def _make_room(self, frame_type):
+        if self.policy == "drop":
+            if frame_type in DROPPABLE_TYPES:
+                frames_dropped.inc(type=frame_type)
+                return False
+            for i, entry in enumerate(self._queue):
+                if entry[0] in DROPPABLE_TYPES:
+                    del self._queue[i]
+                    self._forget(entry)
+                    frames_dropped.inc(type=entry[0])
+                    return True
+        print(f"DEBUG: Outbound queue of {self.label} overflowed ({len(self._queue)} frames), closing")
+        backpressure_closes.inc()
+        self._queue.clear()
+        self._pending.clear()
+        self.close(BACKPRESSURE_CLOSE_CODE)
+        return False
+
+    def _forget(self, entry):
+        if self._pending.get(entry[0]) is entry:
+            del self._pending[entry[0]]
+
+    def _changed(self):
+        depth = len(self._queue)
+        queue_depth.set(depth, connection=self.label)
+        if depth > self._high_water:
+            self._high_water = depth
+            queue_high_water.set(depth, connection=self.label)
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            while not self._queue:
+                self._wakeup.clear()
+                await self._wakeup.wait()
+            entry = self._queue.popleft()
+            self._forget(entry)
+            queue_depth.set(len(self._queue), connection=self.label)
+            try:
+                if entry[0] is _CLOSE:
+                    await self._close(entry[1])
+                    return
+                await self._send(entry[1])
+            except Exception as e:
+                print(f"DEBUG: Outbound send to {self.label} failed: {e}")
+                self.closed = True
+                self._queue.clear()
+                self._pending.clear()
+                return
@@ -0,0 +1,179 @@
+# teacher_app/portability.py
+
+import gzip
+import zlib
+from datetime import datetime
+
+from bson import json_util
+from pymongo.errors import BulkWriteError
+
+# A user export is gzip-compressed NDJSON, one document per line, in this order:
+#
+#   {"format": EXPORT_FORMAT, "user_id": ..., "exported_at": ...}   header
+#   {"conversation": {...}}                                         each conversation, followed by
+#   {"message": {...}}                                              its messages, oldest first
+#   {"counts": {"conversations": n, "messages": m}}                 footer (absent = truncated)
+#
+# Documents are MongoDB extended JSON (canonical), so ObjectIds, dates and the binary
+# step_data of compacted messages round-trip exactly and the import can keep every _id.
+# Lesson snapshots are not exported; `build_lesson_snapshots` recreates them from the messages.
+EXPORT_FORMAT = "gyansetu.export.v1"
+
+_JSON_OPTIONS = json_util.JSONOptions(json_mode=json_util.JSONMode.CANONICAL, tz_aware=False)
+_DUPLICATE_KEY = 11000
+
+
+def export_pipeline(user_id):
+    """One cursor over a user's conversations joined with their messages: a row per message
+    (plus one for each conversation without messages), conversations in ``_id`` order.
+
+    $lookup directly followed by $unwind is executed as a streaming join, so a conversation's
+    messages are never gathered into one document; ``conversation`` is only kept on its first row.
+    """
+    return [
+        {"$match": {"user_id": user_id, "deleted_at": None}},
+        {"$sort": {"_id": 1}},
+        {"$replaceWith": {"conversation": "$$ROOT"}},
+        {"$lookup": {
+            "from": "messages",
+            "let": {"conversation_id": "$conversation._id"},
+            "pipeline": [
+                {"$match": {"$expr": {"$eq": ["$conversation_id", "$$conversation_id"]}}},
+                {"$sort": {"timestamp": 1, "_id": 1}},
+            ],
+            "as": "message",
+        }},
+        {"$unwind": {"path": "$message", "preserveNullAndEmptyArrays": True, "includeArrayIndex": "index"}},
+        {"$set": {"conversation": {"$cond": [{"$gt": ["$index", 0]}, "$$REMOVE", "$conversation"]}}},
+        {"$project": {"_id": 0, "index": 0}},
+    ]
+
+
+async def export_records(db, user_id, batch_size=1000):
+    """Yield the export records of ``user_id`` (header, documents, footer)."""
+    yield {"format": EXPORT_FORMAT, "user_id": user_id, "exported_at": datetime.utcnow()}
+    counts = {"conversations": 0, "messages": 0}
+    cursor = db["conversations"].aggregate(export_pipeline(user_id), allowDiskUse=True, batchSize=batch_size)
+    async for row in cursor:
+        if "conversation" in row:
+            counts["conversations"] += 1
+            yield {"conversation": row["conversation"]}
+        if "message" in row:
+            counts["messages"] += 1
+            yield {"message": row["message"]}
+    yield {"counts": counts}
+
+
+async def open_export(db, user_id, batch_size=1000):
+    """Run the export query and return its record stream; database errors are raised here,
+    before anything has been written, instead of truncating the output."""
+    records = export_records(db, user_id, batch_size)
+    started = [await anext(records), await anext(records)]  # header, then the first row (or footer)
+
+    async def stream():
+        for record in started:
+            yield record
+        async for record in records:
+            yield record
+    return stream()
+
+
+def encode_record(record):
+    return json_util.dumps(record, json_options=_JSON_OPTIONS).encode("utf-8") + b"\n"
+
+
+async def gzip_chunks(records, chunk_bytes=64 * 1024, compresslevel=6):
+    """Gzip-compress NDJSON ``records`` (an async iterable) into chunks of about ``chunk_bytes``."""
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # gzip framing
+    pending = []
+    size = 0
+    async for record in records:
+        data = compressor.compress(encode_record(record))
+        if data:
+            pending.append(data)
+            size += len(data)
+        if size >= chunk_bytes:
+            yield b"".join(pending)
+            pending, size = [], 0
+    pending.append(compressor.flush())
+    yield b"".join(pending)
+
+
+class ExportFormatError(ValueError):
+    """The input is not a complete export in a supported format."""
+
+
+def read_export(path_or_file):
+    """Yield the records of an export file (path or binary file object)."""
+    try:
+        with gzip.open(path_or_file, "rt", encoding="utf-8") as f:
+            for line in f:
+                if line.strip():
+                    yield json_util.loads(line, json_options=_JSON_OPTIONS)
+    except (EOFError, gzip.BadGzipFile, zlib.error) as e:
+        raise ExportFormatError(f"Export file is damaged or truncated: {e}")
+
+
+async def _insert(collection, docs):
+    """``insert_many`` keeping ``_id``s; documents that already exist are skipped, so re-running
+    an import is safe. Returns ``(inserted, skipped)``."""
+    try:
+        result = await collection.insert_many(docs, ordered=False)
+        return len(result.inserted_ids), 0
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(error.get("code") != _DUPLICATE_KEY for error in errors):
+            raise
+        return e.details.get("nInserted", 0), len(errors)
+
+
+async def import_records(db, records, batch_size=1000, user_id=None):
+    """Insert exported records in batches of ``batch_size`` per collection.
+
+    ``user_id`` reassigns the conversations (and their messages) to another user id (e.g. the
+    account's id in the target environment). Returns ``{"conversations", "messages", "skipped"}``. Raises
+    ExportFormatError for an unknown format or a missing footer (after importing what was read).
+    """
+    records = iter(records)
+    header = next(records, None)
+    if not header or header.get("format") != EXPORT_FORMAT:
+        raise ExportFormatError(f"Not a {EXPORT_FORMAT} export")
+    counts = {"conversations": 0, "messages": 0, "skipped": 0}
+    batches = {"conversations": [], "messages": []}
+
+    async def flush(name):
+        inserted, skipped = await _insert(db[name], batches[name])
+        counts[name] += inserted
+        counts["skipped"] += skipped
+        batches[name] = []
+
+    footer = None
+    owner = None
+    for record in records:
+        if "conversation" in record:
+            conversation = record["conversation"]
+            if user_id is not None:
+                conversation["user_id"] = user_id
+            owner = conversation.get("user_id")
+            batches["conversations"].append(conversation)
+        elif "message" in record:
+            # Messages follow their conversation and carry its owner (per-user search)
+            message = record["message"]
+            message["user_id"] = owner
+            batches["messages"].append(message)
+        elif "counts" in record:
+            footer = record["counts"]
+            break
+        for name, batch in batches.items():
+            if len(batch) >= batch_size:
+                await flush(name)
+    for name, batch in batches.items():
+        if batch:
+            await flush(name)
+
+    if footer is None:
+        raise ExportFormatError(f"Export is truncated (no footer); imported {counts}")
+    expected = footer["conversations"] + footer["messages"]
+    if counts["conversations"] + counts["messages"] + counts["skipped"] != expected:
+        raise ExportFormatError(f"Export footer lists {footer}, imported {counts}")
+    return counts
@@ -0,0 +1,244 @@
+# teacher_app/ratelimit.py
+
+import math
+import threading
+import time
+from collections import namedtuple
+
+from django.conf import settings
+from django.http import JsonResponse
+
+from . import metrics
+
+# Token-bucket rate limits per client. A client is its authenticated user id, otherwise its IP
+# address: the user_id in WebSocket payloads and request parameters is chosen by the client, so
+# it is never used as a key. Each bucket holds up to `capacity` tokens, refills continuously at
+# `per_second` and a request costs some tokens (1 per lesson, 1 per byte of PDF upload, 1 per
+# lesson queued for batch generation).
+#
+# Buckets live in this process by default. With RATE_LIMIT_REDIS_URL (defaults to
+# CACHE_REDIS_URL) they are shared by all workers through Redis, updated atomically by a Lua
+# script using Redis' clock. If Redis fails, requests are let through (and logged): rate
+# limiting must not take the service down with it.
+
+Limit = namedtuple("Limit", "capacity per_second")
+Decision = namedtuple("Decision", "allowed remaining retry_after")
+
+rate_limited = metrics.counter("rate_limited_total", "Requests refused by a rate limit", ["bucket"])
+
+MESSAGES = {
+    "lesson": "Too many lesson requests. Please wait before starting another lesson.",
+    "pdf_bytes": "Too much PDF data uploaded. Please wait before uploading another PDF.",
+    "batch_items": "Too many lessons queued for batch generation. Please wait before submitting more.",
+}
+
+
+def limits():
+    """Configured buckets by name (read on each call, so settings overrides apply)."""
+    return {
+        "lesson": Limit(settings.RATE_LIMIT_LESSON_BURST, settings.RATE_LIMIT_LESSONS_PER_HOUR / 3600),
+        "pdf_bytes": Limit(settings.RATE_LIMIT_PDF_MB_BURST * 2**20, settings.RATE_LIMIT_PDF_MB_PER_HOUR * 2**20 / 3600),
+        "batch_items": Limit(settings.RATE_LIMIT_BATCH_ITEM_BURST, settings.RATE_LIMIT_BATCH_ITEMS_PER_HOUR / 3600),
+    }
+
+
+def _refill(tokens, updated, now, limit):
+    return min(limit.capacity, tokens + max(0.0, now - updated) * limit.per_second)
+
+
+class MemoryBackend:
+    """Buckets in a dict of ``key -> (tokens, updated, limit)``, guarded by a lock (sync views run
+    in threads). Buckets that have refilled completely are dropped when the dict grows past
+    ``max_keys``, since a missing bucket is a full one."""
+
+    def __init__(self, max_keys=100_000):
+        self.max_keys = max_keys
+        self._sweep_at = max_keys  # doubles while every bucket is in use, so sweeps stay rare
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def consume(self, key, limit, cost):
+        now = time.monotonic()
+        with self._lock:
+            tokens, updated, _ = self._buckets.get(key, (limit.capacity, now, limit))
+            tokens = _refill(tokens, updated, now, limit)
+            if tokens >= cost:
+                tokens -= cost
+                decision = Decision(True, tokens, 0.0)
+            else:
+                decision = Decision(False, tokens, (cost - tokens) / limit.per_second)
+            self._buckets[key] = (tokens, now, limit)
+            if len(self._buckets) > self._sweep_at:
+                self._sweep(now)
+        return decision
+
+    async def aconsume(self, key, limit, cost):
+        return self.consume(key, limit, cost)
+
+    def _sweep(self, now):
+        full = [k for k, (tokens, updated, limit) in self._buckets.items()
+                if _refill(tokens, updated, now, limit) >= limit.capacity]
+        for k in full:
+            del self._buckets[k]
+        self._sweep_at = max(self.max_keys, 2 * len(self._buckets))
+
+    def reset(self):
+        with self._lock:
+            self._buckets.clear()
+
+
+# KEYS[1] bucket; ARGV capacity, per_second, cost. Returns {allowed, remaining, retry_after}
+# (floats as strings: Lua numbers are truncated to integers in replies).
+_CONSUME_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed, retry = 0, (cost - tokens) / rate
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed, retry = 1, 0
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+return {allowed, tostring(tokens), tostring(retry)}
+"""
+
+
+class RedisBackend:
+    """Buckets shared through Redis (one hash per key, expiring once it would be full again)."""
+
+    def __init__(self, url, prefix="ratelimit:"):
+        import redis  # noqa: optional dependency (installed with channels-redis)
+        import redis.asyncio
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+        self._script = self._client.register_script(_CONSUME_SCRIPT)
+        self._async_client = redis.asyncio.Redis.from_url(url)
+        self._async_script = self._async_client.register_script(_CONSUME_SCRIPT)
+
+    @staticmethod
+    def _decision(reply):
+        allowed, remaining, retry_after = reply
+        return Decision(bool(int(allowed)), float(remaining), float(retry_after))
+
+    def consume(self, key, limit, cost):
+        try:
+            return self._decision(self._script(keys=[self.prefix + key], args=[limit.capacity, limit.per_second, cost]))
+        except Exception as e:
+            print(f"DEBUG: Rate limit backend failed, allowing the request: {e}")
+            return Decision(True, limit.capacity, 0.0)
+
+    async def aconsume(self, key, limit, cost):
+        try:
+            return self._decision(await self._async_script(keys=[self.prefix + key],
+                                                           args=[limit.capacity, limit.per_second, cost]))
+        except Exception as e:
+            print(f"DEBUG: Rate limit backend failed, allowing the request: {e}")
+            return Decision(True, limit.capacity, 0.0)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    with _backend_lock:
+        if _backend is None:
+            url = getattr(settings, "RATE_LIMIT_REDIS_URL", "")
+            if url:
+                try:
+                    _backend = RedisBackend(url)
+                    print("DEBUG: Rate limits shared through Redis")
+                except ImportError:
+                    print("DEBUG: RATE_LIMIT_REDIS_URL is set but the redis package is not installed, "
+                          "using per-process rate limits")
+            if _backend is None:
+                _backend = MemoryBackend(getattr(settings, "RATE_LIMIT_MAX_KEYS", 100_000))
+        return _backend
+
+
+def _oversized(limit, cost):
+    """A request costing more than the bucket holds can never be allowed (infinite retry_after)."""
+    return Decision(False, 0.0, math.inf) if cost > limit.capacity else None
+
+
+def consume(bucket, key, cost=1):
+    """Charge ``cost`` tokens from ``key``'s ``bucket``; returns a Decision."""
+    if not settings.RATE_LIMIT_ENABLED:
+        return Decision(True, math.inf, 0.0)
+    limit = limits()[bucket]
+    decision = _oversized(limit, cost) or get_backend().consume(f"{bucket}:{key}", limit, cost)
+    if not decision.allowed:
+        rate_limited.inc(bucket=bucket)
+    return decision
+
+
+async def aconsume(bucket, key, cost=1):
+    """Async ``consume`` (does not block the event loop on the shared backend)."""
+    if not settings.RATE_LIMIT_ENABLED:
+        return Decision(True, math.inf, 0.0)
+    limit = limits()[bucket]
+    decision = _oversized(limit, cost) or await get_backend().aconsume(f"{bucket}:{key}", limit, cost)
+    if not decision.allowed:
+        rate_limited.inc(bucket=bucket)
+    return decision
+
+
+# ---------------- Client keys ----------------
+
+def _client_ip(remote_addr, forwarded_for):
+    if settings.RATE_LIMIT_TRUST_X_FORWARDED_FOR and forwarded_for:
+        return forwarded_for.split(",")[0].strip()
+    return remote_addr or "unknown"
+
+
+def request_key(request):
+    """Rate-limit key of an HTTP request."""
+    user = getattr(request, "user", None)
+    if user is not None and user.is_authenticated:
+        return f"user:{user.pk}"
+    return "ip:" + _client_ip(request.META.get("REMOTE_ADDR"), request.META.get("HTTP_X_FORWARDED_FOR"))
+
+
+def scope_key(scope):
+    """Rate-limit key of a WebSocket connection (scope filled by AuthMiddlewareStack)."""
+    user = scope.get("user")
+    if user is not None and getattr(user, "is_authenticated", False):
+        return f"user:{user.pk}"
+    headers = dict(scope.get("headers") or ())
+    forwarded_for = headers.get(b"x-forwarded-for", b"").decode("latin-1")
+    client = scope.get("client") or (None,)
+    return "ip:" + _client_ip(client[0], forwarded_for)
+
+
+# ---------------- Responses ----------------
+
+def retry_after_seconds(decision):
+    """Whole seconds to wait (at least 1), or None when waiting will not help."""
+    return None if math.isinf(decision.retry_after) else max(1, math.ceil(decision.retry_after))
+
+
+def rate_limited_frame(bucket, decision):
+    """``rate_limited`` WebSocket frame."""
+    retry_after = retry_after_seconds(decision)
+    message = MESSAGES[bucket] if retry_after is not None else "This request is larger than the allowed limit."
+    return {"type": "rate_limited", "bucket": bucket, "retry_after": retry_after, "message": message}
+
+
+def rate_limited_response(bucket, decision):
+    """HTTP 429 with a Retry-After header (413 when the request alone exceeds the bucket)."""
+    frame = rate_limited_frame(bucket, decision)
+    details = {k: v for k, v in frame.items() if k != "type"}
+    if frame["retry_after"] is None:
+        return JsonResponse({"error": "request_too_large", **details}, status=413)
+    body = {"error": "rate_limited", **details}
+    response = JsonResponse(body, status=429)
+    response["Retry-After"] = str(frame["retry_after"])
+    return response
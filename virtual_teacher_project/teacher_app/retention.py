@@ -0,0 +1,181 @@
+# teacher_app/retention.py
+
+import gzip
+import os
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from bson import json_util
+from pymongo import ReplaceOne
+
+# Hot collections that hold a conversation's data, keyed by the field pointing at it
+CONVERSATION_CHILDREN = {
+    "messages": "conversation_id",
+    "lesson_snapshots": "conversation_id",
+}
+# Archive collection for each hot collection (used by the "collection" archive target)
+ARCHIVE_COLLECTIONS = {
+    "conversations": "archive_conversations",
+    "messages": "archive_messages",
+    "lesson_snapshots": "archive_lesson_snapshots",
+}
+ARCHIVE_RUNS = "archive_runs"
+
+_JSON_OPTIONS = json_util.JSONOptions(json_mode=json_util.JSONMode.CANONICAL, tz_aware=False)
+
+
+async def soft_delete_conversation(db, conversation_id, now=None):
+    """Mark a conversation and everything under it deleted; the deleted_at TTL indexes purge them later.
+
+    Messages a still-streaming lesson stores afterwards are not marked; sweep_deleted_children()
+    (run by archive_conversations) catches them up.
+    """
+    now = now or datetime.utcnow()
+    result = await db["conversations"].update_one(
+        {"_id": conversation_id},
+        {"$set": {"is_active": False, "deleted_at": now, "updated_at": now}}
+    )
+    if result.matched_count:
+        for name, field in CONVERSATION_CHILDREN.items():
+            await db[name].update_many({field: conversation_id}, {"$set": {"deleted_at": now}})
+    return result.matched_count > 0
+
+
+async def sweep_deleted_children(db):
+    """Mark deleted the messages and snapshots still live under a soft-deleted conversation
+    (stored after the conversation was deleted), with the conversation's deleted_at, so the TTL
+    purges them together. Returns ``{collection: documents marked}``."""
+    swept = {name: 0 for name in CONVERSATION_CHILDREN}
+    async for conversation in db["conversations"].find({"deleted_at": {"$type": "date"}}, {"deleted_at": 1}):
+        for name, field in CONVERSATION_CHILDREN.items():
+            result = await db[name].update_many({field: conversation["_id"], "deleted_at": None},
+                                                {"$set": {"deleted_at": conversation["deleted_at"]}})
+            swept[name] += result.modified_count
+    return swept
+
+
+def stale_conversations_query(days, now=None, restore_grace_days=0):
+    """Live conversations with no activity for ``days`` days (soft-deleted ones are left to the TTL),
+    leaving out those restored from the archive in the last ``restore_grace_days`` days."""
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(days=days)
+    query = {
+        "deleted_at": None,
+        "$or": [
+            {"last_activity_at": {"$lt": cutoff}},
+            {"last_activity_at": None, "updated_at": {"$lt": cutoff}},
+        ],
+    }
+    if restore_grace_days:
+        query["restored_at"] = {"$not": {"$gte": now - timedelta(days=restore_grace_days)}}
+    return query
+
+
+async def load_conversation_records(db, conversation_docs):
+    """Return one archive record per conversation: ``{"conversation", "messages", "lesson_snapshots"}``."""
+    ids = [c["_id"] for c in conversation_docs]
+    records = {c["_id"]: {"conversation": c, **{name: [] for name in CONVERSATION_CHILDREN}} for c in conversation_docs}
+    for name, field in CONVERSATION_CHILDREN.items():
+        async for doc in db[name].find({field: {"$in": ids}}).sort([(field, 1), ("_id", 1)]):
+            records[doc[field]][name].append(doc)
+    return list(records.values())
+
+
+async def delete_conversation_records(db, records):
+    ids = [r["conversation"]["_id"] for r in records]
+    for name, field in CONVERSATION_CHILDREN.items():
+        await db[name].delete_many({field: {"$in": ids}})
+    await db["conversations"].delete_many({"_id": {"$in": ids}})
+
+
+async def restore_records(db, records):
+    """Put archived records back into the hot collections. Idempotent (upsert by ``_id``).
+
+    Conversations keep their last_activity_at and get a ``restored_at``; archive runs leave them
+    alone for ARCHIVE_RESTORE_GRACE_DAYS (stale_conversations_query()).
+    """
+    counts = {"conversations": 0, **{name: 0 for name in CONVERSATION_CHILDREN}}
+    now = datetime.utcnow()
+    for record in records:
+        record["conversation"]["restored_at"] = now
+    conversations = [ReplaceOne({"_id": r["conversation"]["_id"]}, r["conversation"], upsert=True) for r in records]
+    if conversations:
+        await db["conversations"].bulk_write(conversations, ordered=False)
+        counts["conversations"] = len(conversations)
+    for name in CONVERSATION_CHILDREN:
+        ops = [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for r in records for doc in r.get(name, [])]
+        if ops:
+            await db[name].bulk_write(ops, ordered=False)
+            counts[name] = len(ops)
+    return counts
+
+
+class SegmentWriter:
+    """Writes archive records as gzip-compressed NDJSON segment files (one record per line).
+
+    A segment is written to a temporary name and renamed once fsync'd, so a finished
+    ``.ndjson.gz`` file is always complete and safe to delete the hot data for.
+    """
+
+    def __init__(self, directory, prefix="conversations"):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.prefix = prefix
+        self.sequence = 0
+        self.run_id = datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+
+    def write(self, records):
+        """Write one segment; returns ``(path, bytes_written)``."""
+        self.sequence += 1
+        path = self.directory / f"{self.prefix}-{self.run_id}-{self.sequence:04d}.ndjson.gz"
+        tmp = path.with_suffix(path.suffix + ".tmp")
+        with open(tmp, "wb") as raw:
+            with gzip.GzipFile(fileobj=raw, mode="wb", compresslevel=6) as out:
+                for record in records:
+                    out.write(json_util.dumps(record, json_options=_JSON_OPTIONS).encode("utf-8"))
+                    out.write(b"\n")
+            raw.flush()
+            os.fsync(raw.fileno())
+        os.replace(tmp, path)
+        return path, path.stat().st_size
+
+
+def read_segment(path):
+    """Yield the records stored in a segment file."""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                yield json_util.loads(line, json_options=_JSON_OPTIONS)
+
+
+async def archive_to_collections(db, records, archived_at):
+    """Copy records into the archive collections (upsert by ``_id``, so re-archiving is safe)."""
+    for record in records:
+        record["conversation"]["archived_at"] = archived_at
+    ops = {"conversations": [ReplaceOne({"_id": r["conversation"]["_id"]}, r["conversation"], upsert=True) for r in records]}
+    for name in CONVERSATION_CHILDREN:
+        ops[name] = [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for r in records for doc in r[name]]
+    for name, requests in ops.items():
+        if requests:
+            await db[ARCHIVE_COLLECTIONS[name]].bulk_write(requests, ordered=False)
+
+
+async def load_archived_records(db, conversation_ids=None, limit=0):
+    """Rebuild archive records from the archive collections."""
+    query = {"_id": {"$in": conversation_ids}} if conversation_ids else {}
+    conversation_docs = [doc async for doc in db[ARCHIVE_COLLECTIONS["conversations"]].find(query).sort("_id", 1).limit(limit)]
+    for doc in conversation_docs:
+        doc.pop("archived_at", None)
+    ids = [c["_id"] for c in conversation_docs]
+    records = {c["_id"]: {"conversation": c, **{name: [] for name in CONVERSATION_CHILDREN}} for c in conversation_docs}
+    for name, field in CONVERSATION_CHILDREN.items():
+        async for doc in db[ARCHIVE_COLLECTIONS[name]].find({field: {"$in": ids}}):
+            records[doc[field]][name].append(doc)
+    return list(records.values())
+
+
+async def delete_archived_records(db, records):
+    ids = [r["conversation"]["_id"] for r in records]
+    for name, field in CONVERSATION_CHILDREN.items():
+        await db[ARCHIVE_COLLECTIONS[name]].delete_many({field: {"$in": ids}})
+    await db[ARCHIVE_COLLECTIONS["conversations"]].delete_many({"_id": {"$in": ids}})
@@ -1,8 +1,9 @@
 # teacher_app/routing.py
 
 from django.urls import re_path
-from . import consumers
+from . import classroom, consumers
 
 websocket_urlpatterns = [
     re_path(r'ws/teacher/$', consumers.TeacherConsumer.as_asgi()),
+    re_path(r'ws/classroom/(?P<room_id>[^/]+)/$', classroom.ClassroomConsumer.as_asgi()),
 ]
\ No newline at end of file
@@ -0,0 +1,284 @@
+# teacher_app/schema.py
+
+# Whiteboard canvas size used by the frontend (TeachingCanvas.jsx)
+CANVAS_WIDTH = 800
+CANVAS_HEIGHT = 600
+MAX_PERCENT = 100
+MIN_PERCENT = 0
+
+MAX_COMMANDS_PER_STEP = 50
+
+_MISSING = object()
+_INVALID = object()
+
+
+def clamp(value, lo, hi):
+    try:
+        v = float(value)
+    except (ValueError, TypeError):
+        return lo
+    return max(lo, min(hi, v))
+
+
+class Number:
+    """Number clamped to ``[lo, hi]``; values that cannot be cast become ``lo``."""
+
+    def __init__(self, lo, hi, default=_MISSING, integer=False, required=False):
+        self.lo, self.hi, self.integer = lo, hi, integer
+        self.default, self.required = default, required
+
+    def compile(self):
+        lo, hi, integer = self.lo, self.hi, self.integer
+
+        def coerce(value):
+            try:
+                v = float(value)
+            except (ValueError, TypeError):
+                v = lo
+            v = lo if v < lo else hi if not v <= hi else v  # NaN clamps to hi
+            return int(v) if integer else v
+        return coerce
+
+
+class String:
+    """String capped at ``max_length`` characters."""
+
+    def __init__(self, max_length, default=_MISSING, required=False):
+        self.max_length = max_length
+        self.default, self.required = default, required
+
+    def compile(self):
+        max_length = self.max_length
+
+        def coerce(value):
+            if type(value) is not str:
+                value = str(value)
+            return value if len(value) <= max_length else value[:max_length]
+        return coerce
+
+
+class Choice:
+    """One of ``choices``; anything else falls back to ``default`` or is invalid."""
+
+    def __init__(self, choices, default=_MISSING, required=False):
+        self.choices = frozenset(choices)
+        self.default, self.required = default, required
+
+    def compile(self):
+        choices, default = self.choices, self.default
+        fallback = _INVALID if default is _MISSING else default
+
+        def coerce(value):
+            try:
+                return value if value in choices else fallback
+            except TypeError:  # unhashable
+                return fallback
+        return coerce
+
+
+class Points:
+    """Flat list of clamped coordinates with an even length in ``[min_length, max_length]``."""
+
+    def __init__(self, lo, hi, min_length=4, max_length=4, default=_MISSING, required=False):
+        self.lo, self.hi = lo, hi
+        self.min_length, self.max_length = min_length, max_length
+        self.default, self.required = default, required
+
+    def compile(self):
+        number = Number(self.lo, self.hi).compile()
+        min_length, max_length = self.min_length, self.max_length
+
+        def coerce(value):
+            if type(value) is not list or not min_length <= len(value) <= max_length or len(value) % 2:
+                return _INVALID
+            return [number(p) for p in value]
+        return coerce
+
+
+class ListOf:
+    """List of items coerced by ``item``; invalid items are dropped, the rest capped at ``max_length``."""
+
+    def __init__(self, item, max_length, default=_MISSING, required=False):
+        self.item, self.max_length = item, max_length
+        self.default, self.required = default, required
+
+    def compile(self):
+        item, max_length = self.item, self.max_length
+
+        def coerce(value):
+            if type(value) is not list:
+                return []
+            out = []
+            for entry in value:
+                entry = item(entry)
+                if entry is not None:
+                    out.append(entry)
+                    if len(out) == max_length:
+                        break
+            return out
+        return coerce
+
+
+def compile_object(fields, prefix=None):
+    """Compile ``{name: field}`` into ``coerce(dict) -> dict | None``.
+
+    Unknown keys are dropped. A missing or invalid required field rejects the object;
+    an optional one falls back to its default, or is left out when it has none. The
+    coercer walks the keys actually present, so sparse commands stay cheap.
+    """
+    coercers = {name: field.compile() for name, field in fields.items()}
+    base = dict(prefix or {})
+    for name, field in fields.items():
+        if field.default is not _MISSING:
+            base[name] = coercers[name](field.default)
+    required = frozenset(name for name, field in fields.items() if field.required)
+
+    def coerce_object(src):
+        if type(src) is not dict:
+            return None
+        out = base.copy()
+        for name, value in src.items():
+            coerce = coercers.get(name)
+            if coerce is None:
+                continue
+            value = coerce(value)
+            if value is _INVALID:
+                if name in required:
+                    return None
+                continue
+            out[name] = value
+        if required and not required <= out.keys():
+            return None
+        return out
+    return coerce_object
+
+
+def _pixel_x(**kwargs):
+    return Number(0, CANVAS_WIDTH, **kwargs)
+
+
+def _pixel_y(**kwargs):
+    return Number(0, CANVAS_HEIGHT, **kwargs)
+
+
+def _percent(default):
+    return Number(MIN_PERCENT, MAX_PERCENT, default=default)
+
+
+# Fields every drawing command may carry
+COMMON_FIELDS = {
+    "time": Number(0, 600_000, integer=True),  # ms from the start of the step until the command runs
+    "at": Number(0, 86_400_000, integer=True),  # ms from the start of the lesson (set by layout.py)
+}
+
+# One entry per whiteboard action. The draw_* actions are what the lesson prompt asks
+# for and TeachingCanvas.jsx renders; write_text/draw_shape are the older
+# percentage-based vocabulary.
+COMMAND_SCHEMAS = {
+    "clear_all": {},
+    "draw_text": {
+        "text": String(1200, default=""),
+        "x": _pixel_x(),
+        "y": _pixel_y(),
+        "fontSize": Number(8, 96, integer=True),
+        "fontFamily": String(64),
+        "fontStyle": Choice({"normal", "bold", "italic", "italic bold"}, default="normal"),
+        "color": String(32),
+        "width": Number(1, CANVAS_WIDTH),  # wrap width
+    },
+    "draw_rectangle": {
+        "x": _pixel_x(),
+        "y": _pixel_y(),
+        "width": Number(1, CANVAS_WIDTH),
+        "height": Number(1, CANVAS_HEIGHT),
+        "fill": String(32),
+        "color": String(32),
+        "strokeWidth": Number(0, 20),
+    },
+    "draw_circle": {
+        "x": _pixel_x(),
+        "y": _pixel_y(),
+        "radius": Number(1, CANVAS_HEIGHT / 2),
+        "fill": String(32),
+        "color": String(32),
+        "strokeWidth": Number(0, 20),
+    },
+    "draw_arrow": {
+        "points": Points(0, CANVAS_WIDTH),
+        "pointerLength": Number(0, 50),
+        "pointerWidth": Number(0, 50),
+        "color": String(32),
+        "strokeWidth": Number(0, 20),
+    },
+    "draw_line": {
+        "points": Points(0, CANVAS_WIDTH, max_length=64),
+        "color": String(32),
+        "strokeWidth": Number(0, 20),
+    },
+    "highlight": {
+        "x": _pixel_x(),
+        "y": _pixel_y(),
+        "width": Number(1, CANVAS_WIDTH),
+        "height": Number(1, CANVAS_HEIGHT),
+    },
+    "write_text": {
+        "text": String(1200, default=""),
+        "x_percent": _percent(0),
+        "y_percent": _percent(0),
+        "font_size": Number(8, 200, default=20, integer=True),
+        "color": String(32, default="black"),
+        "align": Choice({"left", "center"}, default="left"),
+    },
+    "draw_shape": {
+        "shape": Choice({"rect", "circle"}, required=True),
+        "x_percent": _percent(0),
+        "y_percent": _percent(0),
+        "width_percent": Number(0.1, MAX_PERCENT, default=10),
+        "height_percent": Number(0.1, MAX_PERCENT, default=10),
+        "color": String(32, default="#f3f4f6"),
+        "stroke": String(32, default="black"),
+    },
+}
+
+ALLOWED_ACTIONS = frozenset(COMMAND_SCHEMAS)
+
+_command_coercers = {
+    action: compile_object({**fields, **COMMON_FIELDS}, prefix={"action": action})
+    for action, fields in COMMAND_SCHEMAS.items()
+}
+
+
+def validate_command(cmd):
+    """Return the coerced command dict, or None for unknown actions and invalid commands."""
+    if type(cmd) is not dict:
+        return None
+    try:
+        coerce = _command_coercers.get(cmd.get("action"))
+    except TypeError:  # unhashable action
+        return None
+    return coerce(cmd) if coerce is not None else None
+
+
+STEP_SCHEMA = {
+    "step": Number(0, 10_000, integer=True, required=True),
+    "speech_text": String(5000, required=True),
+    "speech_duration": Number(0, 120_000, integer=True, required=True),
+    "start_ms": Number(0, 86_400_000, integer=True),  # lesson timeline, set by layout.py
+    "end_ms": Number(0, 86_400_000, integer=True),
+    "drawing_commands": ListOf(validate_command, MAX_COMMANDS_PER_STEP, required=True),
+}
+
+validate_step = compile_object(STEP_SCHEMA)
+validate_step.__doc__ = "Return the coerced teaching step dict, or None when a required field is missing."
+
+
+def validate_lesson(steps):
+    """Coerce every step of a lesson in one call, dropping invalid steps and commands."""
+    if type(steps) is not list:
+        return []
+    out = []
+    for step in steps:
+        step = validate_step(step)
+        if step is not None:
+            out.append(step)
+    return out
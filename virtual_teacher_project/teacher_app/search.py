@@ -0,0 +1,182 @@
+# teacher_app/search.py
+
+import asyncio
+import html
+import re
+
+from pymongo.errors import OperationFailure
+
+# Full-text search over a user's conversation history: conversation titles/topics and message
+# content. Both collections have a compound text index with user_id as its prefix ("search" in
+# mongo.INDEXES), so a query only walks the index keys of one user however large the collection
+# is. Messages carry their owner's user_id for this (backfill_message_user_ids() adds it to
+# messages stored before search existed).
+#
+# Hits from the two collections are merged by MongoDB's textScore (titles weigh most); each
+# collection returns at most page * page_size + 1 hits, so deep pages cost more and paging
+# stops at SEARCH_MAX_RESULTS.
+
+SNIPPET_CHARS = 160
+MAX_QUERY_CHARS = 200
+_INDEX_NOT_FOUND = 27
+
+# MongoDB's English text search ignores these; highlighting them would only add noise
+STOPWORDS = frozenset("""
+    a an and are as at be by for from has have in is it its of on or that the this to was were
+    what when where which who why will with how do does did can you your i me my we our
+""".split())
+_SUFFIXES = ("ations", "ation", "ing", "ies", "ed", "es", "ly", "s")
+
+_TOKEN = re.compile(r'"([^"]*)"|(-?)(\w+)')
+
+
+class SearchIndexMissing(RuntimeError):
+    """The text indexes have not been created (`manage.py ensure_indexes` or backfill_message_owners)."""
+
+
+def query_terms(query):
+    """Lower-cased words of a $text query to highlight: phrase words included, negated words
+    ("-word") and stop words dropped."""
+    terms = []
+    for phrase, negated, word in _TOKEN.findall(query):
+        words = re.findall(r"\w+", phrase) if phrase else ([] if negated else [word])
+        terms.extend(w.lower() for w in words if w and w.lower() not in STOPWORDS)
+    return list(dict.fromkeys(terms))
+
+
+def _stem(term):
+    """Crude stand-in for MongoDB's Snowball stemmer: "photosynthesis" and "explained" highlight
+    "photosynthesize" and "explaining"."""
+    for suffix in _SUFFIXES:
+        if term.endswith(suffix) and len(term) - len(suffix) >= 3:
+            return term[:-len(suffix)]
+    return term
+
+
+def highlight_pattern(terms):
+    if not terms:
+        return None
+    stems = sorted({_stem(t) for t in terms}, key=len, reverse=True)
+    return re.compile(r"\b(?:%s)\w*" % "|".join(re.escape(s) for s in stems), re.IGNORECASE)
+
+
+def densest_window(matches, width):
+    """Index of the first match of the ``width``-character window (starting at a match) that
+    holds the most whole matches.
+
+    Matches do not overlap, so their ends increase with their starts: the window starting at
+    match i ends before the first match past match i's start + width, which only moves right.
+    """
+    best, best_count, j = 0, 0, 0
+    for i, match in enumerate(matches):
+        while j < len(matches) and matches[j].end() <= match.start() + width:
+            j += 1
+        if j - i > best_count:
+            best, best_count = i, j - i
+    return best
+
+
+def snippet(text, pattern, width=SNIPPET_CHARS):
+    """HTML snippet of ``text``: the ``width``-character window with the most matches of
+    ``pattern``, escaped, with the matches wrapped in <mark>."""
+    text = " ".join(str(text or "").split())
+    matches = list(pattern.finditer(text)) if pattern else []
+    if not matches:
+        cut = text[:width]
+        return html.escape(cut) + ("…" if len(text) > width else "")
+    start = max(0, matches[densest_window(matches, width)].start() - width // 4)
+    if start:
+        space = text.rfind(" ", 0, start)
+        start = space + 1 if space >= 0 and start - space < 20 else start
+    end = min(len(text), start + width)
+    if end < len(text):
+        space = text.rfind(" ", start, end)
+        end = space if space > start + width // 2 else end
+    parts = ["…" if start else ""]
+    position = start
+    for match in matches:
+        if match.start() < start or match.end() > end:
+            continue
+        parts.append(html.escape(text[position:match.start()]))
+        parts.append(f"<mark>{html.escape(match.group())}</mark>")
+        position = match.end()
+    parts.append(html.escape(text[position:end]))
+    parts.append("…" if end < len(text) else "")
+    return "".join(parts)
+
+
+def _text_query(collection, user_id, query, projection, limit, max_time_ms):
+    score = {"$meta": "textScore"}
+    return collection.find(
+        {"user_id": user_id, "deleted_at": None, "$text": {"$search": query}},
+        dict(projection, score=score),
+    ).sort([("score", score)]).limit(limit).max_time_ms(max_time_ms)
+
+
+async def search_history(db, user_id, query, page=1, page_size=20, max_time_ms=2000):
+    """One page of ranked hits for ``query`` in ``user_id``'s history:
+    ``{"hits": [...], "has_more": bool}``; each hit is a conversation (title/topic matched) or a
+    message, with its conversation's id and title, the textScore and a highlighted snippet.
+    Raises SearchIndexMissing when the text indexes do not exist."""
+    limit = page * page_size + 1
+    try:
+        conversation_docs, message_docs = await asyncio.gather(
+            _text_query(db["conversations"], user_id, query, {"title": 1, "topic": 1, "last_activity_at": 1},
+                        limit, max_time_ms).to_list(limit),
+            _text_query(db["messages"], user_id, query,
+                        {"conversation_id": 1, "content": 1, "sender": 1, "message_type": 1, "timestamp": 1},
+                        limit, max_time_ms).to_list(limit),
+        )
+    except OperationFailure as e:
+        if e.code == _INDEX_NOT_FOUND:
+            raise SearchIndexMissing("Search is not set up: run `manage.py backfill_message_owners`") from e
+        raise
+
+    ranked = [("conversation", doc) for doc in conversation_docs] + [("message", doc) for doc in message_docs]
+    ranked.sort(key=lambda hit: hit[1]["score"], reverse=True)
+    page_hits = ranked[(page - 1) * page_size:page * page_size]
+
+    titles = {doc["_id"]: doc.get("title") for kind, doc in page_hits if kind == "conversation"}
+    missing = list({doc["conversation_id"] for kind, doc in page_hits
+                    if kind == "message" and doc["conversation_id"] not in titles})
+    if missing:
+        async for doc in db["conversations"].find({"_id": {"$in": missing}}, {"title": 1}):
+            titles[doc["_id"]] = doc.get("title")
+
+    pattern = highlight_pattern(query_terms(query))
+    hits = []
+    for kind, doc in page_hits:
+        if kind == "conversation":
+            text = doc.get("title") or ""
+            if doc.get("topic") and doc.get("topic") != doc.get("title"):
+                text = f"{text} · {doc['topic']}"
+            hits.append({"type": "conversation", "conversation_id": str(doc["_id"]),
+                         "conversation_title": doc.get("title"), "score": round(doc["score"], 3),
+                         "snippet": snippet(text, pattern), "timestamp": doc.get("last_activity_at")})
+        else:
+            hits.append({"type": "message", "conversation_id": str(doc["conversation_id"]),
+                         "conversation_title": titles.get(doc["conversation_id"]), "message_id": str(doc["_id"]),
+                         "sender": doc.get("sender"), "message_type": doc.get("message_type"),
+                         "score": round(doc["score"], 3), "snippet": snippet(doc.get("content"), pattern),
+                         "timestamp": doc.get("timestamp")})
+    return {"hits": hits, "has_more": len(ranked) > page * page_size}
+
+
+def backfill_pipeline():
+    """Copies each conversation's user_id onto its messages that have none ($merge on _id)."""
+    return [
+        {"$match": {"user_id": None}},
+        {"$lookup": {"from": "conversations", "localField": "conversation_id", "foreignField": "_id",
+                     "as": "conversation"}},
+        {"$unwind": "$conversation"},
+        {"$project": {"user_id": "$conversation.user_id"}},
+        {"$match": {"user_id": {"$ne": None}}},
+        {"$merge": {"into": "messages", "on": "_id", "whenMatched": "merge", "whenNotMatched": "discard"}},
+    ]
+
+
+async def backfill_message_user_ids(db):
+    """Give messages stored before search existed their conversation's user_id; returns how many
+    messages still have none afterwards (orphans whose conversation is gone)."""
+    await db["messages"].aggregate(backfill_pipeline(), allowDiskUse=True).to_list(None)
+    return await db["messages"].count_documents({"user_id": None})
@@ -0,0 +1,138 @@
+# teacher_app/sessions.py
+
+import asyncio
+import time
+
+from django.conf import settings
+
+from . import metrics
+
+active_sessions = metrics.gauge("lesson_sessions_active", "Lesson sessions held by the registry")
+session_resumes = metrics.counter(
+    "lesson_session_resumes_total", "Reconnects that resumed a lesson session", ["status"])
+sessions_expired = metrics.counter(
+    "lesson_sessions_expired_total", "Detached lesson sessions dropped after the grace period", ["state"])
+
+
+class LessonSession:
+    """One lesson generation and every frame it has sent, numbered with ``seq``.
+
+    The generation runs as its own task, so it outlives the WebSocket connection that started
+    it. Frames go to whichever consumer is attached; a reconnecting consumer attaches with the
+    last ``seq`` it saw and is sent the frames it missed before receiving live ones.
+    """
+
+    def __init__(self, consumer=None, user_id="anonymous"):
+        self.key = None
+        self.user_id = user_id      # only this user may resume the session
+        self.frames = []
+        self.consumer = consumer
+        self.task = None
+        self.done = False
+        self.created_at = time.time()
+        self._lock = asyncio.Lock()
+        self._expiry = None
+
+    @property
+    def last_seq(self):
+        return len(self.frames)
+
+    async def publish(self, frame):
+        """Number the frame, keep it for resuming clients and send it to the attached consumer.
+        Returns the numbered frame."""
+        async with self._lock:
+            frame = {**frame, "seq": len(self.frames) + 1}
+            self.frames.append(frame)
+            if self.consumer is not None:
+                try:
+                    await self.consumer.send_json(frame)
+                except Exception as e:
+                    print(f"DEBUG: Session {self.key} send failed, detaching: {e}")
+                    self.consumer = None
+            return frame
+
+    async def attach(self, consumer, last_seq=0):
+        """Send frames after ``last_seq`` to ``consumer`` and make it the live receiver.
+        Returns the number of frames replayed."""
+        async with self._lock:
+            self._cancel_expiry()
+            missed = self.frames[max(0, min(last_seq, len(self.frames))):]
+            for frame in missed:
+                await consumer.send_json(frame)
+            self.consumer = consumer
+            return len(missed)
+
+    def detach(self, consumer, grace):
+        """Drop ``consumer`` as the receiver; the session is expired after ``grace`` seconds unless
+        someone attaches again."""
+        if self.consumer is not consumer:
+            return
+        self.consumer = None
+        self._cancel_expiry()
+        self._expiry = asyncio.get_running_loop().call_later(grace, self._expire)
+
+    def finish(self):
+        self.done = True
+
+    def _cancel_expiry(self):
+        if self._expiry is not None:
+            self._expiry.cancel()
+            self._expiry = None
+
+    def _expire(self):
+        self._expiry = None
+        if self.consumer is not None:
+            return
+        sessions_expired.inc(state="finished" if self.done else "generating")
+        if not self.done and self.task is not None:
+            print(f"DEBUG: Session {self.key} not resumed in time, cancelling generation")
+            self.task.cancel()
+        registry.remove(self)
+
+
+class SessionRegistry:
+    """In-process lesson sessions keyed by conversation id (as a string).
+
+    Sessions live in the memory of the server process that runs the generation, so a resuming
+    client must reach the same process (sticky routing when running several workers).
+    """
+
+    def __init__(self):
+        self._sessions = {}
+
+    def grace_seconds(self):
+        return getattr(settings, "LESSON_SESSION_GRACE_SECONDS", 60.0)
+
+    def register(self, key, session):
+        key = str(key)
+        previous = self._sessions.get(key)
+        if previous is not None and previous is not session and not previous.done and previous.task is not None:
+            previous.task.cancel()  # a new lesson in the same conversation replaces the old one
+        session.key = key
+        self._sessions[key] = session
+        active_sessions.set(len(self._sessions))
+
+    def get(self, key):
+        return self._sessions.get(str(key))
+
+    def remove(self, session):
+        if session.key is not None and self._sessions.get(session.key) is session:
+            del self._sessions[session.key]
+            active_sessions.set(len(self._sessions))
+
+    def detach(self, session, consumer):
+        if session.key is None:
+            # Never registered (no conversation id), so nobody can resume it
+            if session.consumer is consumer and session.task is not None and not session.done:
+                session.task.cancel()
+            return
+        session.detach(consumer, self.grace_seconds())
+
+    def finish(self, session):
+        """Mark the generation finished; the frames stay resumable for the grace period."""
+        session.finish()
+        if session.key is not None and session.consumer is None:
+            session.detach(None, self.grace_seconds())
+
+
+registry = SessionRegistry()
@@ -0,0 +1,77 @@
+# teacher_app/snapshots.py
+
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import DESCENDING
+
+from .layout import LAYOUT_VERSION, ensure_layout
+from .mongo import STEP_MESSAGE_TYPES
+
+NOTES_MESSAGE_TYPE = "notes_and_quiz"
+# A user request starts a new lesson within a conversation
+LESSON_BOUNDARY_TYPES = ("topic_request",)
+
+
+async def get_latest_snapshot(collection, conversation_id):
+    """Return the newest snapshot for ``conversation_id`` (one indexed read), or None."""
+    if collection is None:
+        return None
+    if not isinstance(conversation_id, ObjectId):
+        conversation_id = ObjectId(conversation_id)
+    return await collection.find_one({"conversation_id": conversation_id}, sort=[("created_at", DESCENDING)])
+
+
+async def ensure_snapshot_layout(collection, snapshot):
+    """Lay out a snapshot stored before the current LAYOUT_VERSION and write the result back,
+    so the layout is computed once per lesson. The write is best effort."""
+    if snapshot.get("layout_version") == LAYOUT_VERSION:
+        return snapshot
+    ensure_layout(snapshot)
+    try:
+        await collection.update_one({"_id": snapshot["_id"]}, {"$set": {
+            "steps": snapshot["steps"],
+            "layout_version": snapshot["layout_version"],
+            "duration_ms": snapshot["duration_ms"],
+        }})
+    except Exception as e:
+        print(f"DEBUG: Could not store the layout of snapshot {snapshot.get('_id')}: {e}")
+    return snapshot
+
+
+def serialize_snapshot(snapshot):
+    """JSON-safe copy of a snapshot document."""
+    out = dict(snapshot)
+    for key, value in out.items():
+        if isinstance(value, ObjectId):
+            out[key] = str(value)
+        elif isinstance(value, datetime):
+            out[key] = value.isoformat()
+    return out
+
+
+def lessons_from_messages(conversation_messages):
+    """Group a conversation's messages (oldest first) into lessons for snapshotting.
+
+    Each lesson is the run of step messages after a user request, plus any notes/quiz
+    message in that run. Returns ``[{"steps", "notes_and_quiz", "first_step_message_id",
+    "created_at"}]``.
+    """
+    lessons = []
+    current = None
+    for message in conversation_messages:
+        message_type = message.get("message_type")
+        if message_type in LESSON_BOUNDARY_TYPES:
+            current = None
+        elif message_type in STEP_MESSAGE_TYPES and isinstance(message.get("step_data"), dict):
+            if current is None:
+                current = {"steps": [], "notes_and_quiz": None,
+                           "first_step_message_id": message["_id"], "created_at": message.get("timestamp")}
+                lessons.append(current)
+            current["steps"].append(message["step_data"])
+            current["created_at"] = message.get("timestamp") or current["created_at"]
+        elif message_type == NOTES_MESSAGE_TYPE and current is not None:
+            current["notes_and_quiz"] = message.get("step_data")
+    for lesson in lessons:
+        lesson["steps"].sort(key=lambda step: step.get("step", 0) if isinstance(step.get("step"), int) else 0)
+    return lessons
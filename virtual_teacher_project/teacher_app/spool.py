@@ -0,0 +1,307 @@
+# teacher_app/spool.py
+
+import os
+import threading
+import time
+from pathlib import Path
+
+import pymongo
+from bson import json_util
+from django.conf import settings
+from pymongo import UpdateOne
+from pymongo.errors import PyMongoError
+
+from . import metrics
+from .mongo import conversation_summary_pipeline, conversation_summary_set
+from .mongo_client import client_options, mongo_available
+
+# Local write-ahead spool for chat writes that could not reach MongoDB.
+#
+# Records are appended as Extended JSON lines to an active segment file
+# (segment-<ns>-<pid>.ndjson.open) and fsync'd in batches by a flusher thread. A segment is
+# sealed (fsync'd, renamed to .ndjson) by the flusher once it grows past SPOOL_SEGMENT_BYTES,
+# or when the replayer picks it up; no fsync runs under the lock that appends take. The
+# replayer claims a sealed segment by renaming it to .replaying-<pid>, writes it to MongoDB
+# and deletes it. Replaying is idempotent: inserts become $setOnInsert upserts
+# keyed by the client-assigned _id, and conversation summaries are recomputed, not incremented.
+#
+# Record shapes:
+#   {"op": "insert", "collection": "messages", "doc": {...}}
+#   {"op": "refresh_summary", "conversation_id": ObjectId}
+
+records_appended = metrics.counter(
+    "spool_records_appended_total", "Writes captured in the local spool instead of MongoDB", ["collection"])
+records_replayed = metrics.counter(
+    "spool_records_replayed_total", "Spooled writes replayed into MongoDB", ["collection"])
+replay_failures = metrics.counter(
+    "spool_replay_failures_total", "Spool segments whose replay failed and will be retried")
+pending_segments = metrics.gauge(
+    "spool_pending_segments", "Spool segment files waiting to be replayed")
+
+_JSON_OPTIONS = json_util.JSONOptions(json_mode=json_util.JSONMode.CANONICAL, tz_aware=False)
+
+ACTIVE_SUFFIX = ".ndjson.open"
+SEALED_SUFFIX = ".ndjson"
+REPLAYING_SUFFIX = ".replaying"
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _owner_pid(path):
+    """pid encoded in a segment name (segment-<ns>-<pid>...), or None if it cannot be parsed."""
+    try:
+        return int(path.name.split(".", 1)[0].rsplit("-", 1)[1])
+    except (IndexError, ValueError):
+        return None
+
+
+def read_records(path):
+    """Yield the records of a segment; a torn (partially written) line is skipped."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json_util.loads(line, json_options=_JSON_OPTIONS)
+            except ValueError:
+                print(f"DEBUG: Skipping unreadable spool record in {path.name}")
+
+
+class Spool:
+    """Append-only, segmented spool directory shared by every process of the server."""
+
+    def __init__(self, directory, segment_bytes=4 * 1024 * 1024, fsync_interval=0.2):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.segment_bytes = segment_bytes
+        self.fsync_interval = fsync_interval
+        self._lock = threading.Lock()
+        self._sync_lock = threading.Lock()  # held by flush() for its fsyncs; never taken by append()
+        self._file = None
+        self._path = None
+        self._dirty = False
+        self._full = []             # detached segments waiting to be fsync'd and sealed
+        self._flusher = None
+        self._replayer = None
+        self._replay_lock = threading.Lock()
+        self._client = None
+
+    # ---------------- Writing ----------------
+    def append(self, records):
+        """Append records to the active segment. Data reaches the OS immediately (so it survives a
+        process crash) and the disk within ``fsync_interval`` seconds. Called on the event loop:
+        it never waits for an fsync, which the flusher thread does outside the lock."""
+        lines = "".join(json_util.dumps(r, json_options=_JSON_OPTIONS) + "\n" for r in records)
+        with self._lock:
+            if self._file is None:
+                self._open_segment()
+            self._file.write(lines)
+            self._file.flush()
+            self._dirty = True
+            if self._file.tell() >= self.segment_bytes:
+                self._full.append(self._detach_locked())  # sealed by the flusher
+        for record in records:
+            records_appended.inc(collection=record.get("collection", "conversations"))
+        self._start_flusher()
+
+    def spool_inserts(self, collection_name, docs):
+        self.append([{"op": "insert", "collection": collection_name, "doc": doc} for doc in docs])
+
+    def spool_summary_refresh(self, conversation_id):
+        self.append([{"op": "refresh_summary", "conversation_id": conversation_id}])
+
+    def _open_segment(self):
+        self._path = self.directory / f"segment-{time.time_ns()}-{os.getpid()}{ACTIVE_SUFFIX}"
+        self._file = open(self._path, "a", encoding="utf-8")
+
+    def _detach_locked(self):
+        """Take the active segment out of use; the next append opens a new one."""
+        segment = (self._file, self._path)
+        self._file = self._path = None
+        self._dirty = False
+        return segment
+
+    @staticmethod
+    def _seal_segment(file, path):
+        os.fsync(file.fileno())
+        file.close()
+        os.replace(path, path.with_name(path.name[:-len(ACTIVE_SUFFIX)] + SEALED_SUFFIX))
+
+    def flush(self):
+        """fsync the active segment and seal the detached ones. The lock is only held to take
+        them; the fsyncs run on a duplicate descriptor so appends are never blocked on the disk."""
+        with self._sync_lock:  # a seal() returns only once the segments the flusher took are sealed
+            with self._lock:
+                full, self._full = self._full, []
+                fd = os.dup(self._file.fileno()) if self._file is not None and self._dirty else None
+                self._dirty = False
+            for file, path in full:
+                try:
+                    self._seal_segment(file, path)
+                except OSError as e:
+                    # Left open; reclaimed by pending() once this process is gone
+                    print(f"DEBUG: Spool could not seal {path.name}: {e}")
+            if fd is not None:
+                try:
+                    os.fsync(fd)
+                finally:
+                    os.close(fd)
+
+    def seal(self):
+        """Close the active segment so the replayer can take it."""
+        with self._lock:
+            if self._file is not None:
+                self._full.append(self._detach_locked())
+        self.flush()
+
+    def _start_flusher(self):
+        if self._flusher is not None:
+            return
+        with self._lock:
+            if self._flusher is None:
+                self._flusher = threading.Thread(target=self._flush_loop, name="spool-flusher", daemon=True)
+                self._flusher.start()
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.fsync_interval)
+            try:
+                self.flush()
+            except OSError as e:
+                print(f"DEBUG: Spool fsync failed: {e}")
+
+    # ---------------- Replaying ----------------
+    def pending(self):
+        """Sealed segments ready for replay, oldest first. Segments left behind by dead processes
+        (still open, or claimed mid-replay) are reclaimed first."""
+        for path in self.directory.iterdir():
+            name = path.name
+            if name.endswith(ACTIVE_SUFFIX) or REPLAYING_SUFFIX in name:
+                pid = _owner_pid(path) if name.endswith(ACTIVE_SUFFIX) else int(name.rsplit("-", 1)[1])
+                if pid is not None and pid != os.getpid() and not _pid_alive(pid):
+                    base = name[:-len(ACTIVE_SUFFIX)] if name.endswith(ACTIVE_SUFFIX) else name.split(REPLAYING_SUFFIX)[0]
+                    try:
+                        os.replace(path, path.with_name(base + SEALED_SUFFIX))
+                    except FileNotFoundError:
+                        pass  # reclaimed by another process
+        segments = sorted(p for p in self.directory.iterdir() if p.name.endswith(SEALED_SUFFIX))
+        pending_segments.set(len(segments))
+        return segments
+
+    def _database(self):
+        if self._client is None:
+            self._client = pymongo.MongoClient(settings.MONGO_DB_URI, **client_options())
+        return self._client[settings.MONGO_DB_NAME]
+
+    def replay(self, database=None):
+        """Drain every pending segment into MongoDB; returns ``{"segments", "records", "failed"}``.
+
+        Stops at the first failing segment (it is put back and retried on the next run)."""
+        stats = {"segments": 0, "records": 0, "failed": 0}
+        with self._replay_lock:
+            self.seal()
+            database = self._database() if database is None else database
+            for path in self.pending():
+                claimed = path.with_name(path.name[:-len(SEALED_SUFFIX)] + f"{REPLAYING_SUFFIX}-{os.getpid()}")
+                try:
+                    os.replace(path, claimed)
+                except FileNotFoundError:
+                    continue  # another process claimed it
+                try:
+                    stats["records"] += replay_segment(database, claimed)
+                except PyMongoError as e:
+                    print(f"DEBUG: Spool replay of {path.name} failed, will retry: {str(e).split(',')[0]}")
+                    replay_failures.inc()
+                    os.replace(claimed, path)
+                    stats["failed"] += 1
+                    break
+                claimed.unlink()
+                stats["segments"] += 1
+            self.pending()
+        if stats["segments"]:
+            print(f"DEBUG: Replayed {stats['records']} spooled writes from {stats['segments']} segments")
+        return stats
+
+    def start_replayer(self, interval=None):
+        """Start the background replay thread (once per process) unless SPOOL_REPLAY_INTERVAL is 0."""
+        interval = getattr(settings, "SPOOL_REPLAY_INTERVAL", 5.0) if interval is None else interval
+        if self._replayer is not None or not interval:
+            return
+        with self._lock:
+            if self._replayer is None:
+                self._replayer = threading.Thread(target=self._replay_loop, args=(interval,),
+                                                  name="spool-replayer", daemon=True)
+                self._replayer.start()
+
+    def _replay_loop(self, interval):
+        while True:
+            try:
+                if mongo_available() and (self._file is not None or self.pending()):
+                    self.replay()
+            except Exception as e:
+                print(f"DEBUG: Spool replayer error: {e}")
+            time.sleep(interval)
+
+
+def replay_segment(database, path):
+    """Write one segment's records to MongoDB; returns the number of records applied."""
+    inserts = {}
+    refresh = set()
+    count = 0
+    for record in read_records(path):
+        count += 1
+        if record.get("op") == "insert":
+            doc = record["doc"]
+            inserts.setdefault(record["collection"], []).append(
+                UpdateOne({"_id": doc["_id"]}, {"$setOnInsert": {k: v for k, v in doc.items() if k != "_id"}},
+                          upsert=True))
+            if record["collection"] == "conversations":
+                refresh.add(doc["_id"])
+            elif doc.get("conversation_id") is not None:
+                refresh.add(doc["conversation_id"])
+        elif record.get("op") == "refresh_summary":
+            refresh.add(record["conversation_id"])
+
+    # Conversations first, so summaries are recomputed over documents that exist
+    for name in sorted(inserts, key=lambda n: n != "conversations"):
+        database[name].bulk_write(inserts[name], ordered=False)
+        records_replayed.inc(len(inserts[name]), collection=name)
+    if refresh:
+        updates = [
+            UpdateOne({"_id": summary["_id"]}, {
+                "$set": conversation_summary_set(summary),
+                "$max": {"updated_at": summary["last_activity_at"]},
+            })
+            for summary in database["messages"].aggregate(conversation_summary_pipeline(refresh))
+        ]
+        if updates:
+            database["conversations"].bulk_write(updates, ordered=False)
+    return count
+
+
+_spool = None
+_spool_lock = threading.Lock()
+
+
+def get_spool():
+    """The process-wide spool, or None when SPOOL_ENABLED is off."""
+    global _spool
+    if not getattr(settings, "SPOOL_ENABLED", True):
+        return None
+    if _spool is None:
+        with _spool_lock:
+            if _spool is None:
+                _spool = Spool(
+                    getattr(settings, "SPOOL_DIR", settings.BASE_DIR / "spool"),
+                    segment_bytes=getattr(settings, "SPOOL_SEGMENT_BYTES", 4 * 1024 * 1024),
+                    fsync_interval=getattr(settings, "SPOOL_FSYNC_INTERVAL", 0.2),
+                )
+    return _spool
@@ -0,0 +1,31 @@
+# teacher_app/startup.py
+
+import threading
+
+from django.conf import settings
+
+# Heavy dependencies kept off the worker start path: each is imported by the code that first
+# needs it (llm.GeminiProvider, consumers.build_lesson_prompt, mongo_client._new_client,
+# batch.extract_pdf_text). `manage.py startup_profile` fails if one of them is imported at startup.
+# They are not pre-imported in the background either: a thread importing them holds the import
+# lock and the GIL, which stalls the worker's first requests instead of the first lesson.
+DEFERRED_IMPORTS = {
+    "google.generativeai": "Gemini SDK (llm.GeminiProvider)",
+    "langchain.prompts": "lesson prompt template (consumers.build_lesson_prompt)",
+    "motor.motor_asyncio": "MongoDB driver (mongo_client)",
+    "fitz": "PyMuPDF (batch.extract_pdf_text)",
+    "numpy": "similar-topic index (topic_index)",
+}
+
+_started = False
+_lock = threading.Lock()
+
+
+def on_worker_start():
+    """Startup hook for server workers, called once the ASGI application is built (asgi.py)."""
+    global _started
+    with _lock:
+        if _started:
+            return
+        _started = True
+    print(f"DEBUG: MongoDB configured for: {settings.MONGO_DB_NAME} (connects on first use)")
@@ -1,3 +1,1600 @@
-from django.test import TestCase
+import asyncio
+import json
+import random
+import struct
+import tempfile
+import threading
+import zlib
+from datetime import datetime, timedelta
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from bson import ObjectId
+from channels.layers import get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import SimpleTestCase, override_settings
+from pymongo.errors import AutoReconnect, BulkWriteError
+
+from . import (analytics, batch, classroom, codec, consumers, layout, llm, loadtest, mongo, mongo_client, outbound,
+               routing, schema, topic_index, wire, wsserver)
+from .analytics import save_progress, save_progress_bulk
+from .bench import SPEECH_SAMPLE, reference_clean_text_for_speech, speech_corpus
+from .consumers import (STEP_END, STEP_START, clean_text_for_speech, parse_notes_and_quiz, parse_teaching_steps,
+                        sanitize_command)
+from .db import configure_sqlite, journal_mode
+from .llm import build_canned_lesson
+from .management.commands import compact_messages
+from .mongo import (PREVIEW_LENGTH, conversation_activity_update, create_lesson_snapshot, create_message,
+                    create_progress, create_quiz)
+from .mongo_client import TrackedCursor, breaker
+from .schema import (MAX_COMMANDS_PER_STEP, Choice, ListOf, Number, Points, String, compile_object, validate_command,
+                     validate_step)
+from .search import densest_window, highlight_pattern, snippet
+from .retention import restore_records, stale_conversations_query, sweep_deleted_children
+from .sessions import registry
+from .speech import get_normalizer
+from .spool import Spool, read_records
+
+class SpeechNormalizerTests(SimpleTestCase):
+    """The normalizer must read text exactly like the original multi-pass cleaner."""
+
+    REPRESENTATIVE = [
+        SPEECH_SAMPLE,
+        (SPEECH_SAMPLE + "\n") * 20,
+        "",
+        "   ",
+        "Hello everyone! Today we will learn about photosynthesis.",
+        "**Note:** see `x.y`!",
+        "**bold** and *italic* and `code` on one line",
+        "2 * 3 = 6 and 4 * 5 = 20",
+        "an *unclosed italic\nand a `stray backtick",
+        "**nested *italic* inside bold**",
+        "w/o sugar w/ milk, e.g. tea vs. coffee, i.e. drinks etc.",
+        "Pi is 3.14; gravity is 9.8 m/s. Why?Because!",
+        "Tabs\tand\nnewlines  and   spaces",
+        "Ends with an abbreviation etc.",
+        "Question?!Exclamation;colon:",
+    ]
+
+    def test_matches_reference_on_representative_inputs(self):
+        for text in self.REPRESENTATIVE:
+            with self.subTest(text=text):
+                self.assertEqual(clean_text_for_speech(text), reference_clean_text_for_speech(text))
+
+    def test_matches_reference_on_fuzzed_inputs(self):
+        normalizer = get_normalizer("en")
+        for text in speech_corpus(fuzz=2000):
+            with self.subTest(text=text):
+                self.assertEqual(normalizer.normalize(text), reference_clean_text_for_speech(text))
+
+    def test_batch_matches_single_texts(self):
+        corpus = self.REPRESENTATIVE + speech_corpus(fuzz=500)
+        normalizer = get_normalizer("en")
+        self.assertEqual(normalizer.normalize_many(corpus), [normalizer.normalize(t) for t in corpus])
+
+    def test_batch_with_separator_character(self):
+        normalizer = get_normalizer("en")
+        texts = ["a\x00b e.g.", "c"]
+        self.assertEqual(normalizer.normalize_many(texts), [normalizer.normalize(t) for t in texts])
+
+    def test_without_is_not_read_as_with(self):
+        self.assertEqual(clean_text_for_speech("w/o sugar"), "without sugar")
+
+    def test_normalize_lesson_updates_steps_in_place(self):
+        steps = [{"speech_text": "**Hi** e.g. you"}, {"speech_text": ""}, {}]
+        get_normalizer("en").normalize_lesson(steps)
+        self.assertEqual([s["speech_text"] for s in steps], ["Hi for example you", "", ""])
+
+    @override_settings(SPEECH_ABBREVIATIONS={"en": {"approx.": "approximately", "vs.": None}})
+    def test_abbreviation_overrides(self):
+        self.assertEqual(clean_text_for_speech("approx. 5 vs. 6"), "approximately 5 vs. 6")
+
+
+class LessonParsingTests(SimpleTestCase):
+    STEP = '{"step": 1, "speech_text": "Hello", "speech_duration": 6000, "drawing_commands": []}'
+    NOTES = '{"notes_and_quiz_ready": {"notes": ["n"], "quiz": [{"q": "?", "a": "!"}]}}'
+
+    def block(self, body):
+        return f"{STEP_START}\n{body}\n{STEP_END}\n"
+
+    def test_notes_and_quiz_block_is_not_a_step(self):
+        content = self.block(self.STEP) + self.block(f"```json\n{self.NOTES}\n```")
+        self.assertEqual(len(parse_teaching_steps(content)), 1)
+        self.assertEqual(parse_notes_and_quiz(content), {"notes": ["n"], "quiz": [{"q": "?", "a": "!"}]})
+
+    def test_lesson_without_notes(self):
+        self.assertIsNone(parse_notes_and_quiz(self.block(self.STEP) + self.block("{not json")))
+
+
+class LLMProviderTests(SimpleTestCase):
+    PROMPT = "Teach this.\nTopic: Volcanoes\n"
+
+    async def collect(self, provider, prompt=PROMPT):
+        return [text async for text in provider.stream(prompt)]
+
+    @override_settings(LLM_PROVIDER="stub", LLM_STUB_CHUNK_SIZE=50, LLM_STUB_STEPS=3, LLM_STUB_TOKENS_PER_SECOND=0)
+    def test_provider_follows_settings(self):
+        provider = llm.get_llm_provider()
+        self.assertIsInstance(provider, llm.StubProvider)
+        self.assertEqual((provider.chunk_size, provider.steps, provider.tokens_per_second), (50, 3, 0))
+        self.assertIsInstance(llm.get_llm_provider("replay"), llm.RecordReplayProvider)
+        self.assertEqual(llm.get_llm_provider("record").mode, "record")
+        with mock.patch("google.generativeai.configure") as configure:
+            self.assertIsInstance(llm.get_llm_provider("gemini"), llm.GeminiProvider)
+        configure.assert_called_once()
+        with self.assertRaises(ValueError):
+            llm.get_llm_provider("gpt")
+
+    def test_stub_streams_the_canned_lesson_for_the_topic(self):
+        chunks = asyncio.run(self.collect(llm.StubProvider(chunk_size=50, steps=3)))
+        self.assertEqual("".join(chunks), build_canned_lesson("Volcanoes", 3))
+        self.assertTrue(all(len(chunk) <= 50 for chunk in chunks))
+        self.assertEqual(len(parse_teaching_steps("".join(chunks))), 3)
+
+    def test_stub_paces_by_token_rate(self):
+        provider = llm.StubProvider(tokens_per_second=1000, chunk_size=40, steps=1)  # 10 tokens a chunk
+        with mock.patch("teacher_app.llm.asyncio.sleep", mock.AsyncMock()) as sleep:
+            chunks = asyncio.run(self.collect(provider))
+        self.assertEqual(sleep.await_count, len(chunks))
+        self.assertEqual(sleep.await_args.args, (0.01,))
+
+    def test_record_then_replay(self):
+        with tempfile.TemporaryDirectory() as directory:
+            recorder = llm.RecordReplayProvider("record", directory, inner=llm.StubProvider(chunk_size=64, steps=2))
+            recorded = asyncio.run(self.collect(recorder))
+            replayer = llm.RecordReplayProvider("replay", directory, speed=0)
+            self.assertEqual(asyncio.run(self.collect(replayer)), recorded)
+            with self.assertRaises(FileNotFoundError):
+                asyncio.run(self.collect(replayer, "Topic: Glaciers\n"))
+        with self.assertRaises(ValueError):
+            llm.RecordReplayProvider("live")
+
+
+class SnippetTests(SimpleTestCase):
+    def test_window_with_most_matches(self):
+        text = "cell " + "filler " * 40 + "cells divide, each cell splits into cells " + "filler " * 40
+        self.assertEqual(snippet(text, highlight_pattern(["cell"]), width=60),
+                         "…filler filler filler <mark>cells</mark> divide, each <mark>cell</mark> splits into…")
+
+    def test_densest_window_on_long_inputs(self):
+        rng = random.Random(3)
+        pattern = highlight_pattern(["cell"])
+        for _ in range(20):
+            text = " ".join(rng.choice(["cell", "cells", "filler", "membrane"]) for _ in range(rng.randint(500, 3000)))
+            matches = list(pattern.finditer(text))
+            counts = [sum(1 for m in matches[i:] if m.end() <= match.start() + 160) for i, match in enumerate(matches)]
+            self.assertEqual(densest_window(matches, 160), counts.index(max(counts)))
+
+    def test_dense_cluster_deep_in_a_long_text(self):
+        text = ("cell " + "filler " * 30) * 3000 + "cell cell membrane cell " + "filler " * 30
+        self.assertIn("<mark>cell</mark> <mark>cell</mark> membrane <mark>cell</mark>",
+                      snippet(text, highlight_pattern(["cell"]), width=60))
+
+    def test_many_matches_stay_linear(self):
+        text = "photosynthesis " * 20000
+        result = snippet(text, highlight_pattern(["photosynthesis"]))
+        self.assertTrue(result.startswith("<mark>photosynthesis</mark> "))
+        self.assertTrue(result.endswith("…"))
+
+
+class SchemaCoercerTests(SimpleTestCase):
+    def test_number(self):
+        coerce = Number(0, 100).compile()
+        self.assertEqual([coerce(v) for v in (50, "30", -5, 150, "x", None)], [50, 30, 0, 100, 0, 0])
+        self.assertEqual(coerce(float("nan")), 100)
+        self.assertEqual(Number(8, 96, integer=True).compile()("24.9"), 24)
+
+    def test_string(self):
+        coerce = String(5).compile()
+        self.assertEqual([coerce(v) for v in ("abc", "abcdefgh", 12345678, None)], ["abc", "abcde", "12345", "None"])
+
+    def test_choice(self):
+        with_default = Choice({"left", "center"}, default="left").compile()
+        self.assertEqual([with_default(v) for v in ("center", "right", ["left"])], ["center", "left", "left"])
+        self.assertIs(Choice({"rect"}).compile()("tri"), schema._INVALID)
+
+    def test_points(self):
+        coerce = Points(0, 800, max_length=6).compile()
+        self.assertEqual(coerce([10, "20", -5, 900]), [10, 20, 0, 800])
+        self.assertEqual(coerce([1, 2, 3, 4, 5, 6]), [1, 2, 3, 4, 5, 6])
+        for invalid in ([1, 2, 3], [1, 2], [1] * 8, "1,2,3,4", None):
+            self.assertIs(coerce(invalid), schema._INVALID, invalid)
+
+    def test_list_of(self):
+        coerce = ListOf(lambda v: v if isinstance(v, int) else None, max_length=3).compile()
+        self.assertEqual(coerce([1, "x", 2, None, 3, 4]), [1, 2, 3])
+        self.assertEqual(coerce("not a list"), [])
+
+    def test_object_drops_unknown_keys_and_applies_defaults(self):
+        coerce = compile_object({"a": Number(0, 10, required=True), "b": String(3, default="xyz"),
+                                 "c": Choice({"on"})}, prefix={"kind": "k"})
+        self.assertEqual(coerce({"a": "20", "c": "off", "junk": 1}), {"kind": "k", "a": 10, "b": "xyz"})
+        self.assertIsNone(coerce({"b": "x"}))  # required field missing
+        self.assertIsNone(coerce(["a"]))
+
+
+class SanitizeCommandTests(SimpleTestCase):
+    """Legacy (percentage) commands keep the output of the original sanitize_command."""
+
+    def test_write_text(self):
+        self.assertEqual(sanitize_command({"action": "write_text", "text": "Hi", "x_percent": 150, "y_percent": "20",
+                                           "font_size": 500, "align": "right", "extra": 1}),
+                         {"action": "write_text", "text": "Hi", "x_percent": 100, "y_percent": 20, "font_size": 200,
+                          "color": "black", "align": "left"})
+
+    def test_draw_shape(self):
+        self.assertEqual(sanitize_command({"action": "draw_shape", "shape": "circle", "width_percent": "0"}),
+                         {"action": "draw_shape", "shape": "circle", "x_percent": 0, "y_percent": 0,
+                          "width_percent": 0.1, "height_percent": 10, "color": "#f3f4f6", "stroke": "black"})
+        self.assertIsNone(sanitize_command({"action": "draw_shape", "shape": "triangle"}))
+        self.assertIsNone(sanitize_command({"action": "draw_shape"}))
+        self.assertIsNone(sanitize_command({"action": "draw_shape", "shape": ["rect"]}))
+
+    def test_clear_all_and_rejections(self):
+        self.assertEqual(sanitize_command({"action": "clear_all", "x": 5}), {"action": "clear_all"})
+        for invalid in ({"action": "explode"}, {"action": ["clear_all"]}, "clear_all", None):
+            self.assertIsNone(sanitize_command(invalid))
+
+    def test_draw_arrow_points_are_optional_pixels(self):
+        # layout.py places arrows without points; points are canvas pixels (0-800), not percentages
+        self.assertEqual(sanitize_command({"action": "draw_arrow", "color": "red"}), {"action": "draw_arrow", "color": "red"})
+        self.assertEqual(sanitize_command({"action": "draw_arrow", "points": [10, "20", 900, -1]})["points"],
+                         [10, 20, 800, 0])
+        self.assertNotIn("points", sanitize_command({"action": "draw_arrow", "points": [1, 2, 3]}))
+
+
+class StepSchemaTests(SimpleTestCase):
+    def step(self, **fields):
+        return {"step": 1, "speech_text": "Hi", "speech_duration": 6000, "drawing_commands": [], **fields}
+
+    def test_unknown_step_keys_are_dropped(self):
+        self.assertEqual(validate_step(self.step(mood="happy", step="2")),
+                         {"step": 2, "speech_text": "Hi", "speech_duration": 6000, "drawing_commands": []})
+
+    def test_missing_required_field_rejects_the_step(self):
+        for field in ("step", "speech_text", "speech_duration", "drawing_commands"):
+            step = self.step()
+            del step[field]
+            self.assertIsNone(validate_step(step), field)
+
+    def test_commands_are_coerced_dropped_and_capped(self):
+        commands = [{"action": "draw_text", "text": "t", "x": -40, "fontSize": "huge", "time": "1000"},
+                    {"action": "explode"}, "junk"] * MAX_COMMANDS_PER_STEP
+        coerced = validate_step(self.step(drawing_commands=commands))["drawing_commands"]
+        self.assertEqual(len(coerced), MAX_COMMANDS_PER_STEP)
+        self.assertEqual(coerced[0], {"action": "draw_text", "text": "t", "fontStyle": "normal", "x": 0,
+                                      "fontSize": 8, "time": 1000})
+        self.assertEqual(validate_command(coerced[0]), coerced[0])
+
+
+class CodecTests(SimpleTestCase):
+    CONTENT = "Plants turn light into sugar. " * 40
+
+    def message(self, **step_data):
+        step_data = {"step": 1, "speech_text": self.CONTENT, "drawing_commands": [{"action": "clear_all"}] * 30,
+                     **step_data}
+        return {"_id": ObjectId(), "content": self.CONTENT, "message_type": "lesson_step", "step_data": step_data}
+
+    def test_zlib_round_trip(self):
+        message = self.message()
+        encoded = codec.encode_message(message, codec="zlib", min_bytes=0)
+        self.assertEqual(encoded[codec.CODEC_FIELD], "zlib")
+        self.assertEqual(encoded[codec.CONTENT_FIELD], "speech_text")
+        self.assertIsInstance(encoded["step_data"], bytes)
+        self.assertEqual(codec.decode_message(encoded), message)
+
+    @skipUnless(codec.zstandard is not None, "zstandard is not installed")
+    def test_zstd_round_trip(self):
+        message = self.message()
+        encoded = codec.encode_message(message, codec="zstd", min_bytes=0)
+        self.assertEqual(encoded[codec.CODEC_FIELD], "zstd")
+        self.assertEqual(codec.decode_message(encoded), message)
+
+    def test_small_step_data_is_only_deduplicated(self):
+        message = self.message(drawing_commands=[])
+        encoded = codec.encode_message(message, codec="zlib", min_bytes=1 << 20)
+        self.assertNotIn(codec.CODEC_FIELD, encoded)
+        self.assertNotIn("speech_text", encoded["step_data"])
+        self.assertEqual(codec.decode_message(encoded), message)
+
+    def test_content_that_differs_is_kept(self):
+        message = self.message(speech_text="Something else")
+        encoded = codec.encode_message(message, codec="zlib", min_bytes=1 << 20)
+        self.assertNotIn(codec.CONTENT_FIELD, encoded)
+        self.assertEqual(encoded["step_data"]["speech_text"], "Something else")
+
+    def test_messages_stored_before_the_codec_decode_unchanged(self):
+        for message in (self.message(), {"_id": ObjectId(), "content": "hi", "step_data": None}, {"content": "x"}):
+            self.assertIs(codec.decode_message(message), message)
+
+    def test_encoded_messages_are_not_encoded_again(self):
+        encoded = codec.encode_message(self.message(), codec="zlib", min_bytes=0)
+        self.assertIs(codec.encode_message(encoded, codec="zlib", min_bytes=0), encoded)
+
+    def test_unknown_codec_is_an_error(self):
+        with self.assertRaises(RuntimeError):
+            codec.decode_message({"_id": 1, "step_data": b"", codec.CODEC_FIELD: "brotli"})
+
+
+class CompactMessagesTests(SimpleTestCase):
+    class FakeDb:
+        def __init__(self, docs):
+            self.messages = mock.Mock(bulk_write=mock.AsyncMock())
+            self.messages.find.return_value.sort.return_value = AsyncDocs(docs)
+            self.command = mock.AsyncMock(return_value={"size": 1, "storageSize": 1, "count": len(docs)})
+
+        def __getitem__(self, name):
+            return self.messages
+
+    def run_compact(self, docs, dedupe=True):
+        db = self.FakeDb(docs)
+        options = {"dedupe": dedupe, "dry_run": False, "compact": False, "batch_size": 500}
+        with mock.patch("teacher_app.mongo.db", db):
+            report = asyncio.run(compact_messages.Command()._compact("zlib", options))
+        requests = [r for call in db.messages.bulk_write.call_args_list for r in call.args[0]]
+        deleted = [r._filter["_id"] for r in requests if type(r).__name__ == "DeleteOne"]
+        return report, deleted
+
+    def step(self, conversation_id, n, message_type="lesson_step"):
+        return {"_id": ObjectId(), "conversation_id": conversation_id, "message_type": message_type,
+                "content": f"step {n}", "step_data": {"step": n, "speech_text": f"step {n}"}}
+
+    def test_duplicates_within_a_lesson_are_deleted(self):
+        conversation = ObjectId()
+        first, repeat = self.step(conversation, 1), self.step(conversation, 1)
+        report, deleted = self.run_compact([first, self.step(conversation, 2), repeat])
+        self.assertEqual(report["duplicates"], 1)
+        self.assertEqual(deleted, [repeat["_id"]])
+
+    def test_fingerprints_reset_at_conversation_and_topic_request_boundaries(self):
+        a, b = ObjectId(), ObjectId()
+        docs = [self.step(a, 1),
+                {"_id": ObjectId(), "conversation_id": a, "message_type": "topic_request", "content": "again"},
+                self.step(a, 1),   # same step in the next lesson of the conversation
+                self.step(b, 1)]   # same step in another conversation
+        report, deleted = self.run_compact(docs)
+        self.assertEqual((report["duplicates"], deleted), (0, []))
+
+    def test_already_compressed_duplicates_are_found(self):
+        conversation = ObjectId()
+        stored = codec.encode_message(self.step(conversation, 1), codec="zlib", min_bytes=0)
+        repeat = self.step(conversation, 1)
+        report, deleted = self.run_compact([stored, repeat])
+        self.assertEqual(deleted, [repeat["_id"]])
+
+
+class TrackedCursorTests(SimpleTestCase):
+    class FakeCursor:
+        def __init__(self, error=None):
+            self.error = error
+
+        def sort(self, *args):
+            return self
+
+        def __aiter__(self):
+            return self
+
+        async def __anext__(self):
+            if self.error:
+                raise self.error
+            raise StopAsyncIteration
+
+    def tearDown(self):
+        breaker.record_success()
+
+    async def drain(self, cursor):
+        return [doc async for doc in cursor]
+
+    def test_chained_calls_stay_tracked(self):
+        cursor = TrackedCursor(self.FakeCursor())
+        self.assertIs(cursor.sort("timestamp", 1), cursor)
+        self.assertEqual(asyncio.run(self.drain(cursor)), [])
+
+    def test_iteration_errors_reach_the_breaker(self):
+        breaker.record_success()
+        with self.assertRaises(AutoReconnect):
+            asyncio.run(self.drain(TrackedCursor(self.FakeCursor(AutoReconnect("gone")))))
+        self.assertEqual(breaker._failures, 1)
+
+
+class HalfOpenBreakerTests(SimpleTestCase):
+    def setUp(self):
+        self.now = 0.0
+        self.breaker = mongo_client.CircuitBreaker("test", failure_threshold=1, reset_timeout=10, clock=lambda: self.now)
+        patcher = mock.patch.object(mongo_client, "breaker", self.breaker)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.breaker.record_failure()
+        self.now = 10.0
+
+    def call(self, operation):
+        return mongo_client._guard(operation, "test.op", cursor=False)()
+
+    def test_one_trial_at_a_time(self):
+        async def run():
+            started = asyncio.Event()
+
+            async def slow():
+                started.set()
+                await asyncio.sleep(1)
+
+            trial = asyncio.ensure_future(self.call(slow))
+            await started.wait()
+            with self.assertRaises(mongo_client.MongoUnavailable):
+                await self.call(slow)
+            trial.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await trial
+
+        asyncio.run(run())
+        self.assertEqual(self.breaker.state, self.breaker.HALF_OPEN)
+        self.assertFalse(self.breaker._trial_in_flight)
+
+    def test_call_never_awaited_or_cancelled_before_start_holds_no_trial(self):
+        async def ok():
+            return "ok"
+
+        self.call(ok).close()
+
+        async def run():
+            task = asyncio.ensure_future(self.call(ok))
+            task.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await task
+            return await self.call(ok)
+
+        self.assertEqual(asyncio.run(run()), "ok")
+        self.assertEqual(self.breaker.state, self.breaker.CLOSED)
+
+    def test_trial_outcome_closes_or_reopens(self):
+        async def fail():
+            raise AutoReconnect("gone")
+
+        with self.assertRaises(AutoReconnect):
+            asyncio.run(self.call(fail))
+        self.assertEqual(self.breaker.state, self.breaker.OPEN)
+
+        async def ok():
+            return "ok"
+
+        self.now = 20.0
+        self.assertEqual(asyncio.run(self.call(ok)), "ok")
+        self.assertEqual(self.breaker.state, self.breaker.CLOSED)
+
+
+class LoadtestAccountingTests(SimpleTestCase):
+    def scripted(self, frames):
+        frames = iter(frames)
+
+        async def recv():
+            return next(frames)
+
+        return recv
+
+    def drive(self, frames):
+        sent = []
+
+        async def send(text):
+            sent.append(json.loads(text))
+
+        result = asyncio.run(loadtest._drive(send, self.scripted(frames), "Cells", 5))
+        self.assertEqual(sent, [{"topic": "Cells", "user_id": "loadtest"}])
+        return result
+
+    def test_frames_are_counted_up_to_the_lesson(self):
+        frames = [json.dumps({"type": t}) for t in
+                  ("lesson_start", "generation_progress", "generation_progress", "lesson_ready", "notes")]
+        result = self.drive(frames)
+        self.assertEqual(result.frames, 4)  # nothing after lesson_ready is read
+        self.assertIsNone(result.error)
+        self.assertLessEqual(result.first_step, result.total)
+
+    def test_errors_and_closed_sockets(self):
+        result = self.drive([json.dumps({"type": "lesson_start"}), json.dumps({"type": "rate_limited"})])
+        self.assertEqual((result.frames, result.error), (2, "rate_limited"))
+        self.assertIsNotNone(result.total)
+        result = self.drive([json.dumps({"type": "lesson_start"}), None])
+        self.assertEqual((result.frames, result.error, result.total), (1, "closed", None))
+
+    def test_level_totals(self):
+        def client(frames, error=None):
+            result = loadtest.ClientResult()
+            result.frames, result.error, result.first_step, result.total = frames, error, 0.1, 0.5
+            return result
+
+        results = [client(20), client(20), client(3, "timeout"), client(1, "closed")]
+
+        async def make_client(i):
+            return results[i]
+
+        level = asyncio.run(loadtest.run_level(make_client, 4, worker_pids=[]))
+        self.assertEqual((level["frames"], level["completed"], level["error_count"]), (44, 2, 2))
+        self.assertEqual(level["errors"], ["closed", "timeout"])
+        self.assertEqual(level["lesson_time"]["count"], 2)
+        self.assertEqual(level["workers"], [])
+
+    def test_raw_socket_byte_accounting(self):
+        def frame(first, payload):
+            length = len(payload)
+            if length < 126:
+                return bytes([first, length]) + payload
+            return bytes([first, 126]) + struct.pack("!H", length) + payload
+
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -zlib.MAX_WBITS)
+        deflated = (compressor.compress(b"x" * 500) + compressor.flush(zlib.Z_SYNC_FLUSH))[:-4]
+        wire = [
+            frame(0x89, b"ping"),                           # control frames are skipped
+            frame(0x01, b"hel"), frame(0x80, b"lo"),        # a fragmented text message
+            frame(0x81, b"y" * 300),                        # 16-bit length
+            frame(0xC1, deflated),                          # permessage-deflate
+            frame(0x88, b""),
+        ]
+
+        async def run():
+            reader = asyncio.StreamReader()
+            reader.feed_data(b"".join(wire))
+            ws = loadtest.RawWebSocket(reader, None)
+            ws._inflater = zlib.decompressobj(-zlib.MAX_WBITS)
+            return ws, [await ws.recv() for _ in range(4)]
+
+        ws, messages = asyncio.run(run())
+        self.assertEqual(messages, ["hello", "y" * 300, "x" * 500, None])
+        self.assertEqual(ws.bytes_received, sum(len(f) for f in wire))
+        self.assertEqual(ws.payload_bytes, 5 + 300 + 500)
+
+
+class SqliteWalTests(SimpleTestCase):
+    def connect(self, name):
+        from django.db import connections
+        from django.db.backends.sqlite3.base import DatabaseWrapper
+
+        wrapper = DatabaseWrapper(dict(connections["default"].settings_dict, NAME=name), alias="wal_test")
+        wrapper.ensure_connection()  # sends connection_created
+        self.addCleanup(wrapper.close)
+        return wrapper
+
+    def pragma(self, wrapper, name):
+        with wrapper.cursor() as cursor:
+            cursor.execute(f"PRAGMA {name}")
+            return cursor.fetchone()[0]
+
+    def test_new_connections_use_wal(self):
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = self.connect(f"{directory}/wal.sqlite3")
+            self.assertEqual(journal_mode(wrapper), "wal")
+            self.assertEqual(self.pragma(wrapper, "synchronous"), 1)  # NORMAL
+            wrapper.close()
+
+    @override_settings(SQLITE_WAL=False)
+    def test_can_be_turned_off(self):
+        with tempfile.TemporaryDirectory() as directory:
+            wrapper = self.connect(f"{directory}/plain.sqlite3")
+            self.assertEqual(journal_mode(wrapper), "delete")
+            wrapper.close()
+
+    def test_other_databases_are_left_alone(self):
+        self.assertEqual(journal_mode(self.connect(":memory:")), "memory")
+        connection = mock.Mock(vendor="postgresql")
+        configure_sqlite(None, connection)
+        connection.cursor.assert_not_called()
+        self.assertIsNone(journal_mode(connection))
+
+
+class SpoolTests(SimpleTestCase):
+    def test_concurrent_appends_across_segments(self):
+        with tempfile.TemporaryDirectory() as directory:
+            spool = Spool(directory, segment_bytes=2048, fsync_interval=0.01)
+
+            def writer(n):
+                for i in range(200):
+                    spool.spool_inserts("messages", [{"_id": f"{n}-{i}", "content": "x" * 40}])
+
+            threads = [threading.Thread(target=writer, args=(n,)) for n in range(4)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            spool.seal()
+            segments = spool.pending()
+            ids = [record["doc"]["_id"] for path in segments for record in read_records(path)]
+            self.assertGreater(len(segments), 1)
+            self.assertEqual(sorted(ids), sorted(f"{n}-{i}" for n in range(4) for i in range(200)))
+
+
+class SlowSocket:
+    """Fake send/close for an OutboundQueue: each send waits until ``gate`` is set."""
+
+    def __init__(self):
+        self.gate = asyncio.Event()
+        self.sent = []
+        self.closed_with = None
+
+    async def send(self, text):
+        await self.gate.wait()
+        self.sent.append(text)
+
+    async def close(self, code):
+        self.closed_with = code
+
+
+class OutboundQueueTests(SimpleTestCase):
+    async def stalled_queue(self, label, **kwargs):
+        """A queue whose sender has taken frame "c0" and is stuck sending it."""
+        socket = SlowSocket()
+        queue = outbound.OutboundQueue(socket.send, socket.close, label, **kwargs)
+        queue.put("c0", "lesson_content")
+        await asyncio.sleep(0)
+        self.assertEqual(len(queue), 0)
+        return socket, queue
+
+    async def drain(self, socket, queue):
+        socket.gate.set()
+        await asyncio.wait_for(queue._task, 1)
+
+    def test_frames_are_sent_in_order_then_closed(self):
+        async def run():
+            socket, queue = await self.stalled_queue("order")
+            for i in range(1, 6):
+                self.assertTrue(queue.put(f"c{i}", "lesson_content"))
+            queue.close(1000)
+            self.assertFalse(queue.put("late", "lesson_content"))
+            await self.drain(socket, queue)
+            return socket
+
+        socket = asyncio.run(run())
+        self.assertEqual(socket.sent, [f"c{i}" for i in range(6)])
+        self.assertEqual(socket.closed_with, 1000)
+
+    def test_progress_frames_coalesce_in_place(self):
+        async def run():
+            socket, queue = await self.stalled_queue("coalesce")
+            before = outbound.frames_coalesced.value(type="generation_progress")
+            queue.put("p1", "generation_progress")
+            queue.put("c1", "lesson_content")
+            queue.put("p2", "generation_progress")
+            queue.put("p3", "generation_progress")
+            self.assertEqual(len(queue), 2)
+            self.assertEqual(outbound.frames_coalesced.value(type="generation_progress") - before, 2)
+            queue.close()
+            await self.drain(socket, queue)
+            return socket
+
+        # the latest progress keeps the first one's place ahead of the lesson content
+        self.assertEqual(asyncio.run(run()).sent, ["c0", "p3", "c1"])
+
+    def test_drop_policy_drops_status_frames_before_closing(self):
+        async def run():
+            socket, queue = await self.stalled_queue("drop", max_frames=2, policy="drop")
+            dropped = outbound.frames_dropped.value(type="status")
+            closes = outbound.backpressure_closes.value()
+            queue.put("s1", "status")
+            queue.put("c1", "lesson_content")
+            # full: an incoming status frame is dropped ...
+            self.assertFalse(queue.put("s2", "status"))
+            # ... and lesson content evicts the oldest queued status frame
+            self.assertTrue(queue.put("c2", "lesson_content"))
+            self.assertEqual(outbound.frames_dropped.value(type="status") - dropped, 2)
+            self.assertFalse(queue.closed)
+            # nothing left to drop: the connection is closed
+            self.assertFalse(queue.put("c3", "lesson_content"))
+            self.assertTrue(queue.closed)
+            self.assertEqual(outbound.backpressure_closes.value() - closes, 1)
+            await self.drain(socket, queue)
+            return socket
+
+        socket = asyncio.run(run())
+        self.assertEqual(socket.sent, ["c0"])
+        self.assertEqual(socket.closed_with, outbound.BACKPRESSURE_CLOSE_CODE)
+
+    def test_close_policy_closes_on_overflow(self):
+        async def run():
+            socket, queue = await self.stalled_queue("close", max_frames=1, policy="close")
+            self.assertTrue(queue.put("s1", "status"))
+            self.assertFalse(queue.put("s2", "status"))
+            self.assertTrue(queue.closed)
+            await self.drain(socket, queue)
+            return socket
+
+        socket = asyncio.run(run())
+        self.assertEqual(socket.sent, ["c0"])
+        self.assertEqual(socket.closed_with, outbound.BACKPRESSURE_CLOSE_CODE)
+
+    def test_depth_metrics(self):
+        async def run():
+            socket, queue = await self.stalled_queue("depth")
+            for i in range(1, 4):
+                queue.put(f"c{i}", "lesson_content")
+            self.assertEqual(outbound.queue_depth.value(connection="depth"), 3)
+            self.assertEqual(outbound.queue_high_water.value(connection="depth"), 3)
+            socket.gate.set()
+            while socket.sent != ["c0", "c1", "c2", "c3"]:
+                await asyncio.sleep(0)
+            self.assertEqual(outbound.queue_depth.value(connection="depth"), 0)
+            self.assertEqual(outbound.queue_high_water.value(connection="depth"), 3)
+            queue.stop()
+            await asyncio.sleep(0)
+            self.assertTrue(queue._task.cancelled())
+
+        asyncio.run(run())
+        self.assertNotIn(("depth",), dict(outbound.queue_depth.samples()))
+        self.assertNotIn(("depth",), dict(outbound.queue_high_water.samples()))
+
+
+def overlaps(a, b):
+    return a[0] < b[0] + b[2] and b[0] < a[0] + a[2] and a[1] < b[1] + b[3] and b[1] < a[1] + a[3]
+
+
+def random_page(rng):
+    """Drawing commands that fit on one canvas: two text blocks, two shapes and one rule at most."""
+    commands = [{"action": "draw_text", "text": " ".join("word" * rng.randint(1, 3) for _ in range(rng.randint(1, 6))),
+                 "fontSize": rng.choice([None, 18, 24, 28])} for _ in range(rng.randint(0, 2))]
+    for _ in range(rng.randint(0, 2)):
+        if rng.random() < 0.5:
+            commands.append({"action": "draw_rectangle", "width": rng.randint(20, 400), "height": rng.randint(20, 300)})
+        else:
+            commands.append({"action": "draw_circle", "radius": rng.randint(5, 120)})
+    rules = [{"action": "draw_line"}, {"action": "draw_arrow"}, {"action": "highlight"}]
+    commands += rng.sample(rules, rng.randint(0, 2))
+    rng.shuffle(commands)
+    return commands
+
+
+def random_lesson(rng):
+    steps = []
+    for n in range(rng.randint(1, 6)):
+        commands = []
+        for page in range(rng.randint(1, 3)):
+            commands += ([{"action": "clear_all"}] if page else []) + random_page(rng)
+        for command in commands:
+            time = rng.choice([None, None, 0, rng.randint(0, 20000)])  # unordered, often missing
+            if time is not None:
+                command["time"] = time
+        steps.append({"step": n + 1, "speech_duration": rng.choice([None, 0, rng.randint(1000, 20000)]),
+                      "drawing_commands": commands})
+    return steps
+
+
+class LayoutTests(SimpleTestCase):
+    def boxes(self, command):
+        """Bounding box of a placed text block or shape."""
+        action = command["action"]
+        if action == "draw_text":
+            used, height = layout.text_extent(command["text"], command.get("fontSize") or layout.DEFAULT_FONT_SIZE,
+                                              command["width"])
+            return command["x"], command["y"], command["width"], height
+        if action == "draw_rectangle":
+            return command["x"], command["y"], command["width"], command["height"]
+        if action == "draw_circle":
+            r = command["radius"]
+            return command["x"] - r, command["y"] - r, 2 * r, 2 * r
+        return None
+
+    def assert_inside(self, box, region):
+        left, top, width, height = region
+        self.assertGreaterEqual(box[0], left)
+        self.assertGreaterEqual(box[1], top)
+        self.assertLessEqual(box[0] + box[2], left + width)
+        self.assertLessEqual(box[1] + box[3], top + height)
+
+    def test_skyline_packs_without_overlaps(self):
+        rng = random.Random(41)
+        for _ in range(200):
+            region = (rng.randint(0, 100), rng.randint(0, 100), rng.randint(50, 500), rng.randint(50, 500))
+            skyline = layout.Skyline(region)
+            placed = []
+            for _ in range(rng.randint(1, 40)):
+                width, height = rng.randint(1, 300), rng.randint(1, 200)
+                position = skyline.place(width, height)
+                if position is None:
+                    # only when the rectangle fits nowhere along the skyline
+                    w = min(width, region[2])
+                    for x, _, _ in skyline.segments:
+                        if x + w <= region[0] + region[2]:
+                            top = max(y for sx, sw, y in skyline.segments if sx < x + w and sx + sw > x)
+                            self.assertGreater(top + height, region[1] + region[3])
+                    continue
+                box = (*position, min(width, region[2]), height)
+                self.assert_inside(box, region)
+                for other in placed:
+                    self.assertFalse(overlaps(box, other), (box, other))
+                placed.append(box)
+            self.assertEqual(sum(seg[1] for seg in skyline.segments), region[2])
+
+    def test_raise_to(self):
+        skyline = layout.Skyline((0, 0, 300, 400))
+        skyline.place(100, 50)
+        skyline.raise_to(20)  # never lowers the skyline
+        self.assertEqual(skyline.segments, [[0, 300, 50 + layout.GAP]])
+        skyline.raise_to(200)
+        self.assertEqual(skyline.segments, [[0, 300, 200]])
+        self.assertEqual(skyline.place(300, 50), (0, 200))
+        self.assertIsNone(skyline.place(10, 200))
+
+    def test_full_column_falls_back_to_the_bottom(self):
+        step = layout.StepLayout()
+        rects = [step.place({"action": "draw_rectangle", "width": 200, "height": 100}) for _ in range(12)]
+        boxes = [self.boxes(c) for c in rects]
+        bottom = layout.SHAPE_COLUMN[1] + layout.SHAPE_COLUMN[3]
+        fallback = (layout.SHAPE_COLUMN[0], bottom - 100, 200, 100)
+        fitted = boxes[:boxes.index(fallback)]
+        # once the column is full, the rest overlap at its bottom rather than leave the canvas
+        self.assertEqual(set(boxes[len(fitted):]), {fallback})
+        self.assertEqual(len(fitted), layout.SHAPE_COLUMN[3] // (100 + layout.GAP))
+        for i, box in enumerate(fitted):
+            self.assert_inside(box, layout.SHAPE_COLUMN)
+            self.assertFalse(any(overlaps(box, other) for other in fitted[:i]))
+
+    def test_text_extent(self):
+        rng = random.Random(7)
+        for _ in range(500):
+            words = ["x" * rng.randint(1, 60) for _ in range(rng.randint(0, 30))]
+            text = "".join(w + rng.choice([" ", " ", "\n"]) for w in words).strip(" ")
+            font_size, width = rng.choice([12, 18, 28]), rng.randint(40, 600)
+            used, height = layout.text_extent(text, font_size, width)
+            per_line = max(1, int(width / (font_size * layout.CHAR_WIDTH)))
+            self.assertLessEqual(used, width)
+            # at least one line per paragraph and enough lines for every character
+            lines = height / font_size
+            self.assertGreaterEqual(lines, text.count("\n") + 1)
+            self.assertGreaterEqual(lines * per_line, len(text.replace("\n", "")) - text.count(" ") - 1)
+        self.assertEqual(layout.text_extent("", 18, 100), (0, 18))
+
+    def test_generated_lessons(self):
+        rng = random.Random(2024)
+        canvas = (0, 0, layout.CANVAS_WIDTH, layout.CANVAS_HEIGHT)
+        for _ in range(300):
+            steps = random_lesson(rng)
+            duration = layout.layout_lesson(steps)
+            clock = 0
+            for step in steps:
+                self.assertEqual(step["start_ms"], clock)
+                at = step["start_ms"]
+                placed, rule_y = [], None
+                for command in step["drawing_commands"]:
+                    # timestamps never go backwards and stay inside their step
+                    self.assertGreaterEqual(command["at"], at)
+                    at = command["at"]
+                    self.assertLessEqual(at, step["end_ms"])
+                    if command["action"] == "clear_all":
+                        placed, rule_y = [], None
+                    elif command["action"] == "draw_line":
+                        rule_y = command["points"][1]
+                    box = self.boxes(command)
+                    if box is None:
+                        continue
+                    self.assert_inside(box, canvas)
+                    if rule_y is not None:
+                        self.assertGreater(box[1], rule_y)  # below the latest rule
+                    for other in placed:
+                        self.assertFalse(overlaps(box, other), (box, other))
+                    placed.append(box)
+                clock = step["end_ms"]
+                self.assertGreaterEqual(clock - step["start_ms"], step.get("speech_duration") or 0)
+            self.assertEqual(duration, clock)
+
+    def test_ensure_layout_relays_old_snapshots(self):
+        steps = random_lesson(random.Random(3))
+        snapshot = {"layout_version": layout.LAYOUT_VERSION - 1, "steps": steps}
+        self.assertIs(layout.ensure_layout(snapshot), snapshot)
+        self.assertEqual(snapshot["layout_version"], layout.LAYOUT_VERSION)
+        self.assertEqual(snapshot["duration_ms"], steps[-1]["end_ms"])
+        self.assertTrue(all("at" in c for step in steps for c in step["drawing_commands"]))
+
+        current = {"layout_version": layout.LAYOUT_VERSION, "steps": [{"drawing_commands": [{"action": "clear_all"}]}]}
+        layout.ensure_layout(current)
+        self.assertNotIn("duration_ms", current)
+        self.assertNotIn("at", current["steps"][0]["drawing_commands"][0])
+        self.assertEqual(layout.ensure_layout({})["duration_ms"], 0)
+
+
+class WireTests(SimpleTestCase):
+    def round_trip(self, frame):
+        text = wire.encode_frame(frame, wire.COMPACT)
+        self.assertEqual(wire.decode_frame(text), frame)
+        return text
+
+    def test_lesson_frame_round_trip(self):
+        steps = parse_teaching_steps(build_canned_lesson("Photosynthesis", 3))
+        frame = {"type": "lesson_ready", "teaching_steps": steps, "lesson_id": "l1"}
+        text = self.round_trip(frame)
+        self.assertLess(len(text), len(wire.encode_frame(frame)))
+        self.assertEqual(wire.decode_frame(wire.encode_frame(frame)), frame)
+
+    def test_trailing_nulls_are_trimmed(self):
+        command = {"action": "draw_circle", "time": 0, "x": 10, "y": 20, "radius": 5}
+        packed = wire.pack_command(command)
+        self.assertEqual(packed, [wire.ACTION_INDEX["draw_circle"], 0, None, 10, 20, 5])
+        self.assertEqual(wire.unpack_command(packed), command)
+        self.assertEqual(wire.pack_command({"action": "clear_all"}), [wire.ACTION_INDEX["clear_all"]])
+
+    def test_extra_keys_round_trip(self):
+        command = {"action": "draw_text", "time": 0, "text": "Hi", "id": "t1", "layer": 2}
+        self.assertEqual(wire.pack_command(command)[-1], {"id": "t1", "layer": 2})
+        step = {"step": 1, "speech_text": "Hi", "drawing_commands": [command], "topic": "x"}
+        self.round_trip({"type": "lesson_ready", "teaching_steps": [step]})
+
+    def test_object_valued_last_field_is_not_taken_for_extras(self):
+        command = {"action": "draw_line", "time": 0, "points": [0, 0, 5, 5], "strokeWidth": {"px": 2}}
+        packed = wire.pack_command(command)
+        self.assertEqual(packed[-2:], [{"px": 2}, {}])
+        self.assertEqual(wire.unpack_command(packed), command)
+        with_extras = dict(command, id="l1")
+        self.assertEqual(wire.unpack_command(wire.pack_command(with_extras)), with_extras)
+
+    def test_unknown_actions_are_sent_as_is(self):
+        command = {"action": "draw_star", "points": 5}
+        self.assertIs(wire.pack_command(command), command)
+        self.round_trip({"type": "lesson_ready", "teaching_steps": [{"step": 1, "drawing_commands": [command]}]})
+
+    def test_negotiate(self):
+        self.assertEqual(wire.negotiate({"subprotocols": [wire.COMPACT_SUBPROTOCOL]}),
+                         (wire.COMPACT, wire.COMPACT_SUBPROTOCOL))
+        self.assertEqual(wire.negotiate({"query_string": b"encoding=compact"}), (wire.COMPACT, None))
+        self.assertEqual(wire.negotiate({"query_string": b""}), (wire.JSON, None))
+
+
+class PermessageDeflateTests(SimpleTestCase):
+    HANDSHAKE = (b"GET /ws/teacher/ HTTP/1.1\r\nHost: test\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n"
+                 b"Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==\r\nSec-WebSocket-Version: 13\r\n"
+                 b"Sec-WebSocket-Extensions: permessage-deflate; client_max_window_bits\r\n\r\n")
+
+    def handshake_response(self, server_class):
+        """Run an opening handshake offering permessage-deflate against ``server_class``'s factory."""
+        from daphne.ws_protocol import WebSocketFactory
+        from twisted.internet.testing import StringTransport
+
+        daphne = mock.Mock(proxy_forwarded_address_header=None)
+        server = server_class.__new__(server_class)
+        server.ws_factory = WebSocketFactory(daphne, server="Daphne")
+        protocol = server.ws_factory.buildProtocol(None)
+        protocol._raw_query_string = b""
+        transport = StringTransport()
+        protocol.makeConnection(transport)
+        protocol.dataReceived(self.HANDSHAKE)
+        protocol.handshake_deferred.callback(None)  # the application accepted
+        return transport.value()
+
+    def test_deflate_server_negotiates_permessage_deflate(self):
+        response = self.handshake_response(wsserver.DeflateServer)
+        self.assertIn(b"101 Switching Protocols", response)
+        self.assertIn(b"Sec-WebSocket-Extensions: permessage-deflate", response)
+
+    def test_plain_daphne_and_disabled_setting_stay_uncompressed(self):
+        from daphne.server import Server
+
+        self.assertNotIn(b"permessage-deflate", self.handshake_response(Server))
+        with override_settings(WS_PERMESSAGE_DEFLATE=False):
+            response = self.handshake_response(wsserver.DeflateServer)
+        self.assertIn(b"101 Switching Protocols", response)
+        self.assertNotIn(b"permessage-deflate", response)
+
+
+application = URLRouter(routing.websocket_urlpatterns)
+
+
+@override_settings(LLM_PROVIDER="stub", LLM_STUB_TOKENS_PER_SECOND=0, RATE_LIMIT_ENABLED=False, SPOOL_ENABLED=False)
+class WebsocketTestCase(SimpleTestCase):
+    """Consumers driven through WebsocketCommunicator with the stub LLM and no MongoDB."""
+
+    def setUp(self):
+        patcher = mock.patch.multiple(consumers, conversations=None, messages=None, lesson_snapshots=None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def connect(self, path="/ws/teacher/"):
+        communicator = WebsocketCommunicator(application, path)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())["type"], "status")
+        return communicator
+
+    async def receive_until(self, communicator, frame_type):
+        while True:
+            frame = await communicator.receive_json_from(timeout=5)
+            if frame["type"] == frame_type:
+                return frame
+
+    async def start_lesson(self, communicator, conversation_id, user_id="alice", topic="Photosynthesis"):
+        await communicator.send_json_to({"topic": topic, "user_id": user_id, "conversation_id": conversation_id})
+        await self.receive_until(communicator, "lesson_start")
+        self.addCleanup(lambda: registry.get(conversation_id) and registry.remove(registry.get(conversation_id)))
+        return registry.get(conversation_id)
+
+    async def wait_done(self, session):
+        for _ in range(500):
+            if session.done:
+                return
+            await asyncio.sleep(0.01)
+        self.fail("lesson did not finish")
+
+
+class LessonSessionTests(WebsocketTestCase):
+    async def test_only_the_lessons_user_may_resume_it(self):
+        conversation_id = "0123456789abcdef00000001"
+        host = await self.connect()
+        await self.start_lesson(host, conversation_id)
+        await self.receive_until(host, "lesson_ready")
+
+        for user_id in ("bob", None):
+            other = await self.connect()
+            await other.send_json_to({"action": "resume", "conversation_id": conversation_id, "user_id": user_id})
+            self.assertEqual((await other.receive_json_from())["type"], "resume_failed")
+            await other.disconnect()
+
+        again = await self.connect()
+        await again.send_json_to({"action": "resume", "conversation_id": conversation_id, "user_id": "alice"})
+        self.assertEqual((await again.receive_json_from())["type"], "resumed")
+        self.assertEqual((await again.receive_json_from())["type"], "lesson_start")
+        await again.disconnect()
+        await host.disconnect()
+
+    async def test_anonymous_lesson_is_resumable_once_detached(self):
+        conversation_id = "0123456789abcdef00000002"
+        host = await self.connect()
+        await self.start_lesson(host, conversation_id, user_id=None)
+        await self.receive_until(host, "lesson_ready")
+
+        other = await self.connect()
+        await other.send_json_to({"action": "resume", "conversation_id": conversation_id})
+        self.assertEqual((await other.receive_json_from())["type"], "resume_failed")
+        await host.disconnect()
+        await other.send_json_to({"action": "resume", "conversation_id": conversation_id})
+        self.assertEqual((await other.receive_json_from())["type"], "resumed")
+        await other.disconnect()
+
+    @override_settings(LLM_STUB_TOKENS_PER_SECOND=1000)
+    async def test_resume_during_generation_leaves_the_lesson_in_its_session(self):
+        finished_id, generating_id = "0123456789abcdef00000003", "0123456789abcdef00000004"
+        first = await self.connect()
+        finished = await self.start_lesson(first, finished_id)
+        await self.wait_done(finished)
+        frames_before = finished.last_seq
+
+        second = await self.connect()
+        generating = await self.start_lesson(second, generating_id)
+        await second.send_json_to({"action": "resume", "conversation_id": finished_id, "user_id": "alice"})
+        await self.receive_until(second, "resumed")
+        self.assertFalse(generating.done)
+
+        await self.wait_done(generating)
+        self.assertEqual(finished.last_seq, frames_before)
+        self.assertIn("lesson_ready", [frame["type"] for frame in generating.frames])
+        await first.disconnect()
+        await second.disconnect()
+
+
+class ClassroomTests(WebsocketTestCase):
+    async def join(self, room_id, host=False, compact=False):
+        path = f"/ws/classroom/{room_id}/" + ("?role=host" if host else "")
+        communicator = WebsocketCommunicator(
+            application, path, subprotocols=[wire.COMPACT_SUBPROTOCOL] if compact else None)
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from()  # connected / waiting status
+        return communicator
+
+    async def run_lesson(self, room_id, viewer_count):
+        """Run a lesson to a room; returns how many times a frame was serialized."""
+        calls = []
+
+        def counting(frame, encoding=wire.JSON):
+            calls.append(frame.get("type"))
+            return wire.encode_frame(frame, encoding)
+
+        with mock.patch.object(consumers, "encode_frame", counting), \
+                mock.patch.object(classroom, "encode_frame", counting):
+            host = await self.join(room_id, host=True)
+            viewers = [await self.join(room_id, compact=(i == 0)) for i in range(viewer_count)]
+            await host.send_json_to({"topic": "Photosynthesis", "user_id": "alice"})
+            await self.receive_until(host, "lesson_ready")
+            for viewer in viewers:
+                frame = await self.receive_until(viewer, "lesson_ready")
+                self.assertEqual(len(frame["teaching_steps"]), 5)
+            await asyncio.sleep(0.05)
+            for communicator in [host] + viewers:
+                await communicator.disconnect()
+        return len(calls)
+
+    async def test_frames_are_serialized_once_whatever_the_audience(self):
+        self.assertEqual(await self.run_lesson("room-a", 2), await self.run_lesson("room-b", 8))
+
+    async def test_large_room_serializes_each_frame_once_per_encoding(self):
+        layer = get_channel_layer()
+        viewers = [await layer.new_channel() for _ in range(500)]
+        for channel in viewers:
+            await layer.group_add(classroom.group_name("room-big"), channel)
+        calls = []
+
+        def counting(frame, encoding=wire.JSON):
+            calls.append((frame["seq"], encoding))
+            return wire.encode_frame(frame, encoding)
+
+        host = await self.join("room-big", host=True)
+        with mock.patch.object(classroom, "encode_frame", counting):
+            await host.send_json_to({"topic": "Photosynthesis", "user_id": "alice"})
+            await self.receive_until(host, "lesson_ready")
+            await asyncio.sleep(0.05)
+        await host.disconnect()
+
+        published = sorted({seq for seq, _ in calls})
+        self.assertEqual(len(calls), len(set(calls)))  # never twice in the same encoding
+        self.assertEqual([seq for seq, encoding in calls if encoding == wire.JSON], published)
+        expected = None
+        for channel in viewers:
+            messages = [await asyncio.wait_for(layer.receive(channel), 1) for _ in published]
+            texts = [(m["text"], m.get("compact_text")) for m in messages]
+            expected = expected or texts
+            self.assertEqual(texts, expected)
+        lesson = [json.loads(text) for text, compact in expected if compact is not None]
+        self.assertEqual([frame["type"] for frame in lesson], ["lesson_ready"])
+        self.assertEqual(sum(encoding == wire.COMPACT for _, encoding in calls), 1)
+
+    async def test_playback_is_broadcast_but_not_kept_for_resume(self):
+        conversation_id = "0123456789abcdef00000005"
+        host = await self.join("room-c", host=True)
+        viewer = await self.join("room-c")
+        session = await self.start_lesson(host, conversation_id)
+        await self.receive_until(viewer, "lesson_ready")
+
+        await host.send_json_to({"action": "playback", "step_index": 2, "position_ms": 1500})
+        frame = await self.receive_until(viewer, "playback_sync")
+        self.assertEqual((frame["step_index"], frame["position_ms"]), (2, 1500))
+        self.assertNotIn("playback_sync", [f["type"] for f in session.frames])
+
+        late = WebsocketCommunicator(application, "/ws/classroom/room-c/")
+        await late.connect()
+        snapshot = await late.receive_json_from()
+        self.assertEqual(snapshot["type"], "classroom_snapshot")
+        self.assertEqual(snapshot["frames"][-1]["type"], "playback_sync")
+        self.assertEqual(snapshot["seq"], frame["seq"])
+        for communicator in (late, viewer, host):
+            await communicator.disconnect()
+
+    async def test_host_replay_is_broadcast(self):
+        steps = consumers.parse_teaching_steps(build_canned_lesson("Photosynthesis", 3))
+        snapshot = create_lesson_snapshot(None, "alice", "Photosynthesis", "Photosynthesis", steps,
+                                          notes_and_quiz={"notes": ["n"]})
+        host = await self.join("room-d", host=True)
+        viewer = await self.join("room-d")
+        with mock.patch.object(consumers, "get_latest_snapshot", mock.AsyncMock(return_value=snapshot)):
+            await host.send_json_to({"action": "replay", "conversation_id": "0123456789abcdef00000006"})
+            self.assertTrue((await self.receive_until(host, "lesson_ready"))["replay"])
+            frame = await self.receive_until(viewer, "lesson_ready")
+            self.assertTrue(frame["replay"])
+            self.assertEqual(len(frame["teaching_steps"]), 3)
+            self.assertEqual((await viewer.receive_json_from())["type"], "notes_and_quiz_ready")
+        await viewer.disconnect()
+        await host.disconnect()
+
+
+class ConversationSummaryTests(SimpleTestCase):
+    def test_activity_update_folds_in_new_messages(self):
+        docs = [create_message("c1", "user", "Topic: Cells", "topic_request"),
+                create_message("c1", "ai", "Step one", "teaching_step"),
+                create_message("c1", "ai", "Old-style step", "lesson_step"),
+                create_message("c1", "ai", "  Notes\n and   quiz  " + "x" * 200, "notes_and_quiz")]
+        docs[-1]["timestamp"] = datetime(2026, 1, 2, 3, 4, 5)
+        update = conversation_activity_update(docs)
+        self.assertEqual(update["$inc"], {"message_count": 4, "lesson_step_count": 2})
+        self.assertEqual(update["$set"]["last_activity_at"], datetime(2026, 1, 2, 3, 4, 5))
+        self.assertEqual(update["$set"]["updated_at"], datetime(2026, 1, 2, 3, 4, 5))
+        preview = update["$set"]["last_message_preview"]
+        self.assertTrue(preview.startswith("Notes and quiz xxx") and preview.endswith("..."))
+        self.assertEqual(len(preview), PREVIEW_LENGTH)
+
+    def test_activity_update_without_timestamp_or_content(self):
+        message = {"sender": "ai", "message_type": "text"}
+        before = datetime.utcnow()
+        update = conversation_activity_update([message])
+        self.assertEqual(update["$inc"], {"message_count": 1, "lesson_step_count": 0})
+        self.assertEqual(update["$set"]["last_message_preview"], "")
+        self.assertGreaterEqual(update["$set"]["last_activity_at"], before)
+
+    def test_sidebar_index_is_the_listing_query(self):
+        (sidebar,) = [m.document for m in mongo.INDEXES["conversations"] if m.document["name"] == "sidebar"]
+        self.assertEqual(list(sidebar["key"].items()), [("user_id", 1), ("is_active", 1), ("updated_at", -1)])
+
+    def test_ensure_indexes_replaces_an_index_whose_keys_changed(self):
+        old = {"name": "sidebar", "key": {"user_id": 1, "is_active": 1, "updated_at": -1, "_id": 1, "title": 1}}
+        current = {"name": "stale", "key": {"last_activity_at": 1, "updated_at": 1}}
+        collections = {}
+
+        def collection(name):
+            existing = [old, current] if name == "conversations" else []
+            return collections.setdefault(name, mock.Mock(
+                list_indexes=mock.Mock(side_effect=lambda: AsyncDocs(existing)),
+                drop_index=mock.AsyncMock(), create_indexes=mock.AsyncMock(return_value=[])))
+
+        database = mock.MagicMock()
+        database.__getitem__.side_effect = collection
+        asyncio.run(mongo.ensure_indexes(database))
+        collections["conversations"].drop_index.assert_awaited_once_with("sidebar")
+        collections["messages"].drop_index.assert_not_awaited()
+
+
+class FakeProgressCollection:
+    """find_one_and_update / find_one over dicts, applying progress_pipeline's single $set stage."""
+
+    def __init__(self):
+        self.docs = []
+
+    def _match(self, query):
+        return next((d for d in self.docs if all(d.get(k) == v for k, v in query.items())), None)
+
+    async def find_one_and_update(self, query, pipeline, upsert=False, return_document=None):
+        doc = self._match(query)
+        before = dict(doc) if doc is not None else None
+        if doc is None:
+            doc = {"_id": ObjectId(), **query}
+            self.docs.append(doc)
+        for stage in pipeline:
+            doc.update({key: value["$literal"] for key, value in stage["$set"].items()})
+        return before
+
+    async def find_one(self, query, projection=None):
+        return self._match(query)
+
+
+class ProgressDeltaTests(SimpleTestCase):
+    def added(self, update):
+        """The amount each counter of an increment_update() pipeline adds."""
+        return {name: expr["$add"][1] for name, expr in update[0]["$set"].items()}
+
+    def test_deltas_for_every_transition(self):
+        cases = {
+            (None, False): {"learners": 1, "completed": 0},   # first write, in progress
+            (None, True): {"learners": 1, "completed": 1},    # first write, already complete
+            (False, False): {"learners": 0, "completed": 0},
+            (False, True): {"learners": 0, "completed": 1},
+            (True, True): {"learners": 0, "completed": 0},
+            (True, False): {"learners": 0, "completed": -1},  # steps reset below the total
+        }
+        for (was, now), deltas in cases.items():
+            self.assertEqual(analytics.progress_deltas(was, now), deltas, (was, now))
+            update = analytics.progress_update(was, now)
+            if any(deltas.values()):
+                self.assertEqual(self.added(update), {"attempts": 0, "score_total": 0, **deltas})
+                self.assertIs(update[1], analytics.RATES_STAGE)
+            else:
+                self.assertIsNone(update)
+
+    def test_is_complete(self):
+        self.assertTrue(analytics.is_complete({"completed_steps": 4, "total_steps": 4}))
+        self.assertTrue(analytics.is_complete({"completed_steps": "5", "total_steps": "4"}))
+        self.assertFalse(analytics.is_complete({"completed_steps": 3, "total_steps": 4}))
+        self.assertFalse(analytics.is_complete({"completed_steps": 0, "total_steps": 0}))
+        self.assertFalse(analytics.is_complete({"completed_steps": "all", "total_steps": None}))
+        self.assertFalse(analytics.is_complete(None))
+
+    def test_quiz_update(self):
+        self.assertEqual(self.added(analytics.quiz_update("7.5")),
+                         {"attempts": 1, "score_total": 7.5, "learners": 0, "completed": 0})
+        self.assertEqual(self.added(analytics.quiz_update("n/a"))["score_total"], 0.0)
+
+    def test_apply_is_best_effort(self):
+        collection = mock.Mock(update_one=mock.AsyncMock(side_effect=AutoReconnect("down")))
+        update = analytics.quiz_update(1)
+        asyncio.run(analytics._apply(collection, "l1", update))  # logged, not raised
+        collection.update_one.assert_awaited_once_with({"lesson_id": "l1"}, update, upsert=True)
+        collection.update_one.reset_mock()
+        asyncio.run(analytics._apply(collection, None, update))
+        asyncio.run(analytics._apply(collection, "l1", None))
+        collection.update_one.assert_not_awaited()
+
+
+class SaveProgressTests(SimpleTestCase):
+    def progress(self, completed, total=4):
+        return {"student_id": "s1", "lesson_id": "l1", "completed_steps": completed, "total_steps": total}
+
+    def test_records_and_analytics_deltas(self):
+        progress, updates = FakeProgressCollection(), []
+        with mock.patch("teacher_app.analytics._apply", mock.AsyncMock(
+                side_effect=lambda collection, lesson_id, update: updates.append(update))):
+            first = asyncio.run(save_progress(progress, None, self.progress(1)))
+            second = asyncio.run(save_progress(progress, None, self.progress(4)))
+            asyncio.run(save_progress(progress, None, self.progress(4)))
+
+        self.assertEqual(first["_id"], second["_id"])
+        self.assertEqual(second["completed_steps"], 4)
+        self.assertEqual(len(progress.docs), 1)
+        self.assertNotIn("previously_complete", progress.docs[0])
+        learners_then_completed = [(u[0]["$set"]["learners"]["$add"][1], u[0]["$set"]["completed"]["$add"][1])
+                                   if u else None for u in updates]
+        self.assertEqual(learners_then_completed, [(1, 0), (0, 1), None])
+
+
+@override_settings(TOPIC_INDEX_ENABLED=True)
+class RememberLessonTests(SimpleTestCase):
+    def remember(self, index):
+        collection = mock.Mock(update_one=mock.AsyncMock())
+        with mock.patch.object(topic_index, "get_index", return_value=index), \
+                mock.patch.object(topic_index, "_collection", return_value=collection):
+            asyncio.run(topic_index.remember_lesson("Photosynthesis in plants", "c1", "u1"))
+        return collection.update_one
+
+    def test_persisted_while_the_index_loads(self):
+        update_one = self.remember(None)
+        update_one.assert_awaited_once()
+        self.assertEqual(update_one.call_args.args[1]["$set"]["conversation_id"], "c1")
+
+    def test_added_to_a_loaded_index(self):
+        index = topic_index.TopicIndex()
+        self.remember(index).assert_awaited_once()
+        self.assertEqual(index.lookup("photosynthesis in plants")["conversation_id"], "c1")
+
+
+class AsyncDocs:
+    """Async iteration over a list, like a Motor cursor."""
+
+    def __init__(self, docs):
+        self.docs = iter(docs)
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self.docs)
+        except StopIteration:
+            raise StopAsyncIteration
+
+
+class RetentionTests(SimpleTestCase):
+    def test_restore_keeps_last_activity_and_stamps_restored_at(self):
+        last_activity = datetime(2020, 1, 2)
+        db = {name: mock.Mock(bulk_write=mock.AsyncMock()) for name in ("conversations", "messages", "lesson_snapshots")}
+        record = {"conversation": {"_id": ObjectId(), "last_activity_at": last_activity},
+                  "messages": [{"_id": ObjectId()}], "lesson_snapshots": []}
+        counts = asyncio.run(restore_records(db, [record]))
+
+        self.assertEqual(counts, {"conversations": 1, "messages": 1, "lesson_snapshots": 0})
+        restored = db["conversations"].bulk_write.call_args.args[0][0]._doc
+        self.assertEqual(restored["last_activity_at"], last_activity)
+        self.assertLess(datetime.utcnow() - restored["restored_at"], timedelta(minutes=1))
+
+    def test_stale_query_skips_recent_restores(self):
+        now = datetime(2026, 6, 1)
+        query = stale_conversations_query(180, now=now, restore_grace_days=30)
+        self.assertEqual(query["restored_at"], {"$not": {"$gte": datetime(2026, 5, 2)}})
+        self.assertEqual(query["$or"][0], {"last_activity_at": {"$lt": now - timedelta(days=180)}})
+        self.assertNotIn("restored_at", stale_conversations_query(180, now=now))
+
+    def test_sweep_marks_children_stored_after_the_delete(self):
+        deleted_at = datetime(2026, 6, 1)
+        conversation_id = ObjectId()
+        conversations = mock.Mock(find=mock.Mock(return_value=AsyncDocs([{"_id": conversation_id,
+                                                                           "deleted_at": deleted_at}])))
+        children = {name: mock.Mock(update_many=mock.AsyncMock(return_value=mock.Mock(modified_count=2)))
+                    for name in ("messages", "lesson_snapshots")}
+        swept = asyncio.run(sweep_deleted_children({"conversations": conversations, **children}))
+
+        self.assertEqual(swept, {"messages": 2, "lesson_snapshots": 2})
+        children["messages"].update_many.assert_awaited_once_with(
+            {"conversation_id": conversation_id, "deleted_at": None}, {"$set": {"deleted_at": deleted_at}})
+
+
+class SaveProgressBulkTests(SimpleTestCase):
+    def test_lost_upsert_race_updates_the_other_record(self):
+        docs = [create_progress("s1", 7, 4, 4, 0), create_progress("s2", 7, 1, 4, 0)]
+        race = BulkWriteError({"writeErrors": [{"index": 0, "code": 11000, "errmsg": "E11000"}],
+                               "nMatched": 0, "nUpserted": 1})
+        progress = mock.Mock(find=mock.Mock(return_value=AsyncDocs([])), bulk_write=mock.AsyncMock(side_effect=race),
+                             find_one_and_update=mock.AsyncMock(return_value={"completed_steps": 1, "total_steps": 4}))
+        analytics = mock.Mock(bulk_write=mock.AsyncMock())
+        result = asyncio.run(save_progress_bulk(progress, analytics, docs))
+
+        self.assertEqual(result, {"matched": 1, "upserted": 1, "lessons": 1})
+        query, update = progress.find_one_and_update.call_args.args
+        self.assertEqual(query, {"student_id": "s1", "lesson_id": "7"})
+        self.assertNotIn("upsert", progress.find_one_and_update.call_args.kwargs)
+        # s1 existed (created by the other request) and is now complete; s2 is a new learner
+        (write,) = analytics.bulk_write.call_args.args[0]
+        self.assertEqual(write._doc[0]["$set"]["learners"]["$add"][1], 1)
+        self.assertEqual(write._doc[0]["$set"]["completed"]["$add"][1], 1)
+
+    def test_other_bulk_errors_are_raised(self):
+        error = BulkWriteError({"writeErrors": [{"index": 0, "code": 121, "errmsg": "validation"}],
+                                "nMatched": 0, "nUpserted": 0})
+        progress = mock.Mock(find=mock.Mock(return_value=AsyncDocs([])), bulk_write=mock.AsyncMock(side_effect=error))
+        with self.assertRaises(BulkWriteError):
+            asyncio.run(save_progress_bulk(progress, None, [create_progress("s1", "7", 1, 4, 0)]))
+
+    def test_lesson_ids_are_stored_as_strings(self):
+        self.assertEqual(create_progress("s1", 7, 1, 4, 0)["lesson_id"], "7")
+        self.assertEqual(create_quiz("s1", 7, [], 1, "")["lesson_id"], "7")
+        self.assertIsNone(create_progress("s1", None, 1, 4, 0)["lesson_id"])
+
+
+class FakeQueueCollection:
+    """The subset of a Motor collection batch.py's queue uses, over dicts: equality, $in, $lte and
+    $ne filters, $set/$inc updates and a $match/$group aggregation."""
+
+    def __init__(self):
+        self.docs = []
+
+    @staticmethod
+    def _matches(doc, query):
+        for key, condition in query.items():
+            value = doc.get(key)
+            if isinstance(condition, dict):
+                if "$in" in condition and value not in condition["$in"]:
+                    return False
+                if "$lte" in condition and not value <= condition["$lte"]:
+                    return False
+                if "$ne" in condition and value == condition["$ne"]:
+                    return False
+            elif value != condition:
+                return False
+        return True
+
+    @staticmethod
+    def _apply(doc, update):
+        doc.update(update.get("$set", {}))
+        for key, amount in update.get("$inc", {}).items():
+            doc[key] = doc.get(key, 0) + amount
+
+    def _find(self, query):
+        return [doc for doc in self.docs if self._matches(doc, query)]
+
+    async def insert_many(self, docs, ordered=True):
+        for doc in docs:
+            await self.insert_one(doc)
+
+    async def insert_one(self, doc):
+        doc.setdefault("_id", ObjectId())  # like pymongo, on the caller's dict
+        self.docs.append(doc)
+
+    async def find_one(self, query):
+        return next(iter(self._find(query)), None)
+
+    def find(self, query, projection=None):
+        found = self._find(query)
+        return mock.Mock(sort=lambda key, direction: AsyncDocs(sorted(found, key=lambda doc: doc[key])))
+
+    async def find_one_and_update(self, query, update, sort=None):
+        found = self._find(query)
+        for key, direction in reversed(sort or []):
+            found.sort(key=lambda doc: doc[key], reverse=direction < 0)
+        if not found:
+            return None
+        before = dict(found[0])
+        self._apply(found[0], update)
+        return before
+
+    async def update_one(self, query, update):
+        found = self._find(query)[:1]
+        for doc in found:
+            self._apply(doc, update)
+        return mock.Mock(matched_count=len(found), modified_count=len(found))
+
+    async def update_many(self, query, update):
+        found = self._find(query)
+        for doc in found:
+            self._apply(doc, update)
+        return mock.Mock(matched_count=len(found), modified_count=len(found))
+
+    async def count_documents(self, query):
+        return len(self._find(query))
+
+    def aggregate(self, pipeline):
+        match, group = pipeline[0]["$match"], pipeline[1]["$group"]
+        groups = {}
+        for doc in self._find(match):
+            key = tuple((name, doc.get(field[1:])) for name, field in group["_id"].items())
+            out = groups.setdefault(key, {"_id": dict(key), **{name: 0 for name in group if name != "_id"}})
+            for name, spec in group.items():
+                if name != "_id":
+                    value = 1 if spec["$sum"] == 1 else doc.get(spec["$sum"][1:])
+                    out[name] += value or 0
+        return AsyncDocs(list(groups.values()))
+
+
+class BatchQueueTests(SimpleTestCase):
+    def setUp(self):
+        self.db = {batch.JOBS: FakeQueueCollection(), batch.ITEMS: FakeQueueCollection()}
+
+    def run_queue(self, coroutine):
+        return asyncio.run(coroutine)
+
+    def enqueue(self, topics):
+        return self.run_queue(batch.enqueue_job(self.db, "u1", "syllabus", topics))
+
+    def report(self, job):
+        return self.run_queue(batch.get_job(self.db, job["_id"], with_items=True))
+
+    def expire(self, item):
+        stored = self.run_queue(self.db[batch.ITEMS].find_one({"_id": item["_id"]}))
+        stored["available_at"] = datetime.utcnow() - timedelta(seconds=1)
+
+    def test_claims_are_leases_and_counts_come_from_the_items(self):
+        job = self.enqueue(["Cells", "cells", "Atoms", "Ions"])  # repeated topics are queued once
+        first = self.run_queue(batch.claim_item(self.db, "w1", 60))
+        second = self.run_queue(batch.claim_item(self.db, "w2", 60))
+        self.assertEqual((first["topic"], first["attempts"]), ("Cells", 1))
+        self.assertEqual(second["topic"], "Atoms")  # the leased item is not claimable
+        report = self.report(job)
+        self.assertEqual(report["status"], "running")
+        self.assertEqual(report["counts"], {"queued": 1, "running": 2, "done": 0, "failed": 0})
+        self.assertIsNotNone(report["started_at"])
+
+        self.assertTrue(self.run_queue(batch.renew_lease(self.db, first, 60)))
+        self.assertTrue(self.run_queue(batch.finish_item(self.db, first, batch.DONE, generation_ms=3000)))
+        self.assertTrue(self.run_queue(batch.requeue_item(self.db, second, "timeout", delay=600)))
+        report = self.report(job)
+        self.assertEqual(report["counts"], {"queued": 2, "running": 0, "done": 1, "failed": 0})
+        self.assertEqual(report["mean_generation_seconds"], 3.0)
+        # the backoff holds the requeued item back
+        self.assertEqual(self.run_queue(batch.claim_item(self.db, "w1", 60))["topic"], "Ions")
+        self.assertIsNone(self.run_queue(batch.claim_item(self.db, "w1", 60)))
+
+    def test_expired_lease_is_resumed_and_the_old_holder_is_fenced_off(self):
+        job = self.enqueue(["Cells"])
+        stale = self.run_queue(batch.claim_item(self.db, "w1", 60))
+        self.expire(stale)
+        with self.assertLogs("teacher_app.batch", "WARNING") as logs:
+            resumed = self.run_queue(batch.claim_item(self.db, "w2", 60))
+        self.assertIn("resumed after the lease of w1 expired", logs.output[0])
+        self.assertEqual((resumed["_id"], resumed["attempts"]), (stale["_id"], 2))
+        self.assertEqual(resumed["conversation_id"], stale["conversation_id"])  # a retry overwrites the lesson
+
+        self.assertFalse(self.run_queue(batch.renew_lease(self.db, stale, 60)))
+        self.assertFalse(self.run_queue(batch.finish_item(self.db, stale, batch.DONE)))
+        self.assertFalse(self.run_queue(batch.requeue_item(self.db, stale)))
+        self.assertEqual(self.report(job)["counts"]["running"], 1)
+        self.assertTrue(self.run_queue(batch.finish_item(self.db, resumed, batch.DONE)))
+        report = self.report(job)
+        self.assertEqual((report["status"], report["counts"]["done"], report["progress"]), ("finished", 1, 1.0))
+
+    def test_refunded_release_and_retry_failed(self):
+        job = self.enqueue(["Cells", "Atoms"])
+        item = self.run_queue(batch.claim_item(self.db, "w1", 60))
+        self.assertTrue(self.run_queue(batch.requeue_item(self.db, item, refund_attempt=True)))
+        other = self.run_queue(batch.claim_item(self.db, "w1", 60))  # released now, so behind Atoms
+        item = self.run_queue(batch.claim_item(self.db, "w1", 60))
+        self.assertEqual((other["topic"], item["topic"], item["attempts"]), ("Atoms", "Cells", 1))
+        self.run_queue(batch.finish_item(self.db, item, batch.FAILED, error="ValueError: no steps"))
+        self.assertEqual(self.report(job)["status"], "running")
+        self.run_queue(batch.finish_item(self.db, other, batch.DONE, generation_ms=1000))
+        report = self.report(job)
+        self.assertEqual(report["status"], "finished")
+        self.assertEqual([i["error"] for i in report["items"]], ["ValueError: no steps", None])
+
+        self.assertEqual(self.run_queue(batch.retry_failed(self.db, job["_id"])), 1)
+        report = self.report(job)
+        self.assertEqual((report["status"], report["finished_at"]), ("running", None))
+        self.assertEqual(report["counts"], {"queued": 1, "running": 0, "done": 1, "failed": 0})
+        self.assertEqual(report["items"][0]["attempts"], 0)
+
+    @override_settings(BATCH_LLM_REQUESTS_PER_MINUTE=0, BATCH_POLL_SECONDS=0.01)
+    def test_worker_pool_reports_throughput(self):
+        from .llm import StubProvider
+
+        job = self.enqueue(["Cells", "Atoms", "Ions", "Stars", "Waves", "Forces"])
+        pool = batch.BatchWorkerPool(self.db, workers=3, llm_concurrency=2, llm=StubProvider(steps=2))
+        reports = []
+
+        async def report():
+            reports.append(pool.stats())
+
+        with mock.patch("teacher_app.batch.store_lesson", mock.AsyncMock()) as store:
+            self.run_queue(pool.run(until_idle=True, report=report, report_every=0.001))
+        self.assertEqual(store.await_count, 6)
+        self.assertTrue(reports)
+        stats = pool.stats()
+        self.assertEqual((stats["done"], stats["failed"], stats["retried"]), (6, 0, 0))
+        self.assertGreater(stats["lessons_per_minute"], 0)
+        report = self.report(job)
+        self.assertEqual((report["status"], report["counts"]["done"]), ("finished", 6))
+        self.assertGreater(report["lessons_per_minute"], 0)
+        self.assertEqual(report["eta_seconds"], 0.0)
+
+
+class UploadPdfRateLimitTests(SimpleTestCase):
+    @override_settings(RATE_LIMIT_ENABLED=True, RATE_LIMIT_PDF_MB_BURST=0.01)
+    def test_rejected_upload_is_not_parsed(self):
+        upload = SimpleUploadedFile("big.pdf", b"%PDF-1.4 " + b"x" * 20000, content_type="application/pdf")
+        with mock.patch("django.http.multipartparser.MultiPartParser.parse") as parse:
+            response = self.client.post("/upload_pdf/", {"pdf_file": upload})
+        self.assertEqual(response.status_code, 413)  # larger than the whole bucket
+        parse.assert_not_called()
@@ -0,0 +1,462 @@
+# teacher_app/topic_index.py
+
+import asyncio
+import re
+import time
+import unicodedata
+import zlib
+from datetime import datetime
+
+import numpy as np
+from django.conf import settings
+from pymongo import UpdateOne
+
+from . import metrics
+
+# Near-duplicate lookup over the topics of stored lessons, so "Photosynthesis", "what is
+# photosynthesis?" and "photosynthesis in plants" can replay one lesson instead of generating
+# three. Topics are normalized (case, accents, filler words, plurals, word order), cut into
+# character 4-gram shingles and MinHashed; LSH over the signatures finds candidates, which are
+# then ranked by their exact shingle Jaccard similarity.
+#
+# In memory the LSH buckets are one sorted uint64 array of (band << 32 | band hash) keys plus the
+# entry each key belongs to, so a lookup is two np.searchsorted calls whatever the index size;
+# single additions sit in a small dict until they are merged in. The entries are persisted in
+# the topic_index collection (with their band keys, so loading does not recompute MinHashes)
+# and can be rebuilt from conversations with `manage.py rebuild_topic_index`.
+
+INDEX_VERSION = 1  # bump when normalization, shingling or hashing changes (forces a rebuild)
+COLLECTION = "topic_index"
+NUM_PERM = 64
+BANDS = 16
+ROWS = NUM_PERM // BANDS  # 16 bands x 4 rows: pairs at Jaccard 0.6 become candidates ~89% of the time
+MAX_CANDIDATES = 64       # candidates ranked exactly, most shared bands first
+MERGE_PENDING_KEYS = BANDS * 4096
+
+STOPWORDS = frozenset("""
+    a an the of in on at for to from and or with by into about is are was were be been being
+    what whats which who whom how why when where does do did can could would should will shall
+    explain explained explaining explanation describe description define definition tell teach teaching
+    learn learning me us my i you please give show introduction intro overview basics lesson
+    topic concept concepts understand understanding know simple simply kid kids child children
+    beginner beginners student students
+""".split())
+
+_PRIME = np.uint64(4294967311)  # smallest prime above 2**32
+_rng = np.random.RandomState(0x5EED)
+_A = _rng.randint(1, 2**32, NUM_PERM, dtype=np.uint64)
+_B = _rng.randint(0, 2**32, NUM_PERM, dtype=np.uint64)
+_MIX = np.uint64(0x9E3779B97F4A7C15)
+_FMIX = np.uint64(0xFF51AFD7ED558CCD)
+_LOW32 = np.uint64(0xFFFFFFFF)
+_BAND_TAGS = np.arange(BANDS, dtype=np.uint64) << np.uint64(32)
+
+_NUMBER_WORD = re.compile(r"\S*\d\S*")
+
+lookups = metrics.counter("topic_index_lookups_total", "Similar-topic lookups", ["result"])
+index_size = metrics.gauge("topic_index_entries", "Lesson topics held by the similar-topic index")
+
+
+def _stem(token):
+    return token[:-1] if len(token) > 3 and token.endswith("s") and not token.endswith("ss") else token
+
+
+def normalize_topic(topic):
+    """Canonical form of a topic: lower case, accents and filler words dropped, crude plural
+    stemming, unique words in sorted order ("What is Photosynthesis in plants?" ->
+    "photosynthesi plant")."""
+    text = unicodedata.normalize("NFKD", str(topic or "").casefold())
+    text = "".join(ch for ch in text if unicodedata.category(ch) != "Mn")
+    text = re.sub(r"['’]s\b", "", text)  # possessives: "newton's" -> "newton"
+    tokens = {_stem(t) for t in re.findall(r"\w+", text) if t not in STOPWORDS and t != "_"}
+    return " ".join(sorted(tokens))
+
+
+def numbers(normalized):
+    """Number words of a normalized topic; topics only match when these agree ("World War 1" is
+    not "World War 2", however similar the strings)."""
+    return set(_NUMBER_WORD.findall(normalized))
+
+
+def shingles(normalized):
+    padded = f" {normalized} "
+    if len(padded) <= 4:
+        return {padded}
+    return {padded[i:i + 4] for i in range(len(padded) - 3)}
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 0.0
+
+
+def signatures(shingle_sets):
+    """MinHash signatures, shape (len(shingle_sets), NUM_PERM), of non-empty shingle sets."""
+    sizes = np.fromiter((len(s) for s in shingle_sets), dtype=np.int64, count=len(shingle_sets))
+    x = np.fromiter((zlib.crc32(sh.encode("utf-8")) for s in shingle_sets for sh in s), dtype=np.uint64,
+                    count=int(sizes.sum()))
+    hashed = (x[:, None] * _A[None, :] + _B[None, :]) % _PRIME  # no overflow: a, x, b < 2**32
+    starts = np.concatenate([[0], np.cumsum(sizes)[:-1]])
+    return np.minimum.reduceat(hashed, starts, axis=0)
+
+
+def signature(shingle_set):
+    return signatures([shingle_set])[0]
+
+
+def band_keys_many(sigs, scopes):
+    """LSH bucket keys, shape (len(sigs), BANDS): ``band << 32 | hash(band rows, scope)``.
+
+    Mixing the scope into every key keeps per-user indexes apart inside one array.
+    """
+    seeds = np.fromiter((zlib.crc32(scope.encode("utf-8")) for scope in scopes), dtype=np.uint64, count=len(scopes))
+    h = np.repeat(seeds[:, None], BANDS, axis=1)
+    rows = sigs.reshape(len(sigs), BANDS, ROWS)
+    for r in range(ROWS):
+        h = (h ^ rows[:, :, r]) * _MIX
+    h ^= h >> np.uint64(33)
+    h *= _FMIX
+    h ^= h >> np.uint64(29)
+    return _BAND_TAGS[None, :] | (h & _LOW32)
+
+
+def band_keys(sig, scope=""):
+    return band_keys_many(sig[None, :], [scope])[0]
+
+
+def entry_id(scope, normalized):
+    return f"{scope}\n{normalized}"
+
+
+class TopicIndex:
+    """In-memory MinHash/LSH index of lesson topics; one entry per (scope, normalized topic),
+    pointing at the latest conversation that taught it."""
+
+    def __init__(self, threshold=0.6):
+        self.threshold = threshold
+        self.topics = []            # display topic per entry
+        self.normalized = []
+        self.conversation_ids = []
+        self.scopes = []
+        self._by_id = {}            # entry_id -> entry index
+        self._keys = np.empty(0, dtype=np.uint64)   # sorted band keys
+        self._owners = np.empty(0, dtype=np.int32)  # entry index of each key
+        self._pending = {}          # band key -> [entry index], not merged yet
+        self._pending_keys = 0
+        self._pending_arrays = []   # bulk additions (keys, owners), merged by merge()
+
+    def __len__(self):
+        return len(self.topics)
+
+    def _append(self, topic, conversation_id, scope, normalized):
+        """Entry index of a new entry, or None when the topic is already indexed (the existing
+        entry is repointed to ``conversation_id``) or has no words."""
+        if not normalized:
+            return None
+        eid = entry_id(scope, normalized)
+        index = self._by_id.get(eid)
+        if index is not None:
+            self.topics[index] = topic
+            self.conversation_ids[index] = conversation_id
+            return None
+        index = self._by_id[eid] = len(self.topics)
+        self.topics.append(topic)
+        self.normalized.append(normalized)
+        self.conversation_ids.append(conversation_id)
+        self.scopes.append(scope)
+        return index
+
+    def add(self, topic, conversation_id, scope=""):
+        """Index a lesson topic; a topic already present (same normalized form) is repointed to
+        ``conversation_id``. Returns the entry id, or None if the topic has no words."""
+        normalized = normalize_topic(topic)
+        index = self._append(topic, conversation_id, scope, normalized)
+        if index is not None:
+            for key in band_keys(signature(shingles(normalized)), scope).tolist():
+                self._pending.setdefault(key, []).append(index)
+            self._pending_keys += BANDS
+            if self._pending_keys >= MERGE_PENDING_KEYS:
+                self.merge()
+        return entry_id(scope, normalized) if normalized else None
+
+    def add_many(self, items, chunk=10000):
+        """Bulk ``add`` of ``(topic, conversation_id, scope[, normalized, keys])`` items (loading
+        passes the stored normalized form and band keys), MinHashing up to ``chunk`` topics per
+        numpy operation and merging once at the end."""
+        computed, stored = [], []
+        for item in items:
+            topic, conversation_id, scope = item[:3]
+            normalized = item[3] if len(item) > 3 else normalize_topic(topic)
+            index = self._append(topic, conversation_id, scope, normalized)
+            if index is None:
+                continue
+            if len(item) > 4:
+                stored.append((index, item[4]))
+            else:
+                computed.append(index)
+            if len(computed) >= chunk:
+                self._stage_computed(computed)
+                computed = []
+            if len(stored) >= chunk:
+                self._stage_stored(stored)
+                stored = []
+        self._stage_computed(computed)
+        self._stage_stored(stored)
+        self.merge()
+
+    def _stage_computed(self, entries):
+        if entries:
+            keys = band_keys_many(signatures([shingles(self.normalized[i]) for i in entries]),
+                                  [self.scopes[i] for i in entries])
+            self._pending_arrays.append((keys.ravel(), np.repeat(np.array(entries, dtype=np.int32), BANDS)))
+
+    def _stage_stored(self, entries):
+        if entries:
+            keys = np.array([keys for _, keys in entries], dtype=np.uint64).ravel()
+            owners = np.repeat(np.array([i for i, _ in entries], dtype=np.int32), BANDS)
+            self._pending_arrays.append((keys, owners))
+
+    def merge(self):
+        """Fold pending additions into the sorted arrays: the additions are sorted on their own
+        and inserted in one linear pass, so merging a few thousand topics into a million-topic
+        index copies the arrays once instead of re-sorting them."""
+        if self._pending:
+            self._pending_arrays.append((
+                np.fromiter((k for k, owners in self._pending.items() for _ in owners), dtype=np.uint64,
+                            count=self._pending_keys),
+                np.fromiter((o for owners in self._pending.values() for o in owners), dtype=np.int32,
+                            count=self._pending_keys),
+            ))
+            self._pending = {}
+            self._pending_keys = 0
+        if not self._pending_arrays:
+            return
+        keys = np.concatenate([keys for keys, _ in self._pending_arrays])
+        owners = np.concatenate([owners for _, owners in self._pending_arrays])
+        self._pending_arrays = []
+        order = np.argsort(keys, kind="stable")
+        keys, owners = keys[order], owners[order]
+        positions = np.searchsorted(self._keys, keys, "right")
+        self._keys = np.insert(self._keys, positions, keys)
+        self._owners = np.insert(self._owners, positions, owners)
+
+    def entry_keys(self):
+        """Merged band keys per entry, shape (len(self), BANDS), in band order."""
+        self.merge()
+        return self._keys[np.lexsort((self._keys, self._owners))].reshape(-1, BANDS)
+
+    def _candidates(self, keys):
+        hits = {}
+        starts = np.searchsorted(self._keys, keys, "left")
+        ends = np.searchsorted(self._keys, keys, "right")
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            for owner in self._owners[start:end].tolist():
+                hits[owner] = hits.get(owner, 0) + 1
+        for key in keys.tolist():
+            for owner in self._pending.get(key, ()):
+                hits[owner] = hits.get(owner, 0) + 1
+        return sorted(hits, key=hits.get, reverse=True)[:MAX_CANDIDATES]
+
+    def lookup(self, topic, scope=""):
+        """The most similar indexed topic in ``scope`` at or above the threshold, as
+        ``{"conversation_id", "topic", "similarity"}``, or None."""
+        normalized = normalize_topic(topic)
+        if not normalized:
+            return None
+        index = self._by_id.get(entry_id(scope, normalized))
+        if index is not None:
+            return self._match(index, 1.0)
+        query, query_numbers = shingles(normalized), numbers(normalized)
+        best, best_similarity = None, self.threshold
+        for candidate in self._candidates(band_keys(signature(query), scope)):
+            other = self.normalized[candidate]
+            # Jaccard <= smaller set / larger set, and a topic of n characters has n - 1 shingles
+            # (fewer only if a 4-gram repeats, which real topics practically never do)
+            if self.scopes[candidate] != scope or \
+                    min(len(other), len(normalized)) - 1 < best_similarity * (max(len(other), len(normalized)) - 1):
+                continue
+            similarity = jaccard(query, shingles(other))
+            if similarity >= best_similarity and numbers(self.normalized[candidate]) == query_numbers:
+                best, best_similarity = candidate, similarity
+        return None if best is None else self._match(best, best_similarity)
+
+    def _match(self, index, similarity):
+        return {"conversation_id": self.conversation_ids[index], "topic": self.topics[index],
+                "similarity": round(similarity, 3)}
+
+
+def index_document(index, eid, keys=None):
+    """topic_index document (``$set`` fields) of an entry."""
+    i = index._by_id[eid]
+    if keys is None:
+        keys = band_keys(signature(shingles(index.normalized[i])), index.scopes[i])
+    return {"topic": index.topics[i], "conversation_id": index.conversation_ids[i], "scope": index.scopes[i],
+            "normalized": index.normalized[i], "keys": [int(k) for k in keys], "version": INDEX_VERSION,
+            "updated_at": datetime.utcnow()}
+
+
+async def load_index(index, collection, since=None, batch_size=5000):
+    """Add persisted entries (updated after ``since``) to ``index``; returns the newest updated_at."""
+    query = {"version": INDEX_VERSION}
+    if since is not None:
+        query["updated_at"] = {"$gt": since}
+    newest = since
+    cursor = collection.find(query, {"_id": 0, "topic": 1, "conversation_id": 1, "scope": 1, "normalized": 1,
+                                     "keys": 1, "updated_at": 1}, batch_size=batch_size)
+    batch = []
+    async for doc in cursor:
+        batch.append((doc["topic"], doc["conversation_id"], doc["scope"], doc["normalized"], doc["keys"]))
+        if newest is None or doc["updated_at"] > newest:
+            newest = doc["updated_at"]
+        if len(batch) >= batch_size:
+            index.add_many(batch)
+            batch = []
+    index.add_many(batch)
+    index_size.set(len(index))
+    return newest
+
+
+def rebuild_pipeline(user_scoped):
+    """Conversations that have a stored lesson for a typed topic, oldest activity first (so the
+    latest conversation per topic wins)."""
+    return [
+        {"$match": {"deleted_at": None, "topic": {"$nin": [None, ""]}, "pdf_filename": {"$in": [None, ""]}}},
+        {"$sort": {"last_activity_at": 1}},
+        {"$lookup": {"from": "lesson_snapshots", "localField": "_id", "foreignField": "conversation_id",
+                     "pipeline": [{"$limit": 1}, {"$project": {"_id": 1}}], "as": "snapshot"}},
+        {"$match": {"snapshot": {"$ne": []}}},
+        {"$project": {"topic": 1, "user_id": 1} if user_scoped else {"topic": 1}},
+    ]
+
+
+async def rebuild_index(db, user_scoped, batch_size=1000):
+    """Recompute the topic_index collection from conversations (written to a new collection and
+    swapped in). Returns ``(conversations read, entries written)``."""
+    index = TopicIndex()
+    target = db[f"{COLLECTION}_rebuild"]
+    await target.drop()
+    items = []
+    async for conversation in db["conversations"].aggregate(rebuild_pipeline(user_scoped), allowDiskUse=True):
+        items.append((conversation["topic"], conversation["_id"],
+                      str(conversation.get("user_id") or "anonymous") if user_scoped else ""))
+    index.add_many(items)
+    read = len(items)
+    keys = index.entry_keys()
+    writes = []
+    for eid, i in index._by_id.items():
+        writes.append(UpdateOne({"_id": eid}, {"$set": index_document(index, eid, keys[i])}, upsert=True))
+        if len(writes) >= batch_size:
+            await target.bulk_write(writes, ordered=False)
+            writes = []
+    if writes:
+        await target.bulk_write(writes, ordered=False)
+    if len(index):
+        from .mongo import INDEXES  # noqa: deferred, see _collection()
+        await target.create_indexes(INDEXES[COLLECTION])
+        await target.rename(COLLECTION, dropTarget=True)
+    else:
+        await db[COLLECTION].delete_many({})
+    return read, len(index)
+
+
+# ---------------- Process-wide index ----------------
+
+_index = None
+_loading = None
+_loaded_until = None
+_refreshed_at = 0.0
+
+
+def _scope(user_id):
+    return str(user_id or "anonymous") if getattr(settings, "TOPIC_INDEX_SCOPE", "global") == "user" else ""
+
+
+def _enabled():
+    return getattr(settings, "TOPIC_INDEX_ENABLED", True)
+
+
+def _collection():
+    from .mongo import db  # noqa: deferred so the index can be used without MongoDB (benchmarks)
+    return db[COLLECTION]
+
+
+async def _load():
+    global _index, _loaded_until, _refreshed_at
+    index = TopicIndex(getattr(settings, "TOPIC_SIMILARITY_THRESHOLD", 0.6))
+    started = time.perf_counter()
+    try:
+        _loaded_until = await load_index(index, _collection())
+        print(f"DEBUG: Topic index loaded {len(index)} topics in {time.perf_counter() - started:.1f}s")
+    except Exception as e:
+        print(f"DEBUG: Could not load the topic index, starting empty: {e}")
+    _index = index
+    _refreshed_at = time.monotonic()
+
+
+async def _refresh():
+    """Pick up topics added by other workers since the last load."""
+    global _loaded_until
+    try:
+        _loaded_until = await load_index(_index, _collection(), since=_loaded_until)
+    except Exception as e:
+        print(f"DEBUG: Could not refresh the topic index: {e}")
+
+
+def get_index():
+    """The loaded index, or None while it is loading (the first call starts the load in the
+    background); also schedules the periodic refresh."""
+    global _loading, _refreshed_at
+    if not _enabled():
+        return None
+    if _loading is None or _loading.done():
+        interval = getattr(settings, "TOPIC_INDEX_REFRESH_SECONDS", 60)
+        if _index is None:
+            _loading = asyncio.ensure_future(_load())
+        elif interval and time.monotonic() - _refreshed_at >= interval:
+            _refreshed_at = time.monotonic()
+            _loading = asyncio.ensure_future(_refresh())
+    return _index
+
+
+def find_similar_lesson(topic, user_id=None):
+    """The stored lesson whose topic is closest to ``topic`` (at or above
+    TOPIC_SIMILARITY_THRESHOLD), or None."""
+    index = get_index()
+    if index is None:
+        return None
+    match = index.lookup(topic, _scope(user_id))
+    lookups.inc(result="hit" if match else "miss")
+    return match
+
+
+async def remember_lesson(topic, conversation_id, user_id=None):
+    """Index the topic of a newly stored lesson and persist the entry (best effort). While the
+    index is still loading the entry is only persisted; the load or the next refresh adds it."""
+    index = get_index()
+    if index is None:
+        await persist_lesson_topic(topic, conversation_id, user_id)
+        return
+    if not topic or conversation_id is None:
+        return
+    eid = index.add(topic, conversation_id, _scope(user_id))
+    if eid is None:
+        return
+    index_size.set(len(index))
+    try:
+        await _collection().update_one({"_id": eid}, {"$set": index_document(index, eid)}, upsert=True)
+    except Exception as e:
+        print(f"DEBUG: Could not persist topic index entry: {e}")
+
+
+async def persist_lesson_topic(topic, conversation_id, user_id=None):
+    """Write the topic_index entry of a lesson stored outside the serving processes (batch
+    generation) without loading the index; serving workers pick it up on their next refresh."""
+    if not _enabled() or not topic or conversation_id is None:
+        return
+    entry = TopicIndex(getattr(settings, "TOPIC_SIMILARITY_THRESHOLD", 0.6))
+    eid = entry.add(topic, conversation_id, _scope(user_id))
+    if eid is None:
+        return
+    try:
+        await _collection().update_one({"_id": eid}, {"$set": index_document(entry, eid)}, upsert=True)
+    except Exception as e:
+        print(f"DEBUG: Could not persist topic index entry: {e}")
@@ -18,14 +18,23 @@ urlpatterns = [
     # API endpoints for React frontend
     path('api/students/', views.api_students, name='api_students'),
     path('api/lessons/', views.api_lessons, name='api_lessons'),
+    path('api/lessons/<str:lesson_id>/analytics/', views.api_lesson_analytics, name='api_lesson_analytics'),
     path('api/quizzes/', views.api_quizzes, name='api_quizzes'),
     path('api/progress/', views.api_progress, name='api_progress'),
+    path('api/progress/bulk/', views.api_progress_bulk, name='api_progress_bulk'),
+    path('api/metrics/', views.api_metrics, name='api_metrics'),
+    path('api/wire-schema/', views.api_wire_schema, name='api_wire_schema'),
     
     # Chat History endpoints
     path('api/conversations/', views.api_conversations, name='api_conversations'),
+    path('api/conversations/export/', views.api_export_conversations, name='api_export_conversations'),
+    path('api/search/', views.api_search, name='api_search'),
+    path('api/batch/jobs/', views.api_batch_jobs, name='api_batch_jobs'),
+    path('api/batch/jobs/<str:job_id>/', views.api_batch_job, name='api_batch_job'),
     path('api/conversations/<str:conversation_id>/messages/', views.api_conversation_messages, name='api_conversation_messages'),
     path('api/conversations/<str:conversation_id>/delete/', views.api_delete_conversation, name='api_delete_conversation'),
     path('api/conversations/<str:conversation_id>/rename/', views.api_rename_conversation, name='api_rename_conversation'),
+    path('api/conversations/<str:conversation_id>/replay/', views.api_conversation_replay, name='api_conversation_replay'),
     
     # Chat History endpoints
     path('api/conversations/', views.api_conversations, name='api_conversations'),
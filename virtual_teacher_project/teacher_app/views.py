@@ -2,20 +2,32 @@
 
 import logging
 import json
+import re
 from datetime import datetime
+from django.conf import settings
 from django.shortcuts import render
-from django.http import JsonResponse, HttpRequest
+from django.http import JsonResponse, HttpRequest, HttpResponse, HttpResponseNotAllowed, StreamingHttpResponse
 from django.views.decorators.http import require_POST, require_http_methods
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.contrib.auth import authenticate, login, logout
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
-import fitz  # PyMuPDF
 import asyncio
-from .mongo_collections import students, lessons, quizzes, progress, analytics, conversations, messages, conversations, messages
-from .mongo import create_student, create_lesson, create_quiz, create_progress
+from .mongo_collections import students, lessons, quizzes, progress, analytics, conversations, messages, conversations, messages, lesson_snapshots
+from .snapshots import ensure_snapshot_layout, get_latest_snapshot, serialize_snapshot
+from .codec import decode_message
+from . import metrics
+from . import wire
+from .mongo import db, create_student, create_lesson, create_quiz, create_progress, SIDEBAR_PROJECTION
+from .retention import soft_delete_conversation
+from .portability import gzip_chunks, open_export
+from .search import MAX_QUERY_CHARS, SearchIndexMissing, search_history
+from . import ratelimit
+from .batch import enqueue_job, extract_pdf_text, get_job, list_jobs, retry_failed
+from .analytics import coalesce_progress, get_lesson_analytics, record_quiz, save_progress, save_progress_bulk
 from bson import ObjectId
+from pymongo.errors import ConnectionFailure
 import asyncio
 
 # It's good practice to get a logger instance.
@@ -25,6 +37,18 @@ def teacher_view(request: HttpRequest):
     """Renders the main teacher page."""
     return render(request, "teacher_app/teacher.html")
 
+@require_http_methods(["GET"])
+def api_metrics(request: HttpRequest):
+    """Process metrics (MongoDB circuit breaker state etc.) in the Prometheus text format."""
+    return HttpResponse(metrics.render(), content_type="text/plain; version=0.0.4; charset=utf-8")
+
+@require_http_methods(["GET"])
+def api_wire_schema(request: HttpRequest):
+    """Key tables of the compact WebSocket encoding (see wire.py); fixed per COMPACT_VERSION."""
+    response = JsonResponse(wire.SCHEMA)
+    response["Cache-Control"] = "public, max-age=86400"
+    return response
+
 def landing_page(request: HttpRequest):
     """Serves the landing page."""
     # For now, we'll serve a simple HTML that will load the React app
@@ -35,28 +59,38 @@ def landing_page(request: HttpRequest):
 @require_POST
 def upload_pdf(request: HttpRequest):
     """Handles PDF file uploads, extracts text, and returns it as JSON."""
+    # Charged by the declared body size before the upload is parsed (and spooled) at all,
+    # so nothing above this may touch request.FILES or request.POST
+    try:
+        upload_bytes = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        upload_bytes = 0
+    decision = ratelimit.consume("pdf_bytes", ratelimit.request_key(request), max(upload_bytes, 1))
+    if not decision.allowed:
+        return ratelimit.rate_limited_response("pdf_bytes", decision)
+
     print(f"Upload PDF request received: {request.method}")
     print(f"Request headers: {dict(request.headers)}")
     print(f"Request FILES: {list(request.FILES.keys())}")
     print(f"Request META: {request.META.get('HTTP_ORIGIN', 'No origin')}")
-    
+
     if not request.FILES.get('pdf_file'):
         print("No pdf_file in request.FILES")
         return JsonResponse({'error': 'No PDF file found in the request.'}, status=400)
 
     pdf_file = request.FILES['pdf_file']
     print(f"PDF file received: {pdf_file.name}, size: {pdf_file.size}")
+    if not upload_bytes:  # no Content-Length (chunked upload): charge the actual size instead
+        decision = ratelimit.consume("pdf_bytes", ratelimit.request_key(request), pdf_file.size)
+        if not decision.allowed:
+            return ratelimit.rate_limited_response("pdf_bytes", decision)
     
     # Validate that it's a PDF file
     if not pdf_file.name.lower().endswith('.pdf'):
         return JsonResponse({'error': 'Invalid file type. Please upload a PDF.'}, status=400)
     
     try:
-        # Open the PDF from the in-memory file
-        doc = fitz.open(stream=pdf_file.read(), filetype="pdf")
-        text_content = ""
-        for page in doc:
-            text_content += page.get_text()
+        text_content = extract_pdf_text(pdf_file.read())
         
         if not text_content.strip():
              return JsonResponse({'error': 'Could not extract any text from the PDF.'}, status=400)
@@ -217,6 +251,7 @@ def api_quizzes(request: HttpRequest):
                 quiz_doc = create_quiz(student_id, lesson_id, questions_data, score, time_taken)
                 result = await quizzes.insert_one(quiz_doc)
                 quiz_doc['_id'] = str(result.inserted_id)
+                await record_quiz(analytics, quiz_doc['lesson_id'], score)
                 return quiz_doc
             
             loop = asyncio.new_event_loop()
@@ -281,18 +316,11 @@ def api_progress(request: HttpRequest):
             async def update_progress_async():
                 progress_doc = create_progress(student_id, lesson_id, completed_steps, total_steps, score)
                 
-                # Upsert progress (update if exists, insert if not)
-                filter_query = {'student_id': student_id, 'lesson_id': lesson_id}
-                result = await progress.replace_one(filter_query, progress_doc, upsert=True)
-                
-                if result.upserted_id:
-                    progress_doc['_id'] = str(result.upserted_id)
-                else:
-                    # Find the existing document to get its ID
-                    existing = await progress.find_one(filter_query)
-                    progress_doc['_id'] = str(existing['_id'])
+                # Upsert progress (update if exists, insert if not) and update the lesson's analytics
+                record = await save_progress(progress, analytics, progress_doc)
+                record['_id'] = str(record['_id'])
                 
-                return progress_doc
+                return record
             
             loop = asyncio.new_event_loop()
             asyncio.set_event_loop(loop)
@@ -307,6 +335,52 @@ def api_progress(request: HttpRequest):
         finally:
             loop.close()
 
+@csrf_exempt
+@require_POST
+def api_progress_bulk(request: HttpRequest):
+    """Apply many progress updates in one request: {"updates": [{student_id, lesson_id,
+    completed_steps, total_steps, score}, ...]}.
+
+    Clients coalesce locally (last update per student and lesson wins) and flush at most every
+    ``coalesce_ms``, which the response returns; the server coalesces each batch the same way.
+    """
+    try:
+        data = json.loads(request.body)
+    except json.JSONDecodeError:
+        return JsonResponse({'error': 'Invalid JSON'}, status=400)
+    updates = data.get('updates') if isinstance(data, dict) else None
+    if not isinstance(updates, list) or not all(isinstance(u, dict) for u in updates):
+        return JsonResponse({'error': 'updates must be a list of objects'}, status=400)
+    max_updates = getattr(settings, "PROGRESS_BULK_MAX_UPDATES", 500)
+    if len(updates) > max_updates:
+        return JsonResponse({'error': f'At most {max_updates} updates per request'}, status=400)
+    if any(not isinstance(u.get(key), (str, int)) or not u.get(key)
+           for u in updates for key in ('student_id', 'lesson_id')):
+        return JsonResponse({'error': 'Every update needs a student_id and a lesson_id'}, status=400)
+    if progress is None:
+        return JsonResponse({'error': 'Database not available'}, status=503)
+
+    progress_docs = coalesce_progress([
+        create_progress(u['student_id'], u['lesson_id'], u.get('completed_steps', 0),
+                        u.get('total_steps', 0), u.get('score', 0))
+        for u in updates
+    ])
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        result = loop.run_until_complete(save_progress_bulk(progress, analytics, progress_docs))
+        return JsonResponse({
+            'received': len(updates),
+            'applied': len(progress_docs),
+            **result,
+            'coalesce_ms': getattr(settings, "PROGRESS_COALESCE_MS", 1000),
+        })
+    except Exception as e:
+        logger.error(f"Error applying progress updates: {e}")
+        return JsonResponse({'error': str(e)}, status=500)
+    finally:
+        loop.close()
+
 # Authentication Views
 @csrf_exempt
 @require_POST
@@ -502,6 +576,7 @@ def api_conversation_messages(request: HttpRequest, conversation_id: str):
             try:
                 messages_list = []
                 async for message in messages.find({"conversation_id": ObjectId(conversation_id)}).sort("timestamp", 1):
+                    message = decode_message(message)
                     message['_id'] = str(message['_id'])
                     message['conversation_id'] = str(message['conversation_id'])
                     messages_list.append(message)
@@ -530,11 +605,8 @@ def api_delete_conversation(request: HttpRequest, conversation_id: str):
     """Delete a conversation (soft delete)."""
     try:
         async def delete_conversation():
-            result = await conversations.update_one(
-                {"_id": ObjectId(conversation_id)},
-                {"$set": {"is_active": False, "updated_at": datetime.utcnow()}}
-            )
-            return result.modified_count > 0
+            # Messages and snapshots are flagged too; the deleted_at TTL indexes purge them later
+            return await soft_delete_conversation(db, ObjectId(conversation_id))
         
         loop = asyncio.new_event_loop()
         asyncio.set_event_loop(loop)
@@ -603,7 +675,9 @@ def api_conversations(request: HttpRequest):
         async def get_conversations():
             try:
                 conversations_list = []
-                async for conversation in conversations.find({"user_id": user_id}).sort("updated_at", -1):
+                # Walks the "sidebar" index (manage.py ensure_indexes) in updated_at order
+                cursor = conversations.find({"user_id": user_id, "is_active": True}, SIDEBAR_PROJECTION).sort("updated_at", -1)
+                async for conversation in cursor:
                     conversation['_id'] = str(conversation['_id'])
                     conversations_list.append(conversation)
                 return conversations_list
@@ -658,6 +732,7 @@ def api_conversation_messages(request: HttpRequest, conversation_id: str):
             try:
                 messages_list = []
                 async for message in messages.find({"conversation_id": ObjectId(conversation_id)}).sort("timestamp", 1):
+                    message = decode_message(message)
                     message['_id'] = str(message['_id'])
                     message['conversation_id'] = str(message['conversation_id'])
                     messages_list.append(message)
@@ -677,6 +752,219 @@ def api_conversation_messages(request: HttpRequest, conversation_id: str):
     finally:
         loop.close()
 
+@csrf_exempt
+@require_http_methods(["GET"])
+def api_conversation_replay(request: HttpRequest, conversation_id: str):
+    """Get the latest lesson of a conversation as a single snapshot document."""
+    if not ObjectId.is_valid(conversation_id):
+        return JsonResponse({'error': 'Invalid conversation ID'}, status=400)
+    if lesson_snapshots is None:
+        return JsonResponse({'error': 'Database not available'}, status=503)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        snapshot = loop.run_until_complete(get_latest_snapshot(lesson_snapshots, conversation_id))
+        if snapshot is None:
+            return JsonResponse({'error': 'No stored lesson for this conversation'}, status=404)
+        snapshot = loop.run_until_complete(ensure_snapshot_layout(lesson_snapshots, snapshot))
+        return JsonResponse({'snapshot': serialize_snapshot(snapshot)})
+    except Exception as e:
+        logger.error(f"Error loading lesson snapshot: {e}")
+        return JsonResponse({'error': str(e)}, status=500)
+    finally:
+        loop.close()
+
+@require_http_methods(["GET"])
+def api_lesson_analytics(request: HttpRequest, lesson_id: str):
+    """Get a lesson's quiz and progress analytics (maintained on every write, see analytics.py)."""
+    if analytics is None:
+        return JsonResponse({'error': 'Database not available'}, status=503)
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        lesson_analytics = loop.run_until_complete(get_lesson_analytics(analytics, lesson_id))
+        return JsonResponse({'analytics': lesson_analytics})
+    except Exception as e:
+        logger.error(f"Error loading lesson analytics: {e}")
+        return JsonResponse({'error': str(e)}, status=500)
+    finally:
+        loop.close()
+
+async def api_export_conversations(request: HttpRequest):
+    """Stream all of a user's conversations and messages as a gzip-compressed NDJSON download
+    (format in portability.py; `manage.py import_conversations` loads it)."""
+    # Async view so the export streams from one cursor on the server's event loop; Django 4.2's
+    # require_http_methods does not wrap async views, hence the explicit check
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+    user_id = request.GET.get('user_id')
+    if not user_id:
+        return JsonResponse({'error': 'user_id is required'}, status=400)
+    if conversations is None:
+        return JsonResponse({'error': 'Database not available'}, status=503)
+    try:
+        records = await open_export(db, user_id)
+    except Exception as e:
+        logger.error(f"Error starting conversation export: {e}")
+        return JsonResponse({'error': str(e)}, status=503)
+
+    response = StreamingHttpResponse(gzip_chunks(records), content_type="application/gzip")
+    safe_user = re.sub(r"[^\w.-]", "_", user_id)
+    filename = f"conversations-{safe_user}-{datetime.utcnow():%Y%m%dT%H%M%S}.ndjson.gz"
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+async def api_search(request: HttpRequest):
+    """Ranked full-text search over a user's conversation titles/topics and messages
+    (?user_id=&q=&page=&page_size=); hits carry HTML snippets with the matches in <mark>."""
+    if request.method != "GET":
+        return HttpResponseNotAllowed(["GET"])
+    user_id = request.GET.get('user_id')
+    query = request.GET.get('q', '').strip()
+    if not user_id or not query:
+        return JsonResponse({'error': 'user_id and q are required'}, status=400)
+    if len(query) > MAX_QUERY_CHARS:
+        return JsonResponse({'error': f'q is longer than {MAX_QUERY_CHARS} characters'}, status=400)
+    try:
+        page = int(request.GET.get('page', 1))
+        page_size = int(request.GET.get('page_size', settings.SEARCH_PAGE_SIZE))
+    except ValueError:
+        return JsonResponse({'error': 'page and page_size must be integers'}, status=400)
+    if page < 1 or not 1 <= page_size <= settings.SEARCH_PAGE_SIZE * 5:
+        return JsonResponse({'error': f'page must be >= 1 and page_size 1-{settings.SEARCH_PAGE_SIZE * 5}'}, status=400)
+    if page * page_size > settings.SEARCH_MAX_RESULTS:
+        return JsonResponse({'error': f'Only the first {settings.SEARCH_MAX_RESULTS} hits can be paged; refine the query'},
+                            status=400)
+    if conversations is None:
+        return JsonResponse({'error': 'Database not available'}, status=503)
+    try:
+        result = await search_history(db, user_id, query, page, page_size, settings.SEARCH_MAX_TIME_MS)
+    except SearchIndexMissing as e:
+        return JsonResponse({'error': str(e)}, status=503)
+    except ConnectionFailure as e:
+        logger.error(f"Error searching conversations: {e}")
+        return JsonResponse({'error': 'Database not available'}, status=503)
+    except Exception as e:
+        logger.error(f"Error searching conversations: {e}")
+        return JsonResponse({'error': str(e)}, status=500)
+    return JsonResponse({'query': query, 'page': page, 'page_size': page_size, **result})
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+def api_batch_jobs(request: HttpRequest):
+    """List a user's batch generation jobs (GET ?user_id=), or queue one (POST): JSON
+    {"user_id", "name", "topics": [...]} or a multipart form with user_id, name, topics (one per
+    line) and pdf_files. Lessons are generated by `manage.py batch_worker` (see batch.py)."""
+    if conversations is None:
+        return JsonResponse({'error': 'Database not available'}, status=503)
+    if request.method == "GET":
+        user_id = request.GET.get('user_id')
+        if not user_id:
+            return JsonResponse({'error': 'user_id is required'}, status=400)
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        try:
+            return JsonResponse({'jobs': loop.run_until_complete(list_jobs(db, user_id))})
+        except Exception as e:
+            logger.error(f"Error listing batch jobs: {e}")
+            return JsonResponse({'error': str(e)}, status=500)
+        finally:
+            loop.close()
+
+    if request.content_type == 'application/json':
+        try:
+            data = json.loads(request.body)
+        except json.JSONDecodeError:
+            return JsonResponse({'error': 'Invalid JSON'}, status=400)
+        if not isinstance(data, dict):
+            return JsonResponse({'error': 'Expected a JSON object'}, status=400)
+        topics = data.get('topics') or []
+        pdf_files = []
+    else:
+        data = request.POST
+        topics = [line for value in request.POST.getlist('topics') for line in value.splitlines()]
+        pdf_files = request.FILES.getlist('pdf_files')
+    user_id = data.get('user_id')
+    if not user_id:
+        return JsonResponse({'error': 'user_id is required'}, status=400)
+    if not isinstance(topics, list) or not all(isinstance(t, str) for t in topics):
+        return JsonResponse({'error': 'topics must be a list of strings'}, status=400)
+    if not topics and not pdf_files:
+        return JsonResponse({'error': 'Send at least one topic or PDF'}, status=400)
+    if len(topics) + len(pdf_files) > settings.BATCH_MAX_ITEMS:
+        return JsonResponse({'error': f'At most {settings.BATCH_MAX_ITEMS} topics and PDFs per job'}, status=400)
+    if any(not f.name.lower().endswith('.pdf') for f in pdf_files):
+        return JsonResponse({'error': 'Invalid file type. Please upload PDFs only.'}, status=400)
+
+    key = ratelimit.request_key(request)
+    if pdf_files:
+        decision = ratelimit.consume("pdf_bytes", key, max(1, sum(f.size for f in pdf_files)))
+        if not decision.allowed:
+            return ratelimit.rate_limited_response("pdf_bytes", decision)
+    decision = ratelimit.consume("batch_items", key, len(topics) + len(pdf_files))
+    if not decision.allowed:
+        return ratelimit.rate_limited_response("batch_items", decision)
+
+    pdfs = []
+    for pdf_file in pdf_files:
+        try:
+            text = extract_pdf_text(pdf_file.read())
+        except Exception as e:
+            logger.error(f"Error processing PDF '{pdf_file.name}': {e}")
+            return JsonResponse({'error': f"Could not read '{pdf_file.name}': {e}"}, status=400)
+        if not text.strip():
+            return JsonResponse({'error': f"Could not extract any text from '{pdf_file.name}'."}, status=400)
+        pdfs.append((pdf_file.name, text))
+
+    name = str(data.get('name') or f"Batch of {len(topics) + len(pdfs)} lessons")[:200]
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        job = loop.run_until_complete(enqueue_job(db, user_id, name, topics, pdfs))
+        report = loop.run_until_complete(get_job(db, job["_id"]))
+        return JsonResponse({'job': report}, status=201)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    except ConnectionFailure as e:
+        logger.error(f"Error queueing batch job: {e}")
+        return JsonResponse({'error': 'Database not available'}, status=503)
+    except Exception as e:
+        logger.error(f"Error queueing batch job: {e}")
+        return JsonResponse({'error': str(e)}, status=500)
+    finally:
+        loop.close()
+
+@csrf_exempt
+@require_http_methods(["GET", "POST"])
+def api_batch_job(request: HttpRequest, job_id: str):
+    """A batch job's progress, throughput and items (GET); POST queues its failed items again."""
+    if not ObjectId.is_valid(job_id):
+        return JsonResponse({'error': 'Invalid job ID'}, status=400)
+    if conversations is None:
+        return JsonResponse({'error': 'Database not available'}, status=503)
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    try:
+        requeued = None
+        if request.method == "POST":
+            requeued = loop.run_until_complete(retry_failed(db, ObjectId(job_id)))
+        report = loop.run_until_complete(get_job(db, ObjectId(job_id), with_items=request.method == "GET"))
+        if report is None:
+            return JsonResponse({'error': 'Batch job not found'}, status=404)
+        if requeued is not None:
+            return JsonResponse({'job': report, 'requeued': requeued})
+        return JsonResponse({'job': report})
+    except ConnectionFailure as e:
+        logger.error(f"Error loading batch job: {e}")
+        return JsonResponse({'error': 'Database not available'}, status=503)
+    except Exception as e:
+        logger.error(f"Error loading batch job: {e}")
+        return JsonResponse({'error': str(e)}, status=500)
+    finally:
+        loop.close()
+
 @csrf_exempt
 @require_http_methods(["DELETE"])
 def api_conversation_delete(request: HttpRequest, conversation_id: str):
@@ -685,6 +973,7 @@ def api_conversation_delete(request: HttpRequest, conversation_id: str):
         async def delete_conversation_async():
             # Delete all messages in the conversation
             await messages.delete_many({"conversation_id": ObjectId(conversation_id)})
+            await lesson_snapshots.delete_many({"conversation_id": ObjectId(conversation_id)})
             # Delete the conversation
             result = await conversations.delete_one({"_id": ObjectId(conversation_id)})
             return result.deleted_count > 0
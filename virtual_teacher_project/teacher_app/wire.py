@@ -0,0 +1,126 @@
+# teacher_app/wire.py
+
+import json
+from urllib.parse import parse_qs
+
+from .schema import COMMAND_SCHEMAS, COMMON_FIELDS, STEP_SCHEMA
+
+# Wire encodings for lesson frames.
+#
+# "json" (default) sends frames as plain JSON objects. "compact" is opt-in, by offering the
+# COMPACT_SUBPROTOCOL WebSocket subprotocol or connecting with ?encoding=compact. It packs
+# teaching steps and drawing commands as arrays in the order of the key tables in SCHEMA, which
+# clients fetch once from api/wire-schema/ (it only changes with COMPACT_VERSION):
+#
+#   step:     [value for each step field..., [command, ...], {extra keys}?]
+#   command:  [action index, value for each field of that action..., {extra keys}?]
+#
+# Missing fields are null and trailing nulls are dropped; a trailing object carries keys that
+# are not in the tables. It is always sent (empty if need be) when the last value is itself an
+# object, so a trailing object is never mistaken for a field. Frames are also serialized
+# without whitespace.
+
+COMPACT = "compact"
+JSON = "json"
+COMPACT_VERSION = "compact.v2"
+COMPACT_SUBPROTOCOL = "gyansetu.compact.v2"
+
+ACTIONS = tuple(COMMAND_SCHEMAS)
+ACTION_INDEX = {action: i for i, action in enumerate(ACTIONS)}
+COMMAND_FIELDS = {action: tuple(COMMON_FIELDS) + tuple(fields) for action, fields in COMMAND_SCHEMAS.items()}
+STEP_FIELDS = tuple(name for name in STEP_SCHEMA if name != "drawing_commands")
+# Frame keys holding a list of teaching steps
+STEP_LIST_KEYS = ("teaching_steps", "steps")
+
+SCHEMA = {
+    "encoding": COMPACT_VERSION,
+    "actions": list(ACTIONS),
+    "command_fields": {action: list(fields) for action, fields in COMMAND_FIELDS.items()},
+    "step_fields": list(STEP_FIELDS),
+}
+
+_COMPACT_SEPARATORS = (",", ":")
+
+
+def negotiate(scope):
+    """Pick the wire encoding for a connection: ``(encoding, subprotocol to accept or None)``."""
+    if COMPACT_SUBPROTOCOL in (scope.get("subprotocols") or ()):
+        return COMPACT, COMPACT_SUBPROTOCOL
+    query = parse_qs(scope.get("query_string", b"").decode())
+    if query.get("encoding", [""])[0] == COMPACT:
+        return COMPACT, None
+    return JSON, None
+
+
+def _pack(values, extras):
+    while values and values[-1] is None:
+        values.pop()
+    if extras or (values and isinstance(values[-1], dict)):
+        values.append(extras)
+    return values
+
+
+def pack_command(command):
+    action = command.get("action")
+    fields = COMMAND_FIELDS.get(action)
+    if fields is None:
+        return command  # unknown action: sent as-is
+    values = [ACTION_INDEX[action]] + [command.get(name) for name in fields]
+    known = ("action",) + fields
+    extras = {k: v for k, v in command.items() if k not in known}
+    return _pack(values, extras)
+
+
+def pack_step(step):
+    values = [step.get(name) for name in STEP_FIELDS]
+    values.append([pack_command(c) for c in step.get("drawing_commands") or ()])
+    extras = {k: v for k, v in step.items() if k not in STEP_FIELDS and k != "drawing_commands"}
+    return _pack(values, extras)
+
+
+def unpack_command(packed):
+    if not isinstance(packed, list):
+        return packed
+    action = ACTIONS[packed[0]]
+    command = {"action": action}
+    rest = packed[1:]
+    if rest and isinstance(rest[-1], dict):
+        command.update(rest.pop())
+    for name, value in zip(COMMAND_FIELDS[action], rest):
+        if value is not None:
+            command[name] = value
+    return command
+
+
+def unpack_step(packed):
+    step = {}
+    values = list(packed)
+    if values and isinstance(values[-1], dict):
+        step.update(values.pop())
+    for name, value in zip(STEP_FIELDS, values):
+        if value is not None:
+            step[name] = value
+    if len(values) > len(STEP_FIELDS):
+        step["drawing_commands"] = [unpack_command(c) for c in values[len(STEP_FIELDS)]]
+    return step
+
+
+def encode_frame(frame, encoding=JSON):
+    """Serialize a frame for the wire in ``encoding``."""
+    if encoding != COMPACT:
+        return json.dumps(frame)
+    for key in STEP_LIST_KEYS:
+        if isinstance(frame.get(key), list):
+            frame = {**frame, key: [pack_step(s) for s in frame[key]], "encoding": COMPACT_VERSION}
+    return json.dumps(frame, separators=_COMPACT_SEPARATORS)
+
+
+def decode_frame(text):
+    """Inverse of ``encode_frame`` (used by benchmarks and round-trip checks)."""
+    frame = json.loads(text)
+    if frame.get("encoding") == COMPACT_VERSION:
+        del frame["encoding"]
+        for key in STEP_LIST_KEYS:
+            if isinstance(frame.get(key), list):
+                frame[key] = [unpack_step(s) for s in frame[key]]
+    return frame
@@ -0,0 +1,56 @@
+# teacher_app/wsserver.py
+#
+# Daphne with permessage-deflate (RFC 7692) negotiated on WebSocket connections. Daphne itself
+# never enables WebSocket compression; run this instead of `daphne` with the same arguments:
+#
+#   python -m teacher_app.wsserver -b 0.0.0.0 -p 8000 virtual_teacher_project.asgi:application
+
+import os
+
+from autobahn.websocket.compress import PerMessageDeflateOffer, PerMessageDeflateOfferAccept
+from daphne import server as daphne_server
+from daphne.cli import CommandLineInterface
+
+
+def _setting(name, default):
+    # Read lazily: the ASGI application (and with it Django settings) is imported after the CLI starts
+    from django.conf import settings
+    return getattr(settings, name, default) if settings.configured else default
+
+
+def accept_permessage_deflate(offers):
+    """Accept the client's first permessage-deflate offer (None keeps the connection uncompressed)."""
+    if not _setting("WS_PERMESSAGE_DEFLATE", True):
+        return None
+    for offer in offers:
+        if isinstance(offer, PerMessageDeflateOffer):
+            no_context_takeover = _setting("WS_DEFLATE_NO_CONTEXT_TAKEOVER", False)
+            return PerMessageDeflateOfferAccept(
+                offer,
+                no_context_takeover=no_context_takeover if offer.accept_no_context_takeover else None,
+                mem_level=_setting("WS_DEFLATE_MEM_LEVEL", 8),
+            )
+    return None
+
+
+class DeflateServer(daphne_server.Server):
+    """Daphne server whose WebSocket factory accepts permessage-deflate offers."""
+
+    @property
+    def ws_factory(self):
+        return self._ws_factory
+
+    @ws_factory.setter
+    def ws_factory(self, factory):
+        # Server.run() creates the factory and then sets its other options, which leave this one alone
+        factory.setProtocolOptions(perMessageCompressionAccept=accept_permessage_deflate)
+        self._ws_factory = factory
+
+
+class DeflateCommandLineInterface(CommandLineInterface):
+    server_class = DeflateServer
+
+
+if __name__ == "__main__":
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "virtual_teacher_project.settings")
+    DeflateCommandLineInterface.entrypoint()
@@ -2,17 +2,24 @@
 
 import os
 from django.core.asgi import get_asgi_application
-from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
-import teacher_app.routing
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'virtual_teacher_project.settings')
 
+# Set up Django before importing consumers (they read settings and models at import time)
+django_asgi_app = get_asgi_application()
+
+from channels.routing import ProtocolTypeRouter, URLRouter  # noqa: E402
+from channels.auth import AuthMiddlewareStack  # noqa: E402
+import teacher_app.routing  # noqa: E402
+from teacher_app import startup  # noqa: E402
+
 application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+    "http": django_asgi_app,
     "websocket": AuthMiddlewareStack(
         URLRouter(
             teacher_app.routing.websocket_urlpatterns
         )
     ),
-})
\ No newline at end of file
+})
+
+startup.on_worker_start()
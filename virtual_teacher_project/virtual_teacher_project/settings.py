@@ -18,6 +18,25 @@ from dotenv import load_dotenv
 load_dotenv()
 GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
 
+# LLM provider used for lesson generation: "gemini", "stub" (offline canned lessons),
+# "record" (call Gemini and save fixtures) or "replay" (stream saved fixtures)
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+LLM_GEMINI_MODEL = os.getenv("LLM_GEMINI_MODEL", "gemini-1.5-flash")
+LLM_STUB_TOKENS_PER_SECOND = float(os.getenv("LLM_STUB_TOKENS_PER_SECOND", "0"))  # 0 = no delay
+LLM_STUB_CHUNK_SIZE = int(os.getenv("LLM_STUB_CHUNK_SIZE", "64"))  # characters per chunk
+LLM_STUB_STEPS = int(os.getenv("LLM_STUB_STEPS", "5"))
+LLM_REPLAY_SPEED = float(os.getenv("LLM_REPLAY_SPEED", "1.0"))  # 0 = replay without delays
+
+# Speech text normalization (teacher_app.speech)
+SPEECH_LOCALE = os.getenv("SPEECH_LOCALE", "en")
+# Per-locale abbreviation overrides, e.g. {"en": {"approx.": "approximately", "vs.": None}}
+SPEECH_ABBREVIATIONS = {}
+
+# Storage codec for message step_data (teacher_app.codec): "zlib", "zstd" (needs the
+# zstandard package) or "none". Payloads smaller than MESSAGE_CODEC_MIN_BYTES stay plain.
+MESSAGE_CODEC = os.getenv("MESSAGE_CODEC", "zlib")
+MESSAGE_CODEC_MIN_BYTES = int(os.getenv("MESSAGE_CODEC_MIN_BYTES", "512"))
+
 # MongoDB Configuration
 MONGO_DB_URI = os.getenv("MONGO_DB_URI", "mongodb://localhost:27017/")
 MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "gyansetu_db")
@@ -26,6 +45,18 @@ MONGO_DB_NAME = os.getenv("MONGO_DB_NAME", "gyansetu_db")
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
 
+# Where the "record"/"replay" LLM providers keep their stream fixtures
+LLM_FIXTURE_DIR = os.getenv("LLM_FIXTURE_DIR", str(BASE_DIR / "llm_fixtures"))
+
+# Retention (teacher_app.retention): soft-deleted conversations are purged by TTL after
+# RETENTION_DELETED_TTL_DAYS; `manage.py archive_conversations` moves conversations inactive
+# for ARCHIVE_INACTIVE_DAYS into gzip NDJSON segments under ARCHIVE_DIR (or archive collections),
+# except those restored from the archive in the last ARCHIVE_RESTORE_GRACE_DAYS
+RETENTION_DELETED_TTL_DAYS = float(os.getenv("RETENTION_DELETED_TTL_DAYS", "30"))
+ARCHIVE_INACTIVE_DAYS = float(os.getenv("ARCHIVE_INACTIVE_DAYS", "180"))
+ARCHIVE_RESTORE_GRACE_DAYS = float(os.getenv("ARCHIVE_RESTORE_GRACE_DAYS", "30"))
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", str(BASE_DIR / "archive"))
+
 
 # Quick-start development settings - unsuitable for production
 # See https://docs.djangoproject.com/en/4.2/howto/deployment/checklist/
@@ -110,13 +141,130 @@ DATABASES = {
     'default': {
         'ENGINE': 'django.db.backends.sqlite3',
         'NAME': BASE_DIR / 'db.sqlite3',
+        # Keep connections open between requests (seconds, 0 = close after each request, None = forever)
+        # and check them before reuse, so the auth path does not reconnect per request.
+        'CONN_MAX_AGE': None if os.getenv("DB_CONN_MAX_AGE") == "none" else int(os.getenv("DB_CONN_MAX_AGE", "60")),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {
+            'timeout': float(os.getenv("SQLITE_BUSY_TIMEOUT", "20")),  # seconds to wait on a locked database
+        },
     }
 }
 
+# SQLite journal mode (teacher_app.db): WAL lets session/user reads proceed while a login or
+# signup is writing, instead of serializing every connect behind the write lock.
+SQLITE_WAL = os.getenv("SQLITE_WAL", "1") not in ("0", "false", "False")
+SQLITE_SYNCHRONOUS = os.getenv("SQLITE_SYNCHRONOUS", "NORMAL")
+
+# Cache used for sessions. Local memory by default (per process); set CACHE_REDIS_URL to share
+# sessions between workers through Redis (requires the `redis` package).
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL", "")
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "gyansetu",
+        "OPTIONS": {"MAX_ENTRIES": int(os.getenv("CACHE_MAX_ENTRIES", "10000"))},
+    },
+}
+if CACHE_REDIS_URL:
+    CACHES["default"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": CACHE_REDIS_URL,
+    }
+
+# Sessions: cached_db reads from the cache and only falls back to the database on a miss, which
+# takes the database off the path of AuthMiddlewareStack's per-connect session lookup.
+# Use "django.contrib.sessions.backends.db" for the old behaviour.
+SESSION_ENGINE = os.getenv("SESSION_ENGINE", "django.contrib.sessions.backends.cached_db")
+SESSION_CACHE_ALIAS = "default"
+
 # MongoDB configuration for async operations
 MONGO_DB_NAME = "Gnyansetu"
 MONGO_DB_URI = "mongodb://localhost:27017"
 
+# MongoDB client pool/timeouts (teacher_app.mongo_client). Short server selection keeps a
+# down database from stalling lessons; the breaker then fails fast until the probe recovers.
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", "50"))
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", "0"))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", "2000"))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", "2000"))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", "20000"))
+MONGO_HEALTH_PROBE_INTERVAL = float(os.getenv("MONGO_HEALTH_PROBE_INTERVAL", "5"))  # seconds, 0 = off
+MONGO_HEALTH_PROBE_TIMEOUT_MS = int(os.getenv("MONGO_HEALTH_PROBE_TIMEOUT_MS", "1000"))
+MONGO_BREAKER_FAILURE_THRESHOLD = int(os.getenv("MONGO_BREAKER_FAILURE_THRESHOLD", "3"))
+MONGO_BREAKER_RESET_SECONDS = float(os.getenv("MONGO_BREAKER_RESET_SECONDS", "10"))
+
+# Local spool (teacher_app.spool) for chat writes made while MongoDB is down; the replayer
+# drains it every SPOOL_REPLAY_INTERVAL seconds once the database is back.
+SPOOL_ENABLED = os.getenv("SPOOL_ENABLED", "1") not in ("0", "false", "False")
+SPOOL_DIR = os.getenv("SPOOL_DIR", str(BASE_DIR / "spool"))
+SPOOL_SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", str(4 * 1024 * 1024)))
+SPOOL_FSYNC_INTERVAL = float(os.getenv("SPOOL_FSYNC_INTERVAL", "0.2"))  # seconds between batched fsyncs
+SPOOL_REPLAY_INTERVAL = float(os.getenv("SPOOL_REPLAY_INTERVAL", "5"))  # seconds, 0 = no background replay
+
+# A lesson keeps generating this long after its WebSocket drops, so a reconnecting client can
+# resume it (teacher_app.sessions); unresumed generations are cancelled afterwards.
+LESSON_SESSION_GRACE_SECONDS = float(os.getenv("LESSON_SESSION_GRACE_SECONDS", "60"))
+
+# Per-connection outbound frame queue (teacher_app.outbound). On overflow "drop" sheds progress/status
+# frames (closing only if nothing is droppable) and "close" disconnects the client straight away.
+OUTBOUND_QUEUE_MAX_FRAMES = int(os.getenv("OUTBOUND_QUEUE_MAX_FRAMES", "64"))
+OUTBOUND_OVERFLOW_POLICY = os.getenv("OUTBOUND_OVERFLOW_POLICY", "drop")
+
+# permessage-deflate for WebSockets when served by teacher_app.wsserver (plain daphne never compresses).
+# No context takeover saves server memory per connection at the cost of a worse compression ratio.
+WS_PERMESSAGE_DEFLATE = os.getenv("WS_PERMESSAGE_DEFLATE", "1") not in ("0", "false", "False")
+WS_DEFLATE_NO_CONTEXT_TAKEOVER = os.getenv("WS_DEFLATE_NO_CONTEXT_TAKEOVER", "0") in ("1", "true", "True")
+WS_DEFLATE_MEM_LEVEL = int(os.getenv("WS_DEFLATE_MEM_LEVEL", "8"))
+
+# Progress reporting (views.api_progress_bulk): clients coalesce updates per student and lesson
+# (last write wins) and flush at most every PROGRESS_COALESCE_MS; batches are capped.
+PROGRESS_COALESCE_MS = int(os.getenv("PROGRESS_COALESCE_MS", "1000"))
+PROGRESS_BULK_MAX_UPDATES = int(os.getenv("PROGRESS_BULK_MAX_UPDATES", "500"))
+
+# Similar-topic lookup (teacher_app.topic_index): a topic request sent with allow_similar is
+# offered the stored lesson whose topic has at least this shingle Jaccard similarity. The scope
+# is "global" (any user's lessons) or "user" (only the requester's own lessons).
+TOPIC_INDEX_ENABLED = os.getenv("TOPIC_INDEX_ENABLED", "1") not in ("0", "false", "False")
+TOPIC_SIMILARITY_THRESHOLD = float(os.getenv("TOPIC_SIMILARITY_THRESHOLD", "0.6"))
+TOPIC_INDEX_SCOPE = os.getenv("TOPIC_INDEX_SCOPE", "global")
+TOPIC_INDEX_REFRESH_SECONDS = float(os.getenv("TOPIC_INDEX_REFRESH_SECONDS", "60"))  # 0 = never reload
+
+# History search (views.api_search, teacher_app.search): hits per page, the deepest hit a page may
+# reach (deeper pages fetch more from both collections), and the per-query MongoDB time limit.
+SEARCH_PAGE_SIZE = int(os.getenv("SEARCH_PAGE_SIZE", "20"))
+SEARCH_MAX_RESULTS = int(os.getenv("SEARCH_MAX_RESULTS", "200"))
+SEARCH_MAX_TIME_MS = int(os.getenv("SEARCH_MAX_TIME_MS", "2000"))
+
+# Rate limits (teacher_app.ratelimit): token buckets per authenticated user, else per IP. A lesson
+# generation costs one token, a PDF upload its size, a batch job one per lesson it queues. Buckets
+# are per process unless RATE_LIMIT_REDIS_URL (default CACHE_REDIS_URL) shares them through Redis.
+# Only trust X-Forwarded-For behind a proxy that sets it.
+RATE_LIMIT_ENABLED = os.getenv("RATE_LIMIT_ENABLED", "1") not in ("0", "false", "False")
+RATE_LIMIT_LESSON_BURST = float(os.getenv("RATE_LIMIT_LESSON_BURST", "5"))
+RATE_LIMIT_LESSONS_PER_HOUR = float(os.getenv("RATE_LIMIT_LESSONS_PER_HOUR", "30"))
+RATE_LIMIT_PDF_MB_BURST = float(os.getenv("RATE_LIMIT_PDF_MB_BURST", "50"))
+RATE_LIMIT_PDF_MB_PER_HOUR = float(os.getenv("RATE_LIMIT_PDF_MB_PER_HOUR", "200"))
+RATE_LIMIT_REDIS_URL = os.getenv("RATE_LIMIT_REDIS_URL", CACHE_REDIS_URL)
+RATE_LIMIT_TRUST_X_FORWARDED_FOR = os.getenv("RATE_LIMIT_TRUST_X_FORWARDED_FOR", "0") in ("1", "true", "True")
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "100000"))
+RATE_LIMIT_BATCH_ITEM_BURST = float(os.getenv("RATE_LIMIT_BATCH_ITEM_BURST", "500"))
+RATE_LIMIT_BATCH_ITEMS_PER_HOUR = float(os.getenv("RATE_LIMIT_BATCH_ITEMS_PER_HOUR", "50"))
+
+# Batch lesson generation (teacher_app.batch): `manage.py batch_worker` runs BATCH_WORKERS items
+# at a time, at most BATCH_LLM_CONCURRENCY of them streaming from the LLM, and starts at most
+# BATCH_LLM_REQUESTS_PER_MINUTE generations (0 = unpaced; shared through RATE_LIMIT_REDIS_URL).
+# An item whose worker stops renewing its lease for BATCH_LEASE_SECONDS is picked up again;
+# failures are retried with backoff up to BATCH_MAX_ATTEMPTS times.
+BATCH_WORKERS = int(os.getenv("BATCH_WORKERS", "4"))
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "2"))
+BATCH_LLM_REQUESTS_PER_MINUTE = float(os.getenv("BATCH_LLM_REQUESTS_PER_MINUTE", "0"))
+BATCH_LEASE_SECONDS = float(os.getenv("BATCH_LEASE_SECONDS", "120"))
+BATCH_MAX_ATTEMPTS = int(os.getenv("BATCH_MAX_ATTEMPTS", "3"))
+BATCH_ITEM_TIMEOUT_SECONDS = float(os.getenv("BATCH_ITEM_TIMEOUT_SECONDS", "300"))
+BATCH_POLL_SECONDS = float(os.getenv("BATCH_POLL_SECONDS", "2"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+
 # Channels config
 ASGI_APPLICATION = "virtual_teacher_project.asgi.application"
 